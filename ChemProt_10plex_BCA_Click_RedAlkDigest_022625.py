@@ -1,12 +1,285 @@
 from opentrons import protocol_api
-from opentrons.protocol_api import SINGLE, ALL
+from opentrons.protocol_api import SINGLE, ALL, RuntimeParameterRequiredError
 import pandas as pd
 import numpy as np
+import math
 #import matplotlib.pyplot as plt
 import subprocess
 from pathlib import Path
 import datetime
 import time
+import json
+import re
+import sys
+
+# Per-step timing log for live runs, see run_telemetry.py
+sys.path.append("/var/lib/jupyter/notebooks")
+try:
+    import run_telemetry
+except ImportError:
+    run_telemetry = None
+
+# History of every run's normalization results, see run_history.py
+try:
+    import run_history
+except ImportError:
+    run_history = None
+
+# Wells of the standards and samples on the BCA plate, see plate_map.py
+# ---- plate_map.py (copied by shared_code.py, edit plate_map.py instead) ----
+# Rows and columns of each plate format
+FORMATS = {'96': (8, 12), '384': (16, 24)}
+CHANNELS = 8
+
+
+class PlateMap:
+    """Standards and samples of one plate, each with its replicate wells."""
+
+    def __init__(self, plate, replicates, standards, samples):
+        self.plate = plate
+        self.rows, self.columns = FORMATS[plate]
+        self.replicates = replicates
+        self.row_names = [chr(ord('A') + i) for i in range(self.rows)]
+        step = self.rows // CHANNELS
+        # (first row, first column) of every block, in the order they are filled
+        self.blocks = [(offset, column) for column in range(1, self.columns - replicates + 2, replicates) for offset in range(step)]
+        standard_blocks = math.ceil(len(standards)/CHANNELS)
+        if len(samples) > (len(self.blocks) - standard_blocks)*CHANNELS:
+            raise Exception(f"A {plate}-well plate holds {(len(self.blocks) - standard_blocks)*CHANNELS} samples in {replicates}s next to the standards.")
+        self.standards = [self._entry(name, i) for i, name in enumerate(standards)]
+        self.samples = [self._entry(name, standard_blocks*CHANNELS + i) for i, name in enumerate(samples)]
+
+    def _entry(self, name, position):
+        block, row = divmod(position, CHANNELS)
+        offset, column = self.blocks[block]
+        row_name = self.row_names[offset + row*(self.rows // CHANNELS)]
+        return {'name': name, 'block': block, 'wells': [f"{row_name}{column + i}" for i in range(self.replicates)]}
+
+    def wells(self, name):
+        """Replicate wells of a standard or sample."""
+        for entry in self.standards + self.samples:
+            if entry['name'] == name:
+                return entry['wells']
+        raise KeyError(name)
+
+    def top_wells(self, block):
+        """Wells the first nozzle of an 8-channel goes to for each replicate column of a block."""
+        offset, column = self.blocks[block]
+        return [f"{self.row_names[offset]}{column + i}" for i in range(self.replicates)]
+
+    def sample_blocks(self):
+        """(top wells, samples) of every block that holds samples, in plating order."""
+        blocks = {}
+        for entry in self.samples:
+            blocks.setdefault(entry['block'], []).append(entry)
+        return [(self.top_wells(block), entries) for block, entries in blocks.items()]
+
+    def read(self, block):
+        """Replicates of the standards, then the samples, from a reader block of rows x columns."""
+        values = pd.DataFrame(block).values
+        table = {'Sample': []}
+        table.update({f'Replicate {i + 1}': [] for i in range(self.replicates)})
+        for entry in self.standards + self.samples:
+            table['Sample'].append(entry['name'])
+            for i, well in enumerate(entry['wells']):
+                table[f'Replicate {i + 1}'].append(values[self.row_names.index(well[0]), int(well[1:]) - 1])
+        return pd.DataFrame(table)
+
+    def grid(self):
+        """The plate as text, a short label per well."""
+        labels = {}
+        for i, entry in enumerate(self.standards):
+            labels.update({well: f"S{i + 1}" for well in entry['wells']})
+        for i, entry in enumerate(self.samples):
+            labels.update({well: str(i + 1) for well in entry['wells']})
+        lines = ["   " + "".join(f"{column:>4}" for column in range(1, self.columns + 1))]
+        for row in self.row_names:
+            lines.append(f"{row:<3}" + "".join(f"{labels.get(f'{row}{column}', '.'):>4}" for column in range(1, self.columns + 1)))
+        return "\n".join(lines)
+
+
+def capacity(plate='96', replicates=3, standards=8):
+    """Samples one plate holds next to the standards."""
+    rows, columns = FORMATS[plate]
+    blocks = (rows // CHANNELS)*len(range(1, columns - replicates + 2, replicates))
+    return (blocks - math.ceil(standards/CHANNELS))*CHANNELS
+
+
+def compile_map(samples, plate='96', replicates=3, standards=8):
+    """Plate map for sample names (or a number of samples) and standards (names or a number)."""
+    if isinstance(samples, int):
+        samples = [f"Sample {i + 1}" for i in range(samples)]
+    if isinstance(standards, int):
+        standards = [f"Standard {i + 1}" for i in range(standards)]
+    return PlateMap(str(plate), replicates, list(standards), list(samples))
+# ---- end of plate_map.py ----
+
+# Samples and tubes of the sample manifest, see sample_manifest.py
+# ---- sample_manifest.py (copied by shared_code.py, edit sample_manifest.py instead) ----
+# Tubes of the 24-tube aluminum block
+TUBE_ROWS = 'ABCD'
+TUBE_COLUMNS = 6
+# Header names each manifest column goes by
+HEADERS = {
+    'sample': ['sample', 'sample_id', 'id'],
+    'tube': ['position', 'tube'],
+    'expected': ['expected', 'expected_mg_ml', 'conc', 'concentration', 'conc_mg_ml', 'concentration_mg_ml'],
+    'target': ['target', 'target_ug'],
+}
+
+
+def free_tubes(reserved_tubes):
+    """Tubes left for samples, row by row."""
+    return [f"{row}{number}" for row in TUBE_ROWS for number in range(1, TUBE_COLUMNS + 1) if f"{row}{number}" not in reserved_tubes]
+
+
+def header_name(cell):
+    """A header cell in lower case with every run of spaces and punctuation as one underscore."""
+    return re.sub(r'[^a-z0-9]+', '_', cell.lower()).strip('_')
+
+
+def parse_manifest(rows, reserved_tubes, max_samples=None):
+    """Samples of manifest rows as dicts of sample, tube, expected (mg/mL) and target (ug)."""
+    rows = [row for row in rows if any(cell.strip() for cell in row)]
+    if not rows:
+        raise Exception("The sample manifest is empty")
+    header = [header_name(cell) for cell in rows[0]]
+
+    def column(field):
+        return next((i for i, cell in enumerate(header) if cell in HEADERS[field]), None)
+
+    sample_column, tube_column = column('sample'), column('tube')
+    expected_column, target_column = column('expected'), column('target')
+    if sample_column is None or tube_column is None:
+        raise Exception(f"The sample manifest needs a sample and a position column, not {', '.join(rows[0])}")
+    tubes = free_tubes(reserved_tubes)
+    room = len(tubes) if max_samples is None else min(len(tubes), max_samples)
+    if len(rows) - 1 > room:
+        raise Exception(f"The sample manifest lists {len(rows) - 1} samples, this run has room for {room}")
+    samples = []
+    for line, row in enumerate(rows[1:], start=2):
+        cells = [cell.strip() for cell in row] + ['']*len(header)
+        sample_id, tube = cells[sample_column], cells[tube_column].upper()
+        if any(sample['sample'] == sample_id for sample in samples):
+            raise Exception(f"Line {line} of the sample manifest repeats sample {sample_id}")
+        if tube not in tubes:
+            raise Exception(f"Line {line} of the sample manifest puts {sample_id} in {tube}, which is not one of the free tubes {', '.join(tubes)}")
+        tubes.remove(tube)
+        try:
+            expected = float(cells[expected_column]) if expected_column is not None and cells[expected_column] else None
+            target = float(cells[target_column]) if target_column is not None and cells[target_column] else None
+        except ValueError:
+            raise Exception(f"Line {line} of the sample manifest has a concentration or target that is not a number")
+        samples.append({'sample': sample_id, 'tube': tube, 'expected': expected, 'target': target})
+    if not samples:
+        raise Exception("The sample manifest has no samples")
+    return samples
+
+
+def read_sample_manifest(manifest, reserved_tubes, max_samples=None):
+    """Samples of a sample_manifest parameter, or None when the run has no manifest."""
+    try:
+        rows = manifest.parse_as_csv()
+    except RuntimeParameterRequiredError:
+        return None
+    return parse_manifest(rows, reserved_tubes, max_samples)
+# ---- end of sample_manifest.py ----
+
+# Heater-shakers and the thermocycler as incubation stations, see incubation_stations.py
+# ---- incubation_stations.py (copied by shared_code.py, edit incubation_stations.py instead) ----
+# Plates that sit on the thermocycler block
+THERMOCYCLER_PLATES = ['opentrons_96_wellplate_200ul_pcr_full_skirt', 'nest_96_wellplate_100ul_pcr_full_skirt',
+                       'biorad_96_wellplate_200ul_pcr']
+
+
+def takes(kind, load_name, rpm=None):
+    """Whether a heater_shaker or thermocycler station takes a plate shaken at rpm."""
+    if kind == 'thermocycler':
+        return not rpm and load_name in THERMOCYCLER_PLATES
+    return True
+
+
+class IncubationStations:
+    """The incubation stations of a run and what incubates on them.
+
+    delay(seconds) waits out an incubation, protocol.delay by default; a rehearsal passes
+    its scaled wait. A station is a dict of kind, module, location (the adapter plates go
+    on) and, while busy, plate, celsius, rpm and end on the time.monotonic() clock.
+    """
+
+    def __init__(self, protocol, delay=None):
+        self.protocol = protocol
+        self.delay = delay or (lambda seconds: protocol.delay(seconds=seconds))
+        self.stations = []
+
+    def add_heater_shaker(self, module, location=None):
+        """A heater-shaker; plates go on location, its adapter, or on the module itself."""
+        self.stations.append({'kind': 'heater_shaker', 'module': module, 'location': location or module, 'plate': None})
+
+    def add_thermocycler(self, module):
+        """The thermocycler, for runs where its block is free while they incubate."""
+        self.stations.append({'kind': 'thermocycler', 'module': module, 'location': module, 'plate': None})
+
+    def free(self, plate, rpm=None):
+        """The first free station that takes the plate, or None."""
+        return next((station for station in self.stations
+                     if station['plate'] is None and takes(station['kind'], plate.load_name, rpm)), None)
+
+    def start(self, plate, minutes, celsius=None, rpm=None):
+        """Put a plate on a free station and start its incubation. Returns the station.
+
+        Without celsius the station keeps the temperature it has, so a heater-shaker
+        warmed up beforehand is not waited on again.
+        """
+        station = self.free(plate, rpm)
+        if station is None:
+            busy = ', '.join(f"{station['kind']} ({station['plate'].load_name})" for station in self.stations if station['plate'] is not None)
+            raise Exception(f"No free incubation station takes {plate.load_name}, busy: {busy or 'none'}")
+        module = station['module']
+        if station['kind'] == 'thermocycler':
+            module.open_lid()
+            self.protocol.move_labware(labware=plate, new_location=station['location'], use_gripper=True)
+            module.close_lid()
+            if celsius is not None:
+                module.set_block_temperature(celsius)
+        else:
+            module.open_labware_latch()
+            self.protocol.move_labware(labware=plate, new_location=station['location'], use_gripper=True)
+            module.close_labware_latch()
+            if celsius is not None:
+                module.set_and_wait_for_temperature(celsius)
+            if rpm:
+                module.set_and_wait_for_shake_speed(rpm)
+        station.update(plate=plate, celsius=celsius, rpm=rpm, end=time.monotonic() + minutes*60)
+        return station
+
+    def finish(self, station, heater_off=None, open_station=True):
+        """Wait out the rest of an incubation, then stop and open the station.
+
+        The heat goes off when start() set it, unless heater_off says otherwise; a heater
+        kept warm for the next plate stays on. open_station=False keeps a plate that is
+        pipetted into where it is latched in.
+        """
+        remaining = station['end'] - time.monotonic()
+        if remaining > 0:
+            self.delay(round(remaining))
+        if heater_off is None:
+            heater_off = station['celsius'] is not None
+        module = station['module']
+        if station['kind'] == 'thermocycler':
+            if heater_off:
+                module.deactivate_block()
+            if open_station:
+                module.open_lid()
+        else:
+            if station['rpm']:
+                module.deactivate_shaker()
+            if heater_off:
+                module.deactivate_heater()
+            if open_station:
+                module.open_labware_latch()
+        station['plate'] = None
+# ---- end of incubation_stations.py ----
 
 metadata = {
     'protocolName': 'Photolabeling BCA Click and RedAlkDigest',
@@ -19,18 +292,163 @@ requirements = {
     "apiLevel": "2.21"
 }
 
+def add_parameters(parameters):
+
+    parameters.add_str(
+        variable_name="resume_from",
+        display_name="Resume from",
+        description="Phase to start at. Later phases restore the deck, tips and volumes saved after the previous phase.",
+        choices=[
+            {"display_name": "BCA (full run)", "value": "bca"},
+            {"display_name": "Normalization", "value": "normalization"},
+            {"display_name": "Click reaction", "value": "click"},
+            {"display_name": "SP3 cleanup", "value": "sp3_cleanup"},
+            {"display_name": "Streptavidin enrichment", "value": "enrichment"},
+            {"display_name": "Digest", "value": "digest"}
+        ],
+        default="bca"
+    )
+    parameters.add_str(
+        variable_name="stop_after",
+        display_name="Stop after",
+        description="Last phase to run here. Stopping early writes a hand-off manifest for the next robot",
+        choices=[
+            {"display_name": "BCA", "value": "bca"},
+            {"display_name": "Normalization", "value": "normalization"},
+            {"display_name": "Click reaction", "value": "click"},
+            {"display_name": "SP3 cleanup", "value": "sp3_cleanup"},
+            {"display_name": "Streptavidin enrichment", "value": "enrichment"},
+            {"display_name": "Digest (full run)", "value": "digest"}
+        ],
+        default="digest"
+    )
+    parameters.add_bool(
+        variable_name="from_handoff",
+        display_name="Start from hand-off",
+        description="Resume from another robot's hand-off manifest, with full tip racks",
+        default=False
+    )
+    parameters.add_bool(
+        variable_name="rehearsal",
+        display_name="Rehearsal mode",
+        description="Dry run with identical motion: short delays, no heating or cooling, no plate reader file",
+        default=False
+    )
+    parameters.add_float(
+        variable_name="rehearsal_delay_scale",
+        display_name="Rehearsal delay scale",
+        description="Fraction of every delay kept in rehearsal mode",
+        default=0.02,
+        minimum=0,
+        maximum=1
+    )
+    parameters.add_bool(
+        variable_name="rehearsal_water",
+        display_name="Rehearse with water",
+        description="Fill every sample and reagent position with water instead of the real liquids",
+        default=False
+    )
+    parameters.add_csv_file(
+        variable_name="sample_manifest",
+        display_name="Sample manifest",
+        description="CSV of sample, position (tube), expected_mg_ml and target_ug, one row per sample"
+    )
+    parameters.add_bool(
+        variable_name="profile_analysis",
+        display_name="Profile analysis",
+        description="Log the time and peak memory of each step of the plate reader analysis",
+        default=False
+    )
+
 def run(protocol: protocol_api.ProtocolContext):
+    telemetry = run_telemetry.instrument(protocol, metadata['protocolName']) if run_telemetry else None
+    history = run_history.start(protocol, metadata['protocolName'], telemetry.run_id if telemetry else None) if run_history else None
     #######################################################################################
     # The necessary amounts of each BSA standard = 1, lysis buffer = 600 (# samples
     protocol.comment(
         "Place BSA Standard in A1, Lysis buffer in A2, samples in row B-C, empty tube in C5, biotin in C6, cuso4 in D4, tbta in D5, tcep in D6")
-    protocol.comment("Running the BCA assay")
-    
-    num_samples = 10 #change this to the number of samples you need to run. The maximum is 18.
+
+    num_samples = 10 # samples when there is no manifest
+    max_samples = 18 # most samples one run takes
     # Change these if not using 96-well
     num_rows = 8  # A-H
     num_replicates = 3  # the number of replicates
 
+    #define the target protein concentration for the normalized samples and final volume in mL
+    target_concentration = 1
+    final_volume = 0.385
+    final_volume_ul = final_volume*1000
+
+    # ---------------- Sample manifest ----------------
+    # The samples come from the sample_manifest CSV: one row per sample with its ID, its tube on
+    # the temperature block and, optionally, the expected concentration (mg/mL) and the protein
+    # to normalize to (ug, target_concentration x final_volume by default). It is read once into
+    # sample_sheet, keyed by sample ID, together with the BCA and plate3 wells of every sample,
+    # so the steps below look a sample up instead of working out its wells again. Without a
+    # manifest (the simulator has none) num_samples numbered samples fill B1-B6, C1-C6, D1-D6.
+    reserved_tubes = ['A1', 'A2', 'D5', 'D6']
+    sample_sheet = {}
+
+    def add_sample(sample_id, tube, expected=None, target=None):
+        index = len(sample_sheet)
+        sample_sheet[sample_id] = {
+            'index': index,
+            'tube': tube,
+            'expected': expected,
+            'target': target if target is not None else target_concentration*final_volume_ul,
+            'well': f"{'ABCDEFGH'[index % 8]}{(index // 8) + 1}",
+        }
+
+    manifest = read_sample_manifest(protocol.params.sample_manifest, reserved_tubes, max_samples)
+    if manifest:
+        for sample in manifest:
+            add_sample(sample['sample'], sample['tube'], sample['expected'], sample['target'])
+        num_samples = len(sample_sheet)
+    else:
+        for i in range(num_samples):
+            add_sample(f'Sample {i + 1}', f"{'BCD'[i // 6]}{i % 6 + 1}")
+
+    # Triplicates of the samples next to the standards on the BCA plate, in sample sheet order
+    bca_map = compile_map(list(sample_sheet))
+    for sample, mapped in zip(sample_sheet.values(), bca_map.samples):
+        sample['bca_wells'] = mapped['wells']
+
+    # ---------------- Phases and checkpoints ----------------
+    # The run is split into phases. After each one the deck, tip usage and volumes are saved
+    # so an interrupted run can be restarted with resume_from set to the next phase.
+    # Running resume_from..stop_after on one robot and the rest on another hands the plate
+    # over with a manifest of plate IDs, the well map and the computed volumes.
+    phases = ['bca', 'normalization', 'click', 'sp3_cleanup', 'enrichment', 'digest']
+    resume_from = protocol.params.resume_from
+    stop_after = protocol.params.stop_after
+    checkpoint_file = Path("/var/lib/jupyter/notebooks/TWH/ChemProt_10plex_checkpoint.json")
+    run_stamp = datetime.datetime.now().strftime("%y%m%d-%H%M")
+    handoff_file = Path("/var/lib/jupyter/notebooks/TWH/ChemProt_10plex_handoff.json")
+    if phases.index(stop_after) < phases.index(resume_from):
+        raise Exception(f"Cannot stop after {stop_after} when starting at {resume_from}")
+
+    def should_run(phase):
+        return phases.index(resume_from) <= phases.index(phase) <= phases.index(stop_after)
+
+    checkpoint = {'num_samples': num_samples, 'phase': None, 'plate_ids': {}}
+    if resume_from != 'bca':
+        # A hand-off comes from another robot, so its tip usage does not apply to the racks here
+        state_file = handoff_file if protocol.params.from_handoff else checkpoint_file
+        if not state_file.exists():
+            raise Exception(f"No checkpoint found at {state_file}, start the run from the BCA")
+        checkpoint = json.loads(state_file.read_text())
+        if protocol.params.from_handoff:
+            checkpoint['tips_used'] = {}
+        checkpoint.setdefault('plate_ids', {})
+        previous_phase = phases[phases.index(resume_from) - 1]
+        if checkpoint['phase'] != previous_phase:
+            raise Exception(f"The last checkpoint was saved after {checkpoint['phase']}, so the run can only resume from {phases[phases.index(checkpoint['phase']) + 1]}")
+        if checkpoint['num_samples'] != num_samples:
+            raise Exception(f"The checkpoint is for {checkpoint['num_samples']} samples, not {num_samples}")
+        if 'well_map' in checkpoint and list(checkpoint['well_map']) != list(sample_sheet):
+            raise Exception(f"The checkpoint is for samples {', '.join(checkpoint['well_map'])}, not the ones in the manifest")
+        protocol.comment(f"Resuming from {resume_from} using the {'hand-off manifest' if protocol.params.from_handoff else 'checkpoint'} saved after {previous_phase}")
+
     #Start recording the video
     video_output_file = 'BCA_Assay_012425.mp4'
     device_index = "<video2>"
@@ -45,574 +463,758 @@ def run(protocol: protocol_api.ProtocolContext):
     chute = protocol.load_waste_chute()
 
     # Load adapters
-    hs_adapter = heater_shaker.load_adapter('opentrons_universal_flat_adapter')
+    if should_run('bca'):
+        hs_adapter = heater_shaker.load_adapter('opentrons_universal_flat_adapter')
     temp_adapter = temp_module.load_labware('opentrons_24_aluminumblock_nest_1.5ml_screwcap')
 
+    # ---------------- Rehearsal mode ----------------
+    # Every delay goes through wait() and every temperature through heat_shaker()/cool_tubes(),
+    # so a rehearsal keeps the pipetting and gripper motion but not the hours of holds and heat-up.
+    rehearsal = protocol.params.rehearsal
+    if rehearsal:
+        protocol.comment(f"Rehearsal mode: delays scaled by {protocol.params.rehearsal_delay_scale}, modules not heated or cooled")
+        if protocol.params.rehearsal_water:
+            protocol.comment("Rehearsal mode: fill every sample and reagent position with water")
+
+    def wait(minutes):
+        if rehearsal:
+            minutes = minutes * protocol.params.rehearsal_delay_scale
+        protocol.delay(seconds=round(minutes*60))
+
+    def heat_shaker(celsius):
+        if rehearsal:
+            protocol.comment(f"Rehearsal mode: skipping heater-shaker at {celsius} °C")
+        else:
+            heater_shaker.set_and_wait_for_temperature(celsius)
+
+    def cool_tubes(celsius):
+        if rehearsal:
+            protocol.comment(f"Rehearsal mode: skipping temperature module at {celsius} °C")
+        else:
+            temp_module.set_temperature(celsius=celsius)
+
+    def liquid_name(name):
+        if rehearsal and protocol.params.rehearsal_water:
+            return f"Water ({name})"
+        return name
+
     #set the heater_shaker temp to 60C
-    heater_shaker.set_and_wait_for_temperature(37)
+    heat_shaker(37)
 
     #set the temp module to 0c
-    temp_module.set_temperature(celsius=10)
-    
+    cool_tubes(10)
+
+    # Where the tip racks and sample plate start; a resumed run loads them where the checkpoint left them
+    locations = {'tips_50': 'A4', 'partial_50': 'A3', 'tips_200': 'B4', 'partial_200': 'B3', 'plate3': 'B2'}
+    locations.update(checkpoint.get('locations', {}))
+    module_locations = {'mag_block': mag_block}
+
+    def load_at(name, load_name):
+        if locations[name] in module_locations:
+            return module_locations[locations[name]].load_labware(load_name)
+        return protocol.load_labware(load_name, locations[name])
+
+    def location_name(labware):
+        for name, location in module_locations.items():
+            if labware.parent == location:
+                return name
+        return labware.parent
+
     # Load labware
-    tips_50 = protocol.load_labware('opentrons_flex_96_filtertiprack_50ul', 'A4')
-    partial_50 = protocol.load_labware(load_name="opentrons_flex_96_filtertiprack_50ul",location="A3")
-    tips_200 = protocol.load_labware('opentrons_flex_96_filtertiprack_200ul', 'B4')
-    partial_200 = protocol.load_labware(load_name="opentrons_flex_96_filtertiprack_200ul",location="B3")
-    plate1 = protocol.load_labware('corning_96_wellplate_360ul_flat', 'A2')
-    plate2 = protocol.load_labware('corning_96_wellplate_360ul_flat', 'B2')
+    tips_50 = load_at('tips_50', 'opentrons_flex_96_filtertiprack_50ul')
+    partial_50 = load_at('partial_50', 'opentrons_flex_96_filtertiprack_50ul')
+    tips_200 = load_at('tips_200', 'opentrons_flex_96_filtertiprack_200ul')
+    partial_200 = load_at('partial_200', 'opentrons_flex_96_filtertiprack_200ul')
+    if should_run('bca'):
+        plate1 = protocol.load_labware('corning_96_wellplate_360ul_flat', 'A2')
+        plate2 = protocol.load_labware('corning_96_wellplate_360ul_flat', 'B2')
+        checkpoint['plate_ids']['plate2'] = f"BCA-{run_stamp}"
     reservoir = protocol.load_labware('nest_12_reservoir_15ml', 'C2')
-    
+    racks = {'tips_50': tips_50, 'partial_50': partial_50, 'tips_200': tips_200, 'partial_200': partial_200}
+
     # Liquid definitions
-    bsa_standard = protocol.define_liquid(name = 'BSA Standard', display_color="#704848",)
-    lysis_buffer = protocol.define_liquid(name = 'Lysis Buffer', display_color="#FF0000",)
-    sample_liquids = [protocol.define_liquid(name = f'Sample {i + 1}', display_color="#FFA000",) for i in range(num_samples)]
-    biotin_azide = protocol.define_liquid(name = 'Biotin Azide', display_color="#FF0011",)
-    copper_sulfate = protocol.define_liquid(name = 'CuSO4', display_color="#FF0022",)
-    tbta = protocol.define_liquid(name = 'TBTA', display_color="#FF0033",)
-    tcep = protocol.define_liquid(name = 'TCEP', display_color="#FF0044",)
-    
+    bsa_standard = protocol.define_liquid(name=liquid_name('BSA Standard'), display_color="#704848",)
+    lysis_buffer = protocol.define_liquid(name=liquid_name('Lysis Buffer'), display_color="#FF0000",)
+    sample_liquids = {sample_id: protocol.define_liquid(name=liquid_name(sample_id), display_color="#FFA000",) for sample_id in sample_sheet}
+    biotin_azide = protocol.define_liquid(name=liquid_name('Biotin Azide'), display_color="#FF0011",)
+    copper_sulfate = protocol.define_liquid(name=liquid_name('CuSO4'), display_color="#FF0022",)
+    tbta = protocol.define_liquid(name=liquid_name('TBTA'), display_color="#FF0033",)
+    tcep = protocol.define_liquid(name=liquid_name('TCEP'), display_color="#FF0044",)
+
+    #print the locations of the samples
+    print("Sample Locations:", {sample_id: sample['tube'] for sample_id, sample in sample_sheet.items()})
+
     # load the liquids to the tube racks and reservoirs
-    reagent_res.wells()[1].load_liquid(liquid=ab_def, volume=ab_vol_stock)     
+    temp_adapter['A1'].load_liquid(liquid=bsa_standard, volume=1000)
+    temp_adapter['A2'].load_liquid(liquid=lysis_buffer, volume=1500)
+    for sample_id, sample in sample_sheet.items():
+        temp_adapter[sample['tube']].load_liquid(liquid=sample_liquids[sample_id], volume=100)
 
     # Load pipettes
     p50_multi = protocol.load_instrument('flex_8channel_50', 'left') #, tip_racks=[tips_50]
     p1000_multi = protocol.load_instrument('flex_8channel_1000', 'right') #, tip_racks=[tips_200]
 
-    #Configure the p1000 pipette to use single tip NOTE: this resets the pipettes tip racks!
-    p1000_multi.configure_nozzle_layout(style=SINGLE, start="A1",tip_racks=[partial_200])
-
-    # Steps 1: Add lysis buffer to column 1 of plate1. 
-    p1000_multi.distribute(50, 
-         temp_adapter['A2'],
-         plate1.columns('1'),
-         rate = 0.35,
-         delay = 2,
-         new_tip='once')
-
-    # Step 2: move the 200uL partial tips to D4 and then the 50 uL partial tips to B3
-    protocol.move_labware(labware=partial_200, new_location="D4", use_gripper=True)
-    protocol.move_labware(labware=partial_50, new_location="B3", use_gripper=True)
-
-    #Step 3: Configure the p50 pipette to use single tip NOTE: this resets the pipettes tip racks!
-    p50_multi.configure_nozzle_layout(style=SINGLE, start="A1",tip_racks=[partial_50])
-
-    # Step 4: Transfer BSA standard (20 mg/ml) to first well of column 1
-    p50_multi.transfer(50,
-        temp_adapter['A1'],
-        plate1['A1'],
-        rate = 0.35,
-        delay = 2,
-        mix_after=(3, 40),
-        new_tip='once')
-
-    # Step 5: Perform serial dilution down column 1
-    rows = ['A','B', 'C', 'D', 'E', 'F', 'G']
-    p50_multi.pick_up_tip()
-    for source, dest in zip(rows[:-1], rows[1:]):
-        p50_multi.transfer(50,
-                         plate1[f'{source}1'],
-                         plate1[f'{dest}1'],
-                         rate = 0.5,
-                         mix_after=(3, 40),
-                         new_tip='never', 
-                         disposal_vol=0)
-
-    # Step 6: remove excess standard from well G
-    p50_multi.aspirate(50,plate1['G1'])
-    p50_multi.drop_tip()
-
-    # assign sample locations dynamically
-    sample_locations = []
-    for i in range(num_samples):
-        if i < 6:  # B1 to B6
-            sample_locations.append(f'B{i + 1}')
-        elif i < 12:  # C1 to C6
-            sample_locations.append(f'C{i - 5}')
-        elif i < 18:  # D1 to D6
-            sample_locations.append(f'D{i - 11}')
+    # Full-column racks skip the columns a resumed run already used. starting_tip only works
+    # with the full nozzle layout, so single-tip racks have to be refilled by hand instead.
+    first_unused = {}
+    refills = []
+    for name, used_wells in checkpoint.get('tips_used', {}).items():
+        if not used_wells:
+            continue
+        if name in ['tips_50', 'tips_200']:
+            first_unused[name] = next((well for well in racks[name].wells() if well.well_name not in used_wells), None)
+            if first_unused[name] is None:
+                refills.append(f"Replace {name} in {locations[name]} with a full rack")
         else:
-            break  # Stop if we exceed the number of available rows/columns
-
-    #print the locations of the samples
-    print("Sample Locations:", sample_locations)
-
-    # Predefined list of letters A-H
-    row = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
-
-    # Create a list of rows that repeats based on num_samples
-    rows = [row[i % len(row)] for i in range(num_samples)]
-
-    # Create a dynamic sample map based on the assigned sample locations
-    sample_map = list(map(lambda i,j :(i,j), rows, sample_locations))
-
-    # Print the dynamic sample map for verification
-    print("Dynamic Sample Map:", sample_map)
-
-    # Iterate over the sample_map list
-    for index, (row, tube) in enumerate(sample_map):
-        if index < 8:
-            base_column = 4 + (index // 8)  # This will determine the starting column for each row
-        elif index< 16:
-            base_column = 6 + (index // 8)
+            refills.append(f"Refill {name} in {locations[name]} at {', '.join(used_wells)} or swap in a full rack")
+    if refills:
+        for refill in refills:
+            protocol.comment(refill)
+        protocol.pause("Refill the tip racks listed above, then resume")
+
+    def configure_tips(pipette, style, name):
+        if style == ALL:
+            pipette.configure_nozzle_layout(style=ALL, tip_racks=[racks[name]])
+            pipette.starting_tip = first_unused.get(name)
         else:
-            base_column = 8 + (index //8)
-
-        # Prepare destination wells
-        destination_wells = [f'{row}{base_column + (i % 3)}' for i in range(3)]  # Generate wells like A4, A5, A6 or B4, B5, B6, etc.
-        print("Distributing from " + tube + " to wells: ", destination_wells)
-        
-        #Transfer the samples onto plate 2
-        p50_multi.distribute(
-            10,
-            temp_adapter[tube],
-            [plate2[i] for i in destination_wells],
-            rate = 0.5)  # Distributing to three consecutive columns
-
-    # Step 8: move the 50uL complete tips to A3
-    protocol.move_labware(labware=tips_50, new_location="A3", use_gripper=True)
-
-    #Step 9: Load the p50 with full tip rack
-    p50_multi.configure_nozzle_layout(style=ALL, tip_racks=[tips_50]) #, 
-
-    #Step 10: Pipette triplicate of controls from plate1 column 1 to plate2 columns 1,2,3 
-    p50_multi.distribute(10, plate1['A1'], [plate2[f'A{i}'] for i in range(1, 4)])
-
-    # Step 11: move the 50 uL partial tips to C3 and the 200uL complete tips to B3
-    protocol.move_labware(labware=partial_50, new_location="C4", use_gripper=True)
-    protocol.move_labware(labware=tips_200, new_location="B3", use_gripper=True)
-
-    #Step 12: Load the p1000 with full tip rack
-    p1000_multi.configure_nozzle_layout(style=ALL, tip_racks=[tips_200]) #,
-
-    # Step 13: Add reagent A
-    p1000_multi.distribute(75,
-                        reservoir['A1'],
-                        plate2.wells(),
-                        new_tip='once')
-
-    # Step 14: Add reagent B
-    p1000_multi.distribute(72,
-                        reservoir['A3'],
-                        plate2.wells(),
-                        new_tip='once')
-
-    # Step 15: Add reagent c
-    p50_multi.distribute(3,
-                        reservoir['A5'],
-                        plate2.wells(),
-                        new_tip='once')
-
-    #Step 16: move plate 2 to the heater shaker and incubate at 37c
-    heater_shaker.open_labware_latch()
-    protocol.move_labware(labware=plate2, new_location=hs_adapter,use_gripper=True)
-    heater_shaker.close_labware_latch()
-    heater_shaker.set_and_wait_for_shake_speed(500)
-    protocol.delay(minutes=5)
-
-    #Step 17 deactivate heater shaker and temp modules
-    heater_shaker.deactivate_shaker()
-    heater_shaker.deactivate_heater()
-    heater_shaker.open_labware_latch()
-    #temp_module.deactivate()
+            pipette.configure_nozzle_layout(style=SINGLE, start="A1", tip_racks=[racks[name]])
+            pipette.starting_tip = None
+
+    # The SP3 washes use more columns than one 200 uL rack holds. When the next steps need more
+    # than is left, the rack goes to the chute and the operator puts a full one in its place.
+    def ensure_columns(name, columns):
+        rack = racks[name]
+        # Columns before the starting tip of a resumed run were used before the interruption
+        skipped = int(first_unused[name].well_name[1:]) - 1 if first_unused.get(name) else 0
+        if sum(all(well.has_tip for well in column) for column in rack.columns()[skipped:]) >= columns:
+            return
+        location = rack.parent
+        protocol.move_labware(labware=rack, new_location=chute, use_gripper=True)
+        racks[name] = protocol.load_labware(rack.load_name, protocol_api.OFF_DECK)
+        protocol.comment(f"Place a full {name} rack in {location}")
+        protocol.move_labware(labware=racks[name], new_location=location)
+        first_unused.pop(name, None)
+
+    # Remember the volume added to the samples
+    added_vol = checkpoint.get('added_vol', 0)
+
+    def save_checkpoint(phase):
+        checkpoint['phase'] = phase
+        checkpoint['locations'] = {name: location_name(labware) for name, labware in racks.items()}
+        if phases.index(phase) >= phases.index('normalization'):
+            checkpoint['locations']['plate3'] = location_name(plate3)
+        checkpoint['tips_used'] = {name: [well.well_name for well in rack.wells() if not well.has_tip] for name, rack in racks.items()}
+        checkpoint['added_vol'] = added_vol
+        checkpoint['well_map'] = {sample_id: {'tube': sample['tube']} for sample_id, sample in sample_sheet.items()}
+        for sample_id, sample in sample_sheet.items():
+            if phases.index(phase) >= phases.index('normalization'):
+                checkpoint['well_map'][sample_id]['plate3'] = sample['well']
+            if phases.index(phase) >= phases.index('enrichment'):
+                checkpoint['well_map'][sample_id]['plate3_enriched'] = sample['enriched_well']
+        # Only a live run leaves state on the deck worth resuming from
+        if not protocol.is_simulating() and not rehearsal:
+            checkpoint_file.write_text(json.dumps(checkpoint, indent=2))
+            protocol.comment(f"Checkpoint saved after {phase}")
+
+    # ---------------- BCA ----------------
+    if should_run('bca'):
+        protocol.comment("Running the BCA assay")
+
+        #Configure the p1000 pipette to use single tip NOTE: this resets the pipettes tip racks!
+        configure_tips(p1000_multi, SINGLE, 'partial_200')
+
+        # Steps 1: Add lysis buffer to column 1 of plate1.
+        p1000_multi.distribute(50,
+             temp_adapter['A2'],
+             plate1.columns('1'),
+             rate = 0.35,
+             delay = 2,
+             new_tip='once')
+
+        # Step 2: move the 200uL partial tips to D4 and then the 50 uL partial tips to B3
+        protocol.move_labware(labware=partial_200, new_location="D4", use_gripper=True)
+        protocol.move_labware(labware=partial_50, new_location="B3", use_gripper=True)
+
+        #Step 3: Configure the p50 pipette to use single tip NOTE: this resets the pipettes tip racks!
+        configure_tips(p50_multi, SINGLE, 'partial_50')
+
+        # Step 4: Transfer BSA standard (20 mg/ml) to first well of column 1
+        p50_multi.transfer(50,
+            temp_adapter['A1'],
+            plate1['A1'],
+            rate = 0.35,
+            delay = 2,
+            mix_after=(3, 40),
+            new_tip='once')
+
+        # Step 5: Perform serial dilution down column 1
+        rows = ['A','B', 'C', 'D', 'E', 'F', 'G']
+        p50_multi.pick_up_tip()
+        for source, dest in zip(rows[:-1], rows[1:]):
+            p50_multi.transfer(50,
+                             plate1[f'{source}1'],
+                             plate1[f'{dest}1'],
+                             rate = 0.5,
+                             mix_after=(3, 40),
+                             new_tip='never',
+                             disposal_vol=0)
+
+        # Step 6: remove excess standard from well G
+        p50_multi.aspirate(50,plate1['G1'])
+        p50_multi.drop_tip()
+
+        # Iterate over the samples in the sample sheet
+        for sample_id, sample in sample_sheet.items():
+            print("Distributing " + sample_id + " from " + sample['tube'] + " to wells: ", sample['bca_wells'])
+
+            #Transfer the samples onto plate 2
+            p50_multi.distribute(
+                10,
+                temp_adapter[sample['tube']],
+                [plate2[i] for i in sample['bca_wells']],
+                rate = 0.5)  # Distributing to three consecutive columns
+
+        # Step 8: move the 50uL complete tips to A3
+        protocol.move_labware(labware=tips_50, new_location="A3", use_gripper=True)
+
+        #Step 9: Load the p50 with full tip rack
+        configure_tips(p50_multi, ALL, 'tips_50')
+
+        #Step 10: Pipette triplicate of controls from plate1 column 1 to plate2 columns 1,2,3
+        p50_multi.distribute(10, plate1['A1'], [plate2[i] for i in bca_map.top_wells(0)])
+
+        # Step 11: move the 50 uL partial tips to C3 and the 200uL complete tips to B3
+        protocol.move_labware(labware=partial_50, new_location="C4", use_gripper=True)
+        protocol.move_labware(labware=racks['tips_200'], new_location="B3", use_gripper=True)
+
+        #Step 12: Load the p1000 with full tip rack
+        configure_tips(p1000_multi, ALL, 'tips_200')
+
+        # Step 13: Add reagent A
+        p1000_multi.distribute(75,
+                            reservoir['A1'],
+                            plate2.rows()[0],
+                            new_tip='once')
+
+        # Step 14: Add reagent B
+        p1000_multi.distribute(72,
+                            reservoir['A3'],
+                            plate2.rows()[0],
+                            new_tip='once')
+
+        # Step 15: Add reagent c
+        p50_multi.distribute(3,
+                            reservoir['A5'],
+                            plate2.rows()[0],
+                            new_tip='once')
+
+        #Step 16: move plate 2 to the heater shaker and incubate at 37c
+        heater_shaker.open_labware_latch()
+        protocol.move_labware(labware=plate2, new_location=hs_adapter,use_gripper=True)
+        heater_shaker.close_labware_latch()
+        heater_shaker.set_and_wait_for_shake_speed(500)
+        wait(5)
+
+        #Step 17 deactivate heater shaker and temp modules
+        heater_shaker.deactivate_shaker()
+        heater_shaker.deactivate_heater()
+        heater_shaker.open_labware_latch()
+        #temp_module.deactivate()
+
+        save_checkpoint('bca')
 
     #######################################################################################
-    # Tell the user to load BCA assay data
-    protocol.comment("Place BCA assay absorbance data in /var/lib/jupyter/notebooks/TWH, load new deep well plate into hs_adapter (where BCA plate was), and new tube rack into A2 (with click mix, beads and TCEP/IAA)")
-    
-    #define the target protein concentration for the normalized samples and final volume in mL
-    target_concentration = 1
-    final_volume = 0.385
-    final_volume_ul = final_volume*1000
-
-    # Pause the protocol until the user loads the file to /var/lib/jupyter/notebooks
-    protocol.pause()
-
-    # Tell user the protocol started
-    protocol.comment("Running Protein Normalization")
-
-    # Tell the robot that new labware will be placed onto the deck
-    protocol.move_labware(labware=plate1, new_location=protocol_api.OFF_DECK)
-    protocol.move_labware(labware=plate2, new_location=protocol_api.OFF_DECK)
-
-    # Load the new labware
-    plate3 = protocol.load_labware('thermoscientificnunc_96_wellplate_2000ul', location='hs_adapter')  # New deep well plate for final samples
-    epp_rack = protocol.load_labware('opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap', location="A2")
-    excess_lysis = protocol.define_liquid(name='excess_lysis', display_color="#FF0077")
-    
-    #create wells on the new 96-deep well plate
-    rows = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
-    destination_wells  = [f'{rows[i % 8]}{(i // 8)+ 1}' for i in range(num_samples)]
-
-    #Add some initial lysis buffer to all sample wells
-    p1000_multi.distribute(final_volume_ul/2, reservoir['A7'], [plate3[i] for i in destination_wells], rate=0.5, new_tip='once')
-
-    # move the complete 200uL to A4 and then the partial 200 uL tips to B3
-    protocol.move_labware(labware=tips_200, new_location="A4", use_gripper=True)
-    protocol.move_labware(labware=partial_200, new_location="B3", use_gripper=True)
-    
-    #Configure the p50 pipette to use single tip NOTE: this resets the pipettes tip racks!
-    p1000_multi.configure_nozzle_layout(style=SINGLE, start="A1",tip_racks=[partial_200])
-
-    # Define the directory path
-    directory = Path("/var/lib/jupyter/notebooks/TWH/")
-
-    # Get today's date in YYMMDD format
-    today_date = datetime.date.today().strftime("%y%m%d")
-
-    find_file = subprocess.Popen(['python3',"/var/lib/jupyter/notebooks/wait_for_file.py"],stdout=subprocess.PIPE,
-        text=True)
-    stdout, stderr = find_file.communicate()
-
-    if stderr:
-        raise ValueError(f"Error while waiting for file: {stderr}")
-
-    # Extract the file path from the output
-    file_path = stdout.splitlines()[1]
-    if not file_path:
-        raise ValueError("No file path returned by wait_for_file.py")
-
-    protocol.comment(f"Successfully loaded: {file_path}")
-    # Read the data file
-    df = pd.read_excel(file_path, header=5, nrows=8, usecols="C:N")
-
-    # Create a list of well names (A1 to H12)
-    well_names = [f"{row}{col}" for col in range(1, 13) for row in "ABCDEFGH"]
-
-    # Flatten the absorbance values into a single list
-    absorbance_values = df.values.flatten()
-
-    # Create the DataFrame
-    initial_df = pd.DataFrame({'Well': well_names, 'Absorbance': absorbance_values})
-
-    # Process data for normalization
-    samples, replicate_1, replicate_2, replicate_3 = [], [], [], []
-    sample_index = 1
-    for col_offset in range(0, 12, 3):  # Iterate by column groups (triplets)
-        for row_offset in range(8):  # Iterate row-wise for each sample
-            start = row_offset * 12 + col_offset  # Starting index for the sample
-            if start + 2 < len(initial_df):
-                samples.append(f"Sample {sample_index}")
-                replicate_1.append(initial_df.iloc[start]['Absorbance'])
-                replicate_2.append(initial_df.iloc[start + 1]['Absorbance'])
-                replicate_3.append(initial_df.iloc[start + 2]['Absorbance'])
-                sample_index += 1
-
-    final_df = pd.DataFrame({
-        'Sample': samples,
-        'Replicate 1': replicate_1,
-        'Replicate 2': replicate_2,
-        'Replicate 3': replicate_3
-    })
-
-    samples_1_to_8 = final_df.iloc[:8]
-    samples_1_to_8['Mean Absorbance'] = samples_1_to_8[['Replicate 1', 'Replicate 2', 'Replicate 3']].mean(axis=1)
-    protein_concentrations = [10, 5, 2.5, 1.25, 0.625, 0.3125, 0.15625, 0]
-    samples_1_to_8['Protein Concentration (mg/mL)'] = protein_concentrations
-
-    slope, intercept = np.polyfit(samples_1_to_8['Protein Concentration (mg/mL)'], samples_1_to_8['Mean Absorbance'], 1)
-    y_pred = slope * samples_1_to_8['Protein Concentration (mg/mL)'] + intercept
-    ss_res = np.sum((samples_1_to_8['Mean Absorbance'] - y_pred) ** 2)
-    ss_tot = np.sum((samples_1_to_8['Mean Absorbance'] - np.mean(samples_1_to_8['Mean Absorbance'])) ** 2)
-    r_squared = 1 - (ss_res / ss_tot)
-
-    unknown_samples = final_df.iloc[8:8 + num_samples]
-    unknown_samples['Mean Absorbance'] = unknown_samples[['Replicate 1', 'Replicate 2', 'Replicate 3']].mean(axis=1)
-    unknown_samples['Protein Concentration (mg/mL)'] = (unknown_samples['Mean Absorbance'] - intercept) / slope
-    
-    unknown_samples['Sample Volume (mL)'] = (target_concentration * final_volume) / unknown_samples['Protein Concentration (mg/mL)']
-    unknown_samples['Diluent Volume (mL)'] = final_volume - unknown_samples['Sample Volume (mL)']
-    unknown_samples.loc[unknown_samples['Sample Volume (mL)'] > final_volume, ['Sample Volume (mL)', 'Diluent Volume (mL)']] = [final_volume, 0]
-    protocol.comment("\nNormalized Unknown Samples (to 1 mg/mL in 500 µL):")
-    print(unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Sample Volume (mL)', 'Diluent Volume (mL)']])
-
-    normalized_samples = unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Sample Volume (mL)', 'Diluent Volume (mL)']].reset_index().drop(columns='index')
-
-    # Add the samples and the rest of the lysis buffer to plate 3
-    for i, row in normalized_samples.iterrows():
-        source_well = sample_locations[i]
-        normalized_volume = row['Sample Volume (mL)']
-        diluent_volume = (final_volume_ul/2) - normalized_volume
-        destination_well = destination_wells[i]
-        p1000_multi.transfer(normalized_volume, temp_adapter[source_well], plate3[destination_well], rate=0.5, new_tip='once')
-        p1000_multi.transfer(diluent_volume, reservoir['A7'], plate3[destination_well], rate=0.5, new_tip='once')
-    
-    #########################################################################################
-    protocol.comment("Transferring Biotin-Peg3 in epp_rack A1, cuso4 in A2, tbta in A3, tcep A4, into empty A5 then samples.")
-
-    #Pipette biotin, tbta, cuso4, and tcep
-    p1000_multi.distribute(110, epp_rack['A1'], temp_adapter['A5'], new_tip='always')
-    p1000_multi.distribute(660, epp_rack['A2'], temp_adapter['A5'], new_tip='always')
-    p1000_multi.distribute(220, epp_rack['A3'], temp_adapter['A5'], new_tip='always')
-    p1000_multi.distribute(220, epp_rack['A4'], temp_adapter['A5'], new_tip='always')
-        
-    #Pipette the click reaction premix
-    p1000_multi.distribute(55, epp_rack['A5'], [plate3[i] for i in destination_wells], new_tip='always')
-
-    #Remember the volume added to the samples
-    added_vol = final_volume_ul + 55
-
-    # Step 11: shake the sample plate for click reaction
-    heater_shaker.close_labware_latch()
-    heater_shaker.set_and_wait_for_shake_speed(600)
-    protocol.delay(minutes=60)
-    heater_shaker.deactivate_shaker()
-    #heater_shaker.open_labware_latch()
-
-    # mix the sp3 beads to homogenize
-    p1000_multi.mix(4, 200, epp_rack['B1'])
-
-    # transfer the sp3 beads for protein precipitation
-    p1000_multi.distribute(60, epp_rack['B1'], [plate3[i] for i in destination_wells])
-    
-    #Remember the volume added to the samples
-    added_vol = added_vol + 60
-
-    # incubate beads with shaking for 5 minutes
-    heater_shaker.set_and_wait_for_shake_speed(1000)
-    protocol.delay(minutes=5)
-
-    # move the partial 200uL to B4 and then the partial 200 uL tips to B3
-    protocol.move_labware(labware=partial_200, new_location="B4", use_gripper=True)
-    protocol.move_labware(labware=tips_200, new_location="B3", use_gripper=True)
-    
-    #Configure the p50 pipette to use All tips NOTE: this resets the pipettes tip racks!
-    p1000_multi.configure_nozzle_layout(style=ALL, tip_racks=[tips_200])
-
-    # Determine number of full columns to fill
-    num_full_columns = (num_samples + 7) // 8  # Round up to ensure all samples are covered
-
-    # Get the destination wells as full columns
-    destination_columns = plate3.columns()[:num_full_columns]
-
-    # Convert columns to top-row wells (e.g., ['A1', 'A2', ..., 'A12'])
-    destination_wells_col = [col[0] for col in destination_columns]  # Only use top row for multi-channel pipette
-
-    # Add EtOH to the sample columns to bind protein and use air gap for volatility
-    p1000_multi.distribute(600, reservoir['A9'], destination_wells_col, new_tip='once',air_gap=10)
-
-    #Remember the volume added to the samples
-    added_vol = added_vol + 600
-
-    # incubate ethanol with shaking for 5 minutes
-    heater_shaker.set_and_wait_for_shake_speed(1000)
-    protocol.delay(minutes=5)
-    
-    # Move samples to the magnet
-    heater_shaker.open_labware_latch()
-    protocol.move_labware(labware=plate3, new_location=mag_block, use_gripper=True)
-    protocol.delay(minutes=3)
-
-    # Remove the EtOH from the beads leaving 200 uL in the bottom
-    p1000_multi.consolidate(900, destination_wells_col.bottom(z=0.2), chute, rate = 0.5, new_tip='once')
-
-    #Remember the volume added to the samples
-    added_vol = added_vol -900
-
-    # Remove remainder of EtOH and Add 80% EtOH and wash the beads three times with 200 uL 80% EtOH
-    for i in range(3):
-        p1000_multi.consolidate(200, destination_wells_col.bottom(z=0.2), chute, rate = 0.35, new_tip='once')
-        protocol.move_labware(labware=plate3, new_location=hs_adapter, use_gripper=True)
-        p1000_multi.distribute(200, reservoir['A10'], destination_wells_col, mix_after=(3, 150), new_tip='once')
-        if i<2:
-            protocol.move_labware(labware=plate3, new_location=mag_block, use_gripper=True)
+    if should_run('normalization'):
+        # Tell the user to load BCA assay data
+        if rehearsal:
+            protocol.comment("Rehearsal mode: no BCA data to load, load new deep well plate into B2, and new tube rack into C3")
         else:
-            protocol.move_labware(labware=plate3, new_location=mag_block, use_gripper=True)
-            p1000_multi.consolidate(200, destination_wells_col.bottom(z=0.2), chute, rate = 0.35, new_tip='once')
-    
-    # resuspend in 2 M urea in PBS with 0.5% SDS and move to shaker
-    protocol.move_labware(labware=plate3, new_location=hs_adapter, use_gripper=True)
-    p1000_multi.distribute(200, reservoir['A12'], destination_wells_col, mix_after=(3, 150), new_tip='once')
-   
-    #Remember the volume added to the samples
-    added_vol = added_vol + 200
-
-    #set the heater_shaker temp to 37 c for reduce
-    heater_shaker.set_and_wait_for_temperature(37)
-
-    # move the partial 200uL to A4 and then the partial 200 uL tips to B3
-    protocol.move_labware(labware=tips_200, new_location="A4", use_gripper=True)
-    protocol.move_labware(labware=partial_200, new_location="B3", use_gripper=True)
-
-    #Configure the p50 pipette to use single tip NOTE: this resets the pipettes tip racks!
-    p1000_multi.configure_nozzle_layout(style=SINGLE, start="A1",tip_racks=[partial_200])
-
-    #Pipette mix K2CO3, and TCEP and transfer to samples
-    Redu_mix = num_samples*50*1.2/2
-    p1000_multi.transfer(Redu_mix, epp_rack['C1'], epp_rack['C4'], new_tip='always')
-    p1000_multi.transfer(Redu_mix, epp_rack['C2'], epp_rack['C4'], new_tip='always')
-    p1000_multi.distribute(50, epp_rack['C4'], [plate3[i] for i in destination_wells], new_tip='always')
-    
-    #Remember the volume added to the samples
-    added_vol = added_vol + 50
-
-    # Reduce for 30 minutes
-    heater_shaker.close_labware_latch()
-    heater_shaker.set_and_wait_for_shake_speed(1000)
-    protocol.delay(minutes=30)
-    heater_shaker.deactivate_shaker()
-
-    # add IAA and alkylate for 30 minutes
-    p1000_multi.distribute(70, epp_rack['C3'], [plate3[i] for i in destination_wells], new_tip='always')
-    heater_shaker.set_and_wait_for_shake_speed(1000)
-    protocol.delay(minutes=30)
-    heater_shaker.deactivate_shaker()
-
-    #Remember the volume added to the samples
-    added_vol = added_vol +70
-
-    # move the partial 200uL to A4 and then the partial 200 uL tips to B3
-    protocol.move_labware(labware=partial_200, new_location="B4", use_gripper=True)
-    protocol.move_labware(labware=tips_200, new_location="B3", use_gripper=True)
-    
-    #Configure the p100 pipette to use All tips
-    p1000_multi.configure_nozzle_layout(style=ALL, tip_racks=[tips_200])
-
-    # Add EtOH and wash beads 3 times again
-    p1000_multi.distribute(400, reservoir['A10'], destination_wells_col, new_tip='once')
-    
-    #Remember the volume added to the samples
-    added_vol = added_vol +400
-
-    # Incubate with EtOH for 5-10 minutes
-    heater_shaker.set_and_wait_for_shake_speed(1000)
-    protocol.delay(minutes=5)
-    heater_shaker.deactivate_shaker()
-
-    # Move samples to the magnet and remove EtOH
-    heater_shaker.open_labware_latch()
-    protocol.move_labware(labware=plate3, new_location=mag_block, use_gripper=True)
-    protocol.delay(minutes=3)
-    p1000_multi.consolidate(520, destination_wells_col.bottom(z=0.2), chute, rate = 0.5, new_tip='once')
-    
-    #Remember the volume added to the samples
-    added_vol = added_vol -520
-
-    # Wash the beads 3 times with 80% EtoH
-    for i in range(3):
-        p1000_multi.consolidate(200, destination_wells_col.bottom(z=0.2), chute, rate = 0.35, new_tip='once')
-        protocol.move_labware(labware=plate3, new_location=hs_adapter, use_gripper=True)
-        p1000_multi.distribute(200, reservoir['A10'], destination_wells_col.bottom(z=0.2), mix_after=(3, 150), new_tip='once')
-        if i<2:
-            protocol.move_labware(labware=plate3, new_location=mag_block, use_gripper=True)
+            protocol.comment("Place BCA assay absorbance data in /var/lib/jupyter/notebooks/TWH, load new deep well plate into B2, and new tube rack into C3 (with click mix, beads and TCEP/IAA)")
+
+            # Pause the protocol until the user loads the file to /var/lib/jupyter/notebooks
+            protocol.pause()
+
+        # Tell user the protocol started
+        protocol.comment("Running Protein Normalization")
+
+        # Tell the robot that new labware will be placed onto the deck
+        if should_run('bca'):
+            protocol.move_labware(labware=plate1, new_location=protocol_api.OFF_DECK)
+            protocol.move_labware(labware=plate2, new_location=protocol_api.OFF_DECK)
+            protocol.move_labware(labware=hs_adapter, new_location=protocol_api.OFF_DECK)
+
+    # A run that stops after the BCA hands the samples on without touching plate3
+    plate3_needed = stop_after != 'bca'
+    if plate3_needed:
+        # Load the new labware. The deep well plate sits on the deep well adapter instead of the flat one
+        hs_adapter = heater_shaker.load_adapter('opentrons_96_deep_well_adapter')
+        module_locations['hs_adapter'] = hs_adapter
+        plate3 = load_at('plate3', 'nest_96_wellplate_2ml_deep')  # New deep well plate for final samples
+        checkpoint['plate_ids'].setdefault('plate3', f"ChemProt10plex-{run_stamp}")
+        epp_rack = protocol.load_labware('opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap', location="C3")
+
+    # consolidate() can't dispense into the waste chute, so supernatant is aspirated in
+    # tip-sized steps with one column of tips and dispensed into the chute directly
+    def remove_supernatant(volume, locations, rate):
+        p1000_multi.pick_up_tip()
+        for location in locations:
+            remaining = volume
+            while remaining > 0:
+                step = min(remaining, 200)
+                p1000_multi.aspirate(step, location, rate=rate)
+                p1000_multi.dispense(step, chute)
+                remaining -= step
+        p1000_multi.drop_tip()
+
+    # Single tips can't reach the back rows of a plate in the front row of the deck, so plate3
+    # comes to B2 for single-tip additions. The latch is opened to take plate3 off the
+    # heater-shaker and closed again before anything is pipetted into it there.
+    def move_plate3(location):
+        heater_shaker.open_labware_latch()
+        protocol.move_labware(labware=plate3, new_location=location, use_gripper=True)
+        if location == hs_adapter:
+            heater_shaker.close_labware_latch()
+
+    # The 37 °C reduce and alkylate holds run on the heater-shaker while the gantry gets the
+    # next tips ready (see incubation_stations.py); a rehearsal waits the scaled delay
+    stations = IncubationStations(protocol, delay=lambda seconds: wait(seconds/60))
+    if plate3_needed:
+        stations.add_heater_shaker(heater_shaker, hs_adapter)
+    excess_lysis = protocol.define_liquid(name=liquid_name('excess_lysis'), display_color="#FF0077")
+
+    #the wells of the samples on the new 96-deep well plate
+    destination_wells = [sample['well'] for sample in sample_sheet.values()]
+
+    if plate3_needed:
+        # Determine number of full columns to fill
+        num_full_columns = (num_samples + 7) // 8  # Round up to ensure all samples are covered
+
+        # Get the destination wells as full columns
+        destination_columns = plate3.columns()[:num_full_columns]
+
+        # Convert columns to top-row wells (e.g., ['A1', 'A2', ..., 'A12'])
+        destination_wells_col = [col[0] for col in destination_columns]  # Only use top row for multi-channel pipette
+
+    if should_run('normalization'):
+        ensure_columns('tips_200', 1)
+        configure_tips(p1000_multi, ALL, 'tips_200')
+
+        #Add some initial lysis buffer to all sample wells
+        p1000_multi.distribute(final_volume_ul/2, reservoir['A7'], destination_wells_col, rate=0.5, new_tip='once')
+
+        # move the complete 200uL to A4 and then the partial 200 uL tips to B3
+        protocol.move_labware(labware=racks['tips_200'], new_location="A4", use_gripper=True)
+        protocol.move_labware(labware=partial_200, new_location="B3", use_gripper=True)
+
+        #Configure the p50 pipette to use single tip NOTE: this resets the pipettes tip racks!
+        configure_tips(p1000_multi, SINGLE, 'partial_200')
+
+        # Define the directory path
+        directory = Path("/var/lib/jupyter/notebooks/TWH/")
+
+        # Get today's date in YYMMDD format
+        today_date = datetime.date.today().strftime("%y%m%d")
+
+        # Time each step of the analysis when profiling, see run_telemetry.py
+        profile = telemetry.profile() if telemetry and protocol.params.profile_analysis else None
+
+        def stage(name=None):
+            if profile:
+                profile.stage(name)
+
+        if rehearsal:
+            # Water reads as a flat standard curve, so a rehearsal normalizes to the manifest's expected
+            # concentrations, or to one that splits the volume evenly between sample and lysis buffer
+            protocol.comment("Rehearsal mode: no plate reader file, normalizing to the expected concentrations")
+            unknown_samples = pd.DataFrame({'Sample': list(sample_sheet)})
+            unknown_samples['Protein Concentration (mg/mL)'] = [sample['expected'] or (sample['target']/1000) / (final_volume/4) for sample in sample_sheet.values()]
+            stage('normalization volumes')
         else:
-            protocol.move_labware(labware=plate3, new_location=mag_block, use_gripper=True)
-            p1000_multi.consolidate(200, destination_wells_col.bottom(z=0.2), chute, rate = 0.35, new_tip='once')
-    
-    # move plate3 to the heater shaker and and elute in 0.2% SDS in PBS
-    protocol.move_labware(labware=plate3, new_location=hs_adapter, use_gripper=True)
-    p1000_multi.distribute(100, reservoir['A11'], destination_wells_col, mix_after=(3, 90), new_tip='once')
+            stage('wait for file')
+            find_file = subprocess.Popen(['python3',"/var/lib/jupyter/notebooks/wait_for_file.py"],stdout=subprocess.PIPE,
+                text=True)
+            stdout, stderr = find_file.communicate()
+
+            if stderr:
+                raise ValueError(f"Error while waiting for file: {stderr}")
+
+            # Extract the file path from the output
+            file_path = stdout.splitlines()[1]
+            if not file_path:
+                raise ValueError("No file path returned by wait_for_file.py")
+
+            protocol.comment(f"Successfully loaded: {file_path}")
+            stage('read_excel')
+            # Read the data file
+            df = pd.read_excel(file_path, header=5, nrows=8, usecols="C:N")
+
+            stage('replicate loop')
+            # The standards, then the samples in the order they were plated, from their wells in the plate map
+            final_df = bca_map.read(df)
+
+            stage('standard curve')
+            samples_1_to_8 = final_df.iloc[:8]
+            samples_1_to_8['Mean Absorbance'] = samples_1_to_8[['Replicate 1', 'Replicate 2', 'Replicate 3']].mean(axis=1)
+            protein_concentrations = [10, 5, 2.5, 1.25, 0.625, 0.3125, 0.15625, 0]
+            samples_1_to_8['Protein Concentration (mg/mL)'] = protein_concentrations
+
+            slope, intercept = np.polyfit(samples_1_to_8['Protein Concentration (mg/mL)'], samples_1_to_8['Mean Absorbance'], 1)
+            y_pred = slope * samples_1_to_8['Protein Concentration (mg/mL)'] + intercept
+            ss_res = np.sum((samples_1_to_8['Mean Absorbance'] - y_pred) ** 2)
+            ss_tot = np.sum((samples_1_to_8['Mean Absorbance'] - np.mean(samples_1_to_8['Mean Absorbance'])) ** 2)
+            r_squared = 1 - (ss_res / ss_tot)
+
+            stage('normalization volumes')
+            # The plate reader rows after the standards are the samples in the order they were plated
+            unknown_samples = final_df.iloc[8:]
+            unknown_samples['Mean Absorbance'] = unknown_samples[['Replicate 1', 'Replicate 2', 'Replicate 3']].mean(axis=1)
+            unknown_samples['Protein Concentration (mg/mL)'] = (unknown_samples['Mean Absorbance'] - intercept) / slope
+        unknown_samples['Expected Concentration (mg/mL)'] = [sample['expected'] for sample in sample_sheet.values()]
+        unknown_samples['Target (ug)'] = [sample['target'] for sample in sample_sheet.values()]
+
+        unknown_samples['Sample Volume (mL)'] = (unknown_samples['Target (ug)'] / 1000) / unknown_samples['Protein Concentration (mg/mL)']
+        unknown_samples['Diluent Volume (mL)'] = final_volume - unknown_samples['Sample Volume (mL)']
+        unknown_samples.loc[unknown_samples['Sample Volume (mL)'] > final_volume, ['Sample Volume (mL)', 'Diluent Volume (mL)']] = [final_volume, 0]
+        protocol.comment("\nNormalized Unknown Samples (to 1 mg/mL in 500 µL):")
+        print(unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Sample Volume (mL)', 'Diluent Volume (mL)']])
+
+        normalized_samples = unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Expected Concentration (mg/mL)', 'Sample Volume (mL)', 'Diluent Volume (mL)']].reset_index().drop(columns='index')
+        if history and not rehearsal:
+            history.add_plate(file_path, df, (slope, intercept, r_squared), unknown_samples)
+        stage()
+        checkpoint['normalized_samples'] = normalized_samples.to_dict('records')
+
+        # Samples that read far from what the manifest expects are worth a second look before they are used up
+        for _, row in normalized_samples.dropna(subset=['Expected Concentration (mg/mL)']).iterrows():
+            if not 0.5 <= row['Protein Concentration (mg/mL)'] / row['Expected Concentration (mg/mL)'] <= 2:
+                protocol.comment(f"{row['Sample']} reads {row['Protein Concentration (mg/mL)']:.2f} mg/mL, the manifest expects {row['Expected Concentration (mg/mL)']:g} mg/mL")
+
+        # Add the samples and the rest of the lysis buffer to plate 3
+        for i, row in normalized_samples.iterrows():
+            sample = sample_sheet[row['Sample']]
+            source_well = sample['tube']
+            normalized_volume = row['Sample Volume (mL)']*1000
+            diluent_volume = (final_volume_ul/2) - normalized_volume
+            destination_well = sample['well']
+            p1000_multi.transfer(normalized_volume, temp_adapter[source_well], plate3[destination_well], rate=0.5, new_tip='once')
+            p1000_multi.transfer(diluent_volume, reservoir['A7'], plate3[destination_well], rate=0.5, new_tip='once')
+
+        save_checkpoint('normalization')
 
-###################################################################################################################################
-    protcol.comment('Running streptavidin enrichment')
-    # Incubate
-    heater_shaker.close_labware_latch()
-    heater_shaker.set_and_wait_for_temperature(37)
-    heater_shaker.set_and_wait_for_shake_speed(1000)
-    protocol.delay(minutes=10)
-    heater_shaker.deactivate_shaker()
-    heater_shaker.open_labware_latch()
-    
-    # Define the next empty column to move samples to.
-    # Extract column indices and count wells in each column
-    column_counts = {}  # Dictionary to store the count of wells per column
-    for well in destination_wells:
-        column_index = int(well[1:])  # Extract column number (1-based)
-        if column_index in column_counts:
-            column_counts[column_index] += 1
-        else:
-            column_counts[column_index] = 1
-    # Get all columns in the plate
-    all_columns = plate3.columns()
-    # Find the first completely empty column
-    occupied_columns = sorted(column_counts.keys())  # Sorted list of occupied column indices
-    next_empty_column_idx = occupied_columns[-1] + 1  # Start checking from the last known occupied column
-    # Ensure we skip partially filled columns
-    while next_empty_column_idx in column_counts and column_counts[next_empty_column_idx] < 8:
-        next_empty_column_idx += 1  # Skip until we find a completely empty column
-    # Determine the next set of empty columns
-    destination_columns = all_columns[next_empty_column_idx:next_empty_column_idx + num_full_columns]
-    # Get the first well of each new destination column
-    destination_wells_col_new = [col[0] for col in destination_columns]
-    destination_wells_new = [well for well in destination_columns]
-
-    # move plate3 to the magnet and move samples to new wells
-    protocol.move_labware(labware=plate3, new_location=magnet, use_gripper=True)
-    p1000_multi.distribute(200, destination_wells_col, destination_wells_col_new, new_tip='once')
-    protocol.move_labware(labware=plate3, new_location=hs_adapter, use_gripper=True)
-
-    # Dilute samples in 0.2% SDS in PBS
-    p1000_multi.distribute(300, reservoir['A11'], destination_wells_col_new, new_tip='once')
-
-    # move the partial 200uL to A4 and then the partial 200 uL tips to B3
-    protocol.move_labware(labware=tips_200, new_location="A4", use_gripper=True)
-    protocol.move_labware(labware=partial_200, new_location="B3", use_gripper=True)
-
-    #Configure the p50 pipette to use single tip NOTE: this resets the pipettes tip racks!
-    p1000_multi.configure_nozzle_layout(style=SINGLE, start="A1",tip_racks=[partial_200])
-
-    # Mix the streptavidin magnetic beads and add them to samples in new well
-    p1000_multi.mix(4, 200, epp_rack['B2'])
-    p1000_multi.distribute(60, epp_rack['B1'], [plate3[i] for i in destination_wells_new])
-
-    #Incubate with shaking for 1.5 hours
-    heater_shaker.close_labware_latch()
-    heater_shaker.set_and_wait_for_shake_speed(1000)
-    protocol.delay(minutes=90)
-    heater_shaker.deactivate_shaker()
-
-    # move the partial 200uL to B4 and then the 200 uL tips to B3
-    protocol.move_labware(labware=partial_200, new_location="B4", use_gripper=True)
-    protocol.move_labware(labware=tips_200, new_location="B3", use_gripper=True)
-    
-    #Configure the p50 pipette to use All tips NOTE: this resets the pipettes tip racks!
-    p1000_multi.configure_nozzle_layout(style=ALL, tip_racks=[tips_200])
-
-    # Move samples to the magnet
-    heater_shaker.open_labware_latch()
-    protocol.move_labware(labware=plate3, new_location=mag_block, use_gripper=True)
-    protocol.delay(minutes=3)
-
-    # Remove the flow through from the beads leaving 200 uL in the bottom
-    p1000_multi.consolidate(360, destination_wells_col_new.bottom(z=0.2), chute, rate = 0.5, new_tip='once')
-
-    # Remove remainder of flow through and wash the beads three times with 0.2% SDS in PBS
-    for i in range(3):
-        p1000_multi.consolidate(200, destination_wells_col_new.bottom(z=0.2), chute, rate = 0.35, new_tip='once')
-        protocol.move_labware(labware=plate3, new_location=hs_adapter, use_gripper=True)
-        p1000_multi.distribute(200, reservoir['A11'], destination_wells_col_new, mix_after=(3, 150), new_tip='once')
-        if i<2:
-            protocol.move_labware(labware=plate3, new_location=mag_block, use_gripper=True)
-        else:
-            protocol.move_labware(labware=plate3, new_location=mag_block, use_gripper=True)
-            p1000_multi.consolidate(200, destination_wells_col_new.bottom(z=0.2), chute, rate = 0.35, new_tip='once')
+    #########################################################################################
+    if should_run('click'):
+        protocol.comment("Transferring Biotin-Peg3 in epp_rack A1, cuso4 in A2, tbta in A3, tcep A4, into empty A5 then samples.")
+        configure_tips(p1000_multi, SINGLE, 'partial_200')
+
+        #Pipette biotin, tbta, cuso4, and tcep
+        p1000_multi.distribute(110, epp_rack['A1'], epp_rack['A5'], new_tip='always')
+        p1000_multi.distribute(660, epp_rack['A2'], epp_rack['A5'], new_tip='always')
+        p1000_multi.distribute(220, epp_rack['A3'], epp_rack['A5'], new_tip='always')
+        p1000_multi.distribute(220, epp_rack['A4'], epp_rack['A5'], new_tip='always')
+
+        #Pipette the click reaction premix
+        p1000_multi.distribute(55, epp_rack['A5'], [plate3[i] for i in destination_wells], new_tip='always')
+
+        #Remember the volume added to the samples
+        added_vol = final_volume_ul + 55
+
+        # Step 11: shake the sample plate for click reaction
+        move_plate3(hs_adapter)
+        heater_shaker.set_and_wait_for_shake_speed(600)
+        wait(60)
+        heater_shaker.deactivate_shaker()
+        #heater_shaker.open_labware_latch()
+
+        save_checkpoint('click')
+
+    if should_run('sp3_cleanup'):
+        protocol.comment("Running SP3 cleanup")
+        configure_tips(p1000_multi, SINGLE, 'partial_200')
+
+        # mix the sp3 beads to homogenize
+        move_plate3("B2")
+        p1000_multi.pick_up_tip()
+        p1000_multi.mix(4, 200, epp_rack['B1'])
+        p1000_multi.drop_tip()
+
+        # transfer the sp3 beads for protein precipitation
+        p1000_multi.distribute(60, epp_rack['B1'], [plate3[i] for i in destination_wells])
+
+        #Remember the volume added to the samples
+        added_vol = added_vol + 60
+
+        # incubate beads with shaking for 5 minutes
+        move_plate3(hs_adapter)
+        heater_shaker.set_and_wait_for_shake_speed(1000)
+        wait(5)
+        heater_shaker.deactivate_shaker()
 
-    # move plate3 to the heater shaker and resuspend in 2 M urea in EPPS
-    protocol.move_labware(labware=plate3, new_location=hs_adapter, use_gripper=True)
-    p1000_multi.distribute(147.5, reservoir['A12'], destination_wells_col_new, mix_after=(3, 150), new_tip='once')
-    
-    # move the partial 200uL to A4 and then the partial 200 uL tips to B3
-    protocol.move_labware(labware=tips_200, new_location="A4", use_gripper=True)
-    protocol.move_labware(labware=partial_50, new_location="B3", use_gripper=True)
+        # move the partial 200uL to B4 and then the partial 200 uL tips to B3
+        protocol.move_labware(labware=partial_200, new_location="B4", use_gripper=True)
+        protocol.move_labware(labware=racks['tips_200'], new_location="B3", use_gripper=True)
+
+        #Configure the p50 pipette to use All tips NOTE: this resets the pipettes tip racks!
+        ensure_columns('tips_200', 10)  # EtOH, 5 removals, 3 washes and the urea
+        configure_tips(p1000_multi, ALL, 'tips_200')
 
-    #Configure the p50 pipette to use single tip NOTE: this resets the pipettes tip racks!
-    p50_multi.configure_nozzle_layout(style=SINGLE, start="A1",tip_racks=[partial_50])
+        # Add EtOH to the sample columns to bind protein and use air gap for volatility
+        p1000_multi.distribute(600, reservoir['A9'], destination_wells_col, new_tip='once',air_gap=10)
+
+        #Remember the volume added to the samples
+        added_vol = added_vol + 600
+
+        # incubate ethanol with shaking for 5 minutes
+        heater_shaker.set_and_wait_for_shake_speed(1000)
+        wait(5)
+        heater_shaker.deactivate_shaker()
+
+        # Move samples to the magnet
+        move_plate3(mag_block)
+        wait(3)
+
+        # Remove the EtOH from the beads leaving 200 uL in the bottom
+        remove_supernatant(900, [well.bottom(z=0.2) for well in destination_wells_col], rate=0.5)
+
+        #Remember the volume added to the samples
+        added_vol = added_vol -900
+
+        # Remove remainder of EtOH and Add 80% EtOH and wash the beads three times with 200 uL 80% EtOH
+        for i in range(3):
+            remove_supernatant(200, [well.bottom(z=0.2) for well in destination_wells_col], rate=0.35)
+            move_plate3(hs_adapter)
+            p1000_multi.distribute(200, reservoir['A10'], destination_wells_col, mix_after=(3, 150), new_tip='once')
+            if i<2:
+                move_plate3(mag_block)
+            else:
+                move_plate3(mag_block)
+                remove_supernatant(200, [well.bottom(z=0.2) for well in destination_wells_col], rate=0.35)
+
+        # resuspend in 2 M urea in PBS with 0.5% SDS and move to shaker
+        move_plate3(hs_adapter)
+        p1000_multi.distribute(200, reservoir['A12'], destination_wells_col, mix_after=(3, 150), new_tip='once')
+
+        #Remember the volume added to the samples
+        added_vol = added_vol + 200
+
+        #set the heater_shaker temp to 37 c for reduce
+        heat_shaker(37)
+
+        # move the partial 200uL to A4 and then the partial 200 uL tips to B3
+        protocol.move_labware(labware=racks['tips_200'], new_location="A4", use_gripper=True)
+        protocol.move_labware(labware=partial_200, new_location="B3", use_gripper=True)
+
+        #Configure the p50 pipette to use single tip NOTE: this resets the pipettes tip racks!
+        configure_tips(p1000_multi, SINGLE, 'partial_200')
+
+        #Pipette mix K2CO3, and TCEP and transfer to samples
+        move_plate3("B2")
+        Redu_mix = num_samples*50*1.2/2
+        p1000_multi.transfer(Redu_mix, epp_rack['C1'], epp_rack['C4'], new_tip='always')
+        p1000_multi.transfer(Redu_mix, epp_rack['C2'], epp_rack['C4'], new_tip='always')
+        p1000_multi.distribute(50, epp_rack['C4'], [plate3[i] for i in destination_wells], new_tip='always')
+
+        #Remember the volume added to the samples
+        added_vol = added_vol + 50
+
+        # Reduce for 30 minutes, move_plate3 unlatches the plate to take it off
+        stations.finish(stations.start(plate3, minutes=30, rpm=1000), open_station=False)
+
+        # add IAA and alkylate for 30 minutes
+        move_plate3("B2")
+        p1000_multi.distribute(70, epp_rack['C3'], [plate3[i] for i in destination_wells], new_tip='always')
+        alkylation = stations.start(plate3, minutes=30, rpm=1000)
 
-    # Add CaCl2, trypsin in epps, and move to shaker
-    p50_multi.distribute(2.5, temp_adapter['D5'], [plate3[i] for i in destination_wells], new_tip='once')
-    p50_multi.distribute(50, temp_adapter['D6'], [plate3[i] for i in destination_wells], new_tip='once')
+        #Remember the volume added to the samples
+        added_vol = added_vol +70
+
+        # While the samples alkylate, move the partial 200uL to B4 and then the 200 uL tips to B3
+        protocol.move_labware(labware=partial_200, new_location="B4", use_gripper=True)
+        protocol.move_labware(labware=racks['tips_200'], new_location="B3", use_gripper=True)
+
+        #Configure the p100 pipette to use All tips
+        ensure_columns('tips_200', 10)  # EtOH, 5 removals, 3 washes and the elution
+        configure_tips(p1000_multi, ALL, 'tips_200')
+
+        # The EtOH goes in on the heater-shaker, so the plate stays latched
+        stations.finish(alkylation, open_station=False)
+
+        # Add EtOH and wash beads 3 times again
+        p1000_multi.distribute(400, reservoir['A10'], destination_wells_col, new_tip='once')
+
+        #Remember the volume added to the samples
+        added_vol = added_vol +400
+
+        # Incubate with EtOH for 5-10 minutes
+        heater_shaker.set_and_wait_for_shake_speed(1000)
+        wait(5)
+        heater_shaker.deactivate_shaker()
 
-    #Remember the volume added to the samples
-    added_vol = added_vol + 2.5 + 50
+        # Move samples to the magnet and remove EtOH
+        move_plate3(mag_block)
+        wait(3)
+        remove_supernatant(520, [well.bottom(z=0.2) for well in destination_wells_col], rate=0.5)
+
+        #Remember the volume added to the samples
+        added_vol = added_vol -520
 
-    # Digest overnight
-    heater_shaker.close_labware_latch()
-    heater_shaker.set_and_wait_for_shake_speed(1000)
-    protocol.delay(minutes=960)
-    heater_shaker.deactivate_shaker()
-    heater_shaker.open_labware_latch()
-    protocol.comment("Samples have been digested")
+        # Wash the beads 3 times with 80% EtoH
+        for i in range(3):
+            remove_supernatant(200, [well.bottom(z=0.2) for well in destination_wells_col], rate=0.35)
+            move_plate3(hs_adapter)
+            p1000_multi.distribute(200, reservoir['A10'], [well.bottom(z=0.2) for well in destination_wells_col], mix_after=(3, 150), new_tip='once')
+            if i<2:
+                move_plate3(mag_block)
+            else:
+                move_plate3(mag_block)
+                remove_supernatant(200, [well.bottom(z=0.2) for well in destination_wells_col], rate=0.35)
 
+        # move plate3 to the heater shaker and and elute in 0.2% SDS in PBS
+        move_plate3(hs_adapter)
+        p1000_multi.distribute(100, reservoir['A11'], destination_wells_col, mix_after=(3, 90), new_tip='once')
+
+        save_checkpoint('sp3_cleanup')
+
+###################################################################################################################################
+    if should_run('enrichment'):
+        protocol.comment('Running streptavidin enrichment')
+        ensure_columns('tips_200', 2)  # moving the samples and diluting them
+        configure_tips(p1000_multi, ALL, 'tips_200')
+
+        # Incubate
+        heater_shaker.close_labware_latch()
+        heat_shaker(37)
+        heater_shaker.set_and_wait_for_shake_speed(1000)
+        wait(10)
+        heater_shaker.deactivate_shaker()
+        heater_shaker.open_labware_latch()
+
+    if plate3_needed:
+        # Define the next empty column to move samples to.
+        # Extract column indices and count wells in each column
+        column_counts = {}  # Dictionary to store the count of wells per column
+        for well in destination_wells:
+            column_index = int(well[1:])  # Extract column number (1-based)
+            if column_index in column_counts:
+                column_counts[column_index] += 1
+            else:
+                column_counts[column_index] = 1
+        # Get all columns in the plate
+        all_columns = plate3.columns()
+        # Find the first completely empty column
+        occupied_columns = sorted(column_counts.keys())  # Sorted list of occupied column indices
+        next_empty_column_idx = occupied_columns[-1] + 1  # Start checking from the last known occupied column
+        # Ensure we skip partially filled columns
+        while next_empty_column_idx in column_counts and column_counts[next_empty_column_idx] < 8:
+            next_empty_column_idx += 1  # Skip until we find a completely empty column
+        # Determine the next set of empty columns
+        destination_columns = all_columns[next_empty_column_idx:next_empty_column_idx + num_full_columns]
+        # Get the first well of each new destination column
+        destination_wells_col_new = [col[0] for col in destination_columns]
+        destination_wells_new = [well.well_name for col in destination_columns for well in col][:num_samples]
+        for (sample_id, sample), well in zip(sample_sheet.items(), destination_wells_new):
+            # A resumed run digests the samples in the wells the enrichment recorded
+            sample['enriched_well'] = checkpoint.get('well_map', {}).get(sample_id, {}).get('plate3_enriched', well)
+
+    if should_run('enrichment'):
+        # move plate3 to the magnet and move samples to new wells
+        move_plate3(mag_block)
+        p1000_multi.transfer(200, destination_wells_col, destination_wells_col_new, new_tip='once')
+        move_plate3(hs_adapter)
+
+        # Dilute samples in 0.2% SDS in PBS
+        p1000_multi.distribute(300, reservoir['A11'], destination_wells_col_new, new_tip='once')
+
+        # move the partial 200uL to A4 and then the partial 200 uL tips to B3
+        protocol.move_labware(labware=racks['tips_200'], new_location="A4", use_gripper=True)
+        protocol.move_labware(labware=partial_200, new_location="B3", use_gripper=True)
+
+        #Configure the p50 pipette to use single tip NOTE: this resets the pipettes tip racks!
+        configure_tips(p1000_multi, SINGLE, 'partial_200')
+
+        # Mix the streptavidin magnetic beads and add them to samples in new well
+        move_plate3("B2")
+        p1000_multi.pick_up_tip()
+        p1000_multi.mix(4, 200, epp_rack['B2'])
+        p1000_multi.drop_tip()
+        p1000_multi.distribute(60, epp_rack['B1'], [plate3[i] for i in destination_wells_new])
+
+        #Incubate with shaking for 1.5 hours
+        move_plate3(hs_adapter)
+        heater_shaker.set_and_wait_for_shake_speed(1000)
+        wait(90)
+        heater_shaker.deactivate_shaker()
+
+        # move the partial 200uL to B4 and then the 200 uL tips to B3
+        protocol.move_labware(labware=partial_200, new_location="B4", use_gripper=True)
+        protocol.move_labware(labware=racks['tips_200'], new_location="B3", use_gripper=True)
+
+        #Configure the p50 pipette to use All tips NOTE: this resets the pipettes tip racks!
+        ensure_columns('tips_200', 9)  # 5 removals, 3 washes and the urea
+        configure_tips(p1000_multi, ALL, 'tips_200')
+
+        # Move samples to the magnet
+        move_plate3(mag_block)
+        wait(3)
+
+        # Remove the flow through from the beads leaving 200 uL in the bottom
+        remove_supernatant(360, [well.bottom(z=0.2) for well in destination_wells_col_new], rate=0.5)
+
+        # Remove remainder of flow through and wash the beads three times with 0.2% SDS in PBS
+        for i in range(3):
+            remove_supernatant(200, [well.bottom(z=0.2) for well in destination_wells_col_new], rate=0.35)
+            move_plate3(hs_adapter)
+            p1000_multi.distribute(200, reservoir['A11'], destination_wells_col_new, mix_after=(3, 150), new_tip='once')
+            if i<2:
+                move_plate3(mag_block)
+            else:
+                move_plate3(mag_block)
+                remove_supernatant(200, [well.bottom(z=0.2) for well in destination_wells_col_new], rate=0.35)
+
+        # move plate3 to the heater shaker and resuspend in 2 M urea in EPPS
+        move_plate3(hs_adapter)
+        p1000_multi.distribute(147.5, reservoir['A12'], destination_wells_col_new, mix_after=(3, 150), new_tip='once')
+
+        save_checkpoint('enrichment')
+
+    if should_run('digest'):
+        protocol.comment("Running the digest")
+
+        # move the partial 200uL to A4 and then the partial 200 uL tips to B3
+        protocol.move_labware(labware=racks['tips_200'], new_location="A4", use_gripper=True)
+        protocol.move_labware(labware=partial_50, new_location="B3", use_gripper=True)
+
+        #Configure the p50 pipette to use single tip NOTE: this resets the pipettes tip racks!
+        configure_tips(p50_multi, SINGLE, 'partial_50')
+
+        # Add CaCl2, trypsin in epps, and move to shaker
+        enriched_wells = [plate3[sample['enriched_well']] for sample in sample_sheet.values()]
+        move_plate3("B2")
+        p50_multi.distribute(2.5, temp_adapter['D5'], enriched_wells, new_tip='once')
+        p50_multi.distribute(50, temp_adapter['D6'], enriched_wells, new_tip='once')
+
+        #Remember the volume added to the samples
+        added_vol = added_vol + 2.5 + 50
+
+        # Digest overnight
+        move_plate3(hs_adapter)
+        heater_shaker.set_and_wait_for_shake_speed(1000)
+        wait(960)
+        heater_shaker.deactivate_shaker()
+        heater_shaker.open_labware_latch()
+        protocol.comment("Samples have been digested")
+
+        save_checkpoint('digest')
+
+    # Hand the plate over to the robot that runs the next phase
+    if stop_after != phases[-1]:
+        manifest = {key: value for key, value in checkpoint.items() if key != 'tips_used'}
+        manifest['next_phase'] = phases[phases.index(stop_after) + 1]
+        manifest['handed_off'] = datetime.datetime.now().isoformat(timespec='seconds')
+        if not protocol.is_simulating() and not rehearsal:
+            handoff_file.write_text(json.dumps(manifest, indent=2))
+        protocol.comment(f"Hand-off manifest written to {handoff_file}. Copy it to the next robot, move {manifest['plate_ids'].get('plate3', 'the sample tubes')} over and start it from {manifest['next_phase']} with 'Start from hand-off'")
+        for name, location in manifest['locations'].items():
+            protocol.comment(f"Next robot: {name} in {location}")
 
     # Stop video recording after the main task is completed
-    video_process.terminate()
\ No newline at end of file
+    video_process.terminate()
@@ -6,6 +6,183 @@ import subprocess
 from pathlib import Path
 import datetime
 import time
+import math
+import json
+import sys
+
+# Per-step timing log for live runs, see run_telemetry.py
+sys.path.append("/var/lib/jupyter/notebooks")
+try:
+    import run_telemetry
+except ImportError:
+    run_telemetry = None
+
+# History of every run's normalization results, see run_history.py
+try:
+    import run_history
+except ImportError:
+    run_history = None
+
+# Wells of the standards and samples on the BCA plate, see plate_map.py
+# ---- plate_map.py (copied by shared_code.py, edit plate_map.py instead) ----
+# Rows and columns of each plate format
+FORMATS = {'96': (8, 12), '384': (16, 24)}
+CHANNELS = 8
+
+
+class PlateMap:
+    """Standards and samples of one plate, each with its replicate wells."""
+
+    def __init__(self, plate, replicates, standards, samples):
+        self.plate = plate
+        self.rows, self.columns = FORMATS[plate]
+        self.replicates = replicates
+        self.row_names = [chr(ord('A') + i) for i in range(self.rows)]
+        step = self.rows // CHANNELS
+        # (first row, first column) of every block, in the order they are filled
+        self.blocks = [(offset, column) for column in range(1, self.columns - replicates + 2, replicates) for offset in range(step)]
+        standard_blocks = math.ceil(len(standards)/CHANNELS)
+        if len(samples) > (len(self.blocks) - standard_blocks)*CHANNELS:
+            raise Exception(f"A {plate}-well plate holds {(len(self.blocks) - standard_blocks)*CHANNELS} samples in {replicates}s next to the standards.")
+        self.standards = [self._entry(name, i) for i, name in enumerate(standards)]
+        self.samples = [self._entry(name, standard_blocks*CHANNELS + i) for i, name in enumerate(samples)]
+
+    def _entry(self, name, position):
+        block, row = divmod(position, CHANNELS)
+        offset, column = self.blocks[block]
+        row_name = self.row_names[offset + row*(self.rows // CHANNELS)]
+        return {'name': name, 'block': block, 'wells': [f"{row_name}{column + i}" for i in range(self.replicates)]}
+
+    def wells(self, name):
+        """Replicate wells of a standard or sample."""
+        for entry in self.standards + self.samples:
+            if entry['name'] == name:
+                return entry['wells']
+        raise KeyError(name)
+
+    def top_wells(self, block):
+        """Wells the first nozzle of an 8-channel goes to for each replicate column of a block."""
+        offset, column = self.blocks[block]
+        return [f"{self.row_names[offset]}{column + i}" for i in range(self.replicates)]
+
+    def sample_blocks(self):
+        """(top wells, samples) of every block that holds samples, in plating order."""
+        blocks = {}
+        for entry in self.samples:
+            blocks.setdefault(entry['block'], []).append(entry)
+        return [(self.top_wells(block), entries) for block, entries in blocks.items()]
+
+    def read(self, block):
+        """Replicates of the standards, then the samples, from a reader block of rows x columns."""
+        values = pd.DataFrame(block).values
+        table = {'Sample': []}
+        table.update({f'Replicate {i + 1}': [] for i in range(self.replicates)})
+        for entry in self.standards + self.samples:
+            table['Sample'].append(entry['name'])
+            for i, well in enumerate(entry['wells']):
+                table[f'Replicate {i + 1}'].append(values[self.row_names.index(well[0]), int(well[1:]) - 1])
+        return pd.DataFrame(table)
+
+    def grid(self):
+        """The plate as text, a short label per well."""
+        labels = {}
+        for i, entry in enumerate(self.standards):
+            labels.update({well: f"S{i + 1}" for well in entry['wells']})
+        for i, entry in enumerate(self.samples):
+            labels.update({well: str(i + 1) for well in entry['wells']})
+        lines = ["   " + "".join(f"{column:>4}" for column in range(1, self.columns + 1))]
+        for row in self.row_names:
+            lines.append(f"{row:<3}" + "".join(f"{labels.get(f'{row}{column}', '.'):>4}" for column in range(1, self.columns + 1)))
+        return "\n".join(lines)
+
+
+def capacity(plate='96', replicates=3, standards=8):
+    """Samples one plate holds next to the standards."""
+    rows, columns = FORMATS[plate]
+    blocks = (rows // CHANNELS)*len(range(1, columns - replicates + 2, replicates))
+    return (blocks - math.ceil(standards/CHANNELS))*CHANNELS
+
+
+def compile_map(samples, plate='96', replicates=3, standards=8):
+    """Plate map for sample names (or a number of samples) and standards (names or a number)."""
+    if isinstance(samples, int):
+        samples = [f"Sample {i + 1}" for i in range(samples)]
+    if isinstance(standards, int):
+        standards = [f"Standard {i + 1}" for i in range(standards)]
+    return PlateMap(str(plate), replicates, list(standards), list(samples))
+# ---- end of plate_map.py ----
+
+# Spare tip racks and the swap when a rack runs dry, see tip_planner.py
+# ---- tip_planner.py (copied by shared_code.py, edit tip_planner.py instead) ----
+def pick_up_tips(columns, tips, pick_ups):
+    """Take the pick-ups from the tips left in each column. Returns False when the rack runs dry."""
+    for _ in range(pick_ups):
+        free = [i for i, n in enumerate(columns) if n >= tips]
+        if tips == 8:
+            free = [i for i in free if columns[i] == 8]
+        if not free:
+            return False
+        columns[free[0]] -= tips
+    return True
+
+
+def count_spares(tip_plan, rack_names):
+    """Spare racks of each type the plan needs, walking it with fresh racks."""
+    spares_needed = {name: 0 for name in rack_names}
+    rack_columns = {name: [8]*12 for name in rack_names}
+    for step, (name, tips, pick_ups) in tip_plan.items():
+        if not pick_up_tips(rack_columns[name], tips, pick_ups):
+            spares_needed[name] += 1
+            rack_columns[name] = [8]*12
+            if not pick_up_tips(rack_columns[name], tips, pick_ups):
+                raise Exception(f"Step {step} needs more than one {name} rack on its own.")
+    return spares_needed
+
+
+class TipPlanner:
+    """The racks of a run by name, their spares and the swap when one runs dry.
+
+    racks is updated in place when a spare is swapped in, so the protocol's own dict
+    always holds the rack in use. Spares go to spare_slots, staging slots the protocol
+    never parks labware in; with off_deck the ones that do not fit wait off deck and are
+    put in place by hand, otherwise running out of slots raises.
+    """
+
+    def __init__(self, protocol, racks, tip_plan, chute, pipettes, spare_slots, off_deck=False):
+        self.protocol = protocol
+        self.racks = racks
+        self.tip_plan = tip_plan
+        self.chute = chute
+        self.pipettes = pipettes
+        self.spares_needed = count_spares(tip_plan, racks)
+        spare_slots = list(spare_slots)
+        if not off_deck and sum(self.spares_needed.values()) > len(spare_slots):
+            raise Exception(f"Not enough staging slots for spare tip racks: {self.spares_needed}")
+        self.spare_racks = {name: [] for name in racks}
+        for name, count in self.spares_needed.items():
+            for _ in range(count):
+                slot = spare_slots.pop(0) if spare_slots else protocol_api.OFF_DECK
+                self.spare_racks[name].append(protocol.load_labware(racks[name].load_name, location=slot))
+        protocol.comment(f"Tip plan: spare racks {self.spares_needed}")
+
+    def ensure(self, step):
+        """Swap an exhausted rack for its spare right before the step that would run it dry."""
+        name, tips, pick_ups = self.tip_plan[step]
+        rack = self.racks[name]
+        columns = [sum(well.has_tip for well in column) for column in rack.columns()]
+        if pick_up_tips(columns, tips, pick_ups):
+            return
+        spare = self.spare_racks[name].pop(0)
+        slot = rack.parent
+        self.protocol.comment(f"{name} is out of tips for {step}, swapping in the spare rack")
+        self.protocol.move_labware(labware=rack, new_location=self.chute, use_gripper=True)
+        # A spare kept off deck is put in place by hand, the run waits for it
+        self.protocol.move_labware(labware=spare, new_location=slot, use_gripper=spare.parent != protocol_api.OFF_DECK)
+        self.racks[name] = spare
+        for pipette in self.pipettes:
+            if rack in pipette.tip_racks:
+                pipette.tip_racks = [spare]
+# ---- end of tip_planner.py ----
 
 metadata = {
     'protocolName': 'Gel-based Chemical Proteomics 08192025',
@@ -26,7 +203,7 @@ def add_parameters(parameters):
         description="Number of input samples to be tested for mycoplasma.",
         default=10,
         minimum=1,
-        maximum=24
+        maximum=96
     )
     parameters.add_int(
         variable_name="standards_col",
@@ -55,13 +232,113 @@ def add_parameters(parameters):
         maximum=500,
         unit="µL"
     )
+    parameters.add_str(
+        variable_name="bca_plate",
+        display_name="BCA plate",
+        description="384 wells fit the standards and up to 120 samples in triplicate at half the volumes",
+        choices=[
+            {"display_name": "96-well", "value": "96"},
+            {"display_name": "384-well", "value": "384"}
+        ],
+        default="96"
+    )
+    parameters.add_str(
+        variable_name="sample_input",
+        display_name="Sample input",
+        description="Samples in tubes B1-D6 of the cold block (up to 18) or a 96-well PCR plate on the magnet",
+        choices=[
+            {"display_name": "Tubes", "value": "tubes"},
+            {"display_name": "96-well plate", "value": "plate"}
+        ],
+        default="tubes"
+    )
+    parameters.add_str(
+        variable_name="start_at",
+        display_name="Start at",
+        description="Phase to start at. Later phases read the hand-off manifest from the robot that ran the earlier ones",
+        choices=[
+            {"display_name": "BCA (full run)", "value": "bca"},
+            {"display_name": "Normalization", "value": "normalization"},
+            {"display_name": "Click reaction", "value": "click"}
+        ],
+        default="bca"
+    )
+    parameters.add_str(
+        variable_name="stop_after",
+        display_name="Stop after",
+        description="Last phase to run here. Stopping early writes a hand-off manifest for the next robot",
+        choices=[
+            {"display_name": "BCA", "value": "bca"},
+            {"display_name": "Normalization", "value": "normalization"},
+            {"display_name": "Click reaction", "value": "click"}
+        ],
+        default="click"
+    )
+    parameters.add_bool(
+        variable_name="profile_analysis",
+        display_name="Profile analysis",
+        description="Log the time and peak memory of each step of the plate reader analysis",
+        default=False
+    )
 def run(protocol: protocol_api.ProtocolContext):
+    telemetry = run_telemetry.instrument(protocol, metadata['protocolName']) if run_telemetry else None
+    # Run ID of the run history and of the BCA results this run writes for WesternBlot_Normalize_Only
+    run_id = telemetry.run_id if telemetry else datetime.datetime.now().strftime("%y%m%d-%H%M%S")
+    history = run_history.start(protocol, metadata['protocolName'], run_id) if run_history else None
+    # Samples come in tubes in B1-D6 of the cold block, or column by column in a PCR plate on the magnetic block
+    sample_plate_input = protocol.params.sample_input == 'plate'
+    if not sample_plate_input and protocol.params.num_samples > 18:
+        raise Exception(f"At most 18 samples fit in tubes, load {protocol.params.num_samples} samples from a plate.")
     protocol.comment(
-        "Place BSA Standard in A1, Lysis buffer in A2, tbta in A3, biotin in A4, cuso4 in A5, tcep in A6 and samples in row B")
-    protocol.comment("Running the BCA assay")
+        "Place BSA Standard in A1, Lysis buffer in A2, tbta in A3, biotin in A4, cuso4 in A5, tcep in A6 and samples in "
+        + ("a PCR plate on the magnetic block" if sample_plate_input else "row B"))
     num_rows = 8  # A-H
     speed= 0.3 #Speed of pipetting NP40 lysis buffer=0.35, 2M Urea in EPPS=0.3
 
+    # The run can be split across robots by phase. Stopping before the click reaction writes
+    # a hand-off manifest with the plate IDs, well map and normalization volumes, and the
+    # robot that picks the plate up reads it back with start_at set to the next phase.
+    phases = ['bca', 'normalization', 'click']
+    start_at = protocol.params.start_at
+    stop_after = protocol.params.stop_after
+    handoff_file = Path("/var/lib/jupyter/notebooks/Data/ChemProt_Gel_handoff.json")
+    run_stamp = datetime.datetime.now().strftime("%y%m%d-%H%M")
+    if phases.index(stop_after) < phases.index(start_at):
+        raise Exception(f"Cannot stop after {stop_after} when starting at {start_at}")
+
+    def should_run(phase):
+        return phases.index(start_at) <= phases.index(phase) <= phases.index(stop_after)
+
+    # BCA plate formats: labware, size of the reader block and µL per well of sample and reagents A, B and C
+    bca_formats = {
+        '96': {'labware': 'corning_96_wellplate_360ul_flat', 'rows': 8, 'reader_columns': 'C:N',
+               'sample': 5, 'reagent_a': 50, 'reagent_b': 48, 'reagent_c': 2},
+        '384': {'labware': 'corning_384_wellplate_112ul_flat', 'rows': 16, 'reader_columns': 'C:Z',
+                'sample': 2.5, 'reagent_a': 25, 'reagent_b': 24, 'reagent_c': 1},
+    }
+    bca = bca_formats[protocol.params.bca_plate]
+    if protocol.params.num_samples > capacity(protocol.params.bca_plate):
+        raise Exception(f"A {protocol.params.bca_plate}-well BCA plate holds {capacity(protocol.params.bca_plate)} samples in triplicate.")
+
+    manifest = {'num_samples': protocol.params.num_samples, 'phase': None, 'plate_ids': {}, 'well_map': {},
+                'sample_input': protocol.params.sample_input, 'bca_plate': protocol.params.bca_plate}
+    if start_at != 'bca':
+        if not handoff_file.exists():
+            raise Exception(f"No hand-off manifest found at {handoff_file}, start the run from the BCA")
+        manifest = json.loads(handoff_file.read_text())
+        if manifest['next_phase'] != start_at:
+            raise Exception(f"The hand-off manifest was written to start at {manifest['next_phase']}, not {start_at}")
+        if manifest['num_samples'] != protocol.params.num_samples:
+            raise Exception(f"The hand-off manifest is for {manifest['num_samples']} samples, not {protocol.params.num_samples}")
+        # Normalization reads the BCA plate and draws from the samples the BCA robot plated
+        for name, plated in [('sample_input', 'tubes'), ('bca_plate', '96')]:
+            if start_at == 'normalization' and manifest.get(name, plated) != getattr(protocol.params, name):
+                raise Exception(f"The BCA was run with {name} {manifest.get(name, plated)}, not {getattr(protocol.params, name)}")
+        if start_at == 'click' and manifest['final_volume'] != protocol.params.final_volume:
+            raise Exception(f"The samples were normalized in {manifest['final_volume']} µL, not {protocol.params.final_volume} µL")
+        protocol.comment(f"Starting at {start_at} with {', '.join(manifest['plate_ids'].values())} from the hand-off manifest written {manifest['handed_off']}")
+    protocol.comment(f"Phases on this robot: {', '.join(phase for phase in phases if should_run(phase))}")
+
     #Start recording the video
     video_process = subprocess.Popen(["python3", "/var/lib/jupyter/notebooks/record_video_chemprot.py"])
 
@@ -85,10 +362,19 @@ def run(protocol: protocol_api.ProtocolContext):
     partial_50 = protocol.load_labware(load_name="opentrons_flex_96_filtertiprack_50ul",location="B3")
     tips_200 = protocol.load_labware(load_name="opentrons_flex_96_filtertiprack_200ul",location="A3")
     tips_1000 = protocol.load_labware('opentrons_flex_96_filtertiprack_1000ul', 'C4')
-    plate1 = protocol.load_labware('opentrons_96_wellplate_200ul_pcr_full_skirt', 'A2') 
-    plate2 = protocol.load_labware('corning_96_wellplate_360ul_flat', location='B2') #on heatshaker
-    plate3 = protocol.load_labware('opentrons_96_wellplate_200ul_pcr_full_skirt', location='A4')  # New deep well plate for final samples
+    if should_run('bca'):
+        plate1 = protocol.load_labware('opentrons_96_wellplate_200ul_pcr_full_skirt', 'A2') 
+        plate2 = protocol.load_labware(bca['labware'], location='B2') #on heatshaker
+        manifest['plate_ids']['plate2'] = f"BCA-{run_stamp}"
+    # A normalized plate handed over for the click reaction goes straight to B2
+    plate3 = protocol.load_labware('opentrons_96_wellplate_200ul_pcr_full_skirt', location='B2' if start_at == 'click' else 'A4')  # New deep well plate for final samples
+    manifest['plate_ids'].setdefault('plate3', f"ChemProtGel-{run_stamp}")
     reservoir = protocol.load_labware('nest_12_reservoir_15ml', 'C2')
+    # The magnetic block is free in this protocol, the sample plate sits on it
+    if sample_plate_input and (should_run('bca') or should_run('normalization')):
+        sample_source = mag_block.load_labware('opentrons_96_wellplate_200ul_pcr_full_skirt')
+    else:
+        sample_source = temp_adapter
     
     # Liquid definitions
     bsa_standard = protocol.define_liquid(name='BSA Standard', display_color="#FF6F61")      # Bright Coral
@@ -121,387 +407,507 @@ def run(protocol: protocol_api.ProtocolContext):
     p50_multi = protocol.load_instrument('flex_8channel_50', 'left') 
     p1000_multi = protocol.load_instrument('flex_8channel_1000', 'right') 
 
-    #Configure the p1000 pipette to use all channels
-    p1000_multi.configure_nozzle_layout(style=ALL, tip_racks=[tips_200])
-
-    # Steps 1: Add lysis buffer to column 1 of plate1. 
-    p1000_multi.distribute(50, 
-         reservoir['A7'],
-         plate1[f'A{protocol.params.standards_col}'],
-         rate = speed,
-         mix_before=(1, 50),
-         delay = 2,
-         new_tip='once')
-
-    #Step 3: Configure the p50 pipette to use single tip NOTE: this resets the pipettes tip racks! it doesn't
-    p50_multi.configure_nozzle_layout(style=SINGLE, start="A1",tip_racks=[partial_50])
-
-    # Step 4: Transfer BSA standard (20 mg/ml) to first well of column 1
-    p50_multi.transfer(50,
-        temp_adapter['A1'],
-        plate1[f'A{protocol.params.standards_col}'],
-        rate = 0.35,
-        delay = 2,
-        mix_after=(3, 40),
-        new_tip='once')
-
-    # Step 5: Perform serial dilution down column 1
-    rows = ['A','B', 'C', 'D', 'E', 'F', 'G']
-    p50_multi.pick_up_tip()
-    for source, dest in zip(rows[:-1], rows[1:]):
-        p50_multi.transfer(50,
-                         plate1[f'{source}{protocol.params.standards_col}'],
-                         plate1[f'{dest}{protocol.params.standards_col}'],
-                         rate = 0.5,
-                         mix_after=(3, 40),
-                         new_tip='never', 
-                         disposal_vol=0)
-
-    # Step 6: remove excess standard from well G
-    p50_multi.aspirate(50,plate1[f'G{protocol.params.standards_col}'])
-    p50_multi.drop_tip()
-
-    # assign sample locations dynamically
+    # ---------------- Tip planning ----------------
+    # Count the tips every step picks up for these parameters so spare racks can be
+    # staged before the run instead of the run stalling on an empty rack.
+    num_samples = protocol.params.num_samples
+    final_volume = protocol.params.final_volume
+    click_volume = 6*(final_volume/50)
+    loading_buffer_volume = round((final_volume) / 3, 1)
+    num_columns = math.ceil(num_samples / 8)
+    mix_volume = final_volume + click_volume
+    if mix_volume < 100:
+        mix_rack = 'partial_50'
+    elif 100 < mix_volume < 200:
+        mix_rack = 'tips_200'
+    else:
+        mix_rack = 'tips_1000'
+
+    # step: (tip rack, tips per pick-up, number of pick-ups), in the order the steps run.
+    # Samples in a plate are plated and get the click premix a column at a time
+    tip_plan = {
+        'standards_lysis': ('tips_200', 8, 1),
+        'bsa_standard': ('partial_50', 1, 2),
+        'bca_samples': ('partial_50', 8, num_columns) if sample_plate_input else ('partial_50', 1, num_samples),
+        'bca_standards': ('partial_50', 8, 1),
+        'reagent_ab': ('tips_1000', 8, 2),
+        'reagent_c': ('partial_50', 8, 1),
+        'diluent': ('tips_200', 1, 1 if sample_plate_input else 0),
+        'normalization': ('tips_200', 1, num_samples) if sample_plate_input else ('tips_200', 1, 2*num_samples),
+        'click_reagents': ('partial_50', 1, sum(math.ceil(v*num_samples/50) for v in [2, 6, 2, 2])),
+        'click_mix': (mix_rack, 1, 1),
+    }
+    # Column by column steps, so large volumes for a plate of samples can take more than one rack
+    if sample_plate_input:
+        tip_plan.update({f'click_premix {column}': ('partial_50', 8, math.ceil(click_volume/50)) for column in range(1, num_columns + 1)})
+    else:
+        tip_plan['click_premix'] = ('partial_50', 1, num_samples*math.ceil(click_volume/50))
+    tip_plan.update({f'loading_buffer {column}': ('partial_50', 8, math.ceil(loading_buffer_volume/50)) for column in range(1, num_columns + 1)})
+    step_phases = {step: 'bca' for step in ['standards_lysis', 'bsa_standard', 'bca_samples', 'bca_standards', 'reagent_ab', 'reagent_c']}
+    step_phases.update({step: 'normalization' for step in ['diluent', 'normalization']})
+    step_phases.update({step: 'click' for step in ['click_reagents', 'click_mix', 'click_premix', 'loading_buffer']})
+    tip_plan = {step: plan for step, plan in tip_plan.items() if should_run(step_phases[step.split()[0]])}
+    racks = {'partial_50': partial_50, 'tips_200': tips_200, 'tips_1000': tips_1000}
+
+    # Spares go to staging slots the protocol never parks labware in, see tip_planner.py. A
+    # plate of samples can need more spares than D4 holds, the rest are put in place by hand
+    tip_planner = TipPlanner(protocol, racks, tip_plan, chute, (p50_multi, p1000_multi), spare_slots=['D4'], off_deck=sample_plate_input)
+    spare_racks = tip_planner.spare_racks
+    ensure_tips = tip_planner.ensure
+
+    # assign sample locations dynamically: B1 to D6 of the tube block, or the sample plate column by column
     sample_locations = []
     for i in range(protocol.params.num_samples):
-        if i < 6:  # B1 to B6
+        if sample_plate_input:
+            sample_locations.append(f"{'ABCDEFGH'[i % 8]}{i // 8 + 1}")
+        elif i < 6:  # B1 to B6
             sample_locations.append(f'B{i + 1}')
         elif i < 12:  # C1 to C6
             sample_locations.append(f'C{i - 5}')
         elif i < 18:  # D1 to D6
             sample_locations.append(f'D{i - 11}')
-        else:
-            break  # Stop if we exceed the number of available rows/columns
 
-    # Predefined list of letters A-H
-    row = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
+    # BCA plate map: standards in columns 1-3, each sample's triplicate in the blocks after them
+    bca_map = compile_map([f"Sample {9 + i}" for i in range(protocol.params.num_samples)], protocol.params.bca_plate)
 
-    # Create a list of rows that repeats based on protocol.params.num_samples
-    rows = [row[i % len(row)] for i in range(protocol.params.num_samples)]
+    # ---------------- BCA ----------------
+    if should_run('bca'):
+        protocol.comment("Running the BCA assay")
+        #Configure the p1000 pipette to use all channels
+        p1000_multi.configure_nozzle_layout(style=ALL, tip_racks=[racks['tips_200']])
 
-    # Create a dynamic sample map based on the assigned sample locations
-    sample_map = list(map(lambda i,j :(i,j), rows, sample_locations))
+        ensure_tips('standards_lysis')
 
-    # Iterate over the sample_map list
-    for index, (row, tube) in enumerate(sample_map):
-        if index < 8:
-            base_column = 4 + (index // 8)  # This will determine the starting column for each row
-        elif index< 16:
-            base_column = 6 + (index // 8)
-        else:
-            base_column = 8 + (index //8)
-
-        # Prepare destination wells
-        destination_wells = [f'{row}{base_column + (i % 3)}' for i in range(3)]  # Generate wells like A4, A5, A6 or B4, B5, B6, etc.
-        
-        #Transfer the samples onto plate 2
-        p50_multi.distribute(5,
-                        temp_adapter[tube],
-                        [plate2[i].bottom(z=0.3) for i in destination_wells],
-                        rate = speed,
-                        mix_before=(1, 10),
-                        disposal_vol=5)  # Distributing to three consecutive columns
-
-    #Step 9: Load the p50 with full tip rack (don't need to)
-    p50_multi.configure_nozzle_layout(style=ALL, tip_racks=[partial_50]) #, 
-
-    #Step 10: Pipette triplicate of controls from plate1 column 1 to plate2 columns 1,2,3 
-    p50_multi.distribute(5, 
-                        plate1[f'A{protocol.params.standards_col}'], 
-                        [plate2[f'A{i}'].bottom(z=0.1) for i in range(1, 4)],
-                        rate= speed,
-                        mix_before=(1, 10),
-                        disposal_vol=5)
+        # Steps 1: Add lysis buffer to column 1 of plate1. 
+        p1000_multi.distribute(50, 
+             reservoir['A7'],
+             plate1[f'A{protocol.params.standards_col}'],
+             rate = speed,
+             mix_before=(1, 50),
+             delay = 2,
+             new_tip='once')
+
+        #Step 3: Configure the p50 pipette to use single tip NOTE: this resets the pipettes tip racks! it doesn't
+        p50_multi.configure_nozzle_layout(style=SINGLE, start="A1",tip_racks=[racks['partial_50']])
+
+        ensure_tips('bsa_standard')
+
+        # Step 4: Transfer BSA standard (20 mg/ml) to first well of column 1
+        p50_multi.transfer(50,
+            temp_adapter['A1'],
+            plate1[f'A{protocol.params.standards_col}'],
+            rate = 0.35,
+            delay = 2,
+            mix_after=(3, 40),
+            new_tip='once')
+
+        # Step 5: Perform serial dilution down column 1
+        rows = ['A','B', 'C', 'D', 'E', 'F', 'G']
+        p50_multi.pick_up_tip()
+        for source, dest in zip(rows[:-1], rows[1:]):
+            p50_multi.transfer(50,
+                             plate1[f'{source}{protocol.params.standards_col}'],
+                             plate1[f'{dest}{protocol.params.standards_col}'],
+                             rate = 0.5,
+                             mix_after=(3, 40),
+                             new_tip='never', 
+                             disposal_vol=0)
+
+        # Step 6: remove excess standard from well G
+        p50_multi.aspirate(50,plate1[f'G{protocol.params.standards_col}'])
+        p50_multi.drop_tip()
+
+        if not sample_plate_input:
+            ensure_tips('bca_samples')
+
+            # Each tube into its triplicate wells of the plate map
+            for tube, sample in zip(sample_locations, bca_map.samples):
+                # Triplicate wells like A4, A5, A6 or B4, B5, B6, etc.
+                destination_wells = sample['wells']
+            
+                #Transfer the samples onto plate 2
+                p50_multi.distribute(bca['sample'],
+                                temp_adapter[tube],
+                                [plate2[i].bottom(z=0.3) for i in destination_wells],
+                                rate = speed,
+                                mix_before=(1, 10),
+                                disposal_vol=5)  # Distributing to three consecutive columns
+
+        #Step 9: Load the p50 with full tip rack (don't need to)
+        p50_multi.configure_nozzle_layout(style=ALL, tip_racks=[racks['partial_50']]) #, 
+
+        if sample_plate_input:
+            ensure_tips('bca_samples')
+            # Eight samples at a time: each column of the sample plate into the next block of the BCA plate
+            for column, (top_wells, _) in enumerate(bca_map.sample_blocks()):
+                p50_multi.distribute(bca['sample'],
+                                sample_source[f'A{column + 1}'],
+                                [plate2[well].bottom(z=0.3) for well in top_wells],
+                                rate = speed,
+                                mix_before=(1, 10),
+                                disposal_vol=5)
+
+        ensure_tips('bca_standards')
+        #Step 10: Pipette triplicate of controls from plate1 column 1 to the standards block of the plate map
+        p50_multi.distribute(bca['sample'], 
+                            plate1[f'A{protocol.params.standards_col}'], 
+                            [plate2[well].bottom(z=0.1) for well in bca_map.top_wells(0)],
+                            rate= speed,
+                            mix_before=(1, 10),
+                            disposal_vol=5)
 
     
-    protocol.move_labware(labware=tips_1000, new_location='C3', use_gripper=True)
-    #Step 12: Load the p1000 with full tip rack (don't need to)
-    p1000_multi.configure_nozzle_layout(style=ALL, tip_racks=[tips_1000]) #,
-
-    # Step 13: Add reagent A
-    p1000_multi.distribute(50,
-                        reservoir['A1'],
-                        plate2.wells(),
-                        new_tip='once',
-                        disposal_vol=50)
-
-    # Step 14: Add reagent B
-    p1000_multi.distribute(48,
-                        reservoir['A3'],
-                        plate2.wells(),
-                        new_tip='once',
-                        disposal_vol=50)
-
-    # Step 15: Add reagent c
-    p50_multi.distribute(2,
-                        reservoir['A5'],
-                        plate2.wells(),
-                        new_tip='once',
-                        rate = speed,
-                        mix_after=(2, 10),
-                        disposal_vol=5)
-
-    #Step 16: move plate 2 to the heater shaker and incubate at 37c
-    protocol.move_labware(labware=plate2, new_location=heater_shaker, use_gripper=True)
-    heater_shaker.set_and_wait_for_temperature(50)
-    heater_shaker.close_labware_latch()
-    heater_shaker.set_and_wait_for_shake_speed(500)
-    protocol.delay(minutes=5)
-
-    #Step 17 deactivate heater shaker and temp modules
-    heater_shaker.deactivate_shaker()
-    heater_shaker.deactivate_heater()
-    heater_shaker.open_labware_latch()
+        protocol.move_labware(labware=racks['tips_1000'], new_location='C3', use_gripper=True)
+        #Step 12: Load the p1000 with full tip rack (don't need to)
+        p1000_multi.configure_nozzle_layout(style=ALL, tip_racks=[racks['tips_1000']]) #,
+
+        ensure_tips('reagent_ab')
+
+        # Step 13: Add reagent A
+        p1000_multi.distribute(bca['reagent_a'],
+                            reservoir['A1'],
+                            plate2.wells(),
+                            new_tip='once',
+                            disposal_vol=50)
+
+        # Step 14: Add reagent B
+        p1000_multi.distribute(bca['reagent_b'],
+                            reservoir['A3'],
+                            plate2.wells(),
+                            new_tip='once',
+                            disposal_vol=50)
+
+        ensure_tips('reagent_c')
+
+        # Step 15: Add reagent c
+        p50_multi.distribute(bca['reagent_c'],
+                            reservoir['A5'],
+                            plate2.wells(),
+                            new_tip='once',
+                            rate = speed,
+                            mix_after=(2, 10),
+                            disposal_vol=5)
+
+        #Step 16: move plate 2 to the heater shaker and incubate at 37c
+        protocol.move_labware(labware=plate2, new_location=heater_shaker, use_gripper=True)
+        heater_shaker.set_and_wait_for_temperature(50)
+        heater_shaker.close_labware_latch()
+        heater_shaker.set_and_wait_for_shake_speed(500)
+        protocol.delay(minutes=5)
+
+        #Step 17 deactivate heater shaker and temp modules
+        heater_shaker.deactivate_shaker()
+        heater_shaker.deactivate_heater()
+        heater_shaker.open_labware_latch()
 
     # ---------------- Normalizing BCA Assay ----------------
-    # Tell the user to load BCA assay data
-    protocol.comment("Place BCA assay absorbance data in /var/lib/jupyter/notebooks/Data")
-
-    # Pause the protocol until the user loads the file to /var/lib/jupyter/notebooks
-    protocol.pause()
-
-    # Tell the robot that new labware will be placed onto the deck
-    protocol.move_labware(labware=plate1, new_location='D4', use_gripper=True)
-    protocol.move_labware(labware=plate2, new_location='A2', use_gripper=True)
-    protocol.move_labware(labware=plate3, new_location="B2", use_gripper=True)
-    protocol.move_labware(labware=partial_50, new_location='B4', use_gripper=True)
-
-    #Configure the p1000 pipette to use single tip NOTE: this resets the pipettes tip racks!
-    p1000_multi.configure_nozzle_layout(style=SINGLE, start="A1",tip_racks=[tips_200])
-
-    # Define the directory path
-    directory = Path("/var/lib/jupyter/notebooks/Data/")
-
-    # Get today's date in YYMMDD format
-    today_date = datetime.date.today().strftime("%y%m%d")
-
-    find_file = subprocess.Popen(['python3',"/var/lib/jupyter/notebooks/wait_for_file.py"],stdout=subprocess.PIPE,
-        text=True)
-    stdout, stderr = find_file.communicate()
-
-    if stderr:
-        raise ValueError(f"Error while waiting for file: {stderr}")
-
-    # Extract the file path from the output
-    file_path = stdout.splitlines()[1]
-    if not file_path:
-        raise ValueError("No file path returned by wait_for_file.py")
-
-    protocol.comment(f"Successfully loaded: {file_path}")
-    # Read the data file
-    df = pd.read_excel(file_path, header=5, nrows=8, usecols="C:N")
-
-    # Create a list of well names (A1 to H12)
-    well_names = [f"{row}{col}" for col in range(1, 13) for row in "ABCDEFGH"]
-
-    # Flatten the absorbance values into a single list
-    absorbance_values = df.values.flatten()
-
-    # Create the DataFrame
-    initial_df = pd.DataFrame({'Well': well_names, 'Absorbance': absorbance_values})
-
-    # Process data for normalization
-    samples, replicate_1, replicate_2, replicate_3 = [], [], [], []
-    sample_index = 1
-    for col_offset in range(0, 12, 3):  # Iterate by column groups (triplets)
-        for row_offset in range(8):  # Iterate row-wise for each sample
-            start = row_offset * 12 + col_offset  # Starting index for the sample
-            if start + 2 < len(initial_df):
-                samples.append(f"Sample {sample_index}")
-                replicate_1.append(initial_df.iloc[start]['Absorbance'])
-                replicate_2.append(initial_df.iloc[start + 1]['Absorbance'])
-                replicate_3.append(initial_df.iloc[start + 2]['Absorbance'])
-                sample_index += 1
-
-    final_df = pd.DataFrame({
-        'Sample': samples,
-        'Replicate 1': replicate_1,
-        'Replicate 2': replicate_2,
-        'Replicate 3': replicate_3
-    })
-
-    samples_1_to_8 = final_df.iloc[:8]
-    samples_1_to_8['Mean Absorbance'] = samples_1_to_8[['Replicate 1', 'Replicate 2', 'Replicate 3']].mean(axis=1)
-    protein_concentrations = [10, 5, 2.5, 1.25, 0.625, 0.3125, 0.15625, 0]
-    samples_1_to_8['Protein Concentration (mg/mL)'] = protein_concentrations
-
-    slope, intercept = np.polyfit(samples_1_to_8['Protein Concentration (mg/mL)'], samples_1_to_8['Mean Absorbance'], 1)
-    y_pred = slope * samples_1_to_8['Protein Concentration (mg/mL)'] + intercept
-    ss_res = np.sum((samples_1_to_8['Mean Absorbance'] - y_pred) ** 2)
-    ss_tot = np.sum((samples_1_to_8['Mean Absorbance'] - np.mean(samples_1_to_8['Mean Absorbance'])) ** 2)
-    r_squared = 1 - (ss_res / ss_tot)
-
-    unknown_samples = final_df.iloc[8:8 + protocol.params.num_samples]
-    unknown_samples['Mean Absorbance'] = unknown_samples[['Replicate 1', 'Replicate 2', 'Replicate 3']].mean(axis=1)
-    unknown_samples['Protein Concentration (mg/mL)'] = (unknown_samples['Mean Absorbance'] - intercept) / slope
-    unknown_samples['Sample Volume (µL)'] = (protocol.params.target_concentration * protocol.params.final_volume) / unknown_samples['Protein Concentration (mg/mL)']
-    unknown_samples['Diluent Volume (µL)'] = protocol.params.final_volume - unknown_samples['Sample Volume (µL)']
-    unknown_samples.loc[unknown_samples['Sample Volume (µL)'] > protocol.params.final_volume, ['Sample Volume (µL)', 'Diluent Volume (µL)']] = [protocol.params.final_volume, 0]
-    protocol.comment(f"\nNormalized Unknown Samples (to {protocol.params.target_concentration} mg/mL in {protocol.params.final_volume} µL):")
-    summary = unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Sample Volume (µL)', 'Diluent Volume (µL)']].to_string(index=False)
-    protocol.comment(f"\nNormalized sample volumes:\n{summary}")
-
-    normalized_samples = unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Sample Volume (µL)', 'Diluent Volume (µL)']].reset_index().drop(columns='index')
-    # Write the output and image of data plot to the instrument jupyter notebook directory
-    filename = f"Protocol_output_{today_date}.csv"
-    output_file_destination_path = directory.joinpath(filename)
-    normalized_samples.to_csv(output_file_destination_path)
-    rows = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
-    destination_wells  = [f'{rows[i % 8]}{(i // 8)+ 1}' for i in range(len(normalized_samples))]
-
-    for i, row in normalized_samples.iterrows():
-        source_well = sample_locations[i]
-        normalized_volume = row['Sample Volume (µL)']
-        diluent_volume = protocol.params.final_volume - normalized_volume
-        destination_well = destination_wells[i]
-        p1000_multi.transfer(normalized_volume, temp_adapter[source_well], plate3[destination_well], rate=0.5, new_tip='once')
-        p1000_multi.transfer(diluent_volume, reservoir['A7'], plate3[destination_well], rate=0.5, new_tip='once')
+    if should_run('normalization'):
+        protocol.comment("Running the normalization")
+        # Tell the user to load BCA assay data
+        protocol.comment("Place BCA assay absorbance data in /var/lib/jupyter/notebooks/Data")
+
+        # Pause the protocol until the user loads the file to /var/lib/jupyter/notebooks
+        protocol.pause()
+
+        # Tell the robot that new labware will be placed onto the deck
+        # plate1 parks in D4 unless a spare tip rack is staged there, then in A4 once plate3 has left it
+        protocol.move_labware(labware=plate3, new_location="B2", use_gripper=True)
+        if should_run('bca'):
+            plate1_parking = 'A4' if any(rack.parent == 'D4' for spares in spare_racks.values() for rack in spares) else 'D4'
+            protocol.move_labware(labware=plate1, new_location=plate1_parking, use_gripper=True)
+            protocol.move_labware(labware=plate2, new_location='A2', use_gripper=True)
+        protocol.move_labware(labware=racks['partial_50'], new_location='B4', use_gripper=True)
+
+        #Configure the p1000 pipette to use single tip NOTE: this resets the pipettes tip racks!
+        p1000_multi.configure_nozzle_layout(style=SINGLE, start="A1",tip_racks=[racks['tips_200']])
+
+        # Define the directory path
+        directory = Path("/var/lib/jupyter/notebooks/Data/")
+
+        # Get today's date in YYMMDD format
+        today_date = datetime.date.today().strftime("%y%m%d")
+
+        # Time each step of the analysis when profiling, see run_telemetry.py
+        profile = telemetry.profile() if telemetry and protocol.params.profile_analysis else None
+
+        def stage(name=None):
+            if profile:
+                profile.stage(name)
+
+        stage('wait for file')
+        find_file = subprocess.Popen(['python3',"/var/lib/jupyter/notebooks/wait_for_file.py"],stdout=subprocess.PIPE,
+            text=True)
+        stdout, stderr = find_file.communicate()
+
+        if stderr:
+            raise ValueError(f"Error while waiting for file: {stderr}")
+
+        # Extract the file path from the output
+        file_path = stdout.splitlines()[1]
+        if not file_path:
+            raise ValueError("No file path returned by wait_for_file.py")
+
+        protocol.comment(f"Successfully loaded: {file_path}")
+        stage('read_excel')
+        # Read the data file
+        df = pd.read_excel(file_path, header=5, nrows=bca['rows'], usecols=bca['reader_columns'])
+
+        stage('replicate loop')
+        # The standards, then the samples in the order they were plated, from their wells in the plate map
+        final_df = bca_map.read(df)
+
+        stage('standard curve')
+        samples_1_to_8 = final_df.iloc[:8]
+        samples_1_to_8['Mean Absorbance'] = samples_1_to_8[['Replicate 1', 'Replicate 2', 'Replicate 3']].mean(axis=1)
+        protein_concentrations = [10, 5, 2.5, 1.25, 0.625, 0.3125, 0.15625, 0]
+        samples_1_to_8['Protein Concentration (mg/mL)'] = protein_concentrations
+
+        slope, intercept = np.polyfit(samples_1_to_8['Protein Concentration (mg/mL)'], samples_1_to_8['Mean Absorbance'], 1)
+        y_pred = slope * samples_1_to_8['Protein Concentration (mg/mL)'] + intercept
+        ss_res = np.sum((samples_1_to_8['Mean Absorbance'] - y_pred) ** 2)
+        ss_tot = np.sum((samples_1_to_8['Mean Absorbance'] - np.mean(samples_1_to_8['Mean Absorbance'])) ** 2)
+        r_squared = 1 - (ss_res / ss_tot)
+
+        stage('normalization volumes')
+        unknown_samples = final_df.iloc[8:8 + protocol.params.num_samples]
+        unknown_samples['Mean Absorbance'] = unknown_samples[['Replicate 1', 'Replicate 2', 'Replicate 3']].mean(axis=1)
+        unknown_samples['Protein Concentration (mg/mL)'] = (unknown_samples['Mean Absorbance'] - intercept) / slope
+        unknown_samples['Sample Volume (µL)'] = (protocol.params.target_concentration * protocol.params.final_volume) / unknown_samples['Protein Concentration (mg/mL)']
+        unknown_samples['Diluent Volume (µL)'] = protocol.params.final_volume - unknown_samples['Sample Volume (µL)']
+        unknown_samples.loc[unknown_samples['Sample Volume (µL)'] > protocol.params.final_volume, ['Sample Volume (µL)', 'Diluent Volume (µL)']] = [protocol.params.final_volume, 0]
+        protocol.comment(f"\nNormalized Unknown Samples (to {protocol.params.target_concentration} mg/mL in {protocol.params.final_volume} µL):")
+        summary = unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Sample Volume (µL)', 'Diluent Volume (µL)']].to_string(index=False)
+        protocol.comment(f"\nNormalized sample volumes:\n{summary}")
+
+        normalized_samples = unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Sample Volume (µL)', 'Diluent Volume (µL)']].reset_index().drop(columns='index')
+        if history:
+            history.add_plate(file_path, df, (slope, intercept, r_squared), unknown_samples)
+        stage('to_csv')
+        # Write the output and image of data plot to the instrument jupyter notebook directory
+        filename = f"Protocol_output_{today_date}.csv"
+        output_file_destination_path = directory.joinpath(filename)
+        normalized_samples.to_csv(output_file_destination_path)
+        # The fit and concentrations for WesternBlot_Normalize_Only to start from
+        bca_results = {'run_id': run_id, 'protocol': metadata['protocolName'], 'written': datetime.datetime.now().isoformat(timespec='seconds'),
+                       'plates': [{'plate': 1, 'batch': 1, 'data_file': str(file_path),
+                                   'slope': float(slope), 'intercept': float(intercept), 'r_squared': float(r_squared)}],
+                       'samples': [{'sample': row['Sample'], 'batch': 1, 'plate': 1, 'mean_absorbance': float(row['Mean Absorbance']),
+                                    'concentration_mg_ml': float(row['Protein Concentration (mg/mL)'])} for _, row in unknown_samples.iterrows()]}
+        if not protocol.is_simulating():
+            results_file = directory.joinpath("bca_results", f"{run_id}.json")
+            results_file.parent.mkdir(parents=True, exist_ok=True)
+            results_file.write_text(json.dumps(bca_results, indent=2))
+            protocol.comment(f"BCA results saved as run {run_id}")
+        stage()
+        rows = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
+        destination_wells  = [f'{rows[i % 8]}{(i // 8)+ 1}' for i in range(len(normalized_samples))]
+
+        # Normalization volumes differ per sample, so even from a plate each sample goes
+        # with a single tip. The lysis buffer then goes into the empty wells first with one tip,
+        # and the sample plate moves off the magnetic block in D2, where a single nozzle cannot
+        # reach it, to B3 with the 1000 uL tips out of the way in front of it
+        if sample_plate_input:
+            if racks['tips_1000'].parent == 'C3':
+                protocol.move_labware(labware=racks['tips_1000'], new_location='C4', use_gripper=True)
+            protocol.move_labware(labware=sample_source, new_location='B3', use_gripper=True)
+            ensure_tips('diluent')
+            p1000_multi.transfer(list(normalized_samples['Diluent Volume (µL)']),
+                                 reservoir['A7'],
+                                 [plate3[destination_wells[i]] for i in range(len(normalized_samples))],
+                                 rate=0.5,
+                                 new_tip='once')
+        ensure_tips('normalization')
+        for i, row in normalized_samples.iterrows():
+            source_well = sample_locations[i]
+            normalized_volume = row['Sample Volume (µL)']
+            diluent_volume = protocol.params.final_volume - normalized_volume
+            destination_well = destination_wells[i]
+            p1000_multi.transfer(normalized_volume, sample_source[source_well], plate3[destination_well], rate=0.5, new_tip='once')
+            if not sample_plate_input:
+                p1000_multi.transfer(diluent_volume, reservoir['A7'], plate3[destination_well], rate=0.5, new_tip='once')
+        if sample_plate_input:
+            protocol.move_labware(labware=sample_source, new_location=mag_block, use_gripper=True)
+
+        manifest['phase'] = 'normalization'
+        manifest['final_volume'] = protocol.params.final_volume
+        manifest['target_concentration'] = protocol.params.target_concentration
+        manifest['well_map'] = {f"Sample {i + 1}": {'tube': sample_locations[i], 'plate3': destination_wells[i]} for i in range(len(normalized_samples))}
+        manifest['normalized_samples'] = normalized_samples.to_dict(orient='records')
 
     # ---------------- Click Reaction ----------------
-    protocol.comment("Running click reaction")
-    protocol.move_labware(labware=partial_50, new_location='B3', use_gripper=True)
-    protocol.move_labware(labware=tips_1000, new_location='C4', use_gripper=True)
-    p50_multi.configure_nozzle_layout(style=SINGLE, start="A1", tip_racks=[partial_50]) #,
+    if should_run('click'):
+        protocol.comment("Running click reaction")
+        if racks['partial_50'].parent != 'B3':
+            protocol.move_labware(labware=racks['partial_50'], new_location='B3', use_gripper=True)
+        if racks['tips_1000'].parent != 'C4':
+            protocol.move_labware(labware=racks['tips_1000'], new_location='C4', use_gripper=True)
+        if not should_run('normalization'):
+            destination_wells = [manifest['well_map'][f"Sample {i + 1}"]['plate3'] for i in range(protocol.params.num_samples)]
+        p50_multi.configure_nozzle_layout(style=SINGLE, start="A1", tip_racks=[racks['partial_50']]) #,
+
+        # The premix is made in the A6 tube, or for a plate of samples in reservoir A11 where the 8-channel reaches it
+        premix = reservoir['A11'] if sample_plate_input else temp_adapter['A6']
     
-    #Pipette rhodamine azide (A3), tbta (A5), cuso4 (A2), and tcep (A4)
-    p50_multi.transfer(1*(protocol.params.num_samples*2), 
-                            temp_adapter['A3'], 
-                            temp_adapter['A6'].bottom(z=0.1),
-                            rate=speed,
-                            mix_before=(1,10), 
-                            #delay=2,
-                            disposal_vol=1,
-                            #blow_out=True,
-                            new_tip='always')
-
-    p50_multi.transfer(3*(protocol.params.num_samples*2), 
-                            temp_adapter['A5'], 
-                            temp_adapter['A6'],
-                            mix_before=(1,10),
-                            rate=speed,
-                            #delay=3, 
-                            new_tip='always')
-
-    p50_multi.transfer(1*(protocol.params.num_samples*2), 
-                            temp_adapter['A2'], 
-                            temp_adapter['A6'], 
-                            mix_before=(1,10),
-                            new_tip='always')
-
-    p50_multi.transfer(1*(protocol.params.num_samples*2), 
-                            temp_adapter['A4'], 
-                            temp_adapter['A6'], 
-                            #mix_after=(3,30),
-                            new_tip='always')
+        ensure_tips('click_reagents')
+
+        #Pipette rhodamine azide (A3), tbta (A5), cuso4 (A2), and tcep (A4)
+        p50_multi.transfer(1*(protocol.params.num_samples*2), 
+                                temp_adapter['A3'], 
+                                premix.bottom(z=0.1),
+                                rate=speed,
+                                mix_before=(1,10), 
+                                #delay=2,
+                                disposal_vol=1,
+                                #blow_out=True,
+                                new_tip='always')
+
+        p50_multi.transfer(3*(protocol.params.num_samples*2), 
+                                temp_adapter['A5'], 
+                                premix,
+                                mix_before=(1,10),
+                                rate=speed,
+                                #delay=3, 
+                                new_tip='always')
+
+        p50_multi.transfer(1*(protocol.params.num_samples*2), 
+                                temp_adapter['A2'], 
+                                premix, 
+                                mix_before=(1,10),
+                                new_tip='always')
+
+        p50_multi.transfer(1*(protocol.params.num_samples*2), 
+                                temp_adapter['A4'], 
+                                premix, 
+                                #mix_after=(3,30),
+                                new_tip='always')
     
-    # Make sure the click reagents are well mixed
-    click_volume = 6*(protocol.params.final_volume/50)
-    # Track where tip racks are currently located
-    tiprack_locations = {
-        "partial_50": "B3",  # assume starts here
-        "tips_1000": "C4",   # assume starts here
-    }
-
-    def mix_click_reagents():
-        volume_click_reaction = protocol.params.final_volume + click_volume
-        location = temp_adapter['A6']
-        pipette = None
-
-        positions_mixing = [1, 1, 1]  # default fallback
-
-        if volume_click_reaction < 100:
-            positions_mixing = [1, 2, 3]
-            pipette = p50_multi
-
-        elif 100 < volume_click_reaction < 200:
-            positions_mixing = [1, 4, 9]
-            if tiprack_locations["partial_50"] != "B4":
-                protocol.move_labware(partial_50, new_location="B4", use_gripper=True)
-                tiprack_locations["partial_50"] = "B4"
-            p1000_multi.configure_nozzle_layout(style=SINGLE, start="A1", tip_racks=[tips_200])
-            pipette = p1000_multi
-
-        elif 200 < volume_click_reaction < 500:
-            positions_mixing = [1, 6, 11]
-            if tiprack_locations["partial_50"] != "B4":
-                protocol.move_labware(partial_50, new_location="B4", use_gripper=True)
-                tiprack_locations["partial_50"] = "B4"
-            if tiprack_locations["tips_1000"] != "B3":
-                protocol.move_labware(tips_1000, new_location="B3", use_gripper=True)
-                tiprack_locations["tips_1000"] = "B3"
-            p1000_multi.configure_nozzle_layout(style=SINGLE, start="A1", tip_racks=[tips_1000])
-            pipette = p1000_multi
-
-        elif 500 < volume_click_reaction < 1000:
-            positions_mixing = [1, 10, 16]
-            if tiprack_locations["partial_50"] != "B4":
-                protocol.move_labware(partial_50, new_location="B4", use_gripper=True)
-                tiprack_locations["partial_50"] = "B4"
-            if tiprack_locations["tips_1000"] != "B3":
-                protocol.move_labware(tips_1000, new_location="B3", use_gripper=True)
-                tiprack_locations["tips_1000"] = "B3"
-            p1000_multi.configure_nozzle_layout(style=SINGLE, start="A1", tip_racks=[tips_1000])
-            pipette = p1000_multi
-
+        # Make sure the click reagents are well mixed
+        # Track where tip racks are currently located
+        tiprack_locations = {
+            "partial_50": "B3",  # assume starts here
+            "tips_1000": "C4",   # assume starts here
+        }
+
+        def mix_click_reagents():
+            volume_click_reaction = protocol.params.final_volume + click_volume
+            location = premix
+            pipette = None
+
+            positions_mixing = [1, 1, 1]  # default fallback
+
+            if volume_click_reaction < 100:
+                positions_mixing = [1, 2, 3]
+                pipette = p50_multi
+
+            elif 100 < volume_click_reaction < 200:
+                positions_mixing = [1, 4, 9]
+                if tiprack_locations["partial_50"] != "B4":
+                    protocol.move_labware(racks['partial_50'], new_location="B4", use_gripper=True)
+                    tiprack_locations["partial_50"] = "B4"
+                p1000_multi.configure_nozzle_layout(style=SINGLE, start="A1", tip_racks=[racks['tips_200']])
+                pipette = p1000_multi
+
+            elif 200 < volume_click_reaction < 500:
+                positions_mixing = [1, 6, 11]
+                if tiprack_locations["partial_50"] != "B4":
+                    protocol.move_labware(racks['partial_50'], new_location="B4", use_gripper=True)
+                    tiprack_locations["partial_50"] = "B4"
+                if tiprack_locations["tips_1000"] != "B3":
+                    protocol.move_labware(racks['tips_1000'], new_location="B3", use_gripper=True)
+                    tiprack_locations["tips_1000"] = "B3"
+                p1000_multi.configure_nozzle_layout(style=SINGLE, start="A1", tip_racks=[racks['tips_1000']])
+                pipette = p1000_multi
+
+            elif 500 < volume_click_reaction < 1000:
+                positions_mixing = [1, 10, 16]
+                if tiprack_locations["partial_50"] != "B4":
+                    protocol.move_labware(racks['partial_50'], new_location="B4", use_gripper=True)
+                    tiprack_locations["partial_50"] = "B4"
+                if tiprack_locations["tips_1000"] != "B3":
+                    protocol.move_labware(racks['tips_1000'], new_location="B3", use_gripper=True)
+                    tiprack_locations["tips_1000"] = "B3"
+                p1000_multi.configure_nozzle_layout(style=SINGLE, start="A1", tip_racks=[racks['tips_1000']])
+                pipette = p1000_multi
+
+            else:
+                pipette = p1000_multi
+
+            ensure_tips('click_mix')
+
+            # Perform mixing
+            pipette.pick_up_tip()
+            pipette.aspirate(protocol.params.final_volume / 2, location.bottom(z=positions_mixing[0]))
+            pipette.dispense(protocol.params.final_volume / 2, location.bottom(z=positions_mixing[1]))
+            pipette.aspirate(protocol.params.final_volume / 3, location.bottom(z=positions_mixing[2]))
+            pipette.dispense(protocol.params.final_volume / 3, location.bottom(z=positions_mixing[0]))
+            pipette.mix(3, protocol.params.final_volume, location.bottom(z=positions_mixing[0]))
+            pipette.drop_tip()
+
+            # Move tip racks back to original locations in correct order
+            if tiprack_locations["tips_1000"] != "C4":
+                protocol.move_labware(racks['tips_1000'], new_location="C4", use_gripper=True)
+                tiprack_locations["tips_1000"] = "C4"
+            if tiprack_locations["partial_50"] != "B3":
+                protocol.move_labware(racks['partial_50'], new_location="B3", use_gripper=True)
+                tiprack_locations["partial_50"] = "B3"
+
+        # Call the function
+        mix_click_reagents()
+
+        # Pipette the click reaction premix, a column at a time from a plate of samples
+        columns = sorted(set(well[1:] for well in destination_wells), key=int)
+        column_targets = [f'A{col}' for col in columns]
+        if sample_plate_input:
+            p50_multi.configure_nozzle_layout(style=ALL, tip_racks=[racks['partial_50']])
+            premix_steps = [(f'click_premix {number}', [well]) for number, well in enumerate(column_targets, start=1)]
         else:
-            pipette = p1000_multi
-
-        # Perform mixing
-        pipette.pick_up_tip()
-        pipette.aspirate(protocol.params.final_volume / 2, location.bottom(z=positions_mixing[0]))
-        pipette.dispense(protocol.params.final_volume / 2, location.bottom(z=positions_mixing[1]))
-        pipette.aspirate(protocol.params.final_volume / 3, location.bottom(z=positions_mixing[2]))
-        pipette.dispense(protocol.params.final_volume / 3, location.bottom(z=positions_mixing[0]))
-        pipette.mix(3, protocol.params.final_volume, location.bottom(z=positions_mixing[0]))
-        pipette.drop_tip()
-
-        # Move tip racks back to original locations in correct order
-        if tiprack_locations["tips_1000"] != "C4":
-            protocol.move_labware(tips_1000, new_location="C4", use_gripper=True)
-            tiprack_locations["tips_1000"] = "C4"
-        if tiprack_locations["partial_50"] != "B3":
-            protocol.move_labware(partial_50, new_location="B3", use_gripper=True)
-            tiprack_locations["partial_50"] = "B3"
-
-    # Call the function
-    mix_click_reagents()
-
-    # Pipette the click reaction premix
-    p50_multi.transfer(click_volume, 
-                            temp_adapter['A6'], 
-                            [plate3[i] for i in destination_wells],
-                            rate=speed-0.1,
-                            delay=2,
-                            disposal_vol=0,
-                            mix_before=(1, 6),
-                            mix_after=(3,30),
-                            new_tip='always')
-
-    # Step 11: shake the sample plate for click reaction
-    protocol.move_labware(labware=plate3, new_location=heater_shaker, use_gripper=True)
-    heater_shaker.close_labware_latch()
-    heater_shaker.set_and_wait_for_shake_speed(1000)
-    protocol.delay(minutes=90)
-    heater_shaker.deactivate_shaker()
-    heater_shaker.open_labware_latch()
-    thermocycler.open_lid()
-    protocol.move_labware(labware=plate3, new_location=thermocycler, use_gripper=True)
-
-    # Add the loading buffer and move to the thermocylcer to seal and store.
-    loading_buffer_volume = round((protocol.params.final_volume) / 3, 1)
-    columns = sorted(set(well[1:] for well in destination_wells), key=int)
-    column_targets = [f'A{col}' for col in columns]
-    p50_multi.configure_nozzle_layout(style=ALL, tip_racks=[partial_50])
-    p50_multi.transfer(loading_buffer_volume, 
-                            reservoir['A9'], 
-                            [plate3[well] for well in column_targets],
-                            disposal_vol=0,
-                            rate=speed-0.1,
-                            delay=2,
-                            mix_before=(1,30), 
-                            mix_after=(3, 40), 
-                            new_tip='always')
-    thermocycler.close_lid()
-    thermocycler.set_block_temperature(95)
-    protocol.delay(minutes=5)
-    thermocycler.set_block_temperature(4)  # Hold at 4°C
+            premix_steps = [('click_premix', destination_wells)]
+        for step, targets in premix_steps:
+            ensure_tips(step)
+            p50_multi.transfer(click_volume, 
+                                    premix, 
+                                    [plate3[i] for i in targets],
+                                    rate=speed-0.1,
+                                    delay=2,
+                                    disposal_vol=0,
+                                    mix_before=(1, 6),
+                                    mix_after=(3,30),
+                                    new_tip='always')
+
+        # Step 11: shake the sample plate for click reaction
+        protocol.move_labware(labware=plate3, new_location=heater_shaker, use_gripper=True)
+        heater_shaker.close_labware_latch()
+        heater_shaker.set_and_wait_for_shake_speed(1000)
+        protocol.delay(minutes=90)
+        heater_shaker.deactivate_shaker()
+        heater_shaker.open_labware_latch()
+        thermocycler.open_lid()
+        protocol.move_labware(labware=plate3, new_location=thermocycler, use_gripper=True)
+
+        # Add the loading buffer and move to the thermocylcer to seal and store.
+        p50_multi.configure_nozzle_layout(style=ALL, tip_racks=[racks['partial_50']])
+        for number, well in enumerate(column_targets, start=1):
+            ensure_tips(f'loading_buffer {number}')
+            p50_multi.transfer(loading_buffer_volume, 
+                                    reservoir['A9'], 
+                                    plate3[well],
+                                    disposal_vol=0,
+                                    rate=speed-0.1,
+                                    delay=2,
+                                    mix_before=(1,30), 
+                                    mix_after=(3, 40), 
+                                    new_tip='always')
+        thermocycler.close_lid()
+        thermocycler.set_block_temperature(95)
+        protocol.delay(minutes=5)
+        thermocycler.set_block_temperature(4)  # Hold at 4°C
+
+    # Hand the plate over to the robot that runs the next phase
+    if stop_after != phases[-1]:
+        if stop_after == 'bca':
+            manifest['phase'] = 'bca'
+        manifest['next_phase'] = phases[phases.index(stop_after) + 1]
+        manifest['handed_off'] = datetime.datetime.now().isoformat(timespec='seconds')
+        if not protocol.is_simulating():
+            handoff_file.write_text(json.dumps(manifest, indent=2))
+        protocol.comment(f"Hand-off manifest written to {handoff_file}. Copy it to the next robot, move {manifest['plate_ids'].get('plate3')} over and start it at {manifest['next_phase']}")
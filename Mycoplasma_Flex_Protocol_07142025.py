@@ -1,6 +1,86 @@
 from opentrons import protocol_api
-from opentrons.protocol_api import SINGLE, ALL
+from opentrons.protocol_api import SINGLE, ALL, RuntimeParameterRequiredError
 import subprocess
+import re
+import sys
+
+# Per-step timing log for live runs, see run_telemetry.py
+sys.path.append("/var/lib/jupyter/notebooks")
+try:
+    import run_telemetry
+except ImportError:
+    run_telemetry = None
+
+# Samples and tubes of the sample manifest, see sample_manifest.py
+# ---- sample_manifest.py (copied by shared_code.py, edit sample_manifest.py instead) ----
+# Tubes of the 24-tube aluminum block
+TUBE_ROWS = 'ABCD'
+TUBE_COLUMNS = 6
+# Header names each manifest column goes by
+HEADERS = {
+    'sample': ['sample', 'sample_id', 'id'],
+    'tube': ['position', 'tube'],
+    'expected': ['expected', 'expected_mg_ml', 'conc', 'concentration', 'conc_mg_ml', 'concentration_mg_ml'],
+    'target': ['target', 'target_ug'],
+}
+
+
+def free_tubes(reserved_tubes):
+    """Tubes left for samples, row by row."""
+    return [f"{row}{number}" for row in TUBE_ROWS for number in range(1, TUBE_COLUMNS + 1) if f"{row}{number}" not in reserved_tubes]
+
+
+def header_name(cell):
+    """A header cell in lower case with every run of spaces and punctuation as one underscore."""
+    return re.sub(r'[^a-z0-9]+', '_', cell.lower()).strip('_')
+
+
+def parse_manifest(rows, reserved_tubes, max_samples=None):
+    """Samples of manifest rows as dicts of sample, tube, expected (mg/mL) and target (ug)."""
+    rows = [row for row in rows if any(cell.strip() for cell in row)]
+    if not rows:
+        raise Exception("The sample manifest is empty")
+    header = [header_name(cell) for cell in rows[0]]
+
+    def column(field):
+        return next((i for i, cell in enumerate(header) if cell in HEADERS[field]), None)
+
+    sample_column, tube_column = column('sample'), column('tube')
+    expected_column, target_column = column('expected'), column('target')
+    if sample_column is None or tube_column is None:
+        raise Exception(f"The sample manifest needs a sample and a position column, not {', '.join(rows[0])}")
+    tubes = free_tubes(reserved_tubes)
+    room = len(tubes) if max_samples is None else min(len(tubes), max_samples)
+    if len(rows) - 1 > room:
+        raise Exception(f"The sample manifest lists {len(rows) - 1} samples, this run has room for {room}")
+    samples = []
+    for line, row in enumerate(rows[1:], start=2):
+        cells = [cell.strip() for cell in row] + ['']*len(header)
+        sample_id, tube = cells[sample_column], cells[tube_column].upper()
+        if any(sample['sample'] == sample_id for sample in samples):
+            raise Exception(f"Line {line} of the sample manifest repeats sample {sample_id}")
+        if tube not in tubes:
+            raise Exception(f"Line {line} of the sample manifest puts {sample_id} in {tube}, which is not one of the free tubes {', '.join(tubes)}")
+        tubes.remove(tube)
+        try:
+            expected = float(cells[expected_column]) if expected_column is not None and cells[expected_column] else None
+            target = float(cells[target_column]) if target_column is not None and cells[target_column] else None
+        except ValueError:
+            raise Exception(f"Line {line} of the sample manifest has a concentration or target that is not a number")
+        samples.append({'sample': sample_id, 'tube': tube, 'expected': expected, 'target': target})
+    if not samples:
+        raise Exception("The sample manifest has no samples")
+    return samples
+
+
+def read_sample_manifest(manifest, reserved_tubes, max_samples=None):
+    """Samples of a sample_manifest parameter, or None when the run has no manifest."""
+    try:
+        rows = manifest.parse_as_csv()
+    except RuntimeParameterRequiredError:
+        return None
+    return parse_manifest(rows, reserved_tubes, max_samples)
+# ---- end of sample_manifest.py ----
 
 metadata = {
     'protocolName': 'Mycoplasma Detection PCR Protocol Tube-based',
@@ -13,13 +93,39 @@ requirements = {
     "apiLevel": "2.21"
 }
 
+def add_parameters(parameters):
+
+    parameters.add_csv_file(
+        variable_name="sample_manifest",
+        display_name="Sample manifest",
+        description="CSV of sample and position (tube), one row per sample"
+    )
+
 def run(protocol: protocol_api.ProtocolContext):
+    if run_telemetry:
+        run_telemetry.instrument(protocol, metadata['protocolName'])
 
     # Enter the number of samples 
     speed= 0.5
     target_concentration = 1
-    num_samples = 16
+    num_samples = 16 # samples when there is no manifest
     num_replicates = 2
+
+    # The samples come from the sample_manifest CSV, one row per sample with its ID and its tube
+    # on the temperature block (concentration and target columns are not used here). It is read
+    # once into sample_sheet, keyed by sample ID, with the PCR wells of every sample. Without a
+    # manifest (the simulator has none) num_samples numbered samples fill B1-B6, C1-C6, D1-D6.
+    reserved_tubes = ['A1', 'A2', 'A3', 'A4', 'A5', 'A6']
+    sample_sheet = {}
+
+    manifest = read_sample_manifest(protocol.params.sample_manifest, reserved_tubes)
+    if manifest:
+        for sample in manifest:
+            sample_sheet[sample['sample']] = {'index': len(sample_sheet), 'tube': sample['tube']}
+        num_samples = len(sample_sheet)
+    else:
+        for i in range(num_samples):
+            sample_sheet[f'Sample {i + 1}'] = {'index': i, 'tube': f"{'BCD'[i // 6]}{i % 6 + 1}"}
     numtotalSamples = num_samples + (2*num_replicates)
     reaction_vol = 25
     mastermix_vol = 12.5
@@ -77,23 +183,7 @@ def run(protocol: protocol_api.ProtocolContext):
     p50_multi.configure_nozzle_layout(style=SINGLE, start="A1",tip_racks=[partial_50])
     p1000_multi.configure_nozzle_layout(style=SINGLE, start="A1",tip_racks=[tips_1000])
 
-    # assign sample locations dynamically
-    sample_locations = []
-    row = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
-    for i in range(num_samples):
-        if i < 6:  # B1 to B6
-            sample_locations.append(f'B{i + 1}')
-        elif i < 12:  # C1 to C6
-            sample_locations.append(f'C{i - 5}')
-        elif i < 18:  # D1 to D6
-            sample_locations.append(f'D{i - 11}')
-        elif i < 23:
-            sample_locations.append(f'A{i - 16}')  # Stop if we exceed the number of available rows/columns
-        else:
-            print('Too many samples')
-    
     # define row letters in order
-    samples = [temp_adapter[i] for i in sample_locations]
     row_letters = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
     num_rows = len(row_letters)
     num_columns = 12
@@ -122,9 +212,8 @@ def run(protocol: protocol_api.ProtocolContext):
     sample_well_map["neg_control"] = get_next_wells(1, num_replicates, used_wells)
 
     # allocate wells for each sample
-    for sample_idx in range(num_samples):
-        next_wells = get_next_wells(sample_idx + 2, num_replicates, used_wells)
-        sample_well_map[f"sample_{sample_idx+1}"] = next_wells
+    for sample in sample_sheet.values():
+        sample['wells'] = get_next_wells(sample['index'] + 2, num_replicates, used_wells)
     
     #Add the positive control and no template control to the number of samples
 
@@ -146,14 +235,11 @@ def run(protocol: protocol_api.ProtocolContext):
                          disposal_vol=5)
     
     # Transfer samples
-    for sample_idx in range(num_samples):
-        tube_loc = sample_locations[sample_idx]
-        wells = sample_well_map[f"sample_{sample_idx+1}"]
-
+    for sample_id, sample in sample_sheet.items():
         p50_multi.distribute(
             2.5,
-            temp_adapter[tube_loc],
-            [pcr_plate[well].bottom(z=0.1) for well in wells],
+            temp_adapter[sample['tube']],
+            [pcr_plate[well].bottom(z=0.1) for well in sample['wells']],
             rate=speed,
             mix_before=(1, 10),
             disposal_vol=5)
@@ -177,7 +263,7 @@ def run(protocol: protocol_api.ProtocolContext):
                             mix_after=(3, 40),
                             new_tip='once')
 
-    mastermix_wells = [well for key, wells in sample_well_map.items() for well in wells]
+    mastermix_wells = [well for key, wells in sample_well_map.items() for well in wells] + [well for sample in sample_sheet.values() for well in sample['wells']]
     # distribute mastermix
     p50_multi.distribute(
         22.5,
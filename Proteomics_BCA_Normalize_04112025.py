@@ -1,11 +1,187 @@
 from opentrons import protocol_api
-from opentrons.protocol_api import SINGLE, ALL
+from opentrons.protocol_api import SINGLE, ALL, RuntimeParameterRequiredError
 import pandas as pd
 import numpy as np
+import math
 import subprocess
 from pathlib import Path
 import datetime
 import time
+import re
+import sys
+
+# Per-step timing log for live runs, see run_telemetry.py
+sys.path.append("/var/lib/jupyter/notebooks")
+try:
+    import run_telemetry
+except ImportError:
+    run_telemetry = None
+
+# History of every run's normalization results, see run_history.py
+try:
+    import run_history
+except ImportError:
+    run_history = None
+
+# Wells of the standards and samples on the BCA plate, see plate_map.py
+# ---- plate_map.py (copied by shared_code.py, edit plate_map.py instead) ----
+# Rows and columns of each plate format
+FORMATS = {'96': (8, 12), '384': (16, 24)}
+CHANNELS = 8
+
+
+class PlateMap:
+    """Standards and samples of one plate, each with its replicate wells."""
+
+    def __init__(self, plate, replicates, standards, samples):
+        self.plate = plate
+        self.rows, self.columns = FORMATS[plate]
+        self.replicates = replicates
+        self.row_names = [chr(ord('A') + i) for i in range(self.rows)]
+        step = self.rows // CHANNELS
+        # (first row, first column) of every block, in the order they are filled
+        self.blocks = [(offset, column) for column in range(1, self.columns - replicates + 2, replicates) for offset in range(step)]
+        standard_blocks = math.ceil(len(standards)/CHANNELS)
+        if len(samples) > (len(self.blocks) - standard_blocks)*CHANNELS:
+            raise Exception(f"A {plate}-well plate holds {(len(self.blocks) - standard_blocks)*CHANNELS} samples in {replicates}s next to the standards.")
+        self.standards = [self._entry(name, i) for i, name in enumerate(standards)]
+        self.samples = [self._entry(name, standard_blocks*CHANNELS + i) for i, name in enumerate(samples)]
+
+    def _entry(self, name, position):
+        block, row = divmod(position, CHANNELS)
+        offset, column = self.blocks[block]
+        row_name = self.row_names[offset + row*(self.rows // CHANNELS)]
+        return {'name': name, 'block': block, 'wells': [f"{row_name}{column + i}" for i in range(self.replicates)]}
+
+    def wells(self, name):
+        """Replicate wells of a standard or sample."""
+        for entry in self.standards + self.samples:
+            if entry['name'] == name:
+                return entry['wells']
+        raise KeyError(name)
+
+    def top_wells(self, block):
+        """Wells the first nozzle of an 8-channel goes to for each replicate column of a block."""
+        offset, column = self.blocks[block]
+        return [f"{self.row_names[offset]}{column + i}" for i in range(self.replicates)]
+
+    def sample_blocks(self):
+        """(top wells, samples) of every block that holds samples, in plating order."""
+        blocks = {}
+        for entry in self.samples:
+            blocks.setdefault(entry['block'], []).append(entry)
+        return [(self.top_wells(block), entries) for block, entries in blocks.items()]
+
+    def read(self, block):
+        """Replicates of the standards, then the samples, from a reader block of rows x columns."""
+        values = pd.DataFrame(block).values
+        table = {'Sample': []}
+        table.update({f'Replicate {i + 1}': [] for i in range(self.replicates)})
+        for entry in self.standards + self.samples:
+            table['Sample'].append(entry['name'])
+            for i, well in enumerate(entry['wells']):
+                table[f'Replicate {i + 1}'].append(values[self.row_names.index(well[0]), int(well[1:]) - 1])
+        return pd.DataFrame(table)
+
+    def grid(self):
+        """The plate as text, a short label per well."""
+        labels = {}
+        for i, entry in enumerate(self.standards):
+            labels.update({well: f"S{i + 1}" for well in entry['wells']})
+        for i, entry in enumerate(self.samples):
+            labels.update({well: str(i + 1) for well in entry['wells']})
+        lines = ["   " + "".join(f"{column:>4}" for column in range(1, self.columns + 1))]
+        for row in self.row_names:
+            lines.append(f"{row:<3}" + "".join(f"{labels.get(f'{row}{column}', '.'):>4}" for column in range(1, self.columns + 1)))
+        return "\n".join(lines)
+
+
+def capacity(plate='96', replicates=3, standards=8):
+    """Samples one plate holds next to the standards."""
+    rows, columns = FORMATS[plate]
+    blocks = (rows // CHANNELS)*len(range(1, columns - replicates + 2, replicates))
+    return (blocks - math.ceil(standards/CHANNELS))*CHANNELS
+
+
+def compile_map(samples, plate='96', replicates=3, standards=8):
+    """Plate map for sample names (or a number of samples) and standards (names or a number)."""
+    if isinstance(samples, int):
+        samples = [f"Sample {i + 1}" for i in range(samples)]
+    if isinstance(standards, int):
+        standards = [f"Standard {i + 1}" for i in range(standards)]
+    return PlateMap(str(plate), replicates, list(standards), list(samples))
+# ---- end of plate_map.py ----
+
+# Samples and tubes of the sample manifest, see sample_manifest.py
+# ---- sample_manifest.py (copied by shared_code.py, edit sample_manifest.py instead) ----
+# Tubes of the 24-tube aluminum block
+TUBE_ROWS = 'ABCD'
+TUBE_COLUMNS = 6
+# Header names each manifest column goes by
+HEADERS = {
+    'sample': ['sample', 'sample_id', 'id'],
+    'tube': ['position', 'tube'],
+    'expected': ['expected', 'expected_mg_ml', 'conc', 'concentration', 'conc_mg_ml', 'concentration_mg_ml'],
+    'target': ['target', 'target_ug'],
+}
+
+
+def free_tubes(reserved_tubes):
+    """Tubes left for samples, row by row."""
+    return [f"{row}{number}" for row in TUBE_ROWS for number in range(1, TUBE_COLUMNS + 1) if f"{row}{number}" not in reserved_tubes]
+
+
+def header_name(cell):
+    """A header cell in lower case with every run of spaces and punctuation as one underscore."""
+    return re.sub(r'[^a-z0-9]+', '_', cell.lower()).strip('_')
+
+
+def parse_manifest(rows, reserved_tubes, max_samples=None):
+    """Samples of manifest rows as dicts of sample, tube, expected (mg/mL) and target (ug)."""
+    rows = [row for row in rows if any(cell.strip() for cell in row)]
+    if not rows:
+        raise Exception("The sample manifest is empty")
+    header = [header_name(cell) for cell in rows[0]]
+
+    def column(field):
+        return next((i for i, cell in enumerate(header) if cell in HEADERS[field]), None)
+
+    sample_column, tube_column = column('sample'), column('tube')
+    expected_column, target_column = column('expected'), column('target')
+    if sample_column is None or tube_column is None:
+        raise Exception(f"The sample manifest needs a sample and a position column, not {', '.join(rows[0])}")
+    tubes = free_tubes(reserved_tubes)
+    room = len(tubes) if max_samples is None else min(len(tubes), max_samples)
+    if len(rows) - 1 > room:
+        raise Exception(f"The sample manifest lists {len(rows) - 1} samples, this run has room for {room}")
+    samples = []
+    for line, row in enumerate(rows[1:], start=2):
+        cells = [cell.strip() for cell in row] + ['']*len(header)
+        sample_id, tube = cells[sample_column], cells[tube_column].upper()
+        if any(sample['sample'] == sample_id for sample in samples):
+            raise Exception(f"Line {line} of the sample manifest repeats sample {sample_id}")
+        if tube not in tubes:
+            raise Exception(f"Line {line} of the sample manifest puts {sample_id} in {tube}, which is not one of the free tubes {', '.join(tubes)}")
+        tubes.remove(tube)
+        try:
+            expected = float(cells[expected_column]) if expected_column is not None and cells[expected_column] else None
+            target = float(cells[target_column]) if target_column is not None and cells[target_column] else None
+        except ValueError:
+            raise Exception(f"Line {line} of the sample manifest has a concentration or target that is not a number")
+        samples.append({'sample': sample_id, 'tube': tube, 'expected': expected, 'target': target})
+    if not samples:
+        raise Exception("The sample manifest has no samples")
+    return samples
+
+
+def read_sample_manifest(manifest, reserved_tubes, max_samples=None):
+    """Samples of a sample_manifest parameter, or None when the run has no manifest."""
+    try:
+        rows = manifest.parse_as_csv()
+    except RuntimeParameterRequiredError:
+        return None
+    return parse_manifest(rows, reserved_tubes, max_samples)
+# ---- end of sample_manifest.py ----
 
 metadata = {
     'protocolName': 'BCA Assay with Normalization and Video Recording (Edited)',
@@ -18,7 +194,23 @@ requirements = {
     "apiLevel": "2.21"
 }
 
+def add_parameters(parameters):
+
+    parameters.add_csv_file(
+        variable_name="sample_manifest",
+        display_name="Sample manifest",
+        description="CSV of sample, position (tube), expected_mg_ml and target_ug, one row per sample"
+    )
+    parameters.add_bool(
+        variable_name="profile_analysis",
+        display_name="Profile analysis",
+        description="Log the time and peak memory of each step of the plate reader analysis",
+        default=False
+    )
+
 def run(protocol: protocol_api.ProtocolContext):
+    telemetry = run_telemetry.instrument(protocol, metadata['protocolName']) if run_telemetry else None
+    history = run_history.start(protocol, metadata['protocolName'], telemetry.run_id if telemetry else None) if run_history else None
     #######################################################################################
     protocol.comment(
         "Place BSA Standard in A1, Lysis buffer in A2, tbta in A3, biotin in A4, cuso4 in A5, tcep in A6 and samples in row B")
@@ -26,10 +218,43 @@ def run(protocol: protocol_api.ProtocolContext):
 
     target_concentration = 1
     final_volume = 0.5
-    num_samples = 10 #change this to the number of samples you need to run. The maximum is 18.
+    num_samples = 10 # samples when there is no manifest
+    max_samples = min(18, capacity()) # most samples one run takes: the free tubes B1-D6 and the BCA plate's triplicates
     num_rows = 8  # A-H
     num_replicates = 3  # the number of replicates
 
+    # The samples come from the sample_manifest CSV: one row per sample with its ID, its tube on
+    # the temperature block and, optionally, the expected concentration (mg/mL) and the protein
+    # to normalize to (ug, target_concentration x final_volume by default). It is read once into
+    # sample_sheet, keyed by sample ID, with the BCA and plate3 wells of every sample. Without a
+    # manifest (the simulator has none) num_samples numbered samples fill B1-B6, C1-C6, D1-D6.
+    reserved_tubes = ['A1', 'A2', 'A3', 'A4', 'A5', 'A6']
+    sample_sheet = {}
+
+    def add_sample(sample_id, tube, expected=None, target=None):
+        index = len(sample_sheet)
+        sample_sheet[sample_id] = {
+            'index': index,
+            'tube': tube,
+            'expected': expected,
+            'target': target if target is not None else target_concentration*final_volume*1000,
+            'well': f"{'ABCDEFGH'[index % 8]}{(index // 8) + 1}",
+        }
+
+    manifest = read_sample_manifest(protocol.params.sample_manifest, reserved_tubes, max_samples)
+    if manifest:
+        for sample in manifest:
+            add_sample(sample['sample'], sample['tube'], sample['expected'], sample['target'])
+        num_samples = len(sample_sheet)
+    else:
+        for i in range(num_samples):
+            add_sample(f'Sample {i + 1}', f"{'BCD'[i // 6]}{i % 6 + 1}")
+
+    # Triplicates of the samples next to the standards on the BCA plate, in sample sheet order
+    bca_map = compile_map(list(sample_sheet))
+    for sample, mapped in zip(sample_sheet.values(), bca_map.samples):
+        sample['bca_wells'] = mapped['wells']
+
     #Start recording the video
     video_output_file = 'BCA_Assay_012425.mp4'
     device_index = "<video2>"
@@ -55,10 +280,10 @@ def run(protocol: protocol_api.ProtocolContext):
     
     # Load labware
     partial_50 = protocol.load_labware(load_name="opentrons_flex_96_filtertiprack_50ul",location="A2")
-    tips_200 = protocol.load_labware(load_name="opentrons_flex_96_filtertiprack_200ul",location="B4")
+    tips_200 = protocol.load_labware(load_name="opentrons_flex_96_filtertiprack_200ul",location="B3")
     tips_1000 = protocol.load_labware('opentrons_flex_96_filtertiprack_1000ul', 'A3')
     plate1 = protocol.load_labware('corning_96_wellplate_360ul_flat', 'B2') 
-    plate2 = protocol.load_labware('corning_96_wellplate_360ul_flat', 'D1') #on heatshaker
+    plate2 = protocol.load_labware('corning_96_wellplate_360ul_flat', 'C3') #moved onto the heatshaker to incubate
     reservoir = protocol.load_labware('nest_12_reservoir_15ml', 'C2')
     
     # Liquid definitions
@@ -67,7 +292,7 @@ def run(protocol: protocol_api.ProtocolContext):
     bsa_reag_b = protocol.define_liquid(name = 'Reagent B', display_color="#704900",)
     bsa_reag_c = protocol.define_liquid(name = 'Reagent C', display_color="#701100",)
     excess_lysis = protocol.define_liquid(name='Excess Lysis Buffer', display_color="#FFC0CB")  # Pink
-    sample_liquids = [protocol.define_liquid(name = f'Sample {i + 1}', display_color="#FFA000",) for i in range(num_samples)]
+    sample_liquids = {sample_id: protocol.define_liquid(name = sample_id, display_color="#FFA000",) for sample_id in sample_sheet}
 
     # Reservoir assignments for washes and digestion
     reservoir['A1'].load_liquid(liquid=bsa_reag_a, volume=20000)  
@@ -122,51 +347,20 @@ def run(protocol: protocol_api.ProtocolContext):
     p50_multi.aspirate(50,plate1['G1'])
     p50_multi.drop_tip()
 
-    # assign sample locations dynamically
-    sample_locations = []
-    for i in range(num_samples):
-        if i < 6:  # B1 to B6
-            sample_locations.append(f'B{i + 1}')
-        elif i < 12:  # C1 to C6
-            sample_locations.append(f'C{i - 5}')
-        elif i < 18:  # D1 to D6
-            sample_locations.append(f'D{i - 11}')
-        else:
-            break  # Stop if we exceed the number of available rows/columns
-
-    # Predefined list of letters A-H
-    row = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
-
-    # Create a list of rows that repeats based on num_samples
-    rows = [row[i % len(row)] for i in range(num_samples)]
-
-    # Create a dynamic sample map based on the assigned sample locations
-    sample_map = list(map(lambda i,j :(i,j), rows, sample_locations))
-
-    # Iterate over the sample_map list
-    for index, (row, tube) in enumerate(sample_map):
-        if index < 8:
-            base_column = 4 + (index // 8)  # This will determine the starting column for each row
-        elif index< 16:
-            base_column = 6 + (index // 8)
-        else:
-            base_column = 8 + (index //8)
-
-        # Prepare destination wells
-        destination_wells = [f'{row}{base_column + (i % 3)}' for i in range(3)]  # Generate wells like A4, A5, A6 or B4, B5, B6, etc.
-        
+    # Iterate over the samples in the sample sheet
+    for sample_id, sample in sample_sheet.items():
         #Transfer the samples onto plate 2
         p50_multi.distribute(
             10,
-            temp_adapter[tube],
-            [plate2[i] for i in destination_wells],
+            temp_adapter[sample['tube']],
+            [plate2[i] for i in sample['bca_wells']],
             rate = 0.5)  # Distributing to three consecutive columns
 
     #Step 9: Load the p50 with full tip rack (don't need to)
     p50_multi.configure_nozzle_layout(style=ALL, tip_racks=[partial_50]) #, 
 
     #Step 10: Pipette triplicate of controls from plate1 column 1 to plate2 columns 1,2,3 
-    p50_multi.distribute(10, plate1['A1'], [plate2[f'A{i}'] for i in range(1, 4)])
+    p50_multi.distribute(10, plate1['A1'], [plate2[i] for i in bca_map.top_wells(0)])
 
     #Step 12: Load the p1000 with full tip rack (don't need to)
     p1000_multi.configure_nozzle_layout(style=ALL, tip_racks=[tips_1000]) #,
@@ -211,12 +405,14 @@ def run(protocol: protocol_api.ProtocolContext):
     # Tell the robot that new labware will be placed onto the deck
     protocol.move_labware(labware=plate1, new_location=protocol_api.OFF_DECK)
     protocol.move_labware(labware=plate2, new_location=protocol_api.OFF_DECK)
+    # The 50 µL tips are done with; left in B3 they block the single-nozzle p1000 reaching into A3
+    protocol.move_labware(labware=partial_50, new_location=protocol_api.OFF_DECK)
 
     #Configure the p1000 pipette to use single tip NOTE: this resets the pipettes tip racks!
     p1000_multi.configure_nozzle_layout(style=SINGLE, start="A1",tip_racks=[tips_1000])
 
     # Load the new labware
-    plate3 = protocol.load_labware('thermoscientificnunc_96_wellplate_2000ul', location='B3')  # New deep well plate for final samples
+    plate3 = protocol.load_labware('thermoscientificnunc_96_wellplate_2000ul', location='B2')  # New deep well plate for final samples
 
     # Define the directory path
     directory = Path("/var/lib/jupyter/notebooks/TWH/")
@@ -224,6 +420,14 @@ def run(protocol: protocol_api.ProtocolContext):
     # Get today's date in YYMMDD format
     today_date = datetime.date.today().strftime("%y%m%d")
 
+    # Time each step of the analysis when profiling, see run_telemetry.py
+    profile = telemetry.profile() if telemetry and protocol.params.profile_analysis else None
+
+    def stage(name=None):
+        if profile:
+            profile.stage(name)
+
+    stage('wait for file')
     find_file = subprocess.Popen(['python3',"/var/lib/jupyter/notebooks/wait_for_file.py"],stdout=subprocess.PIPE,
         text=True)
     stdout, stderr = find_file.communicate()
@@ -237,38 +441,15 @@ def run(protocol: protocol_api.ProtocolContext):
         raise ValueError("No file path returned by wait_for_file.py")
 
     protocol.comment(f"Successfully loaded: {file_path}")
+    stage('read_excel')
     # Read the data file
     df = pd.read_excel(file_path, header=5, nrows=8, usecols="C:N")
 
-    # Create a list of well names (A1 to H12)
-    well_names = [f"{row}{col}" for col in range(1, 13) for row in "ABCDEFGH"]
-
-    # Flatten the absorbance values into a single list
-    absorbance_values = df.values.flatten()
-
-    # Create the DataFrame
-    initial_df = pd.DataFrame({'Well': well_names, 'Absorbance': absorbance_values})
-
-    # Process data for normalization
-    samples, replicate_1, replicate_2, replicate_3 = [], [], [], []
-    sample_index = 1
-    for col_offset in range(0, 12, 3):  # Iterate by column groups (triplets)
-        for row_offset in range(8):  # Iterate row-wise for each sample
-            start = row_offset * 12 + col_offset  # Starting index for the sample
-            if start + 2 < len(initial_df):
-                samples.append(f"Sample {sample_index}")
-                replicate_1.append(initial_df.iloc[start]['Absorbance'])
-                replicate_2.append(initial_df.iloc[start + 1]['Absorbance'])
-                replicate_3.append(initial_df.iloc[start + 2]['Absorbance'])
-                sample_index += 1
-
-    final_df = pd.DataFrame({
-        'Sample': samples,
-        'Replicate 1': replicate_1,
-        'Replicate 2': replicate_2,
-        'Replicate 3': replicate_3
-    })
+    stage('replicate loop')
+    # The standards, then the samples in the order they were plated, from their wells in the plate map
+    final_df = bca_map.read(df)
 
+    stage('standard curve')
     samples_1_to_8 = final_df.iloc[:8]
     samples_1_to_8['Mean Absorbance'] = samples_1_to_8[['Replicate 1', 'Replicate 2', 'Replicate 3']].mean(axis=1)
     protein_concentrations = [10, 5, 2.5, 1.25, 0.625, 0.3125, 0.15625, 0]
@@ -280,25 +461,42 @@ def run(protocol: protocol_api.ProtocolContext):
     ss_tot = np.sum((samples_1_to_8['Mean Absorbance'] - np.mean(samples_1_to_8['Mean Absorbance'])) ** 2)
     r_squared = 1 - (ss_res / ss_tot)
 
-    unknown_samples = final_df.iloc[8:8 + num_samples]
+    stage('normalization volumes')
+    # The plate reader rows after the standards are the samples in the order they were plated
+    unknown_samples = final_df.iloc[8:]
     unknown_samples['Mean Absorbance'] = unknown_samples[['Replicate 1', 'Replicate 2', 'Replicate 3']].mean(axis=1)
     unknown_samples['Protein Concentration (mg/mL)'] = (unknown_samples['Mean Absorbance'] - intercept) / slope
+    unknown_samples['Expected Concentration (mg/mL)'] = [sample['expected'] for sample in sample_sheet.values()]
+    unknown_samples['Target (ug)'] = [sample['target'] for sample in sample_sheet.values()]
 
 
-    unknown_samples['Sample Volume (mL)'] = (target_concentration * final_volume) / unknown_samples['Protein Concentration (mg/mL)']
+    unknown_samples['Sample Volume (mL)'] = (unknown_samples['Target (ug)'] / 1000) / unknown_samples['Protein Concentration (mg/mL)']
     unknown_samples['Diluent Volume (mL)'] = final_volume - unknown_samples['Sample Volume (mL)']
     unknown_samples.loc[unknown_samples['Sample Volume (mL)'] > final_volume, ['Sample Volume (mL)', 'Diluent Volume (mL)']] = [final_volume, 0]
-    protocol.comment("\nNormalized Unknown Samples (to 1 mg/mL in 500 µL):")
-    print(unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Sample Volume (mL)', 'Diluent Volume (mL)']])
-
-    normalized_samples = unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Sample Volume (mL)', 'Diluent Volume (mL)']].reset_index().drop(columns='index')
-    rows = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
-    destination_wells  = [f'{rows[i % 8]}{(i // 8)+ 1}' for i in range(len(normalized_samples))]
+    # One concentration when every sample has the same target, otherwise the range of targets from the manifest
+    targets = sorted(set(unknown_samples['Target (ug)']))
+    if len(targets) == 1:
+        normalized_to = f"{targets[0]/1000/final_volume:g} mg/mL"
+    else:
+        normalized_to = f"{targets[0]:g}-{targets[-1]:g} ug"
+    protocol.comment(f"\nNormalized Unknown Samples (to {normalized_to} in {final_volume*1000:g} µL):")
+    print(unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Target (ug)', 'Sample Volume (mL)', 'Diluent Volume (mL)']])
+
+    normalized_samples = unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Expected Concentration (mg/mL)', 'Sample Volume (mL)', 'Diluent Volume (mL)']].reset_index().drop(columns='index')
+    if history:
+        history.add_plate(file_path, df, (slope, intercept, r_squared), unknown_samples)
+    stage()
+
+    # Samples that read far from what the manifest expects are worth a second look before they are used up
+    for _, row in normalized_samples.dropna(subset=['Expected Concentration (mg/mL)']).iterrows():
+        if not 0.5 <= row['Protein Concentration (mg/mL)'] / row['Expected Concentration (mg/mL)'] <= 2:
+            protocol.comment(f"{row['Sample']} reads {row['Protein Concentration (mg/mL)']:.2f} mg/mL, the manifest expects {row['Expected Concentration (mg/mL)']:g} mg/mL")
 
     for i, row in normalized_samples.iterrows():
-        source_well = sample_locations[i]
-        normalized_volume = row['Sample Volume (mL)']
-        diluent_volume = 500 - normalized_volume
-        destination_well = destination_wells[i]
+        sample = sample_sheet[row['Sample']]
+        source_well = sample['tube']
+        normalized_volume = row['Sample Volume (mL)']*1000
+        diluent_volume = final_volume*1000 - normalized_volume
+        destination_well = sample['well']
         p1000_multi.transfer(normalized_volume, temp_adapter[source_well], plate3[destination_well], rate=0.5, new_tip='once')
         p1000_multi.transfer(diluent_volume, reservoir['A7'], plate3[destination_well], rate=0.5, new_tip='once')
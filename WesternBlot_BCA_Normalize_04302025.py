@@ -3,11 +3,284 @@ from opentrons.protocol_api import SINGLE, ALL
 import pandas as pd
 import numpy as np
 import subprocess
+import math
 from pathlib import Path
 #import matplotlib.pyplot as plt
 import datetime
 import time
 import re
+import json
+import sys
+
+# Per-step timing log for live runs, see run_telemetry.py
+sys.path.append("/var/lib/jupyter/notebooks")
+try:
+    import run_telemetry
+except ImportError:
+    run_telemetry = None
+
+# History of every run's normalization results, see run_history.py
+try:
+    import run_history
+except ImportError:
+    run_history = None
+
+# Wells of the standards and samples on the BCA plate, see plate_map.py
+# ---- plate_map.py (copied by shared_code.py, edit plate_map.py instead) ----
+# Rows and columns of each plate format
+FORMATS = {'96': (8, 12), '384': (16, 24)}
+CHANNELS = 8
+
+
+class PlateMap:
+    """Standards and samples of one plate, each with its replicate wells."""
+
+    def __init__(self, plate, replicates, standards, samples):
+        self.plate = plate
+        self.rows, self.columns = FORMATS[plate]
+        self.replicates = replicates
+        self.row_names = [chr(ord('A') + i) for i in range(self.rows)]
+        step = self.rows // CHANNELS
+        # (first row, first column) of every block, in the order they are filled
+        self.blocks = [(offset, column) for column in range(1, self.columns - replicates + 2, replicates) for offset in range(step)]
+        standard_blocks = math.ceil(len(standards)/CHANNELS)
+        if len(samples) > (len(self.blocks) - standard_blocks)*CHANNELS:
+            raise Exception(f"A {plate}-well plate holds {(len(self.blocks) - standard_blocks)*CHANNELS} samples in {replicates}s next to the standards.")
+        self.standards = [self._entry(name, i) for i, name in enumerate(standards)]
+        self.samples = [self._entry(name, standard_blocks*CHANNELS + i) for i, name in enumerate(samples)]
+
+    def _entry(self, name, position):
+        block, row = divmod(position, CHANNELS)
+        offset, column = self.blocks[block]
+        row_name = self.row_names[offset + row*(self.rows // CHANNELS)]
+        return {'name': name, 'block': block, 'wells': [f"{row_name}{column + i}" for i in range(self.replicates)]}
+
+    def wells(self, name):
+        """Replicate wells of a standard or sample."""
+        for entry in self.standards + self.samples:
+            if entry['name'] == name:
+                return entry['wells']
+        raise KeyError(name)
+
+    def top_wells(self, block):
+        """Wells the first nozzle of an 8-channel goes to for each replicate column of a block."""
+        offset, column = self.blocks[block]
+        return [f"{self.row_names[offset]}{column + i}" for i in range(self.replicates)]
+
+    def sample_blocks(self):
+        """(top wells, samples) of every block that holds samples, in plating order."""
+        blocks = {}
+        for entry in self.samples:
+            blocks.setdefault(entry['block'], []).append(entry)
+        return [(self.top_wells(block), entries) for block, entries in blocks.items()]
+
+    def read(self, block):
+        """Replicates of the standards, then the samples, from a reader block of rows x columns."""
+        values = pd.DataFrame(block).values
+        table = {'Sample': []}
+        table.update({f'Replicate {i + 1}': [] for i in range(self.replicates)})
+        for entry in self.standards + self.samples:
+            table['Sample'].append(entry['name'])
+            for i, well in enumerate(entry['wells']):
+                table[f'Replicate {i + 1}'].append(values[self.row_names.index(well[0]), int(well[1:]) - 1])
+        return pd.DataFrame(table)
+
+    def grid(self):
+        """The plate as text, a short label per well."""
+        labels = {}
+        for i, entry in enumerate(self.standards):
+            labels.update({well: f"S{i + 1}" for well in entry['wells']})
+        for i, entry in enumerate(self.samples):
+            labels.update({well: str(i + 1) for well in entry['wells']})
+        lines = ["   " + "".join(f"{column:>4}" for column in range(1, self.columns + 1))]
+        for row in self.row_names:
+            lines.append(f"{row:<3}" + "".join(f"{labels.get(f'{row}{column}', '.'):>4}" for column in range(1, self.columns + 1)))
+        return "\n".join(lines)
+
+
+def capacity(plate='96', replicates=3, standards=8):
+    """Samples one plate holds next to the standards."""
+    rows, columns = FORMATS[plate]
+    blocks = (rows // CHANNELS)*len(range(1, columns - replicates + 2, replicates))
+    return (blocks - math.ceil(standards/CHANNELS))*CHANNELS
+
+
+def compile_map(samples, plate='96', replicates=3, standards=8):
+    """Plate map for sample names (or a number of samples) and standards (names or a number)."""
+    if isinstance(samples, int):
+        samples = [f"Sample {i + 1}" for i in range(samples)]
+    if isinstance(standards, int):
+        standards = [f"Standard {i + 1}" for i in range(standards)]
+    return PlateMap(str(plate), replicates, list(standards), list(samples))
+# ---- end of plate_map.py ----
+
+# Spare tip racks and the swap when a rack runs dry, see tip_planner.py
+# ---- tip_planner.py (copied by shared_code.py, edit tip_planner.py instead) ----
+def pick_up_tips(columns, tips, pick_ups):
+    """Take the pick-ups from the tips left in each column. Returns False when the rack runs dry."""
+    for _ in range(pick_ups):
+        free = [i for i, n in enumerate(columns) if n >= tips]
+        if tips == 8:
+            free = [i for i in free if columns[i] == 8]
+        if not free:
+            return False
+        columns[free[0]] -= tips
+    return True
+
+
+def count_spares(tip_plan, rack_names):
+    """Spare racks of each type the plan needs, walking it with fresh racks."""
+    spares_needed = {name: 0 for name in rack_names}
+    rack_columns = {name: [8]*12 for name in rack_names}
+    for step, (name, tips, pick_ups) in tip_plan.items():
+        if not pick_up_tips(rack_columns[name], tips, pick_ups):
+            spares_needed[name] += 1
+            rack_columns[name] = [8]*12
+            if not pick_up_tips(rack_columns[name], tips, pick_ups):
+                raise Exception(f"Step {step} needs more than one {name} rack on its own.")
+    return spares_needed
+
+
+class TipPlanner:
+    """The racks of a run by name, their spares and the swap when one runs dry.
+
+    racks is updated in place when a spare is swapped in, so the protocol's own dict
+    always holds the rack in use. Spares go to spare_slots, staging slots the protocol
+    never parks labware in; with off_deck the ones that do not fit wait off deck and are
+    put in place by hand, otherwise running out of slots raises.
+    """
+
+    def __init__(self, protocol, racks, tip_plan, chute, pipettes, spare_slots, off_deck=False):
+        self.protocol = protocol
+        self.racks = racks
+        self.tip_plan = tip_plan
+        self.chute = chute
+        self.pipettes = pipettes
+        self.spares_needed = count_spares(tip_plan, racks)
+        spare_slots = list(spare_slots)
+        if not off_deck and sum(self.spares_needed.values()) > len(spare_slots):
+            raise Exception(f"Not enough staging slots for spare tip racks: {self.spares_needed}")
+        self.spare_racks = {name: [] for name in racks}
+        for name, count in self.spares_needed.items():
+            for _ in range(count):
+                slot = spare_slots.pop(0) if spare_slots else protocol_api.OFF_DECK
+                self.spare_racks[name].append(protocol.load_labware(racks[name].load_name, location=slot))
+        protocol.comment(f"Tip plan: spare racks {self.spares_needed}")
+
+    def ensure(self, step):
+        """Swap an exhausted rack for its spare right before the step that would run it dry."""
+        name, tips, pick_ups = self.tip_plan[step]
+        rack = self.racks[name]
+        columns = [sum(well.has_tip for well in column) for column in rack.columns()]
+        if pick_up_tips(columns, tips, pick_ups):
+            return
+        spare = self.spare_racks[name].pop(0)
+        slot = rack.parent
+        self.protocol.comment(f"{name} is out of tips for {step}, swapping in the spare rack")
+        self.protocol.move_labware(labware=rack, new_location=self.chute, use_gripper=True)
+        # A spare kept off deck is put in place by hand, the run waits for it
+        self.protocol.move_labware(labware=spare, new_location=slot, use_gripper=spare.parent != protocol_api.OFF_DECK)
+        self.racks[name] = spare
+        for pipette in self.pipettes:
+            if rack in pipette.tip_racks:
+                pipette.tip_racks = [spare]
+# ---- end of tip_planner.py ----
+
+# Heater-shakers and the thermocycler as incubation stations, see incubation_stations.py
+# ---- incubation_stations.py (copied by shared_code.py, edit incubation_stations.py instead) ----
+# Plates that sit on the thermocycler block
+THERMOCYCLER_PLATES = ['opentrons_96_wellplate_200ul_pcr_full_skirt', 'nest_96_wellplate_100ul_pcr_full_skirt',
+                       'biorad_96_wellplate_200ul_pcr']
+
+
+def takes(kind, load_name, rpm=None):
+    """Whether a heater_shaker or thermocycler station takes a plate shaken at rpm."""
+    if kind == 'thermocycler':
+        return not rpm and load_name in THERMOCYCLER_PLATES
+    return True
+
+
+class IncubationStations:
+    """The incubation stations of a run and what incubates on them.
+
+    delay(seconds) waits out an incubation, protocol.delay by default; a rehearsal passes
+    its scaled wait. A station is a dict of kind, module, location (the adapter plates go
+    on) and, while busy, plate, celsius, rpm and end on the time.monotonic() clock.
+    """
+
+    def __init__(self, protocol, delay=None):
+        self.protocol = protocol
+        self.delay = delay or (lambda seconds: protocol.delay(seconds=seconds))
+        self.stations = []
+
+    def add_heater_shaker(self, module, location=None):
+        """A heater-shaker; plates go on location, its adapter, or on the module itself."""
+        self.stations.append({'kind': 'heater_shaker', 'module': module, 'location': location or module, 'plate': None})
+
+    def add_thermocycler(self, module):
+        """The thermocycler, for runs where its block is free while they incubate."""
+        self.stations.append({'kind': 'thermocycler', 'module': module, 'location': module, 'plate': None})
+
+    def free(self, plate, rpm=None):
+        """The first free station that takes the plate, or None."""
+        return next((station for station in self.stations
+                     if station['plate'] is None and takes(station['kind'], plate.load_name, rpm)), None)
+
+    def start(self, plate, minutes, celsius=None, rpm=None):
+        """Put a plate on a free station and start its incubation. Returns the station.
+
+        Without celsius the station keeps the temperature it has, so a heater-shaker
+        warmed up beforehand is not waited on again.
+        """
+        station = self.free(plate, rpm)
+        if station is None:
+            busy = ', '.join(f"{station['kind']} ({station['plate'].load_name})" for station in self.stations if station['plate'] is not None)
+            raise Exception(f"No free incubation station takes {plate.load_name}, busy: {busy or 'none'}")
+        module = station['module']
+        if station['kind'] == 'thermocycler':
+            module.open_lid()
+            self.protocol.move_labware(labware=plate, new_location=station['location'], use_gripper=True)
+            module.close_lid()
+            if celsius is not None:
+                module.set_block_temperature(celsius)
+        else:
+            module.open_labware_latch()
+            self.protocol.move_labware(labware=plate, new_location=station['location'], use_gripper=True)
+            module.close_labware_latch()
+            if celsius is not None:
+                module.set_and_wait_for_temperature(celsius)
+            if rpm:
+                module.set_and_wait_for_shake_speed(rpm)
+        station.update(plate=plate, celsius=celsius, rpm=rpm, end=time.monotonic() + minutes*60)
+        return station
+
+    def finish(self, station, heater_off=None, open_station=True):
+        """Wait out the rest of an incubation, then stop and open the station.
+
+        The heat goes off when start() set it, unless heater_off says otherwise; a heater
+        kept warm for the next plate stays on. open_station=False keeps a plate that is
+        pipetted into where it is latched in.
+        """
+        remaining = station['end'] - time.monotonic()
+        if remaining > 0:
+            self.delay(round(remaining))
+        if heater_off is None:
+            heater_off = station['celsius'] is not None
+        module = station['module']
+        if station['kind'] == 'thermocycler':
+            if heater_off:
+                module.deactivate_block()
+            if open_station:
+                module.open_lid()
+        else:
+            if station['rpm']:
+                module.deactivate_shaker()
+            if heater_off:
+                module.deactivate_heater()
+            if open_station:
+                module.open_labware_latch()
+        station['plate'] = None
+# ---- end of incubation_stations.py ----
 
 metadata = {
     'protocolName': 'BCA Assay with Normalization for Western Blotting',
@@ -28,7 +301,7 @@ def add_parameters(parameters):
         description="Number of input samples to be tested for mycoplasma.",
         default=8,
         minimum=1,
-        maximum=24
+        maximum=96
     )
     parameters.add_int(
         variable_name="standards_col",
@@ -57,8 +330,61 @@ def add_parameters(parameters):
         maximum=100,
         unit="µL"
     )
+    parameters.add_str(
+        variable_name="bca_plate",
+        display_name="BCA plate",
+        description="384 wells fit the standards and up to 120 samples in triplicate at half the volumes",
+        choices=[
+            {"display_name": "96-well", "value": "96"},
+            {"display_name": "384-well", "value": "384"}
+        ],
+        default="96"
+    )
+    parameters.add_str(
+        variable_name="sample_input",
+        display_name="Sample input",
+        description="Samples in tubes B1-D6 of the cold block (up to 18) or a 96-well PCR plate on the magnet",
+        choices=[
+            {"display_name": "Tubes", "value": "tubes"},
+            {"display_name": "96-well plate", "value": "plate"}
+        ],
+        default="tubes"
+    )
+    parameters.add_bool(
+        variable_name="stream_plates",
+        display_name="Stream BCA plates",
+        description="Batches too big for one BCA plate: read each plate while the next is plated and incubated",
+        default=False
+    )
+    parameters.add_int(
+        variable_name="queued_batches",
+        display_name="Queued batches",
+        description="Batches of num_samples run back to back, sharing the diluted standards",
+        default=1,
+        minimum=1,
+        maximum=6
+    )
+    parameters.add_int(
+        variable_name="standards_hours",
+        display_name="Standards stability",
+        description="Hours diluted standards are reused for later batches before fresh ones are diluted",
+        default=4,
+        minimum=1,
+        maximum=24,
+        unit="h"
+    )
+    parameters.add_bool(
+        variable_name="profile_analysis",
+        display_name="Profile analysis",
+        description="Log the time and peak memory of each step of the plate reader analysis",
+        default=False
+    )
 
 def run(protocol: protocol_api.ProtocolContext):
+    telemetry = run_telemetry.instrument(protocol, metadata['protocolName']) if run_telemetry else None
+    # Run ID of the run history and of the BCA results this run writes for WesternBlot_Normalize_Only
+    run_id = telemetry.run_id if telemetry else datetime.datetime.now().strftime("%y%m%d-%H%M%S")
+    history = run_history.start(protocol, metadata['protocolName'], run_id) if run_history else None
     protocol.comment(
         "Place BSA Standard in A1, Lysis buffer in A2, tbta in A3, biotin in A4, cuso4 in A5, tcep in A6 and samples in row B")
     protocol.comment("Running the BCA assay")
@@ -67,6 +393,48 @@ def run(protocol: protocol_api.ProtocolContext):
     target_concentration = protocol.params.ug_protein/protocol.params.final_volume # 40 ug protein/ 15 uL final volume
     speed= 0.35
 
+    # BCA plate formats: labware, size of the reader block and µL per well of sample and reagents A, B and C
+    bca_formats = {
+        '96': {'labware': 'corning_96_wellplate_360ul_flat', 'rows': 8, 'columns': 12, 'reader_columns': 'C:N',
+               'sample': 5, 'reagent_a': 50, 'reagent_b': 48, 'reagent_c': 2},
+        '384': {'labware': 'corning_384_wellplate_112ul_flat', 'rows': 16, 'columns': 24, 'reader_columns': 'C:Z',
+                'sample': 2.5, 'reagent_a': 25, 'reagent_b': 24, 'reagent_c': 1},
+    }
+    bca = bca_formats[protocol.params.bca_plate]
+
+    # BCA plate map: the standards and triplicates of every plate in blocks of three columns
+    # by the eight rows the 8-channel reaches at once, so a column of the sample plate goes
+    # into one block (see plate_map.py)
+    per_plate = capacity(protocol.params.bca_plate)
+    if protocol.params.num_samples > per_plate and not protocol.params.stream_plates:
+        raise Exception(f"A {protocol.params.bca_plate}-well BCA plate holds {per_plate} samples in triplicate, stream the rest onto more plates.")
+
+    # Streaming: a batch bigger than one BCA plate is split over several plates. Plate N+1 is
+    # plated and incubated while plate N is read, and plate N's samples are normalized as soon
+    # as its file is in. Queued batches follow one another, each with its own samples, BCA
+    # plates and output plate; only the diluted standards carry over.
+    plates = []
+    for batch in range(1, protocol.params.queued_batches + 1):
+        for start in range(0, protocol.params.num_samples, per_plate):
+            samples = list(range(start, min(start + per_plate, protocol.params.num_samples)))
+            plates.append({'batch': batch, 'samples': samples, 'first': start == 0,
+                           'last': start + per_plate >= protocol.params.num_samples,
+                           'map': compile_map([f"Sample {9 + i}" for i in samples], protocol.params.bca_plate)})
+
+    # A diluted standards column holds 50 µL a well; each BCA plate draws a triplicate and the
+    # disposal volume, 5 µL stay behind. Columns are shared by plates while they last and by
+    # later batches for standards_hours, the first batch's columns are diluted up front.
+    plates_per_standards = int((50 - 5) // (3*bca['sample'] + 5))
+    standards_columns = [protocol.params.standards_col + i
+                         for i in range(math.ceil(sum(plate['batch'] == 1 for plate in plates)/plates_per_standards))]
+    if standards_columns[-1] > 12:
+        raise Exception(f"The standards need columns {standards_columns[0]}-{standards_columns[-1]} of plate1.")
+
+    # Samples come in tubes in B1-D6 of the cold block, row A holds the standard and loading buffer
+    sample_plate_input = protocol.params.sample_input == 'plate'
+    if not sample_plate_input and protocol.params.num_samples > 18:
+        raise Exception(f"At most 18 samples fit in tubes, load {protocol.params.num_samples} samples from a plate.")
+
     # Load modules
     heater_shaker = protocol.load_module('heaterShakerModuleV1', 'D1')
     thermocycler = protocol.load_module('thermocyclerModuleV2')
@@ -93,9 +461,11 @@ def run(protocol: protocol_api.ProtocolContext):
     tips_200 = protocol.load_labware(load_name="opentrons_flex_96_filtertiprack_200ul",location="B3")
     tips_1000 = protocol.load_labware('opentrons_flex_96_filtertiprack_1000ul', 'C4')
     plate1 = protocol.load_labware('opentrons_96_wellplate_200ul_pcr_full_skirt', 'A2')
-    plate2 = protocol.load_labware('corning_96_wellplate_360ul_flat', 'B2')
+    plate2 = protocol.load_labware(bca['labware'], 'B2')
     plate3 = thermocycler.load_labware('nest_96_wellplate_100ul_pcr_full_skirt')    
     reservoir = protocol.load_labware('nest_12_reservoir_15ml', 'C2')
+    # The magnetic block is free in this protocol, the sample plate sits on it
+    sample_source = mag_block.load_labware('opentrons_96_wellplate_200ul_pcr_full_skirt') if sample_plate_input else temp_adapter
     
     # Liquid definitions
     bsa_standard = protocol.define_liquid(name = 'BSA Standard', display_color="#704848",)
@@ -110,179 +480,279 @@ def run(protocol: protocol_api.ProtocolContext):
     temp_adapter['A1'].load_liquid(liquid=bsa_standard, volume=1000)  # 20 mg/ml BSA standard
     temp_adapter['A2'].load_liquid(liquid=loading_buffer, volume=1000)  # Additional lysis buffer for SP3
 
-    # Reservoir assignments for washes and digestion
-    reservoir['A1'].load_liquid(liquid=bsa_reag_a, volume=20000)  
-    reservoir['A3'].load_liquid(liquid=bsa_reag_b, volume=20000)  
-    reservoir['A5'].load_liquid(liquid=bsa_reag_c, volume=20000)  
-    reservoir['A7'].load_liquid(liquid=excess_lysis, volume=15000) 
+    # Reservoir assignments for washes and digestion, again for every queued batch
+    def fill_reservoir():
+        reservoir['A1'].load_liquid(liquid=bsa_reag_a, volume=20000)  
+        reservoir['A3'].load_liquid(liquid=bsa_reag_b, volume=20000)  
+        reservoir['A5'].load_liquid(liquid=bsa_reag_c, volume=20000)  
+        reservoir['A7'].load_liquid(liquid=excess_lysis, volume=15000) 
+
+    fill_reservoir()
 
     # Load pipettes
     p50_multi = protocol.load_instrument('flex_8channel_50', 'left') 
     p1000_multi = protocol.load_instrument('flex_8channel_1000', 'right') 
 
+    # ---------------- Tip planning ----------------
+    # Count the tips every step picks up for these parameters so spare racks can be
+    # staged before the run instead of the run stalling on an empty rack.
+
+    # step: (tip rack, tips per pick-up, number of pick-ups), in the order the steps run
+    tip_plan = {
+        'standards_lysis': ('tips_200', 8, 1),
+        'bsa_standard': ('partial_50', 1, 2*len(standards_columns)),
+    }
+    # A plate's steps repeat for every BCA plate, plate N is normalized after plate N+1 is plated
+    # and a batch ends with its loading buffer. Fresh standards are planned whenever a column
+    # runs out and at the start of every later batch, in case the old ones are too old by then.
+    standards_left = plates_per_standards*len(standards_columns)
+    fresh_standards = 0
+    for number, plate in enumerate(plates, start=1):
+        if number > 1 and (plate['first'] or not standards_left):
+            fresh_standards += 1
+            standards_left = plates_per_standards
+            tip_plan.update({
+                f'fresh_lysis {fresh_standards}': ('tips_50', 8, 1),
+                f'fresh_standard {fresh_standards}': ('partial_50', 1, 2),
+            })
+        standards_left -= 1
+        tip_plan.update({
+            f'bca_samples {number}': ('tips_50', 8, math.ceil(len(plate['samples'])/8)) if sample_plate_input else ('partial_50', 1, len(plate['samples'])),
+            f'bca_standards {number}': ('tips_50', 8, 1),
+            f'reagent_ab {number}': ('tips_1000', 8, 2),
+            f'reagent_c {number}': ('tips_50', 8, 1),
+        })
+        for normalized in ([number - 1] if not plate['first'] else []) + ([number] if plate['last'] else []):
+            tip_plan.update({
+                f'diluent {normalized}': ('partial_50', 1, 1),
+                f'normalization {normalized}': ('partial_50', 1, len(plates[normalized - 1]['samples'])),
+            })
+        if plate['last']:
+            tip_plan[f'loading_buffer {plate["batch"]}'] = ('partial_50', 1, 1)
+    racks = {'tips_50': tips_50, 'partial_50': partial_50, 'tips_200': tips_200, 'tips_1000': tips_1000}
+
+    # Spares go to staging slots the protocol never parks labware in; the rest wait
+    # off deck and are swapped in by hand, see tip_planner.py
+    tip_planner = TipPlanner(protocol, racks, tip_plan, chute, (p50_multi, p1000_multi), spare_slots=['B4'], off_deck=True)
+    spare_racks = tip_planner.spare_racks
+    ensure_tips = tip_planner.ensure
+
     #Configure the p1000 pipette to use all channels
-    p1000_multi.configure_nozzle_layout(style=ALL, tip_racks=[tips_200])
+    p1000_multi.configure_nozzle_layout(style=ALL, tip_racks=[racks['tips_200']])
 
     #Start recording the video
     video_process = subprocess.Popen(["python3", "/var/lib/jupyter/notebooks/record_video.py"])
 
-    # Steps 1: Add lysis buffer to column 1 of plate1. 
+    ensure_tips('standards_lysis')
+
+    # Steps 1: Add lysis buffer to column 1 of plate1, and the next columns for more BCA plates
     p1000_multi.distribute(50, 
          reservoir['A7'],
-         plate1[f'A{protocol.params.standards_col}'],
+         [plate1[f'A{column}'] for column in standards_columns],
          rate = 0.35,
          delay = 2,
          new_tip='once',
          blow_out=True)
 
     # Step 2: move the 200uL partial tips to D4 and then the 50 uL partial tips to B3
-    protocol.move_labware(labware=tips_200, new_location="D4", use_gripper=True)
+    protocol.move_labware(labware=racks['tips_200'], new_location="D4", use_gripper=True)
     #protocol.move_labware(labware=partial_50, new_location="B3", use_gripper=True)
 
     #Step 3: Configure the p50 pipette to use single tip NOTE: this resets the pipettes tip racks!
-    p50_multi.configure_nozzle_layout(style=SINGLE, start="A1",tip_racks=[partial_50])
-
-    # Step 4: Transfer BSA standard (20 mg/ml) to first well of column 1
-    p50_multi.transfer(50,
-        temp_adapter['A1'],
-        plate1[f'A{protocol.params.standards_col}'],
-        rate = 0.35,
-        delay = 2,
-        mix_after=(3, 40),
-        new_tip='once',
-        blow_out=True)
-
-    # Step 5: Perform serial dilution down column 1
-    rows = ['A','B', 'C', 'D', 'E', 'F', 'G']
-    p50_multi.pick_up_tip()
-    for source, dest in zip(rows[:-1], rows[1:]):
+    p50_multi.configure_nozzle_layout(style=SINGLE, start="A1",tip_racks=[racks['partial_50']])
+
+    ensure_tips('bsa_standard')
+
+    def dilute_standards(column):
+        rows = ['A','B', 'C', 'D', 'E', 'F', 'G']
+
+        # Step 4: Transfer BSA standard (20 mg/ml) to first well of column 1
+        p50_multi.transfer(50,
+            temp_adapter['A1'],
+            plate1[f'A{column}'],
+            rate = 0.35,
+            delay = 2,
+            mix_after=(3, 40),
+            new_tip='once',
+            blow_out=True)
+
+        # Step 5: Perform serial dilution down column 1
+        p50_multi.pick_up_tip()
+        for source, dest in zip(rows[:-1], rows[1:]):
+            p50_multi.transfer(50,
+                             plate1[f'{source}{column}'],
+                             plate1[f'{dest}{column}'],
+                             rate = 0.5,
+                             mix_after=(3, 40),
+                             new_tip='never', 
+                             disposal_vol=0)
+
+        # Step 6: remove excess standard from well G
+        p50_multi.aspirate(50,plate1[f'G{column}'])
+        p50_multi.drop_tip()
+
+    for column in standards_columns:
+        dilute_standards(column)
+    standards = {'columns': [{'column': column, 'left': plates_per_standards, 'made': time.monotonic()} for column in standards_columns],
+                 'fresh': 0, 'next': standards_columns[-1] + 1}
+
+    def standards_for(plate):
+        # The first column with a plate's worth left; a new batch first drops columns past standards_hours
+        if plate['first']:
+            standards['columns'] = [entry for entry in standards['columns']
+                                    if time.monotonic() - entry['made'] <= protocol.params.standards_hours*3600]
+        for entry in standards['columns']:
+            if entry['left']:
+                entry['left'] -= 1
+                return entry['column']
+
+        # Fresh standards in the next column: lysis buffer with the full 50 uL rack, then the
+        # dilution with single tips, which needs B3 clear of the 1000 uL rack
+        column = standards['next']
+        if column > 12:
+            raise Exception("plate1 has no column left for fresh standards.")
+        standards['fresh'] += 1
+        standards['next'] += 1
+        protocol.comment(f"Diluting fresh standards in column {column} of plate1")
+        p50_multi.configure_nozzle_layout(style=ALL, tip_racks=[racks['tips_50']])
+        ensure_tips(f"fresh_lysis {standards['fresh']}")
         p50_multi.transfer(50,
-                         plate1[f'{source}{protocol.params.standards_col}'],
-                         plate1[f'{dest}{protocol.params.standards_col}'],
-                         rate = 0.5,
-                         mix_after=(3, 40),
-                         new_tip='never', 
-                         disposal_vol=0)
-
-    # Step 6: remove excess standard from well G
-    p50_multi.aspirate(50,plate1[f'G{protocol.params.standards_col}'])
-    p50_multi.drop_tip()
-
-    # assign sample locations dynamically
+                           reservoir['A7'],
+                           plate1[f'A{column}'],
+                           rate = 0.35,
+                           new_tip='once',
+                           blow_out=True)
+        if racks['tips_1000'].parent == 'B3':
+            protocol.move_labware(labware=racks['tips_1000'], new_location="C4", use_gripper=True)
+        p50_multi.configure_nozzle_layout(style=SINGLE, start="A1", tip_racks=[racks['partial_50']])
+        ensure_tips(f"fresh_standard {standards['fresh']}")
+        dilute_standards(column)
+        standards['columns'].append({'column': column, 'left': plates_per_standards - 1, 'made': time.monotonic()})
+        return column
+
+    # assign sample locations dynamically: B1 to D6 of the tube block, or the sample plate column by column
     sample_locations = []
     for i in range(protocol.params.num_samples):
-        if i < 6:  # B1 to B6
+        if sample_plate_input:
+            sample_locations.append(f"{'ABCDEFGH'[i % 8]}{i // 8 + 1}")
+        elif i < 6:  # B1 to B6
             sample_locations.append(f'B{i + 1}')
         elif i < 12:  # C1 to C6
             sample_locations.append(f'C{i - 5}')
-        elif i < 18:  # D1 to D6
+        else:  # D1 to D6
             sample_locations.append(f'D{i - 11}')
-        else:
-            break  # Stop if we exceed the number of available rows/columns
-
-    # Predefined list of letters A-H
-    row = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
-
-    # Create a list of rows that repeats based on num_samples
-    rows = [row[i % len(row)] for i in range(protocol.params.num_samples)]
-
-    # Create a dynamic sample map based on the assigned sample locations
-    sample_map = list(map(lambda i,j :(i,j), rows, sample_locations))
-    s=-1
-    # Iterate over the sample_map list
-    for index, (row, tube) in enumerate(sample_map):
-        s+= 1
-        if index < 8:
-            base_column = 4 + (index // 8)  # This will determine the starting column for each row
-        elif index< 16:
-            base_column = 6 + (index // 8)
-        else:
-            base_column = 8 + (index //8)
 
-        # Load the samples into the temp_adapter
-        sample_name = 'Sample_'+str(index)
-        temp_adapter[tube].load_liquid(liquid=sample_liquids[s], volume=200)  # 20 mg/ml BSA standard
+    def load_samples():
+        for i, well in enumerate(sample_locations):
+            sample_source[well].load_liquid(liquid=sample_liquids[i], volume=200)
 
-        # Prepare destination wells
-        destination_wells = [f'{row}{base_column + (i % 3)}' for i in range(3)]  # Generate wells like A4, A5, A6 or B4, B5, B6, etc.
-        
-        #Transfer the samples onto plate 2
-        p50_multi.distribute(5,
-                        temp_adapter[tube],
-                        [plate2[i].bottom(z=0.1) for i in destination_wells],
-                        rate = speed,
-                        mix_before=(1, 10),
-                        disposal_vol=5)  # Distributing to three consecutive columns
+    def plate_tube_samples(plate, number):
+        layout = plates[number - 1]['map']
+        for i, entry in zip(plates[number - 1]['samples'], layout.samples):
+            tube = sample_locations[i]
+
+            # Triplicate wells from the plate map, like A4, A5, A6 or B4, B5, B6, etc.
+            destination_wells = entry['wells']
+
+            #Transfer the samples onto plate 2
+            p50_multi.distribute(bca['sample'],
+                            temp_adapter[tube],
+                            [plate[i].bottom(z=0.1) for i in destination_wells],
+                            rate = speed,
+                            mix_before=(1, 10),
+                            disposal_vol=5)  # Distributing to three consecutive columns
+
+    load_samples()
+
+    # Tubes hold at most 18 samples, they always fit on one BCA plate
+    if not sample_plate_input:
+        ensure_tips('bca_samples 1')
+        plate_tube_samples(plate2, 1)
 
     # Step 11: move the 50 uL partial tips to C3 and the 200uL complete tips to B3
-    protocol.move_labware(labware=tips_50, new_location="C3", use_gripper=True)
-    protocol.move_labware(labware=tips_1000, new_location="B3", use_gripper=True)
-
-    #Step 9: Load the p50 with full tip rack
-    p50_multi.configure_nozzle_layout(style=ALL, tip_racks=[tips_50]) #, 
-
-    #Step 10: Pipette triplicate of controls from plate1 column 1 to plate2 columns 1,2,3 
-    p50_multi.distribute(5, 
-                        plate1['A1'], 
-                        [plate2[f'A{i}'].bottom(z=0.1) for i in range(1, 4)],
-                        rate= speed,
-                        mix_before=(1, 10),
-                        disposal_vol=5)
-
-    #Step 12: Load the p1000 with full tip rack
-    p1000_multi.configure_nozzle_layout(style=ALL, tip_racks=[tips_1000]) #,
-
-    # Step 13: Add reagent A
-    p1000_multi.distribute(50,
-                        reservoir['A1'],
-                        plate2.wells(),
-                        new_tip='once',
-                        disposal_vol=50)
-
-    # Step 14: Add reagent B
-    p1000_multi.distribute(48,
-                        reservoir['A3'],
-                        plate2.wells(),
-                        new_tip='once',
-                        disposal_vol=50)
-
-    # Step 15: Add reagent c
-    p50_multi.distribute(2,
-                        reservoir['A5'],
-                        plate2.wells(),
-                        new_tip='once',
-                        rate = speed,
-                        mix_after=(2, 10),
-                        disposal_vol=5)
-
-    #Step 16: move plate 2 to the heater shaker and incubate at 37c
-    heater_shaker.open_labware_latch()
-    protocol.move_labware(labware=plate2, new_location=hs_adapter,use_gripper=True)
-    heater_shaker.close_labware_latch()
-    heater_shaker.set_and_wait_for_shake_speed(500)
-    protocol.delay(minutes=10)
-
-    #Step 17 deactivate heater shaker and temp modules
-    heater_shaker.deactivate_shaker()
-    heater_shaker.deactivate_heater()
-    heater_shaker.open_labware_latch()
-
-    # ---------------- Normalizing BCA Assay ----------------
-    protocol.comment("Place BCA assay absorbance data in /var/lib/jupyter/notebooks/TWH, load new deep well plate into flex B2 (where BCA plate was), and new tube rack into A2 (with excess lysis buffer in A1 and empty falcon in A2)")
-
-    # Pause the protocol until the user loads the file to /var/lib/jupyter/notebooks
-    protocol.pause()
-
-    # Tell the robot that new labware will be placed onto the deck
-    protocol.move_labware(labware=plate1, new_location=protocol_api.OFF_DECK)
-    protocol.move_labware(labware=plate2, new_location=protocol_api.OFF_DECK)
-
-    #Move partial_50 tips to A2
-    protocol.move_labware(labware=partial_50, new_location="A2", use_gripper=True)
-    
-    #Configure the p1000 and p50 pipettes to use single tip NOTE: this resets the pipettes tip racks!
-    p1000_multi.configure_nozzle_layout(style=SINGLE, start="A1",tip_racks=[tips_1000])
-    p50_multi.configure_nozzle_layout(style=SINGLE, start="A1", tip_racks=[partial_50]) #, 
+    protocol.move_labware(labware=racks['tips_50'], new_location="C3", use_gripper=True)
+    protocol.move_labware(labware=racks['tips_1000'], new_location="B3", use_gripper=True)
+
+    def plate_bca(plate, number):
+        # Samples of this plate, its standards and the BCA reagents onto the plate in B2
+        samples = plates[number - 1]['samples']
+        layout = plates[number - 1]['map']
+        standards_column = standards_for(plates[number - 1])
+
+        # Tubes of a later batch, with single tips while B3 is still clear
+        if not sample_plate_input and number > 1:
+            p50_multi.configure_nozzle_layout(style=SINGLE, start="A1", tip_racks=[racks['partial_50']])
+            ensure_tips(f'bca_samples {number}')
+            plate_tube_samples(plate, number)
+
+        #Step 9: Load the p50 with full tip rack
+        p50_multi.configure_nozzle_layout(style=ALL, tip_racks=[racks['tips_50']]) #, 
+
+        if sample_plate_input:
+            ensure_tips(f'bca_samples {number}')
+            # Eight samples at a time: each column of the sample plate into the next block of the BCA plate
+            for column, (top_wells, _) in enumerate(layout.sample_blocks()):
+                p50_multi.distribute(bca['sample'],
+                                sample_source[f'A{samples[0]//8 + column + 1}'],
+                                [plate[well].bottom(z=0.1) for well in top_wells],
+                                rate = speed,
+                                mix_before=(1, 10),
+                                disposal_vol=5)
+
+        ensure_tips(f'bca_standards {number}')
+
+        #Step 10: Pipette triplicate of controls from plate1 column 1 to the standards block of the plate map
+        p50_multi.distribute(bca['sample'],
+                            plate1[f'A{standards_column}'], 
+                            [plate[well].bottom(z=0.1) for well in layout.top_wells(0)],
+                            rate= speed,
+                            mix_before=(1, 10),
+                            disposal_vol=5)
+
+        # Back from C4, where it waits while single tips are in use
+        if racks['tips_1000'].parent != 'B3':
+            protocol.move_labware(labware=racks['tips_1000'], new_location="B3", use_gripper=True)
+
+        #Step 12: Load the p1000 with full tip rack
+        p1000_multi.configure_nozzle_layout(style=ALL, tip_racks=[racks['tips_1000']]) #,
+
+        ensure_tips(f'reagent_ab {number}')
+
+        # Step 13: Add reagent A
+        p1000_multi.distribute(bca['reagent_a'],
+                            reservoir['A1'],
+                            plate.wells(),
+                            new_tip='once',
+                            disposal_vol=50)
+
+        # Step 14: Add reagent B
+        p1000_multi.distribute(bca['reagent_b'],
+                            reservoir['A3'],
+                            plate.wells(),
+                            new_tip='once',
+                            disposal_vol=50)
+
+        ensure_tips(f'reagent_c {number}')
+
+        # Step 15: Add reagent c
+        p50_multi.distribute(bca['reagent_c'],
+                            reservoir['A5'],
+                            plate.wells(),
+                            new_tip='once',
+                            rate = speed,
+                            mix_after=(2, 10),
+                            disposal_vol=5)
+
+    def fresh_bca_plate():
+        # A new BCA plate is put in B2 by hand
+        plate = protocol.load_labware(bca['labware'], protocol_api.OFF_DECK)
+        protocol.move_labware(labware=plate, new_location='B2')
+        return plate
+
+    #Step 16: BCA plates incubate for 10 minutes on the heater-shaker, warmed up above, while the
+    # gantry carries on with the next plate. The thermocycler holds plate3, so it is no station here.
+    stations = IncubationStations(protocol)
+    stations.add_heater_shaker(heater_shaker, hs_adapter)
 
      # Define the directory path
     directory = Path("/var/lib/jupyter/notebooks/Data/")
@@ -290,114 +760,216 @@ def run(protocol: protocol_api.ProtocolContext):
     # Get today's date in YYMMDD format
     today_date = datetime.date.today().strftime("%y%m%d")
 
-    # For debugging, change the file from wait_for_file.py to wait_for_file_debug.py
-    find_file = subprocess.Popen(['python3',"/var/lib/jupyter/notebooks/wait_for_file.py"],stdout=subprocess.PIPE,
-        text=True)
-    stdout, stderr = find_file.communicate()
-
-    if stderr:
-        raise ValueError(f"Error while waiting for file: {stderr}")
-
-    # Extract the file path from the output
-    file_path = stdout.splitlines()[1]
-    if not file_path:
-        raise ValueError("No file path returned by wait_for_file.py")
-
-    protocol.comment(f"Successfully loaded: {file_path}")
-    # Read the data file
-    df = pd.read_excel(file_path, header=5, nrows=8, usecols="C:N")
-
-    # Create a list of well names (A1 to H12)
-    well_names = [f"{row}{col}" for col in range(1, 13) for row in "ABCDEFGH"]
-
-    # Flatten the absorbance values into a single list
-    absorbance_values = df.values.flatten()
-
-    # Create the DataFrame
-    initial_df = pd.DataFrame({'Well': well_names, 'Absorbance': absorbance_values})
-
-    # Process data for normalization
-    samples, replicate_1, replicate_2, replicate_3 = [], [], [], []
-    sample_index = 1
-    for col_offset in range(0, 12, 3):  # Iterate by column groups (triplets)
-        for row_offset in range(8):  # Iterate row-wise for each sample
-            start = row_offset * 12 + col_offset  # Starting index for the sample
-            if start + 2 < len(initial_df):
-                samples.append(f"Sample {sample_index}")
-                replicate_1.append(initial_df.iloc[start]['Absorbance'])
-                replicate_2.append(initial_df.iloc[start + 1]['Absorbance'])
-                replicate_3.append(initial_df.iloc[start + 2]['Absorbance'])
-                sample_index += 1
-
-    final_df = pd.DataFrame({
-        'Sample': samples,
-        'Replicate 1': replicate_1,
-        'Replicate 2': replicate_2,
-        'Replicate 3': replicate_3
-    })
-
-    samples_1_to_8 = final_df.iloc[:8]
-    samples_1_to_8['Mean Absorbance'] = samples_1_to_8[['Replicate 1', 'Replicate 2', 'Replicate 3']].mean(axis=1)
-    protein_concentrations = [10, 5, 2.5, 1.25, 0.625, 0.3125, 0.15625, 0]
-    samples_1_to_8['Protein Concentration (mg/mL)'] = protein_concentrations
-
-    slope, intercept = np.polyfit(samples_1_to_8['Protein Concentration (mg/mL)'], samples_1_to_8['Mean Absorbance'], 1)
-    y_pred = slope * samples_1_to_8['Protein Concentration (mg/mL)'] + intercept
-    ss_res = np.sum((samples_1_to_8['Mean Absorbance'] - y_pred) ** 2)
-    ss_tot = np.sum((samples_1_to_8['Mean Absorbance'] - np.mean(samples_1_to_8['Mean Absorbance'])) ** 2)
-    r_squared = 1 - (ss_res / ss_tot)
-
-    unknown_samples = final_df.iloc[8:8 + protocol.params.num_samples]
-    unknown_samples['Mean Absorbance'] = unknown_samples[['Replicate 1', 'Replicate 2', 'Replicate 3']].mean(axis=1)
-    unknown_samples['Protein Concentration (mg/mL)'] = (unknown_samples['Mean Absorbance'] - intercept) / slope
-    unknown_samples['Sample Volume (µL)'] = (target_concentration * protocol.params.final_volume) / unknown_samples['Protein Concentration (mg/mL)']
-    unknown_samples['Diluent Volume (µL)'] = protocol.params.final_volume - unknown_samples['Sample Volume (µL)']
-
-    # Volume check
-    if any(unknown_samples['Sample Volume (µL)'] > protocol.params.final_volume):
-        protocol.comment("One or more samples exceed the maximum allowed volume for dilution.")
-        raise Exception("Aborting protocol: at least one sample volume exceeds the final volume threshold.")
-    unknown_samples.loc[unknown_samples['Sample Volume (µL)'] > protocol.params.final_volume, ['Sample Volume (µL)', 'Diluent Volume (µL)']] = [protocol.params.final_volume, 0]
-    protocol.comment("\nNormalized Unknown Samples (to 1 mg/mL in 500 µL):")
-    normalized_samples = unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Sample Volume (µL)','Diluent Volume (µL)']].reset_index().drop(columns='index')
-
-    # Write the output and image of data plot to the instrument jupyter notebook directory
-    filename = f"Protocol_output_{today_date}.csv"
-    output_file_destination_path = directory.joinpath(filename)
-    normalized_samples.to_csv(output_file_destination_path)
-    print(unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Sample Volume (µL)','Diluent Volume (µL)']])
+    # Normalized samples of the plates read so far, by batch
+    normalized_plates = {}
+
+    # The fit and concentrations of every plate read so far, for WesternBlot_Normalize_Only to start from
+    results_file = directory.joinpath("bca_results", f"{run_id}.json")
+    bca_results = {'run_id': run_id, 'protocol': metadata['protocolName'], 'plates': [], 'samples': []}
+
+    def read_plate(number):
+        # Wait for this plate's reader file and work out the volumes that normalize its samples
+        plate = plates[number - 1]
+        batch = plate['samples']
+
+        # Time each step of the analysis when profiling, see run_telemetry.py
+        profile = telemetry.profile() if telemetry and protocol.params.profile_analysis else None
+
+        def stage(name=None):
+            if profile:
+                profile.stage(name)
+
+        stage('wait for file')
+        # For debugging, change the file from wait_for_file.py to wait_for_file_debug.py
+        find_file = subprocess.Popen(['python3',"/var/lib/jupyter/notebooks/wait_for_file.py"],stdout=subprocess.PIPE,
+            text=True)
+        stdout, stderr = find_file.communicate()
+
+        if stderr:
+            raise ValueError(f"Error while waiting for file: {stderr}")
+
+        # Extract the file path from the output
+        file_path = stdout.splitlines()[1]
+        if not file_path:
+            raise ValueError("No file path returned by wait_for_file.py")
+
+        protocol.comment(f"Successfully loaded: {file_path}")
+        stage('read_excel')
+        # Read the data file
+        df = pd.read_excel(file_path, header=5, nrows=bca['rows'], usecols=bca['reader_columns'])
+
+        stage('replicate loop')
+        # The standards, then the samples in the order they were plated, from their wells in the plate map
+        final_df = plate['map'].read(df)
+
+        stage('standard curve')
+        samples_1_to_8 = final_df.iloc[:8]
+        samples_1_to_8['Mean Absorbance'] = samples_1_to_8[['Replicate 1', 'Replicate 2', 'Replicate 3']].mean(axis=1)
+        protein_concentrations = [10, 5, 2.5, 1.25, 0.625, 0.3125, 0.15625, 0]
+        samples_1_to_8['Protein Concentration (mg/mL)'] = protein_concentrations
+
+        slope, intercept = np.polyfit(samples_1_to_8['Protein Concentration (mg/mL)'], samples_1_to_8['Mean Absorbance'], 1)
+        y_pred = slope * samples_1_to_8['Protein Concentration (mg/mL)'] + intercept
+        ss_res = np.sum((samples_1_to_8['Mean Absorbance'] - y_pred) ** 2)
+        ss_tot = np.sum((samples_1_to_8['Mean Absorbance'] - np.mean(samples_1_to_8['Mean Absorbance'])) ** 2)
+        r_squared = 1 - (ss_res / ss_tot)
+
+        stage('normalization volumes')
+        unknown_samples = final_df.iloc[8:8 + len(batch)]
+        unknown_samples['Mean Absorbance'] = unknown_samples[['Replicate 1', 'Replicate 2', 'Replicate 3']].mean(axis=1)
+        unknown_samples['Protein Concentration (mg/mL)'] = (unknown_samples['Mean Absorbance'] - intercept) / slope
+        unknown_samples['Sample Volume (µL)'] = (target_concentration * protocol.params.final_volume) / unknown_samples['Protein Concentration (mg/mL)']
+        unknown_samples['Diluent Volume (µL)'] = protocol.params.final_volume - unknown_samples['Sample Volume (µL)']
+
+        # Volume check
+        if any(unknown_samples['Sample Volume (µL)'] > protocol.params.final_volume):
+            protocol.comment("One or more samples exceed the maximum allowed volume for dilution.")
+            raise Exception("Aborting protocol: at least one sample volume exceeds the final volume threshold.")
+        unknown_samples.loc[unknown_samples['Sample Volume (µL)'] > protocol.params.final_volume, ['Sample Volume (µL)', 'Diluent Volume (µL)']] = [protocol.params.final_volume, 0]
+        protocol.comment("\nNormalized Unknown Samples (to 1 mg/mL in 500 µL):")
+        normalized_samples = unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Sample Volume (µL)','Diluent Volume (µL)']].reset_index().drop(columns='index')
+        if history:
+            history.add_plate(file_path, df, (slope, intercept, r_squared), unknown_samples, plate['batch'])
+        normalized_plates.setdefault(plate['batch'], []).append(normalized_samples)
+
+        stage('to_csv')
+        # Write the output and image of data plot to the instrument jupyter notebook directory, every plate
+        # of the batch read so far, in a file per batch when batches are queued
+        filename = f"Protocol_output_{today_date}.csv" if protocol.params.queued_batches == 1 else f"Protocol_output_{today_date}_batch{plate['batch']}.csv"
+        output_file_destination_path = directory.joinpath(filename)
+        pd.concat(normalized_plates[plate['batch']], ignore_index=True).to_csv(output_file_destination_path)
+        bca_results['plates'].append({'plate': number, 'batch': plate['batch'], 'data_file': str(file_path),
+                                      'slope': float(slope), 'intercept': float(intercept), 'r_squared': float(r_squared)})
+        bca_results['samples'] += [{'sample': row['Sample'], 'batch': plate['batch'], 'plate': number, 'mean_absorbance': float(row['Mean Absorbance']),
+                                    'concentration_mg_ml': float(row['Protein Concentration (mg/mL)'])} for _, row in unknown_samples.iterrows()]
+        bca_results['written'] = datetime.datetime.now().isoformat(timespec='seconds')
+        if not protocol.is_simulating():
+            results_file.parent.mkdir(parents=True, exist_ok=True)
+            results_file.write_text(json.dumps(bca_results, indent=2))
+            protocol.comment(f"BCA results saved as run {run_id}")
+        stage()
+        print(unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Sample Volume (µL)','Diluent Volume (µL)']])
+        return normalized_samples
 
     # Dilute sample in lysis buffer to 1 mg/ml on deep well plate
     rows = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
-    destination_wells  = [f'{rows[i % 8]}{(i // 8)+ 1}' for i in range(len(normalized_samples))]
-
-    for i, row in normalized_samples.iterrows():
-        source_well = sample_locations[i]
-        normalized_volume = row['Sample Volume (µL)']
-        diluent_volume = protocol.params.final_volume - normalized_volume
-        destination_well = destination_wells[i]
-        p50_multi.transfer(normalized_volume, 
-                    temp_adapter[source_well], 
-                    plate3[destination_well], 
-                    rate=0.5, 
-                    new_tip='once')
-        p50_multi.transfer(diluent_volume, 
-                    reservoir['A7'], 
-                    plate3[destination_well], 
-                    rate=0.5, 
+    destination_wells  = [f'{rows[i % 8]}{(i // 8)+ 1}' for i in range(protocol.params.num_samples)]
+
+    def normalize(number, normalized_samples):
+        samples = plates[number - 1]['samples']
+
+        # Lysis buffer goes into the empty wells first, so one tip does every well
+        ensure_tips(f'diluent {number}')
+        p50_multi.transfer([protocol.params.final_volume - volume for volume in normalized_samples['Sample Volume (µL)']],
+                    reservoir['A7'],
+                    [plate3[destination_wells[i]] for i in samples],
+                    rate=0.5,
                     new_tip='once')
-    # Add loading buffer
-    p50_multi.distribute(protocol.params.final_volume/3,
-                    temp_adapter['A2'],
-                    [plate3[well] for well in destination_wells],
-                    rate=speed,
-                    mix_after=(3, 10),
-                    disposal_vol=1,
-                    new_tip='always')
-
-    # Step 3: Run thermocycling conditions
-    thermocycler.close_lid()
-    thermocycler.set_lid_temperature(70)
-    protocol.comment('Running thermocycler for 10 minutes')
-    thermocycler.set_block_temperature(70,block_max_volume=30, hold_time_minutes=10)
-    thermocycler.set_block_temperature(4)  # Hold at 4°C
+
+        ensure_tips(f'normalization {number}')
+        for i, (_, row) in zip(samples, normalized_samples.iterrows()):
+            source_well = sample_locations[i]
+            normalized_volume = row['Sample Volume (µL)']
+            destination_well = destination_wells[i]
+            p50_multi.transfer(normalized_volume, 
+                        sample_source[source_well], 
+                        plate3[destination_well], 
+                        rate=0.5, 
+                        new_tip='once')
+
+    def finish_batch(batch):
+        ensure_tips(f'loading_buffer {batch}')
+        # Add loading buffer
+        p50_multi.distribute(protocol.params.final_volume/3,
+                        temp_adapter['A2'],
+                        [plate3[well] for well in destination_wells],
+                        rate=speed,
+                        mix_after=(3, 10),
+                        disposal_vol=1,
+                        new_tip='always')
+
+        # Step 3: Run thermocycling conditions
+        thermocycler.close_lid()
+        thermocycler.set_lid_temperature(70)
+        protocol.comment('Running thermocycler for 10 minutes')
+        thermocycler.set_block_temperature(70,block_max_volume=30, hold_time_minutes=10)
+        thermocycler.set_block_temperature(4)  # Hold at 4°C
+
+    bca_plates = [plate2]
+    plate_bca(plate2, 1)
+    incubation = stations.start(plate2, minutes=10, rpm=500)
+
+    for number, plate in enumerate(plates, start=1):
+        last = number == len(plates)
+        #Step 17 stop the heater-shaker, the heater stays on for the next plate
+        stations.finish(incubation, heater_off=last)
+
+        if last:
+            # ---------------- Normalizing BCA Assay ----------------
+            protocol.comment("Place BCA assay absorbance data in /var/lib/jupyter/notebooks/TWH, load new deep well plate into flex B2 (where BCA plate was), and new tube rack into A2 (with excess lysis buffer in A1 and empty falcon in A2)")
+
+            # Pause the protocol until the user loads the file to /var/lib/jupyter/notebooks
+            protocol.pause()
+
+            # Tell the robot that new labware will be placed onto the deck
+            protocol.move_labware(labware=plate1, new_location=protocol_api.OFF_DECK)
+            protocol.move_labware(labware=bca_plates[-1], new_location=protocol_api.OFF_DECK)
+        else:
+            # This plate goes to the reader; within a batch a fresh BCA plate is plated and incubated in its place
+            protocol.comment(f"Take BCA plate {number} to the plate reader" + ("" if plate['last'] else " and put a fresh BCA plate in B2"))
+            protocol.move_labware(labware=bca_plates[-1], new_location=protocol_api.OFF_DECK)
+            if not plate['last']:
+                bca_plates.append(fresh_bca_plate())
+                plate_bca(bca_plates[-1], number + 1)
+                incubation = stations.start(bca_plates[-1], minutes=10, rpm=500)
+
+        # A single nozzle cannot reach the sample plate on the magnetic block in D2, it moves into B2
+        if sample_plate_input:
+            protocol.move_labware(labware=sample_source, new_location='B2', use_gripper=True)
+
+        if last:
+            #Move partial_50 tips to A2
+            protocol.move_labware(labware=racks['partial_50'], new_location="A2", use_gripper=True)
+        elif racks['tips_1000'].parent == 'B3':
+            # plate1 keeps A2 for the next standards, the single nozzle reaches partial_50 in A3 only with B3 clear
+            protocol.move_labware(labware=racks['tips_1000'], new_location="C4", use_gripper=True)
+        
+        #Configure the p1000 and p50 pipettes to use single tip NOTE: this resets the pipettes tip racks!
+        p1000_multi.configure_nozzle_layout(style=SINGLE, start="A1",tip_racks=[racks['tips_1000']])
+        p50_multi.configure_nozzle_layout(style=SINGLE, start="A1", tip_racks=[racks['partial_50']]) #, 
+
+        normalize(number, read_plate(number))
+
+        if not plate['last']:
+            # The next fresh BCA plate goes into B2
+            if sample_plate_input:
+                protocol.move_labware(labware=sample_source, new_location=mag_block, use_gripper=True)
+            continue
+
+        finish_batch(plate['batch'])
+        if last:
+            break
+
+        # ---------------- Next batch in the queue ----------------
+        # The normalized plate and the samples make way for the next batch, plate1 and its standards stay
+        protocol.comment(f"Batch {plate['batch']} is done. Swap in batch {plate['batch'] + 1}: a new PCR plate in the thermocycler, "
+                         f"the new samples, a filled reservoir in C2, a full loading buffer tube in A2 of the cold block and a fresh BCA plate in B2")
+        thermocycler.open_lid()
+        protocol.move_labware(labware=plate3, new_location=protocol_api.OFF_DECK)
+        plate3 = protocol.load_labware('nest_96_wellplate_100ul_pcr_full_skirt', protocol_api.OFF_DECK)
+        protocol.move_labware(labware=plate3, new_location=thermocycler)
+        if sample_plate_input:
+            protocol.move_labware(labware=sample_source, new_location=protocol_api.OFF_DECK)
+            sample_source = protocol.load_labware('opentrons_96_wellplate_200ul_pcr_full_skirt', protocol_api.OFF_DECK)
+            protocol.move_labware(labware=sample_source, new_location=mag_block)
+        else:
+            protocol.pause(f"Replace the sample tubes in B1-D6 of the cold block with batch {plate['batch'] + 1}")
+        load_samples()
+        protocol.move_labware(labware=reservoir, new_location=protocol_api.OFF_DECK)
+        reservoir = protocol.load_labware('nest_12_reservoir_15ml', protocol_api.OFF_DECK)
+        protocol.move_labware(labware=reservoir, new_location='C2')
+        fill_reservoir()
+        temp_adapter['A2'].load_liquid(liquid=loading_buffer, volume=1000)
+        bca_plates.append(fresh_bca_plate())
+        plate_bca(bca_plates[-1], number + 1)
+        incubation = stations.start(bca_plates[-1], minutes=10, rpm=500)
@@ -2,12 +2,117 @@ from opentrons import protocol_api
 from opentrons.protocol_api import SINGLE, ALL
 import pandas as pd
 import numpy as np
+import math
 import subprocess
 from pathlib import Path
 #import matplotlib.pyplot as plt
 import datetime
+import json
 import time
 import re
+import sys
+
+# Per-step timing log for live runs, see run_telemetry.py
+sys.path.append("/var/lib/jupyter/notebooks")
+try:
+    import run_telemetry
+except ImportError:
+    run_telemetry = None
+
+# History of every run's normalization results, see run_history.py
+try:
+    import run_history
+except ImportError:
+    run_history = None
+
+# Wells of the standards and samples on the BCA plate, see plate_map.py
+# ---- plate_map.py (copied by shared_code.py, edit plate_map.py instead) ----
+# Rows and columns of each plate format
+FORMATS = {'96': (8, 12), '384': (16, 24)}
+CHANNELS = 8
+
+
+class PlateMap:
+    """Standards and samples of one plate, each with its replicate wells."""
+
+    def __init__(self, plate, replicates, standards, samples):
+        self.plate = plate
+        self.rows, self.columns = FORMATS[plate]
+        self.replicates = replicates
+        self.row_names = [chr(ord('A') + i) for i in range(self.rows)]
+        step = self.rows // CHANNELS
+        # (first row, first column) of every block, in the order they are filled
+        self.blocks = [(offset, column) for column in range(1, self.columns - replicates + 2, replicates) for offset in range(step)]
+        standard_blocks = math.ceil(len(standards)/CHANNELS)
+        if len(samples) > (len(self.blocks) - standard_blocks)*CHANNELS:
+            raise Exception(f"A {plate}-well plate holds {(len(self.blocks) - standard_blocks)*CHANNELS} samples in {replicates}s next to the standards.")
+        self.standards = [self._entry(name, i) for i, name in enumerate(standards)]
+        self.samples = [self._entry(name, standard_blocks*CHANNELS + i) for i, name in enumerate(samples)]
+
+    def _entry(self, name, position):
+        block, row = divmod(position, CHANNELS)
+        offset, column = self.blocks[block]
+        row_name = self.row_names[offset + row*(self.rows // CHANNELS)]
+        return {'name': name, 'block': block, 'wells': [f"{row_name}{column + i}" for i in range(self.replicates)]}
+
+    def wells(self, name):
+        """Replicate wells of a standard or sample."""
+        for entry in self.standards + self.samples:
+            if entry['name'] == name:
+                return entry['wells']
+        raise KeyError(name)
+
+    def top_wells(self, block):
+        """Wells the first nozzle of an 8-channel goes to for each replicate column of a block."""
+        offset, column = self.blocks[block]
+        return [f"{self.row_names[offset]}{column + i}" for i in range(self.replicates)]
+
+    def sample_blocks(self):
+        """(top wells, samples) of every block that holds samples, in plating order."""
+        blocks = {}
+        for entry in self.samples:
+            blocks.setdefault(entry['block'], []).append(entry)
+        return [(self.top_wells(block), entries) for block, entries in blocks.items()]
+
+    def read(self, block):
+        """Replicates of the standards, then the samples, from a reader block of rows x columns."""
+        values = pd.DataFrame(block).values
+        table = {'Sample': []}
+        table.update({f'Replicate {i + 1}': [] for i in range(self.replicates)})
+        for entry in self.standards + self.samples:
+            table['Sample'].append(entry['name'])
+            for i, well in enumerate(entry['wells']):
+                table[f'Replicate {i + 1}'].append(values[self.row_names.index(well[0]), int(well[1:]) - 1])
+        return pd.DataFrame(table)
+
+    def grid(self):
+        """The plate as text, a short label per well."""
+        labels = {}
+        for i, entry in enumerate(self.standards):
+            labels.update({well: f"S{i + 1}" for well in entry['wells']})
+        for i, entry in enumerate(self.samples):
+            labels.update({well: str(i + 1) for well in entry['wells']})
+        lines = ["   " + "".join(f"{column:>4}" for column in range(1, self.columns + 1))]
+        for row in self.row_names:
+            lines.append(f"{row:<3}" + "".join(f"{labels.get(f'{row}{column}', '.'):>4}" for column in range(1, self.columns + 1)))
+        return "\n".join(lines)
+
+
+def capacity(plate='96', replicates=3, standards=8):
+    """Samples one plate holds next to the standards."""
+    rows, columns = FORMATS[plate]
+    blocks = (rows // CHANNELS)*len(range(1, columns - replicates + 2, replicates))
+    return (blocks - math.ceil(standards/CHANNELS))*CHANNELS
+
+
+def compile_map(samples, plate='96', replicates=3, standards=8):
+    """Plate map for sample names (or a number of samples) and standards (names or a number)."""
+    if isinstance(samples, int):
+        samples = [f"Sample {i + 1}" for i in range(samples)]
+    if isinstance(standards, int):
+        standards = [f"Standard {i + 1}" for i in range(standards)]
+    return PlateMap(str(plate), replicates, list(standards), list(samples))
+# ---- end of plate_map.py ----
 
 metadata = {
     'protocolName': 'BCA Normalization Only for Western Blotting',
@@ -28,7 +133,7 @@ def add_parameters(parameters):
         description="Number of input samples to be tested for mycoplasma.",
         default=8,
         minimum=1,
-        maximum=24
+        maximum=18
     )
     parameters.add_int(
         variable_name="standards_col",
@@ -57,14 +162,67 @@ def add_parameters(parameters):
         maximum=100,
         unit="µL"
     )
+    parameters.add_str(
+        variable_name="concentrations",
+        display_name="Concentrations from",
+        description="Read and fit a plate reader file, or load the results of an earlier BCA run",
+        choices=[
+            {"display_name": "Plate reader file", "value": "reader"},
+            {"display_name": "BCA run results", "value": "results"}
+        ],
+        default="reader"
+    )
+    parameters.add_int(
+        variable_name="bca_run_id",
+        display_name="BCA run ID",
+        description="Run ID of the BCA results as yymmddHHMMSS, 0 for the most recent",
+        default=0,
+        minimum=0,
+        maximum=999999999999
+    )
+    parameters.add_int(
+        variable_name="bca_batch",
+        display_name="BCA batch",
+        description="Batch of the BCA run whose samples these are, for runs of queued batches",
+        default=1,
+        minimum=1,
+        maximum=6
+    )
+    parameters.add_bool(
+        variable_name="profile_analysis",
+        display_name="Profile analysis",
+        description="Log the time and peak memory of each step of the plate reader analysis",
+        default=False
+    )
 
 def run(protocol: protocol_api.ProtocolContext):
+    telemetry = run_telemetry.instrument(protocol, metadata['protocolName']) if run_telemetry else None
+    history = run_history.start(protocol, metadata['protocolName'], telemetry.run_id if telemetry else None) if run_history else None
     protocol.comment("Running the Normalization of BCA Assay")
 
     #Edit these
     target_concentration = protocol.params.ug_protein/protocol.params.final_volume # 40 ug protein/ 15 uL final volume
     speed= 0.35
 
+    # The BCA protocols leave their concentrations in Data/bca_results/<run ID>.json. Starting from
+    # them skips the plate reader file and the standard curve; they are loaded before anything moves.
+    bca_results = None
+    if protocol.params.concentrations == 'results':
+        results_directory = Path("/var/lib/jupyter/notebooks/Data/bca_results")
+        if protocol.params.bca_run_id:
+            bca_run = f"{protocol.params.bca_run_id:012d}"
+            results_file = results_directory.joinpath(f"{bca_run[:6]}-{bca_run[6:]}.json")
+        else:
+            # Run IDs sort by date and time
+            results_file = max(results_directory.glob("*.json"), default=results_directory.joinpath("(none)"))
+        if not results_file.exists():
+            raise Exception(f"No BCA results at {results_file}")
+        bca_results = json.loads(results_file.read_text())
+        batch = [sample for sample in bca_results['samples'] if sample['batch'] == protocol.params.bca_batch]
+        if len(batch) != protocol.params.num_samples:
+            raise Exception(f"BCA run {bca_results['run_id']} has {len(batch)} samples in batch {protocol.params.bca_batch}, not {protocol.params.num_samples}")
+        protocol.comment(f"Using the concentrations of BCA run {bca_results['run_id']} ({bca_results['protocol']}), batch {protocol.params.bca_batch}")
+
     # Load modules
     heater_shaker = protocol.load_module('heaterShakerModuleV1', 'D1')
     thermocycler = protocol.load_module('thermocyclerModuleV2')
@@ -125,37 +283,19 @@ def run(protocol: protocol_api.ProtocolContext):
             sample_locations.append(f'C{i - 5}')
         elif i < 18:  # D1 to D6
             sample_locations.append(f'D{i - 11}')
-        else:
-            break  # Stop if we exceed the number of available rows/columns
-
-    # Predefined list of letters A-H
-    row = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
-
-    # Create a list of rows that repeats based on num_samples
-    rows = [row[i % len(row)] for i in range(protocol.params.num_samples)]
-
-    # Create a dynamic sample map based on the assigned sample locations
-    sample_map = list(map(lambda i,j :(i,j), rows, sample_locations))
-    s=-1
-    # Iterate over the sample_map list
-    for index, (row, tube) in enumerate(sample_map):
-        s+= 1
-        if index < 8:
-            base_column = 4 + (index // 8)  # This will determine the starting column for each row
-        elif index< 16:
-            base_column = 6 + (index // 8)
-        else:
-            base_column = 8 + (index //8)
 
-        # Load the samples into the temp_adapter
-        sample_name = 'Sample_'+str(index)
-        temp_adapter[tube].load_liquid(liquid=sample_liquids[s], volume=200)  # 20 mg/ml BSA standard
+    # Load the samples into the temp_adapter
+    for liquid, tube in zip(sample_liquids, sample_locations):
+        temp_adapter[tube].load_liquid(liquid=liquid, volume=200)
+
+    # The BCA plate was laid out by the BCA protocol's plate map, the reader file is read with the same map
+    bca_map = compile_map([f"Sample {9 + i}" for i in range(protocol.params.num_samples)])
 
-        # Prepare destination wells
-        destination_wells = [f'{row}{base_column + (i % 3)}' for i in range(3)]  # Generate wells like A4, A5, A6 or B4, B5, B6, etc.
-      
     # ---------------- Normalizing BCA Assay ----------------
-    protocol.comment("Place BCA assay absorbance data in /var/lib/jupyter/notebooks/TWH, load new deep well plate into flex B2 (where BCA plate was), and new tube rack into A2 (with excess lysis buffer in A1 and empty falcon in A2)")
+    if bca_results:
+        protocol.comment("Load new deep well plate into flex B2 (where BCA plate was), and new tube rack into A2 (with excess lysis buffer in A1 and empty falcon in A2)")
+    else:
+        protocol.comment("Place BCA assay absorbance data in /var/lib/jupyter/notebooks/TWH, load new deep well plate into flex B2 (where BCA plate was), and new tube rack into A2 (with excess lysis buffer in A1 and empty falcon in A2)")
 
     # Pause the protocol until the user loads the file to /var/lib/jupyter/notebooks
     protocol.pause()
@@ -177,66 +317,57 @@ def run(protocol: protocol_api.ProtocolContext):
     # Get today's date in YYMMDD format
     today_date = datetime.date.today().strftime("%y%m%d")
 
-    # For debugging, change the file from wait_for_file.py to wait_for_file_debug.py
-    find_file = subprocess.Popen(['python3',"/var/lib/jupyter/notebooks/wait_for_file.py"],stdout=subprocess.PIPE,
-        text=True)
-    stdout, stderr = find_file.communicate()
-
-    if stderr:
-        raise ValueError(f"Error while waiting for file: {stderr}")
-
-    # Extract the file path from the output
-    file_path = stdout.splitlines()[1]
-    if not file_path:
-        raise ValueError("No file path returned by wait_for_file.py")
-
-    protocol.comment(f"Successfully loaded: {file_path}")
-    # Read the data file
-    df = pd.read_excel(file_path, header=5, nrows=8, usecols="C:N")
-
-    # Create a list of well names (A1 to H12)
-    well_names = [f"{row}{col}" for col in range(1, 13) for row in "ABCDEFGH"]
-
-    # Flatten the absorbance values into a single list
-    absorbance_values = df.values.flatten()
-
-    # Create the DataFrame
-    initial_df = pd.DataFrame({'Well': well_names, 'Absorbance': absorbance_values})
-
-    # Process data for normalization
-    samples, replicate_1, replicate_2, replicate_3 = [], [], [], []
-    sample_index = 1
-    for col_offset in range(0, 12, 3):  # Iterate by column groups (triplets)
-        for row_offset in range(8):  # Iterate row-wise for each sample
-            start = row_offset * 12 + col_offset  # Starting index for the sample
-            if start + 2 < len(initial_df):
-                samples.append(f"Sample {sample_index}")
-                replicate_1.append(initial_df.iloc[start]['Absorbance'])
-                replicate_2.append(initial_df.iloc[start + 1]['Absorbance'])
-                replicate_3.append(initial_df.iloc[start + 2]['Absorbance'])
-                sample_index += 1
-
-    final_df = pd.DataFrame({
-        'Sample': samples,
-        'Replicate 1': replicate_1,
-        'Replicate 2': replicate_2,
-        'Replicate 3': replicate_3
-    })
-
-    samples_1_to_8 = final_df.iloc[:8]
-    samples_1_to_8['Mean Absorbance'] = samples_1_to_8[['Replicate 1', 'Replicate 2', 'Replicate 3']].mean(axis=1)
-    protein_concentrations = [10, 5, 2.5, 1.25, 0.625, 0.3125, 0.15625, 0]
-    samples_1_to_8['Protein Concentration (mg/mL)'] = protein_concentrations
-
-    slope, intercept = np.polyfit(samples_1_to_8['Protein Concentration (mg/mL)'], samples_1_to_8['Mean Absorbance'], 1)
-    y_pred = slope * samples_1_to_8['Protein Concentration (mg/mL)'] + intercept
-    ss_res = np.sum((samples_1_to_8['Mean Absorbance'] - y_pred) ** 2)
-    ss_tot = np.sum((samples_1_to_8['Mean Absorbance'] - np.mean(samples_1_to_8['Mean Absorbance'])) ** 2)
-    r_squared = 1 - (ss_res / ss_tot)
-
-    unknown_samples = final_df.iloc[8:8 + protocol.params.num_samples]
-    unknown_samples['Mean Absorbance'] = unknown_samples[['Replicate 1', 'Replicate 2', 'Replicate 3']].mean(axis=1)
-    unknown_samples['Protein Concentration (mg/mL)'] = (unknown_samples['Mean Absorbance'] - intercept) / slope
+    # Time each step of the analysis when profiling, see run_telemetry.py
+    profile = telemetry.profile() if telemetry and protocol.params.profile_analysis else None
+
+    def stage(name=None):
+        if profile:
+            profile.stage(name)
+
+    if bca_results:
+        stage('normalization volumes')
+        unknown_samples = pd.DataFrame({'Sample': [sample['sample'] for sample in batch],
+                                        'Protein Concentration (mg/mL)': [sample['concentration_mg_ml'] for sample in batch]})
+    else:
+        stage('wait for file')
+        # For debugging, change the file from wait_for_file.py to wait_for_file_debug.py
+        find_file = subprocess.Popen(['python3',"/var/lib/jupyter/notebooks/wait_for_file.py"],stdout=subprocess.PIPE,
+            text=True)
+        stdout, stderr = find_file.communicate()
+
+        if stderr:
+            raise ValueError(f"Error while waiting for file: {stderr}")
+
+        # Extract the file path from the output
+        file_path = stdout.splitlines()[1]
+        if not file_path:
+            raise ValueError("No file path returned by wait_for_file.py")
+
+        protocol.comment(f"Successfully loaded: {file_path}")
+        stage('read_excel')
+        # Read the data file
+        df = pd.read_excel(file_path, header=5, nrows=8, usecols="C:N")
+
+        stage('replicate loop')
+        # The standards, then the samples in the order they were plated, from their wells in the plate map
+        final_df = bca_map.read(df)
+
+        stage('standard curve')
+        samples_1_to_8 = final_df.iloc[:8]
+        samples_1_to_8['Mean Absorbance'] = samples_1_to_8[['Replicate 1', 'Replicate 2', 'Replicate 3']].mean(axis=1)
+        protein_concentrations = [10, 5, 2.5, 1.25, 0.625, 0.3125, 0.15625, 0]
+        samples_1_to_8['Protein Concentration (mg/mL)'] = protein_concentrations
+
+        slope, intercept = np.polyfit(samples_1_to_8['Protein Concentration (mg/mL)'], samples_1_to_8['Mean Absorbance'], 1)
+        y_pred = slope * samples_1_to_8['Protein Concentration (mg/mL)'] + intercept
+        ss_res = np.sum((samples_1_to_8['Mean Absorbance'] - y_pred) ** 2)
+        ss_tot = np.sum((samples_1_to_8['Mean Absorbance'] - np.mean(samples_1_to_8['Mean Absorbance'])) ** 2)
+        r_squared = 1 - (ss_res / ss_tot)
+
+        stage('normalization volumes')
+        unknown_samples = final_df.iloc[8:8 + protocol.params.num_samples]
+        unknown_samples['Mean Absorbance'] = unknown_samples[['Replicate 1', 'Replicate 2', 'Replicate 3']].mean(axis=1)
+        unknown_samples['Protein Concentration (mg/mL)'] = (unknown_samples['Mean Absorbance'] - intercept) / slope
     unknown_samples['Sample Volume (µL)'] = (target_concentration * protocol.params.final_volume) / unknown_samples['Protein Concentration (mg/mL)']
     unknown_samples['Diluent Volume (µL)'] = protocol.params.final_volume - unknown_samples['Sample Volume (µL)']
 
@@ -247,11 +378,15 @@ def run(protocol: protocol_api.ProtocolContext):
     unknown_samples.loc[unknown_samples['Sample Volume (µL)'] > protocol.params.final_volume, ['Sample Volume (µL)', 'Diluent Volume (µL)']] = [protocol.params.final_volume, 0]
     protocol.comment("\nNormalized Unknown Samples (to 1 mg/mL in 500 µL):")
     normalized_samples = unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Sample Volume (µL)','Diluent Volume (µL)']].reset_index().drop(columns='index')
+    if history and not bca_results:
+        history.add_plate(file_path, df, (slope, intercept, r_squared), unknown_samples)
 
+    stage('to_csv')
     # Write the output and image of data plot to the instrument jupyter notebook directory
     filename = f"Protocol_output_{today_date}.csv"
     output_file_destination_path = directory.joinpath(filename)
     normalized_samples.to_csv(output_file_destination_path)
+    stage()
     print(unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Sample Volume (µL)','Diluent Volume (µL)']])
 
     # Dilute sample in lysis buffer to 1 mg/ml on deep well plate
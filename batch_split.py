@@ -0,0 +1,241 @@
+"""Split a large batch of samples over several Flex robots.
+
+A sample manifest (a CSV with one row per sample, named in a `sample` column or else the
+first column) is cut into consecutive runs of a protocol, each within the protocol's
+num_samples range, and the runs are shared out so every robot is done at about the same
+time. Run times come from traces of the protocol at every sample count, with the
+measured timings of duration_calibration.json when there is one (see duration_model.py).
+Every run gets its parameter set and a deck sheet, and the normalization tables the runs
+write are merged back into one table in manifest order:
+
+    python batch_split.py plan study.csv WesternBlot_BCA_Normalize_04302025.py sample_input=plate --robots 3
+    python batch_split.py merge batch_split/plan.json robot1-run1=robot1/Protocol_output_250301.csv ...
+    python batch_split.py simulate batch_split/plan.json
+
+simulate traces all runs at once, one process per run standing in for the robots, merges
+the tables they write and compares the busiest robot with one robot doing every run.
+"""
+import argparse
+import json
+import math
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+import cost_model
+import duration_model
+import protocol_recorder
+import trace_cache
+
+OUTPUT = Path("batch_split")
+
+
+def read_manifest(path):
+    """The manifest with the sample names in a first column called sample."""
+    manifest = pd.read_csv(path, dtype=str).dropna(how="all")
+    named = [column for column in manifest.columns if column.strip().lower() == "sample"]
+    column = named[0] if named else manifest.columns[0]
+    manifest = manifest.rename(columns={column: "sample"})
+    return manifest[["sample"] + [name for name in manifest.columns if name != "sample"]].reset_index(drop=True)
+
+
+def run_times(path, params=None, calibration=None):
+    """Predicted seconds of one run for every num_samples the protocol takes, None where it refuses the count."""
+    module = protocol_recorder.load_protocol(path)
+    parameters = protocol_recorder.Parameters()
+    if hasattr(module, "add_parameters"):
+        module.add_parameters(parameters)
+    if "num_samples" not in parameters.ranges:
+        raise Exception(f"{Path(path).name} has no num_samples parameter to split on")
+    minimum, maximum = parameters.ranges["num_samples"]
+    times = {}
+    for n in range(minimum, maximum + 1):
+        try:
+            protocol = trace_cache.cached_trace(path, dict(params or {}, num_samples=n))
+        except Exception:
+            times[n] = None
+        else:
+            times[n] = duration_model.predict(protocol.records, calibration)["expected"]
+    return times
+
+
+def _one_robot(count, times):
+    """For every sample count up to count, the quickest way one robot runs them back to back: (seconds, run sizes)."""
+    best = [(0, [])] + [(math.inf, [])]*count
+    for total in range(1, count + 1):
+        for n, seconds in times.items():
+            if seconds is None or n > total or best[total - n][0] + seconds >= best[total][0]:
+                continue
+            best[total] = (best[total - n][0] + seconds, best[total - n][1] + [n])
+    return best
+
+
+def split(count, robots, times):
+    """Run sizes per robot for count samples, consecutive in the manifest, with the longest robot as short as possible."""
+    single = _one_robot(count, times)
+    if single[count][0] == math.inf:
+        raise Exception(f"No combination of runs covers {count} samples")
+    # longest[r][s]: the busiest of r robots sharing the first s samples, and the samples the last of them takes
+    longest = [[(0, 0)] + [(math.inf, 0)]*count]
+    for _ in range(robots):
+        row = []
+        for total in range(count + 1):
+            row.append(min((max(longest[-1][total - own][0], single[own][0]), own) for own in range(total + 1)))
+        longest.append(row)
+    shares = []
+    total = count
+    for row in reversed(longest[1:]):
+        own = row[total][1]
+        shares.append(single[own][1])
+        total -= own
+    return list(reversed(shares)), single[count][0]
+
+
+def plan(manifest_path, path, robots, params=None, calibration=None):
+    """Runs per robot with their parameters, samples and predicted times."""
+    manifest = read_manifest(manifest_path)
+    times = run_times(path, params, calibration)
+    shares, one_robot = split(len(manifest), robots, times)
+    planned = {"protocol": str(path), "manifest": str(manifest_path), "params": params or {}, "robots": [],
+               "one_robot_seconds": one_robot}
+    start = 0
+    for robot, sizes in enumerate(shares, start=1):
+        runs = []
+        for number, n in enumerate(sizes, start=1):
+            runs.append({"id": f"robot{robot}-run{number}", "params": dict(params or {}, num_samples=n),
+                         "samples": list(manifest["sample"][start:start + n]), "predicted_seconds": times[n]})
+            start += n
+        planned["robots"].append({"robot": robot, "runs": runs, "predicted_seconds": sum(run["predicted_seconds"] for run in runs)})
+    planned["longest_seconds"] = max(robot["predicted_seconds"] for robot in planned["robots"])
+    return planned
+
+
+def deck_sheet(path, run):
+    """What to put where for one run, with the manifest samples in their wells."""
+    records = trace_cache.cached_trace(path, run["params"]).records
+    minutes = cost_model.format_minutes
+    shown = ", ".join(f"{name}={value}" for name, value in run["params"].items())
+    lines = [f"{run['id']}: {Path(path).name}", f"Parameters: {shown}",
+             f"Predicted {minutes(run['predicted_seconds'])} min for {len(run['samples'])} samples"]
+    sections = {"Modules": [], "Pipettes": [], "Labware": [], "Liquids": [], "Samples": []}
+    for record in records:
+        if record["call"] == "load_module":
+            sections["Modules"].append(f"{record['location']:<6}{record['module']}")
+        elif record["call"] == "load_instrument":
+            sections["Pipettes"].append(f"{record['mount']:<6}{record['instrument']}")
+        elif record["call"] == "load_labware":
+            sections["Labware"].append(f"{record['location']}: {record['load_name']}")
+        elif record["call"] == "load_liquid":
+            name = record["liquid"]
+            if name.startswith("Sample ") and name[7:].isdigit() and int(name[7:]) <= len(run["samples"]):
+                sections["Samples"].append(f"{record['well']}: {run['samples'][int(name[7:]) - 1]} ({name}), {record['volume']:g} µL")
+            else:
+                sections["Liquids"].append(f"{record['well']}: {name}, {record['volume']:g} µL")
+    for title, entries in sections.items():
+        if entries:
+            lines += [title] + [f"  {entry}" for entry in entries]
+    return "\n".join(lines)
+
+
+def merge(planned, outputs):
+    """One table of every run's output rows, named after the manifest samples they belong to.
+
+    outputs maps run ids to the table a run wrote; its rows are the run's samples in order.
+    """
+    manifest = read_manifest(planned["manifest"]).set_index("sample")
+    merged = []
+    for robot in planned["robots"]:
+        for run in robot["runs"]:
+            if run["id"] not in outputs:
+                raise Exception(f"No output for {run['id']}")
+            table = outputs[run["id"]].drop(columns=[column for column in outputs[run["id"]].columns if column.startswith("Unnamed")])
+            if len(table) != len(run["samples"]):
+                raise Exception(f"{run['id']} wrote {len(table)} rows for {len(run['samples'])} samples")
+            table = table.rename(columns={"Sample": "Protocol Sample"}).reset_index(drop=True)
+            table.insert(0, "run", run["id"])
+            table.insert(0, "robot", robot["robot"])
+            table.insert(0, "sample", run["samples"])
+            merged.append(table)
+    merged = pd.concat(merged, ignore_index=True)
+    return merged.merge(manifest, left_on="sample", right_index=True, how="left")
+
+
+def _simulate_run(path, params):
+    """Trace one run as a robot would do it: its predicted seconds and the last table it wrote."""
+    protocol = protocol_recorder.trace(path, params, quiet=True)
+    written = [record["path"] for record in protocol.records if record["call"] == "write_file" and record["path"] in protocol.files]
+    seconds = duration_model.predict(protocol.records, duration_model.load_calibration())["expected"]
+    return seconds, protocol.files[written[-1]] if written else None
+
+
+def simulate(planned):
+    """Trace every run in its own process and merge what they write. Returns the merged table and seconds per robot."""
+    runs = [(robot["robot"], run) for robot in planned["robots"] for run in robot["runs"]]
+    with ProcessPoolExecutor(max_workers=len(runs)) as pool:
+        results = list(pool.map(_simulate_run, [planned["protocol"]]*len(runs), [run["params"] for _, run in runs]))
+    seconds = {}
+    outputs = {}
+    for (robot, run), (run_seconds, table) in zip(runs, results):
+        seconds[robot] = seconds.get(robot, 0) + run_seconds
+        if table is not None:
+            outputs[run["id"]] = table
+    return merge(planned, outputs), seconds
+
+
+def report(planned, seconds=None):
+    minutes = cost_model.format_minutes
+    seconds = seconds or {robot["robot"]: robot["predicted_seconds"] for robot in planned["robots"]}
+    lines = [f"{Path(planned['protocol']).name}: {sum(len(run['samples']) for robot in planned['robots'] for run in robot['runs'])} samples "
+             f"on {len(planned['robots'])} robots"]
+    for robot in planned["robots"]:
+        sizes = " + ".join(str(len(run["samples"])) for run in robot["runs"]) or "nothing"
+        lines.append(f"  robot {robot['robot']}: {sizes} samples, {minutes(seconds[robot['robot']])} min")
+    longest = max(seconds.values())
+    one_robot = planned["one_robot_seconds"]
+    lines.append(f"  Done in {minutes(longest)} min against {minutes(one_robot)} min on one robot: "
+                 f"{one_robot/longest:.2f}x, {100*one_robot/(longest*len(planned['robots'])):.0f}% of linear")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split a sample manifest over several robots and merge their results")
+    commands = parser.add_subparsers(dest="command", required=True)
+    planning = commands.add_parser("plan", help="runs, parameters and deck sheets per robot")
+    planning.add_argument("manifest", help="CSV with one row per sample")
+    planning.add_argument("protocol")
+    planning.add_argument("params", nargs="*", help="parameter overrides as name=value, for every run")
+    planning.add_argument("--robots", type=int, default=2)
+    planning.add_argument("--out", default=OUTPUT, help="directory for plan.json and the deck sheets")
+    planning.add_argument("--calibration", default=duration_model.CALIBRATION, help="duration calibration to predict with")
+    merging = commands.add_parser("merge", help="merge the tables the runs wrote")
+    merging.add_argument("plan")
+    merging.add_argument("outputs", nargs="+", help="run id and its output CSV as id=path")
+    merging.add_argument("--out", help="merged CSV, next to the plan by default")
+    simulating = commands.add_parser("simulate", help="trace every run in parallel and merge the results")
+    simulating.add_argument("plan")
+    simulating.add_argument("--out", help="merged CSV, next to the plan by default")
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        overrides = dict((name, protocol_recorder._parse_value(value)) for name, value in (param.split("=", 1) for param in args.params))
+        planned = plan(args.manifest, args.protocol, args.robots, overrides, duration_model.load_calibration(args.calibration))
+        out = Path(args.out)
+        out.mkdir(parents=True, exist_ok=True)
+        (out / "plan.json").write_text(json.dumps(planned, indent=2))
+        for robot in planned["robots"]:
+            for run in robot["runs"]:
+                (out / f"{run['id']}_deck.txt").write_text(deck_sheet(args.protocol, run) + "\n")
+        print(report(planned))
+        print(f"Plan and deck sheets in {out}")
+    else:
+        planned = json.loads(Path(args.plan).read_text())
+        if args.command == "merge":
+            outputs = dict((run_id, pd.read_csv(path)) for run_id, path in (output.split("=", 1) for output in args.outputs))
+            merged = merge(planned, outputs)
+        else:
+            merged, seconds = simulate(planned)
+            print(report(planned, seconds))
+        destination = args.out or Path(args.plan).with_name("merged.csv")
+        merged.to_csv(destination, index=False)
+        print(f"{len(merged)} samples merged into {destination}")
@@ -0,0 +1,239 @@
+"""Parameter sweeps over every protocol, kept as a history table.
+
+For each protocol the sweep traces num_samples across its whole range with the other
+parameters at their defaults, then every other parameter across its minimum, default and
+maximum (or each of its choices). A protocol that fixes num_samples in run() instead is
+swept from 1 to its max_samples, the maximum its num_samples comment gives or else the
+value it fixes, with num_samples set in a copy of the file (see variant_compare.pin()).
+Each run is costed with cost_model and stored as one row
+of benchmark_history.csv with the protocol file's hash:
+
+    python benchmark.py                       # every protocol that changed since the last sweep
+    python benchmark.py Proteomics_BCA_Normalize_04112025.py --force
+
+Rows record the estimated duration, tips per rack type, gripper moves, the volume drawn
+from each reagent and the most deck slots in use at once. After a sweep, steps in
+num_samples where the run time jumps are listed, and results that got worse since the
+previous version of a file are flagged as regressions. A protocol with dated variants
+that changed since they were last compared is also compared with them (see
+variant_compare.py).
+"""
+import argparse
+import ast
+import datetime
+import hashlib
+import json
+import re
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+import cost_model
+import protocol_recorder
+import trace_cache
+
+HISTORY = Path(__file__).with_name("benchmark_history.csv")
+
+# A file change that adds more than this much run time is flagged
+DURATION_TOLERANCE = 0.05
+DURATION_SLACK_MINUTES = 0.5
+
+
+def protocol_files(directory=Path(__file__).parent):
+    """The protocol files in the repo, recognised by their run(protocol) entry point."""
+    return sorted(path for path in directory.glob("*.py") if re.search(r"^def run\(protocol", path.read_text(errors="ignore"), re.M))
+
+
+def file_hash(path):
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()[:12]
+
+
+def pinned_samples(path):
+    """The most samples to sweep a protocol that fixes num_samples in run() over, or None."""
+    source = Path(path).read_text()
+    run = next((node for node in ast.parse(source).body if isinstance(node, ast.FunctionDef) and node.name == "run"), None)
+    fixed = {node.targets[0].id: node for node in (run.body if run else [])
+             if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name)
+             and isinstance(node.value, ast.Constant) and isinstance(node.value.value, int)}
+    if "num_samples" not in fixed:
+        return None
+    if "max_samples" in fixed:
+        return fixed["max_samples"].value.value
+    # e.g. "num_samples = 10 # ... The maximum is 18."
+    stated = re.search(r"maximum is (\d+)", source.splitlines()[fixed["num_samples"].lineno - 1])
+    return int(stated.group(1)) if stated else fixed["num_samples"].value.value
+
+
+def sweep_points(path):
+    """Parameter sets to trace: num_samples over its range, the rest one at a time."""
+    module = protocol_recorder.load_protocol(path)
+    parameters = protocol_recorder.Parameters()
+    if hasattr(module, "add_parameters"):
+        module.add_parameters(parameters)
+    points = [{}]
+    if "num_samples" in parameters.ranges:
+        minimum, maximum = parameters.ranges["num_samples"]
+        points = [{"num_samples": n} for n in range(minimum, maximum + 1)]
+    elif pinned_samples(path):
+        points = [{"num_samples": n} for n in range(1, pinned_samples(path) + 1)]
+    for name, default in parameters.values.items():
+        if name == "num_samples":
+            continue
+        if name in parameters.choices:
+            values = parameters.choices[name]
+        elif name in parameters.ranges:
+            values = list(parameters.ranges[name]) + [default]
+        else:
+            continue
+        points += [{name: value} for value in sorted(set(values), key=str) if value != default]
+    return points
+
+
+def reagent_volumes(records):
+    """µL drawn from every source, named by the liquid loaded there where there is one."""
+    liquids = {}
+    for record in records:
+        if record["call"] == "load_liquid":
+            liquids[record["well"].split(" on ")[0]] = record["liquid"]
+    volumes = {}
+    for record in records:
+        if record["call"] not in cost_model.COMPLEX_CALLS:
+            continue
+        sources, dests = record["source"], record["dest"]
+        pairs = max(len(sources), len(dests))
+        each = record["volume"] if isinstance(record["volume"], list) else [record["volume"]]*pairs
+        for i, volume in enumerate(each):
+            source = sources[i % len(sources)].split(" on ")[0].split(" (")[0]
+            name = liquids.get(source, source)
+            volumes[name] = volumes.get(name, 0) + volume
+    return {name: round(volume, 1) for name, volume in volumes.items()}
+
+
+def tip_counts(records):
+    """Tips picked up from every rack type."""
+    tips = {}
+    for record in records:
+        if record["call"] == "pick_up_tip" or record["call"] in cost_model.COMPLEX_CALLS:
+            picked = [record["tips"]] if record["call"] == "pick_up_tip" else record["tips"]
+            for rack, pick_up in zip(record["tip_racks"], picked):
+                tips[rack] = tips.get(rack, 0) + len(pick_up)
+    return tips
+
+
+def measure(path, params):
+    """One row of the history table for a protocol and a parameter set."""
+    import variant_compare
+    row = {"protocol": Path(path).name, "params": json.dumps(params, sort_keys=True)}
+    unused = set(params) - variant_compare.declared_parameters(path)
+    with tempfile.TemporaryDirectory() as directory:
+        # Values run() fixes are set in a copy of the file
+        traced, fixed = variant_compare.pin(path, {name: params[name] for name in unused}, directory)
+        try:
+            protocol = trace_cache.cached_trace(traced, {name: value for name, value in params.items() if name not in fixed})
+        except Exception as error:
+            row["error"] = f"{type(error).__name__}: {error}"
+            return row
+    estimated = cost_model.estimate(protocol.records)
+    tips = tip_counts(protocol.records)
+    row.update({
+        "duration_min": round(estimated["total"]/60, 2),
+        "robot_min": round(estimated["robot"]/60, 2),
+        "tips": json.dumps(tips, sort_keys=True),
+        "tips_total": sum(tips.values()),
+        "gripper_moves": sum(1 for record in protocol.records if record["call"] == "move_labware" and record["use_gripper"]),
+        "reagent_ul": json.dumps(reagent_volumes(protocol.records), sort_keys=True),
+        "peak_deck_slots": protocol.peak_deck,
+        "error": "",
+    })
+    return row
+
+
+def jumps(rows, factor=1.25, minutes=0.25):
+    """num_samples steps that add clearly more run time or tips than the protocol's usual step."""
+    found = []
+    swept = rows[rows["params"].str.fullmatch(r'\{"num_samples": \d+\}') & (rows["error"] == "")].copy()
+    for protocol, group in swept.groupby("protocol"):
+        group = group.assign(n=group["params"].map(lambda params: json.loads(params)["num_samples"])).sort_values("n")
+        steps = group[["duration_min", "tips_total"]].diff().iloc[1:]
+        usual = steps.median()
+        for n, (_, step) in zip(group["n"].iloc[1:], steps.iterrows()):
+            if step["duration_min"] > factor*usual["duration_min"] and step["duration_min"] - usual["duration_min"] >= minutes:
+                found.append(f"{protocol}: {n - 1} -> {n} samples adds {step['duration_min']:.1f} min and {step['tips_total']:g} tips "
+                             f"(usual step {usual['duration_min']:.1f} min, {usual['tips_total']:g} tips)")
+    return found
+
+
+def regressions(history, rows):
+    """Compare each new row with the same protocol and parameters in the previous file version."""
+    flagged = []
+    for _, row in rows.iterrows():
+        earlier = history[(history["protocol"] == row["protocol"]) & (history["params"] == row["params"])
+                          & (history["file_hash"] != row["file_hash"])]
+        if earlier.empty:
+            continue
+        previous = earlier.iloc[-1]
+        where = f"{row['protocol']} {row['params']}"
+        if row["error"] and not previous["error"]:
+            flagged.append(f"{where}: now fails with {row['error']}")
+            continue
+        if row["error"]:
+            continue
+        if previous["error"]:
+            continue
+        if row["duration_min"] > previous["duration_min"]*(1 + DURATION_TOLERANCE) + DURATION_SLACK_MINUTES:
+            flagged.append(f"{where}: {previous['duration_min']:.1f} -> {row['duration_min']:.1f} min")
+        for column in ["tips_total", "gripper_moves", "peak_deck_slots"]:
+            if row[column] > previous[column]:
+                flagged.append(f"{where}: {column} {previous[column]:g} -> {row[column]:g}")
+    return flagged
+
+
+def run_sweep(paths, history_file=HISTORY, force=False, save=True):
+    """Sweep the protocols, append the rows to the history and return (rows, jumps, regressions)."""
+    history = pd.read_csv(history_file) if Path(history_file).exists() else pd.DataFrame()
+    if not history.empty:
+        history["error"] = history["error"].fillna("")
+    run_at = datetime.datetime.now().isoformat(timespec="seconds")
+    rows = []
+    for path in paths:
+        digest = file_hash(path)
+        if not force and not history.empty and ((history["protocol"] == Path(path).name) & (history["file_hash"] == digest)).any():
+            print(f"{Path(path).name}: unchanged since the last sweep")
+            continue
+        for params in sweep_points(path):
+            rows.append(dict(measure(path, params), run_at=run_at, file_hash=digest))
+    rows = pd.DataFrame(rows)
+    if rows.empty:
+        return rows, [], []
+    rows["error"] = rows["error"].fillna("")
+    flagged = regressions(history, rows) if not history.empty else []
+    if save:
+        pd.concat([history, rows], ignore_index=True).to_csv(history_file, index=False)
+    return rows, jumps(rows), flagged
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep protocol parameters and track the results over time")
+    parser.add_argument("protocols", nargs="*", help="protocol files, every protocol in the repo by default")
+    parser.add_argument("--history", default=HISTORY, help="history table to append to")
+    parser.add_argument("--force", action="store_true", help="sweep files that have not changed since the last sweep")
+    parser.add_argument("--no-save", action="store_true", help="do not append this sweep to the history")
+    args = parser.parse_args()
+
+    rows, found, flagged = run_sweep(args.protocols or protocol_files(), args.history, args.force, not args.no_save)
+    if not rows.empty:
+        summary = rows[rows["error"] == ""].groupby("protocol")["duration_min"].agg(["min", "max"])
+        print(summary.to_string())
+        for protocol, errors in rows[rows["error"] != ""].groupby("protocol"):
+            print(f"{protocol}: {len(errors)} parameter sets fail, e.g. {errors['params'].iloc[0]}: {errors['error'].iloc[0]}")
+    for jump in found:
+        print(f"Jump: {jump}")
+    for regression in flagged:
+        print(f"Regression: {regression}")
+    # A new or changed variant is compared with the other variants of its workflow
+    import variant_compare
+    for name, variants in variant_compare.run_comparisons(args.protocols or protocol_files(), save=not args.no_save):
+        print(variant_compare.report(name, variants))
+    if flagged:
+        raise SystemExit(1)
@@ -0,0 +1,315 @@
+"""Run-duration estimates for protocol traces.
+
+estimate() walks the records protocol_recorder.trace() produces and gives every command
+a duration: aspirate and dispense time from the pipette flow rates, gantry moves between
+wells, tip pick-up and drops in the waste chute, gripper moves, module ramps and holds,
+and protocol delays. The commands are grouped into phases, which start at every
+"Running ..." comment, and into categories so variants can be compared:
+
+    python cost_model.py BCA_with_Normalization_and_Click_Reaction_Gel_1.0.py ChemProt_Gel_BCA_Normalization_Click_08282025.py
+
+Complex transfers are costed the way Opentrons 8.x runs them. transfer(), distribute()
+and consolidate() drop rate= and delay=, distribute() drops mix_after and consolidate()
+drops mix_before. as_written=True costs them as the protocol asks instead, with delay=
+seconds spent after every aspirate.
+
+The timings are estimates for a Flex with default speeds, not measurements; operator
+time for pauses and manual labware moves is counted separately from robot time.
+"""
+import argparse
+import math
+import re
+
+import protocol_recorder
+import trace_cache
+
+AMBIENT = 25
+
+# Default Flex flow rates in µL/s by (pipette volume, tip volume): aspirate, dispense, blow out
+FLOW_RATES = {
+    (50, 50): (35, 57, 57),
+    (1000, 50): (478, 478, 80),
+    (1000, 200): (716, 716, 80),
+    (1000, 1000): (716, 716, 80),
+}
+
+# Seconds per motion
+TIMINGS = {
+    'well_move': 2.5,
+    'pick_up_tip': 6,
+    'drop_tip': 7,
+    'blow_out': 3,
+    'touch_tip': 3,
+    'gripper_move': 25,
+    'latch': 2,
+    'lid': 20,
+    'shake_ramp': 5,
+}
+
+# Operator time assumed for a manual labware move
+MANUAL_MOVE = 60
+
+# Ramp rates in °C/s: heating, cooling
+RAMP_RATES = {
+    'heaterShakerModuleV1': (0.12, 0.02),
+    'temperature module gen2': (0.045, 0.014),
+    'thermocyclerModuleV2': (4.25, 2.0),
+    'thermocycler_lid': (0.5, 0.1),
+}
+
+COMPLEX_CALLS = ['transfer', 'distribute', 'consolidate']
+# Keyword arguments the Opentrons transfer planner does not read
+IGNORED = {
+    'transfer': ['rate', 'delay'],
+    'distribute': ['rate', 'delay', 'mix_after'],
+    'consolidate': ['rate', 'delay', 'mix_before'],
+}
+
+
+def _pipette_volume(target):
+    return int(re.search(r"_(\d+) \(", target).group(1))
+
+
+def _flow_rates(record):
+    pipette = _pipette_volume(record['target'])
+    tip = record.get('tip_volume') or pipette
+    return FLOW_RATES.get((pipette, tip), FLOW_RATES.get((pipette, pipette), (100, 100, 100)))
+
+
+def _argument(record, names, position=0, default=None):
+    for name in names:
+        if record.get(name) is not None:
+            return record[name]
+    args = record.get('args') or []
+    return args[position] if len(args) > position else default
+
+
+def _ramp(model, start, target, calibration=None):
+    heating, cooling = RAMP_RATES.get(model, (1, 1))
+    if start is None or target is None:
+        return 0
+    # Measured rates for this setpoint where runs have been logged
+    learned = ((calibration or {}).get('ramp_rates', {}).get(model) or {}).get(str(target))
+    if learned:
+        heating, cooling = learned[0] or heating, learned[1] or cooling
+    return (target - start)/heating if target > start else (start - target)/cooling
+
+
+def _hold(record):
+    return (record.get('hold_time_seconds') or 0) + 60*(record.get('hold_time_minutes') or 0)
+
+
+def _liquid_seconds(record, as_written):
+    """Aspirate, dispense, mix and the moves between wells for one pipetting call."""
+    aspirate_rate, dispense_rate, blow_out_rate = _flow_rates(record)
+    call = record['call']
+    ignored = IGNORED.get(call, []) if not as_written else []
+    rate = record.get('rate') or 1.0
+    if 'rate' in ignored:
+        rate = 1.0
+    delay = 0 if 'delay' in ignored else record.get('delay') or 0
+    well_move = TIMINGS['well_move']
+
+    def aspirate(volume):
+        return well_move + volume/(aspirate_rate*rate) + delay
+
+    def dispense(volume):
+        return well_move + volume/(dispense_rate*rate)
+
+    def mix(option):
+        if record.get(option) is None or option in ignored:
+            return 0
+        repetitions, volume = record[option]
+        return repetitions*(volume/(aspirate_rate*rate) + volume/(dispense_rate*rate))
+
+    if call == 'aspirate':
+        return aspirate(record['volume'] or 0)
+    if call == 'dispense':
+        return dispense(record['volume'] or 0)
+    if call == 'mix':
+        volume = record['volume'] or 0
+        return well_move + record['repetitions']*(volume/(aspirate_rate*rate) + volume/(dispense_rate*rate))
+
+    volume = record['volume']
+    sources, dests = record['source'], record['dest']
+    blow_out = TIMINGS['blow_out'] if record.get('blow_out') else 0
+    touch_tip = TIMINGS['touch_tip'] if record.get('touch_tip') else 0
+    aspirations = record.get('aspirations') or 1
+    seconds = 0
+    if call == 'transfer':
+        pairs = max(len(sources), len(dests))
+        volumes = volume if isinstance(volume, list) else [volume]*pairs
+        chunks = [math.ceil(v/min(_pipette_volume(record['target']), record.get('tip_volume') or v)) if v > 0 else 0 for v in volumes]
+        for v, count in zip(volumes, chunks):
+            for _ in range(count):
+                seconds += mix('mix_before') + aspirate(v/count) + touch_tip + dispense(v/count) + mix('mix_after') + blow_out
+    elif call == 'distribute':
+        # Every aspiration carries the disposal volume, which is blown out in the chute
+        disposal = record.get('disposal_volume') or 0
+        wells = len(sources)*len(dests)/aspirations
+        for _ in range(aspirations):
+            seconds += mix('mix_before') + aspirate(volume*wells + disposal) + touch_tip
+            seconds += wells*(dispense(volume) + mix('mix_after'))
+            if disposal:
+                seconds += TIMINGS['blow_out'] + disposal/blow_out_rate
+    else:
+        wells = len(sources)/aspirations
+        for _ in range(aspirations):
+            seconds += wells*(mix('mix_before') + aspirate(volume) + touch_tip)
+            seconds += dispense(volume*wells) + mix('mix_after') + blow_out
+    return seconds
+
+
+def _module_seconds(record, temperatures, calibration=None):
+    """Ramps, holds, lid and latch moves. temperatures tracks each module between calls."""
+    timings = _timings(calibration)
+    target = record['target']
+    model = target.split(' on ')[0]
+    call = record['call']
+    current = temperatures.get(target, AMBIENT)
+    if call in ['open_labware_latch', 'close_labware_latch']:
+        return timings['latch']
+    if call in ['open_lid', 'close_lid']:
+        return timings['lid']
+    if call in ['set_and_wait_for_shake_speed', 'deactivate_shaker']:
+        return timings['shake_ramp']
+    if call in ['set_and_wait_for_temperature', 'set_temperature', 'set_block_temperature']:
+        celsius = _argument(record, ['celsius', 'temperature'])
+        temperatures[target] = celsius
+        return _ramp(model, current, celsius, calibration) + _hold(record)
+    if call == 'set_target_temperature':
+        temperatures[target + ' target'] = _argument(record, ['celsius'])
+        return 0
+    if call == 'wait_for_temperature':
+        celsius = temperatures.pop(target + ' target', current)
+        temperatures[target] = celsius
+        return _ramp(model, current, celsius, calibration)
+    if call == 'set_lid_temperature':
+        celsius = _argument(record, ['temperature'])
+        lid = temperatures.get(target + ' lid', AMBIENT)
+        temperatures[target + ' lid'] = celsius
+        return _ramp('thermocycler_lid', lid, celsius, calibration)
+    if call == 'execute_profile':
+        steps = _argument(record, ['steps'])
+        repetitions = _argument(record, ['repetitions'], 1, 1)
+        seconds = 0
+        for _ in range(repetitions):
+            for step in steps:
+                celsius = step['temperature']
+                seconds += _ramp(model, current, celsius, calibration) + _hold(step)
+                current = celsius
+        temperatures[target] = current
+        return seconds
+    if call.startswith('deactivate'):
+        # Modules cool down on their own; nothing waits for it
+        temperatures[target] = AMBIENT
+    return 0
+
+
+def _timings(calibration):
+    return dict(TIMINGS, **(calibration or {}).get('timings', {}))
+
+
+def slot(location):
+    """The deck slot in a location label, e.g. 'D2' for 'magneticBlockV1 on D2'."""
+    slots = re.findall(r"\b([A-D][1-4])\b", str(location))
+    return slots[-1] if slots else str(location)
+
+
+def liquid_key(record):
+    """Pipetting calls are calibrated per call and pipette mount."""
+    mount = re.search(r"\((left|right)\)", record['target'])
+    return f"{record['call']} {mount.group(1) if mount else record['target']}"
+
+
+def _command(record, temperatures, as_written, calibration=None):
+    """(category, seconds) for one record."""
+    call = record['call']
+    target = record['target']
+    timings = _timings(calibration)
+    factor = (calibration or {}).get('liquid', {}).get(liquid_key(record), 1)
+    if call in COMPLEX_CALLS:
+        tips = len(record['tips'])*(timings['pick_up_tip'] + timings['drop_tip'])
+        return [('liquid', factor*_liquid_seconds(record, as_written)), ('tips', tips)]
+    if call in ['aspirate', 'dispense', 'mix']:
+        return [('liquid', factor*_liquid_seconds(record, as_written))]
+    if call == 'blow_out':
+        return [('liquid', timings['blow_out'])]
+    if call == 'touch_tip':
+        return [('liquid', timings['touch_tip'])]
+    if call == 'pick_up_tip':
+        return [('tips', timings['pick_up_tip'])]
+    if call in ['drop_tip', 'return_tip']:
+        return [('tips', timings['drop_tip'])]
+    if call == 'move_labware':
+        if record['use_gripper']:
+            moves = (calibration or {}).get('gripper', {})
+            return [('gripper', moves.get(f"{slot(record['source'])}->{slot(record['dest'])}", timings['gripper_move']))]
+        return [('manual', MANUAL_MOVE)]
+    if call == 'delay':
+        return [('delay', record['seconds'])]
+    if target != 'protocol' and target.split(' on ')[0] in RAMP_RATES:
+        return [('module', _module_seconds(record, temperatures, calibration))]
+    return []
+
+
+def estimate(records, as_written=False, calibration=None):
+    """Estimate how long a trace takes.
+
+    Returns the total in seconds, robot time without operator waits, one entry per
+    phase with seconds by category, and a per-command list other tools can build on.
+    calibration holds timings measured on past runs (see duration_model.learn).
+    """
+    temperatures = {}
+    phases = [{'name': 'setup', 'seconds': 0, 'categories': {}}]
+    commands = []
+    pauses = 0
+    for record in records:
+        if record['call'] == 'comment' and str(record.get('msg', '')).startswith('Running '):
+            phases.append({'name': record['msg'][len('Running '):], 'seconds': 0, 'categories': {}})
+            continue
+        if record['call'] == 'pause':
+            pauses += 1
+        phase = phases[-1]
+        for category, seconds in _command(record, temperatures, as_written, calibration):
+            phase['seconds'] += seconds
+            phase['categories'][category] = phase['categories'].get(category, 0) + seconds
+            commands.append({'index': record['index'], 'call': record['call'], 'phase': phase['name'],
+                             'category': category, 'seconds': seconds})
+    phases = [phase for phase in phases if phase['seconds'] or phase['name'] != 'setup']
+    total = sum(phase['seconds'] for phase in phases)
+    manual = sum(phase['categories'].get('manual', 0) for phase in phases)
+    return {'total': total, 'robot': total - manual, 'pauses': pauses, 'phases': phases, 'commands': commands}
+
+
+def format_minutes(seconds):
+    return f"{seconds/60:.1f}"
+
+
+def report(name, estimated):
+    categories = ['liquid', 'tips', 'gripper', 'module', 'delay', 'manual']
+    lines = [name, f"  {'phase':<40}" + ''.join(f"{category:>9}" for category in categories) + f"{'total':>9}"]
+    for phase in estimated['phases']:
+        lines.append(f"  {phase['name'][:40]:<40}" + ''.join(f"{format_minutes(phase['categories'].get(category, 0)):>9}" for category in categories) + f"{format_minutes(phase['seconds']):>9}")
+    lines.append(f"  Total {format_minutes(estimated['total'])} min ({format_minutes(estimated['robot'])} min robot time, {estimated['pauses']} pauses not counted)")
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate protocol run time from an offline trace")
+    parser.add_argument("protocols", nargs="+", help="protocol files to compare")
+    parser.add_argument("--param", action="append", default=[], help="parameter override as name=value, applied where defined")
+    parser.add_argument("--data-file", help="plate reader export to normalize against")
+    parser.add_argument("--as-written", action="store_true", help="cost rate=, delay= and mix options the API ignores")
+    args = parser.parse_args()
+
+    overrides = dict((name, protocol_recorder._parse_value(value)) for name, value in (param.split("=", 1) for param in args.param))
+    totals = []
+    for path in args.protocols:
+        protocol = trace_cache.cached_trace(path, overrides, args.data_file, ignore_unknown=True)
+        estimated = estimate(protocol.records, args.as_written)
+        totals.append(estimated['total'])
+        print(report(path, estimated))
+        print()
+    for path, total in zip(args.protocols[1:], totals[1:]):
+        print(f"{path}: {total/60 - totals[0]/60:+.1f} min against {args.protocols[0]}")
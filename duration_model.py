@@ -0,0 +1,217 @@
+"""Run-time predictions calibrated on logged runs.
+
+learn() reads run_telemetry logs and measures what cost_model otherwise assumes: tip
+pick-up and drop times, gripper moves per slot pair, module ramp rates per setpoint,
+latch, lid and shaker times, how long pauses keep the robot waiting, and a factor per
+pipetting call and mount that scales cost_model's liquid handling time to what the
+robot took. The factors come from matching each logged call with the same call in a
+trace of the protocol with the run's parameters. The result is kept as
+duration_calibration.json and used for predictions and live ETAs:
+
+    python duration_model.py learn /var/lib/jupyter/notebooks/Data/run_logs/*.jsonl
+    python duration_model.py predict ChemProt_Gel_BCA_Normalization_Click_08282025.py num_samples=24 --start 13:30
+    python duration_model.py eta /var/lib/jupyter/notebooks/Data/run_logs/Gel_based_Chemical_Proteomics_08192025_250301-133000.jsonl
+
+Predictions add the median logged pause for every pause in the protocol.
+"""
+import argparse
+import datetime
+import difflib
+import json
+import re
+import statistics
+import time
+from pathlib import Path
+
+import cost_model
+import protocol_recorder
+import run_telemetry
+import trace_cache
+
+CALIBRATION = Path(__file__).with_name("duration_calibration.json")
+
+# Logged calls measured directly, by the cost_model timing they calibrate
+TIMED_CALLS = {
+    'pick_up_tip': 'pick_up_tip',
+    'drop_tip': 'drop_tip',
+    'return_tip': 'drop_tip',
+    'blow_out': 'blow_out',
+    'touch_tip': 'touch_tip',
+    'open_labware_latch': 'latch',
+    'close_labware_latch': 'latch',
+    'open_lid': 'lid',
+    'close_lid': 'lid',
+    'set_and_wait_for_shake_speed': 'shake_ramp',
+    'deactivate_shaker': 'shake_ramp',
+    'pause': 'pause',
+}
+RAMP_CALLS = ['set_and_wait_for_temperature', 'set_temperature', 'set_block_temperature', 'wait_for_temperature']
+LOGGED_CALLS = run_telemetry.PROTOCOL_CALLS + run_telemetry.PIPETTE_CALLS + run_telemetry.MODULE_CALLS
+
+
+def read_log(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def protocol_file(name, directory=Path(__file__).parent):
+    """The protocol in the repo whose metadata has this protocolName."""
+    for path in sorted(directory.glob("*.py")):
+        if re.search(r"['\"]protocolName['\"]\s*:\s*['\"]" + re.escape(name) + r"['\"]", path.read_text(errors="ignore")):
+            return path
+    return None
+
+
+def _key(entry):
+    """What a logged call and a traced record have in common: the call and the pipette mount or module model."""
+    mount = re.search(r"\((left|right)\)", entry['target'])
+    return (entry['call'], mount.group(1) if mount else entry['target'].split(' on ')[0])
+
+
+def _trace(entries):
+    """Trace the protocol a log came from with the run's parameters, or None if it is not in the repo."""
+    path = protocol_file(entries[0]['protocol'])
+    if path is None:
+        return None
+    return trace_cache.cached_trace(path, entries[0]['params'], ignore_unknown=True)
+
+
+def _matches(entries, records):
+    """Pairs of (logged entry, traced record) for the same calls in the same order."""
+    logged = [entry for entry in entries[1:] if 'seconds' in entry]
+    traced = [record for record in records if record['call'] in LOGGED_CALLS]
+    matcher = difflib.SequenceMatcher(None, [_key(entry) for entry in logged], [_key(record) for record in traced], autojunk=False)
+    return [(logged[block.a + i], traced[block.b + i]) for block in matcher.get_matching_blocks() for i in range(block.size)]
+
+
+def _setpoint(entry):
+    for name in ['celsius', 'temperature']:
+        if entry.get(name) is not None:
+            return entry[name]
+    return (entry.get('args') or [None])[0]
+
+
+def learn(paths):
+    """Calibration measured from run logs, in the shape cost_model.estimate takes."""
+    timings, gripper, ramps, liquid = {}, {}, {}, {}
+    runs = 0
+    for path in paths:
+        entries = read_log(path)
+        if not entries or entries[0]['call'] != 'run_start':
+            continue
+        runs += 1
+        temperatures = {}
+        for entry in entries[1:]:
+            if entry.get('error') or 'seconds' not in entry:
+                continue
+            call, seconds = entry['call'], entry['seconds']
+            if call in TIMED_CALLS:
+                timings.setdefault(TIMED_CALLS[call], []).append(seconds)
+            if call == 'move_labware' and entry.get('use_gripper'):
+                timings.setdefault('gripper_move', []).append(seconds)
+                gripper.setdefault(f"{cost_model.slot(entry.get('from'))}->{cost_model.slot(entry['to'])}", []).append(seconds)
+            target = entry['target']
+            if call == 'set_target_temperature':
+                temperatures[target + ' target'] = _setpoint(entry)
+            elif call in RAMP_CALLS:
+                celsius = temperatures.pop(target + ' target', None) if call == 'wait_for_temperature' else _setpoint(entry)
+                start = temperatures.get(target, cost_model.AMBIENT)
+                if celsius is not None and abs(celsius - start) >= 1 and seconds > 0:
+                    rates = ramps.setdefault(target.split(' on ')[0], {}).setdefault(str(celsius), ([], []))
+                    rates[0 if celsius > start else 1].append(abs(celsius - start)/seconds)
+                temperatures[target] = celsius
+            elif call.startswith('deactivate') and call != 'deactivate_shaker':
+                temperatures[target] = cost_model.AMBIENT
+        protocol = _trace(entries)
+        if protocol is None:
+            continue
+        estimated = {}
+        for command in cost_model.estimate(protocol.records)['commands']:
+            if command['category'] == 'liquid':
+                estimated[command['index']] = command['seconds']
+        pick_up = statistics.median(timings.get('pick_up_tip', [cost_model.TIMINGS['pick_up_tip']]))
+        drop = statistics.median(timings.get('drop_tip', [cost_model.TIMINGS['drop_tip']]))
+        for entry, record in _matches(entries, protocol.records):
+            if record['index'] not in estimated or entry.get('error'):
+                continue
+            # Take the tip handling a transfer did out of its measured time
+            tips = len(record['tips'])*(pick_up + drop) if record['call'] in cost_model.COMPLEX_CALLS else 0
+            totals = liquid.setdefault(cost_model.liquid_key(record), [0, 0])
+            totals[0] += max(entry['seconds'] - tips, 0)
+            totals[1] += estimated[record['index']]
+    return {
+        'runs': runs,
+        'timings': {name: round(statistics.median(values), 2) for name, values in timings.items()},
+        'gripper': {pair: round(statistics.median(values), 2) for pair, values in gripper.items()},
+        'ramp_rates': {model: {setpoint: [round(statistics.median(rates), 4) if rates else None for rates in directions]
+                               for setpoint, directions in setpoints.items()} for model, setpoints in ramps.items()},
+        'liquid': {key: round(measured/predicted, 3) for key, (measured, predicted) in liquid.items() if predicted and measured},
+    }
+
+
+def load_calibration(path=CALIBRATION):
+    return json.loads(Path(path).read_text()) if Path(path).exists() else None
+
+
+def predict(records, calibration=None):
+    """Seconds for a trace with measured timings, including the usual wait at every pause."""
+    estimated = cost_model.estimate(records, calibration=calibration)
+    pause = ((calibration or {}).get('timings') or {}).get('pause', 0)
+    return dict(estimated, expected=estimated['total'] + pause*estimated['pauses'], pause_seconds=pause)
+
+
+def eta(path, calibration=None, now=None):
+    """Expected end of a run in progress: now plus the predicted time of the steps not yet logged."""
+    entries = read_log(path)
+    protocol = _trace(entries)
+    if protocol is None:
+        raise Exception(f"No protocol named {entries[0]['protocol']} in the repo")
+    estimated = predict(protocol.records, calibration)
+    matched = _matches(entries, protocol.records)
+    done = matched[-1][1]['index'] if matched else -1
+    remaining = sum(command['seconds'] for command in estimated['commands'] if command['index'] > done)
+    remaining += estimated['pause_seconds']*sum(1 for record in protocol.records if record['call'] == 'pause' and record['index'] > done)
+    now = now or time.time()
+    return {'done': len(matched), 'steps': sum(1 for record in protocol.records if record['call'] in LOGGED_CALLS),
+            'remaining': remaining, 'finish': datetime.datetime.fromtimestamp(now + remaining)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Learn command timings from run logs and predict run times")
+    parser.add_argument("--calibration", default=CALIBRATION, help="calibration file to write or read")
+    commands = parser.add_subparsers(dest="command", required=True)
+    learning = commands.add_parser("learn", help="measure timings from run_telemetry logs")
+    learning.add_argument("logs", nargs="+")
+    predicting = commands.add_parser("predict", help="predict the run time of a protocol")
+    predicting.add_argument("protocol")
+    predicting.add_argument("params", nargs="*", help="parameter overrides as name=value")
+    predicting.add_argument("--data-file", help="plate reader export to normalize against")
+    predicting.add_argument("--start", help="start time as HH:MM, now by default")
+    estimating = commands.add_parser("eta", help="expected end of a run in progress")
+    estimating.add_argument("log")
+    args = parser.parse_args()
+
+    if args.command == "learn":
+        calibration = learn(args.logs)
+        Path(args.calibration).write_text(json.dumps(calibration, indent=2))
+        print(f"Learned from {calibration['runs']} runs: {json.dumps(calibration['timings'])}")
+        for key, factor in calibration['liquid'].items():
+            print(f"  {key}: {factor:.2f}x the nominal liquid handling time")
+    elif args.command == "predict":
+        calibration = load_calibration(args.calibration)
+        if calibration is None:
+            print("No calibration yet, using nominal timings")
+        overrides = dict((name, protocol_recorder._parse_value(value)) for name, value in (param.split("=", 1) for param in args.params))
+        protocol = trace_cache.cached_trace(args.protocol, overrides, args.data_file)
+        estimated = predict(protocol.records, calibration)
+        print(cost_model.report(args.protocol, estimated))
+        start = datetime.datetime.now()
+        if args.start:
+            start = datetime.datetime.combine(start.date(), datetime.time.fromisoformat(args.start))
+        finish = start + datetime.timedelta(seconds=estimated['expected'])
+        print(f"  Including {estimated['pauses']} pauses at {cost_model.format_minutes(estimated['pause_seconds'])} min each, "
+              f"a run started at {start:%H:%M} finishes around {finish:%a %H:%M}")
+    else:
+        expected = eta(args.log, load_calibration(args.calibration))
+        print(f"{expected['done']} of {expected['steps']} steps done, {cost_model.format_minutes(expected['remaining'])} min left, "
+              f"expected to finish around {expected['finish']:%a %H:%M}")
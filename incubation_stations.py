@@ -0,0 +1,122 @@
+"""Incubation stations: plates incubate on the modules while the pipettes work on.
+
+IncubationStations holds the heater-shakers of a run and, where it is free, the
+thermocycler. start() puts a plate on the first free station that takes it, starts the
+heating and shaking and returns straight away, so the gantry can pipette the next plate
+or move tip racks meanwhile; finish() waits out what is left of the incubation, stops the
+station and opens it, leaving the plate there to be picked up. A heater-shaker takes any
+plate and shakes it. The thermocycler takes PCR-skirted plates that need no shaking and
+holds them at the block temperature with the lid closed. With two heater-shakers two
+plates incubate at once; starting a plate no free station takes raises.
+
+    python incubation_stations.py corning_96_wellplate_360ul_flat nest_96_wellplate_100ul_pcr_full_skirt --rpm 500
+
+prints which stations take each plate. Protocols carry a copy of it, kept up to date with
+shared_code.py.
+"""
+import argparse
+import time
+
+# Plates that sit on the thermocycler block
+THERMOCYCLER_PLATES = ['opentrons_96_wellplate_200ul_pcr_full_skirt', 'nest_96_wellplate_100ul_pcr_full_skirt',
+                       'biorad_96_wellplate_200ul_pcr']
+
+
+def takes(kind, load_name, rpm=None):
+    """Whether a heater_shaker or thermocycler station takes a plate shaken at rpm."""
+    if kind == 'thermocycler':
+        return not rpm and load_name in THERMOCYCLER_PLATES
+    return True
+
+
+class IncubationStations:
+    """The incubation stations of a run and what incubates on them.
+
+    delay(seconds) waits out an incubation, protocol.delay by default; a rehearsal passes
+    its scaled wait. A station is a dict of kind, module, location (the adapter plates go
+    on) and, while busy, plate, celsius, rpm and end on the time.monotonic() clock.
+    """
+
+    def __init__(self, protocol, delay=None):
+        self.protocol = protocol
+        self.delay = delay or (lambda seconds: protocol.delay(seconds=seconds))
+        self.stations = []
+
+    def add_heater_shaker(self, module, location=None):
+        """A heater-shaker; plates go on location, its adapter, or on the module itself."""
+        self.stations.append({'kind': 'heater_shaker', 'module': module, 'location': location or module, 'plate': None})
+
+    def add_thermocycler(self, module):
+        """The thermocycler, for runs where its block is free while they incubate."""
+        self.stations.append({'kind': 'thermocycler', 'module': module, 'location': module, 'plate': None})
+
+    def free(self, plate, rpm=None):
+        """The first free station that takes the plate, or None."""
+        return next((station for station in self.stations
+                     if station['plate'] is None and takes(station['kind'], plate.load_name, rpm)), None)
+
+    def start(self, plate, minutes, celsius=None, rpm=None):
+        """Put a plate on a free station and start its incubation. Returns the station.
+
+        Without celsius the station keeps the temperature it has, so a heater-shaker
+        warmed up beforehand is not waited on again.
+        """
+        station = self.free(plate, rpm)
+        if station is None:
+            busy = ', '.join(f"{station['kind']} ({station['plate'].load_name})" for station in self.stations if station['plate'] is not None)
+            raise Exception(f"No free incubation station takes {plate.load_name}, busy: {busy or 'none'}")
+        module = station['module']
+        if station['kind'] == 'thermocycler':
+            module.open_lid()
+            self.protocol.move_labware(labware=plate, new_location=station['location'], use_gripper=True)
+            module.close_lid()
+            if celsius is not None:
+                module.set_block_temperature(celsius)
+        else:
+            module.open_labware_latch()
+            self.protocol.move_labware(labware=plate, new_location=station['location'], use_gripper=True)
+            module.close_labware_latch()
+            if celsius is not None:
+                module.set_and_wait_for_temperature(celsius)
+            if rpm:
+                module.set_and_wait_for_shake_speed(rpm)
+        station.update(plate=plate, celsius=celsius, rpm=rpm, end=time.monotonic() + minutes*60)
+        return station
+
+    def finish(self, station, heater_off=None, open_station=True):
+        """Wait out the rest of an incubation, then stop and open the station.
+
+        The heat goes off when start() set it, unless heater_off says otherwise; a heater
+        kept warm for the next plate stays on. open_station=False keeps a plate that is
+        pipetted into where it is latched in.
+        """
+        remaining = station['end'] - time.monotonic()
+        if remaining > 0:
+            self.delay(round(remaining))
+        if heater_off is None:
+            heater_off = station['celsius'] is not None
+        module = station['module']
+        if station['kind'] == 'thermocycler':
+            if heater_off:
+                module.deactivate_block()
+            if open_station:
+                module.open_lid()
+        else:
+            if station['rpm']:
+                module.deactivate_shaker()
+            if heater_off:
+                module.deactivate_heater()
+            if open_station:
+                module.open_labware_latch()
+        station['plate'] = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show which incubation stations take a plate")
+    parser.add_argument("plates", nargs="+", help="labware load names")
+    parser.add_argument("--rpm", type=int, default=0, help="shaking speed of the incubation")
+    args = parser.parse_args()
+
+    for load_name in args.plates:
+        kinds = [kind for kind in ['heater_shaker', 'thermocycler'] if takes(kind, load_name, args.rpm)]
+        print(f"{load_name}: {', '.join(kinds)}")
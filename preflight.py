@@ -0,0 +1,307 @@
+"""Pre-flight checks before a long run.
+
+Every protocol is read for names that are used but never defined anywhere in the file
+and for copies of shared helpers that differ from the helper (see shared_code.py), then
+traced with protocol_recorder for each combination of its choice and on/off
+parameters, with num_samples over its whole range and the other numeric parameters at
+their minimum, default and maximum. A run that starts at a later phase of a protocol split
+across robots (start_at) is given the hand-off manifest the robot that ran the earlier
+phases would have written. A trace that raises is reported with the protocol
+line and the parameters that reproduce it: undefined names, wells or columns the
+labware does not have, running out of tips, labware or modules put where something
+already sits, and any other error. Traces that finish
+are checked for:
+
+- drawing more from a well than was loaded into it with load_liquid or dispensed there
+- filling a well past the volume in its labware name (200ul, 2ml, 15ml ...)
+- volumes that are negative, not a number, below the pipette minimum, or larger than
+  the tip for aspirate and mix
+
+    python preflight.py ChemProt_10plex_BCA_Click_RedAlkDigest_022625.py
+    python preflight.py --exhaustive      # every protocol, full product of parameter values
+
+The exit status is 1 when anything was found.
+"""
+import argparse
+import ast
+import builtins
+import itertools
+import json
+import math
+import re
+import sys
+import traceback
+from pathlib import Path
+
+import benchmark
+import cost_model
+import protocol_recorder
+import shared_code
+import trace_cache
+
+# Smallest volume each pipette size handles, in µL
+MIN_VOLUMES = {50: 1, 1000: 5}
+
+# Calls after which a failing run has cost reagents or time
+WORK_CALLS = cost_model.COMPLEX_CALLS + ['aspirate', 'dispense', 'mix', 'pick_up_tip', 'move_labware', 'delay']
+
+
+def undefined_names(path):
+    """(line, name) for names the file reads but never binds anywhere."""
+    tree = ast.parse(Path(path).read_text(), str(path))
+    bound = set(dir(builtins)) | {'__file__', '__name__'}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            bound.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            bound.update((alias.asname or alias.name).split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.add(node.name)
+    return sorted({(node.lineno, node.id) for node in ast.walk(tree)
+                   if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id not in bound})
+
+
+def parameter_sets(path, exhaustive=False):
+    """Parameter overrides to trace. Choices are always combined; numbers are varied one at a time unless exhaustive."""
+    module = protocol_recorder.load_protocol(path)
+    parameters = protocol_recorder.Parameters()
+    if hasattr(module, 'add_parameters'):
+        module.add_parameters(parameters)
+    discrete = {name: parameters.choices[name] for name in parameters.values if name in parameters.choices}
+    numeric = {}
+    for name, (minimum, maximum) in parameters.ranges.items():
+        if name == 'num_samples':
+            numeric[name] = list(range(minimum, maximum + 1))
+        else:
+            numeric[name] = sorted({minimum, parameters.values[name], maximum})
+    combinations = [dict(zip(discrete, values)) for values in itertools.product(*discrete.values())]
+    if exhaustive:
+        return [dict(choices, **dict(zip(numeric, values))) for choices in combinations for values in itertools.product(*numeric.values())]
+    sets = []
+    for choices in combinations:
+        sets.append(choices)
+        for name, values in numeric.items():
+            sets += [dict(choices, **{name: value}) for value in values if value != parameters.values[name]]
+    return sets
+
+
+def sample_handoff(path, params):
+    """{path: text} of the hand-off manifest a run starting after the first phase reads,
+    as the robot that ran the earlier phases writes it; empty for other runs."""
+    handoff = re.search(r'Path\("([^"]+_handoff\.json)"\)', Path(path).read_text())
+    module = protocol_recorder.load_protocol(path)
+    parameters = protocol_recorder.Parameters()
+    if hasattr(module, 'add_parameters'):
+        module.add_parameters(parameters)
+    values = dict(parameters.values, **params)
+    if not handoff or 'start_at' not in parameters.choices or values['start_at'] == parameters.choices['start_at'][0]:
+        return {}
+    phases = parameters.choices['start_at']
+    wells = [f"{'ABCDEFGH'[i % 8]}{i // 8 + 1}" for i in range(values['num_samples'])]
+    manifest = {
+        'num_samples': values['num_samples'],
+        'phase': phases[phases.index(values['start_at']) - 1],
+        'next_phase': values['start_at'],
+        'plate_ids': {'plate2': 'BCA-preflight', 'plate3': 'plate3-preflight'},
+        'final_volume': values.get('final_volume'),
+        'target_concentration': values.get('target_concentration'),
+        'sample_input': values.get('sample_input'),
+        'bca_plate': values.get('bca_plate'),
+        'well_map': {f"Sample {i + 1}": {'plate3': well} for i, well in enumerate(wells)},
+        'handed_off': 'preflight',
+    }
+    return {handoff.group(1): json.dumps(manifest, indent=2)}
+
+
+def _started(error, path):
+    """Whether the robot had started work when the protocol raised."""
+    tb = error.__traceback__
+    while tb is not None:
+        frame = tb.tb_frame
+        if frame.f_code.co_name == 'run' and Path(frame.f_code.co_filename).resolve() == Path(path).resolve():
+            records = getattr(frame.f_locals.get('protocol'), 'records', [])
+            return any(record['call'] in WORK_CALLS for record in records)
+        tb = tb.tb_next
+    return True
+
+
+def _failure(error, path):
+    """Kind of error and the protocol line it came from."""
+    frames = traceback.extract_tb(error.__traceback__)
+    line = next((frame.lineno for frame in reversed(frames) if Path(frame.filename).resolve() == Path(path).resolve()), None)
+    recorder = Path(protocol_recorder.__file__).resolve()
+    deepest = frames[-1] if frames else None
+    if isinstance(error, NameError):
+        kind = 'undefined name'
+    elif deepest and Path(deepest.filename).resolve() == recorder and deepest.name in ['__getitem__', 'wells', 'columns', 'rows']:
+        kind = 'invalid well'
+    elif 'out of tips' in str(error):
+        kind = 'tips run out'
+    elif isinstance(error, protocol_recorder.LocationIsOccupiedError):
+        kind = 'deck conflict'
+    elif type(error) is Exception and not _started(error, path):
+        # The protocol's own checks turning a parameter combination down before any work
+        kind = 'rejected'
+    else:
+        kind = 'error'
+    return kind, line, f"{type(error).__name__}: {error}"
+
+
+def _well(label):
+    """The well a location label points at, without the offset."""
+    return re.sub(r" \((top|bottom|center) [+-][\d.]+ mm\)$", "", str(label))
+
+
+def _capacity(well):
+    """Well volume in µL from the labware load name, or None."""
+    volumes = re.findall(r"_(\d+(?:\.\d+)?)(ul|ml)", well.split(' of ', 1)[-1].split(' on ')[0])
+    if not volumes:
+        return None
+    value, unit = volumes[-1]
+    return float(value)*(1000 if unit == 'ml' else 1)
+
+
+def volume_problems(records):
+    """Over-draws, overfills and out-of-range volumes in a finished trace."""
+    problems = []
+    levels = {}
+    channels = {}
+
+    def flag(record, message):
+        problems.append((record['index'], message))
+
+    def move(record, well, volume):
+        well = _well(well)
+        if ' of ' not in well:
+            return
+        # A multichannel pipette draws from one reservoir well with every nozzle
+        if re.search(r"_(1|12)_reservoir", well):
+            volume *= channels.get(record['target'], 1)
+        if volume < 0:
+            # Wells nothing was loaded or dispensed into have an unknown volume
+            if well not in levels:
+                return
+            levels[well] += volume
+            if levels[well] < -1e-6:
+                flag(record, f"draws {-levels[well]:.1f} µL more than {well} holds")
+                levels[well] = 0
+            return
+        levels[well] = levels.get(well, 0) + volume
+        capacity = _capacity(well)
+        if capacity and levels[well] > capacity + 1e-6:
+            flag(record, f"fills {well} to {levels[well]:.0f} µL, more than its {capacity:g} µL")
+            levels[well] = capacity
+
+    def check(record, volume, single=False):
+        minimum = MIN_VOLUMES.get(cost_model._pipette_volume(record['target']), 0)
+        if volume is None:
+            return
+        if isinstance(volume, float) and math.isnan(volume):
+            flag(record, f"{record['call']} volume is not a number")
+        elif volume < 0:
+            flag(record, f"{record['call']} volume {volume:.1f} µL is negative")
+        elif 0 < volume < minimum:
+            flag(record, f"{record['call']} volume {volume:.2f} µL is below the {minimum} µL minimum of {record['target']}")
+        elif single and record.get('tip_volume') and volume > record['tip_volume']:
+            flag(record, f"{record['call']} volume {volume:g} µL does not fit a {record['tip_volume']} µL tip")
+
+    for record in records:
+        call = record['call']
+        if call == 'load_liquid':
+            well = _well(record['well'])
+            levels[well] = levels.get(well, 0) + record['volume']
+        elif call == 'move_labware':
+            # Wells are named by where their labware sits, the levels go along with it. Labware
+            # taken off deck is done with, another of the same kind may come back from there.
+            moved = f" of {record['labware']} on {record['source']}"
+            for well in [well for well in levels if well.endswith(moved)]:
+                level = levels.pop(well)
+                if record['dest'] != protocol_recorder.OFF_DECK:
+                    levels[well[:-len(moved)] + f" of {record['labware']} on {record['dest']}"] = level
+        elif call == 'pick_up_tip':
+            channels[record['target']] = len(record['tips'])
+        elif call == 'configure_nozzle_layout':
+            channels.pop(record['target'], None)
+        elif call in ['aspirate', 'dispense', 'mix']:
+            check(record, record['volume'], single=call != 'dispense')
+            if call != 'mix' and record['volume'] is not None and not math.isnan(record['volume']):
+                move(record, record['location'], -record['volume'] if call == 'aspirate' else record['volume'])
+        elif call in cost_model.COMPLEX_CALLS:
+            if record['tips']:
+                channels[record['target']] = len(record['tips'][0])
+            sources, dests = record['source'], record['dest']
+            pairs = max(len(sources), len(dests))
+            volumes = record['volume'] if isinstance(record['volume'], list) else [record['volume']]*pairs
+            for volume in volumes:
+                check(record, volume)
+            if any(volume is None or math.isnan(volume) or volume < 0 for volume in volumes):
+                continue
+            if call == 'transfer':
+                for i, volume in enumerate(volumes):
+                    move(record, sources[i % len(sources)], -volume)
+                    move(record, dests[i % len(dests)], volume)
+            elif call == 'distribute':
+                move(record, sources[0], -(sum(volumes) + (record.get('disposal_volume') or 0)*(record.get('aspirations') or 1)))
+                for dest, volume in zip(dests, volumes):
+                    move(record, dest, volume)
+            else:
+                for source, volume in zip(sources, volumes):
+                    move(record, source, -volume)
+                move(record, dests[0], sum(volumes))
+    return problems
+
+
+def check(path, exhaustive=False, fail_fast=False):
+    """Findings for one protocol. The same problem in other wells, at other volumes or
+    steps is counted once, with the first parameters that show it and how often it came up."""
+    findings = {}
+
+    def found(kind, where, message, params):
+        key = (kind, re.sub(r"\b[A-P]?\d+(\.\d+)?\b", "#", message) if kind in ['volume', 'rejected'] else where + message)
+        finding = findings.setdefault(key, {'kind': kind, 'where': where, 'message': message, 'params': params, 'count': 0})
+        finding['count'] += 1
+
+    for line, name in undefined_names(path):
+        found('undefined name', f"line {line}", f"{name} is never defined", {})
+        if fail_fast:
+            return findings
+    for helper in shared_code.sync(path, write=False):
+        found('stale copy', helper, f"the copy of {helper} differs from {helper}, run shared_code.py", {})
+        if fail_fast:
+            return findings
+    for params in parameter_sets(path, exhaustive):
+        try:
+            protocol = trace_cache.cached_trace(path, params, files=sample_handoff(path, params))
+        except Exception as error:
+            kind, line, message = _failure(error, path)
+            found(kind, f"line {line}", message, params)
+        else:
+            for index, message in volume_problems(protocol.records):
+                found('volume', f"step {index}", message, params)
+        if fail_fast and any(finding['kind'] != 'rejected' for finding in findings.values()):
+            break
+    return findings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check protocols for errors before running them")
+    parser.add_argument("protocols", nargs="*", help="protocol files, every protocol in the repo by default")
+    parser.add_argument("--exhaustive", action="store_true", help="trace the full product of parameter values")
+    parser.add_argument("--fail-fast", action="store_true", help="stop a protocol at its first finding")
+    args = parser.parse_args()
+
+    failed = False
+    for path in args.protocols or benchmark.protocol_files():
+        findings = check(path, args.exhaustive, args.fail_fast)
+        problems = [finding for finding in findings.values() if finding['kind'] != 'rejected']
+        print(f"{Path(path).name}: {f'{len(problems)} problems' if problems else 'OK'}")
+        for finding in sorted(findings.values(), key=lambda finding: finding['kind'] == 'rejected'):
+            seen = f", {finding['count']} times" if finding['count'] > 1 else ""
+            shown = f" (first with {finding['params']}{seen})" if finding['params'] else ""
+            print(f"  {finding['kind']} at {finding['where']}: {finding['message']}{shown}")
+        failed = failed or bool(problems)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,806 @@
+"""Offline dry-runs of the protocols in this repo.
+
+trace() loads a protocol file and calls its run() with a recording stand-in for the
+Opentrons ProtocolContext. Nothing moves and no modules are contacted: every liquid
+handling, tip, labware move, delay and module call is appended to protocol.records as
+a dict, so a run can be inspected or costed on a laptop in milliseconds.
+
+    protocol = trace("ChemProt_Gel_BCA_Normalization_Click_08282025.py", {"num_samples": 24})
+    for record in protocol.records:
+        print(record)
+
+The video recorder and wait_for_file.py are not started, files the protocol writes are
+recorded instead of written (the tables it writes are kept in protocol.files by path),
+and the plate reader export is either the file passed as
+data_file or a synthetic BCA plate with a linear standard curve. Files an earlier run
+leaves behind, such as a hand-off manifest, are passed as files, {path: text}; the
+protocol finds them there instead of on disk. Like the API, loading
+or moving labware or a module where something already sits raises
+LocationIsOccupiedError, modules only take the methods their API context has, and a
+parameter display name, description or unit longer than the app accepts raises
+ParameterNameError.
+"""
+import argparse
+import csv
+import importlib.util
+import io
+import json
+import math
+import re
+import subprocess
+import sys
+import time
+import types
+import warnings
+from collections import Counter
+from contextlib import contextmanager, redirect_stdout
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    from opentrons import protocol_api
+except ImportError:
+    # Protocols import opentrons at the top, so give them the few names they use
+    protocol_api = types.ModuleType("opentrons.protocol_api")
+    protocol_api.ProtocolContext = object
+    protocol_api.OFF_DECK = "off-deck"
+    protocol_api.RuntimeParameterRequiredError = type("RuntimeParameterRequiredError", (Exception,), {})
+    for style in ["ALL", "SINGLE", "COLUMN", "ROW", "PARTIAL_COLUMN"]:
+        setattr(protocol_api, style, style)
+    opentrons = types.ModuleType("opentrons")
+    opentrons.protocol_api = protocol_api
+    sys.modules["opentrons"] = opentrons
+    sys.modules["opentrons.protocol_api"] = protocol_api
+
+OFF_DECK = "off-deck"
+THERMOCYCLER_SLOT = "B1"
+
+# Methods each module context of the API has, by a part of the module's load name
+MODULE_METHODS = {
+    "heatershaker": ("HeaterShakerContext", ["close_labware_latch", "deactivate_heater", "deactivate_shaker", "open_labware_latch",
+                                             "set_and_wait_for_shake_speed", "set_and_wait_for_temperature",
+                                             "set_target_temperature", "wait_for_temperature"]),
+    "thermocycler": ("ThermocyclerContext", ["close_lid", "deactivate", "deactivate_block", "deactivate_lid", "execute_profile",
+                                             "open_lid", "set_block_temperature", "set_lid_temperature"]),
+    "temperature": ("TemperatureModuleContext", ["await_temperature", "deactivate", "set_temperature", "start_set_temperature"]),
+    "magneticblock": ("MagneticBlockContext", []),
+    "magnetic": ("MagneticModuleContext", ["calibrate", "disengage", "engage"]),
+}
+
+
+# Longest parameter texts the app accepts
+PARAMETER_TEXT_LIMITS = {"display_name": 30, "description": 100, "unit": 10}
+
+
+class ParameterNameError(Exception):
+    """A runtime parameter the app refuses to analyse, as the API raises it."""
+
+
+class LocationIsOccupiedError(Exception):
+    """Labware or a module loaded or moved where something already is, as the API raises it."""
+
+
+def _value(constant):
+    # Opentrons constants are enums, the fallbacks above are plain strings
+    return getattr(constant, "value", constant)
+
+
+def _describe(value):
+    """Turn call arguments into something json.dumps can write."""
+    if isinstance(value, (list, tuple)):
+        return [_describe(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _describe(item) for key, item in value.items()}
+    if isinstance(value, (np.integer, np.floating)):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if _value(value) == OFF_DECK:
+        return OFF_DECK
+    return str(value)
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+class Location:
+    def __init__(self, well, reference, z):
+        self.well = well
+        self.reference = reference
+        self.z = z
+
+    def __str__(self):
+        return f"{self.well} ({self.reference} {self.z:+g} mm)"
+
+
+class Well:
+    def __init__(self, labware, well_name):
+        self.labware = labware
+        self.well_name = well_name
+
+    @property
+    def has_tip(self):
+        return self.well_name in self.labware.tips
+
+    @property
+    def parent(self):
+        return self.labware
+
+    def top(self, z=0):
+        return Location(self, "top", z)
+
+    def bottom(self, z=0):
+        return Location(self, "bottom", z)
+
+    def center(self):
+        return Location(self, "center", 0)
+
+    def load_liquid(self, liquid, volume):
+        self.labware.protocol.record("load_liquid", "protocol", well=self, liquid=liquid.name, volume=volume)
+
+    def __str__(self):
+        return f"{self.well_name} of {self.labware}"
+
+
+class Labware:
+    # Grid sizes by the well count in the load name
+    grids = {1: (1, 1), 6: (2, 3), 12: (1, 12), 15: (3, 5), 24: (4, 6), 48: (6, 8), 96: (8, 12), 384: (16, 24)}
+
+    def __init__(self, protocol, load_name, parent):
+        self.protocol = protocol
+        self.load_name = load_name
+        self.parent = parent
+        count = re.search(r"_(\d+)_", load_name)
+        rows, columns = self.grids.get(int(count.group(1)), (8, 12)) if count else (1, 1)
+        self._columns = [[Well(self, f"{chr(ord('A') + row)}{column + 1}") for row in range(rows)] for column in range(columns)]
+        self._wells = {well.well_name: well for column in self._columns for well in column}
+        self.is_tiprack = "tiprack" in load_name
+        self.tips = set(self._wells) if self.is_tiprack else set()
+        capacity = re.search(r"_(\d+)ul", load_name)
+        self.tip_volume = int(capacity.group(1)) if self.is_tiprack and capacity else None
+
+    def __getitem__(self, well_name):
+        return self._wells[well_name]
+
+    def wells(self, *names):
+        if names:
+            return [self._wells[name] for name in names]
+        return [well for column in self._columns for well in column]
+
+    def wells_by_name(self):
+        return dict(self._wells)
+
+    def columns(self, *indices):
+        columns = [list(column) for column in self._columns]
+        return [columns[int(index) - 1 if isinstance(index, str) else index] for index in indices] if indices else columns
+
+    def rows(self, *indices):
+        rows = [list(row) for row in zip(*self._columns)]
+        return [rows[ord(index) - ord("A") if isinstance(index, str) else index] for index in indices] if indices else rows
+
+    def reset(self):
+        self.tips = set(self._wells) if self.is_tiprack else set()
+
+    def load_labware(self, load_name, *args, **kwargs):
+        return self.protocol.load_labware(load_name, self)
+
+    def __str__(self):
+        return f"{self.load_name} on {self.protocol.location_label(self.parent)}"
+
+
+class Module:
+    """Heater-shaker, thermocycler, temperature module or magnetic block.
+
+    The methods the module has in the API (MODULE_METHODS) are recorded with their
+    arguments and otherwise ignored; any other method raises AttributeError like the API.
+    """
+
+    def __init__(self, protocol, model, location):
+        self.protocol = protocol
+        self.model = model
+        self.location = location
+
+    @property
+    def labware(self):
+        return self.protocol.occupant(self)
+
+    @property
+    def slots(self):
+        """Deck slots the module takes, the thermocycler takes A1 as well as B1."""
+        if self.location == THERMOCYCLER_SLOT and "thermocycler" in self.model.lower():
+            return [self.location, "A1"]
+        return [self.location]
+
+    def load_labware(self, load_name, *args, **kwargs):
+        return self.protocol.load_labware(load_name, self)
+
+    def load_adapter(self, load_name, *args, **kwargs):
+        return self.load_labware(load_name)
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+        context, methods = next((known for key, known in MODULE_METHODS.items() if key in self.model.lower()), (None, None))
+        if methods is not None and method not in methods:
+            raise AttributeError(f"'{context}' object has no attribute '{method}'")
+
+        def call(*args, **kwargs):
+            self.protocol.record(method, str(self), args=args, **kwargs)
+        return call
+
+    def __str__(self):
+        return f"{self.model} on {self.location}"
+
+
+class WasteChute:
+    def __init__(self, location="D3"):
+        self.location = location
+
+    def __str__(self):
+        return "Waste Chute"
+
+
+class Liquid:
+    def __init__(self, name, description=None, display_color=None):
+        self.name = name
+        self.description = description
+        self.display_color = display_color
+
+
+class CsvFile:
+    """A CSV file parameter, read from path. Like on the robot, reading one that was not set raises."""
+
+    def __init__(self, path=None):
+        self.path = path
+
+    @property
+    def contents(self):
+        if self.path is None:
+            raise protocol_api.RuntimeParameterRequiredError("CSV parameter needs to be set to a file for full analysis or run.")
+        return Path(self.path).read_text()
+
+    @property
+    def file(self):
+        return io.StringIO(self.contents)
+
+    def parse_as_csv(self, detect_dialect=True, **kwargs):
+        text = self.contents
+        if detect_dialect and text.strip():
+            kwargs.setdefault("dialect", csv.Sniffer().sniff(text.splitlines()[0], delimiters=",;\t"))
+        return list(csv.reader(io.StringIO(text), **kwargs))
+
+
+class Parameters:
+    """Collects add_parameters() defaults into a namespace for protocol.params."""
+
+    def __init__(self):
+        self.values = {}
+        self.choices = {}
+        self.ranges = {}
+        # Texts longer than the app accepts; trace() raises on them, other tools only read the values
+        self.problems = []
+
+    def _add(self, variable_name, default, choices=None, minimum=None, maximum=None, texts=None):
+        self.values[variable_name] = default
+        for field, limit in PARAMETER_TEXT_LIMITS.items():
+            text = (texts or {}).get(field)
+            if text and len(text) > limit:
+                self.problems.append(f'{field} "{text}" of {variable_name} is longer than {limit} characters')
+        if choices:
+            self.choices[variable_name] = [choice["value"] for choice in choices]
+        elif minimum is not None and maximum is not None:
+            self.ranges[variable_name] = (minimum, maximum)
+
+    def add_int(self, variable_name, default, choices=None, minimum=None, maximum=None, **kwargs):
+        self._add(variable_name, default, choices, minimum, maximum, kwargs)
+
+    def add_float(self, variable_name, default, choices=None, minimum=None, maximum=None, **kwargs):
+        self._add(variable_name, default, choices, minimum, maximum, kwargs)
+
+    def add_bool(self, variable_name, default, **kwargs):
+        self._add(variable_name, default, [{"value": False}, {"value": True}], texts=kwargs)
+
+    def add_str(self, variable_name, default, choices=None, **kwargs):
+        self._add(variable_name, default, choices, texts=kwargs)
+
+    def add_csv_file(self, variable_name, **kwargs):
+        self._add(variable_name, CsvFile(), texts=kwargs)
+
+    def override(self, values, ignore_unknown=False):
+        for name, value in values.items():
+            if name not in self.values:
+                if ignore_unknown:
+                    continue
+                raise Exception(f"The protocol has no parameter called {name}")
+            if isinstance(self.values[name], CsvFile):
+                # CSV file parameters are given as the path of the file
+                self.values[name] = CsvFile(value)
+                continue
+            if isinstance(self.values[name], str) and not isinstance(value, str):
+                # Text parameters whose values look like numbers, e.g. bca_plate=384
+                value = str(value)
+            if name in self.choices and value not in self.choices[name]:
+                raise Exception(f"{name} must be one of {self.choices[name]}, not {value}")
+            self.values[name] = value
+        return types.SimpleNamespace(**self.values)
+
+
+class Instrument:
+    def __init__(self, protocol, instrument_name, mount, tip_racks):
+        self.protocol = protocol
+        self.name = instrument_name
+        self.mount = mount
+        self.tip_racks = list(tip_racks or [])
+        self.channels = 96 if "96channel" in instrument_name else 8 if "8channel" in instrument_name else 1
+        self.max_volume = int(instrument_name.rsplit("_", 1)[1])
+        # Also the default disposal volume of a distribute
+        self.min_volume = 5
+        self.nozzles = self.channels
+        self.starting_tip = None
+        self.tip = None
+
+    def __str__(self):
+        return f"{self.name} ({self.mount})"
+
+    def configure_nozzle_layout(self, style, start=None, end=None, tip_racks=None):
+        style = _value(style)
+        self.nozzles = {"SINGLE": 1, "COLUMN": 8, "ALL": self.channels}.get(style, self.channels)
+        if tip_racks is not None:
+            self.tip_racks = list(tip_racks)
+        self.protocol.record("configure_nozzle_layout", str(self), style=style, start=start,
+                             tip_racks=[str(rack) for rack in self.tip_racks])
+
+    def reset_tipracks(self):
+        for rack in self.tip_racks:
+            rack.reset()
+
+    def _next_tips(self):
+        # Racks are searched column by column from column 1. A single nozzle works up each
+        # column from row H, which is the order the Flex uses for the A1 nozzle.
+        for rack in self.tip_racks:
+            wells = rack.wells()
+            if self.starting_tip is not None and self.starting_tip.labware is rack:
+                wells = wells[wells.index(self.starting_tip):]
+            if self.nozzles == 1:
+                tips = [[well] for column in rack.columns() for well in reversed(column) if well in wells and well.has_tip]
+            else:
+                tips = [column for column in rack.columns() if column[0] in wells and all(well.has_tip for well in column)]
+            if tips:
+                return rack, tips[0]
+        raise Exception(f"{self} is out of tips in {', '.join(str(rack) for rack in self.tip_racks)}")
+
+    def _take_tips(self, location=None):
+        if location is not None:
+            well = location.well if isinstance(location, Location) else location
+            column = well.labware.columns()[int(well.well_name[1:]) - 1]
+            tips = [well] if self.nozzles == 1 else column[column.index(well):column.index(well) + self.nozzles]
+            rack = well.labware
+        else:
+            rack, tips = self._next_tips()
+        for tip in tips:
+            rack.tips.discard(tip.well_name)
+        self.tip = rack
+        return [tip.well_name for tip in tips], rack
+
+    def pick_up_tip(self, location=None, **kwargs):
+        tips, rack = self._take_tips(location)
+        self.protocol.record("pick_up_tip", str(self), tips=tips, tip_rack=str(rack), tip_racks=[rack.load_name], tip_volume=rack.tip_volume)
+
+    def drop_tip(self, location=None, **kwargs):
+        self.tip = None
+        self.protocol.record("drop_tip", str(self), location=location)
+
+    def return_tip(self, **kwargs):
+        self.tip = None
+        self.protocol.record("return_tip", str(self))
+
+    def _tip_volume(self):
+        volumes = [rack.tip_volume for rack in self.tip_racks if rack.tip_volume]
+        return min(volumes) if volumes else None
+
+    def _capacity(self):
+        # A transfer is limited by the pipette and the tips it is using
+        return min(self.max_volume, self._tip_volume() or self.max_volume)
+
+    def _liquid_call(self, call, volume, location, **kwargs):
+        self.protocol.record(call, str(self), volume=volume, location=location, tip=self.tip is not None,
+                             tip_volume=self.tip.tip_volume if self.tip else None, **kwargs)
+
+    def aspirate(self, volume=None, location=None, rate=1.0):
+        self._liquid_call("aspirate", volume, location, rate=rate)
+
+    def dispense(self, volume=None, location=None, rate=1.0, **kwargs):
+        self._liquid_call("dispense", volume, location, rate=rate)
+
+    def mix(self, repetitions=1, volume=None, location=None, rate=1.0):
+        self._liquid_call("mix", volume, location, repetitions=repetitions, rate=rate)
+
+    def blow_out(self, location=None):
+        self.protocol.record("blow_out", str(self), location=location)
+
+    def touch_tip(self, location=None, **kwargs):
+        self.protocol.record("touch_tip", str(self), location=location)
+
+    def air_gap(self, volume=None, height=None):
+        self.protocol.record("air_gap", str(self), volume=volume)
+
+    def move_to(self, location, **kwargs):
+        self.protocol.record("move_to", str(self), location=location)
+
+    def _complex(self, call, volume, source, dest, new_tip, always_pick_ups, kwargs):
+        """Record a transfer, distribute or consolidate as one record with the tips it uses."""
+        pick_ups = {"never": 0, "once": 1, "always": always_pick_ups}.get(new_tip, 1)
+        taken = [self._take_tips() for _ in range(pick_ups)]
+        self.tip = None
+        self.protocol.record(call, str(self), volume=volume, source=_as_list(source), dest=_as_list(dest),
+                             new_tip=new_tip, tips=[tips for tips, rack in taken], tip_racks=[rack.load_name for tips, rack in taken],
+                             tip_volume=self._tip_volume(), **kwargs)
+
+    def _reachable(self, wells, kind):
+        """The wells a complex transfer visits. With every nozzle in use, the API keeps only
+        wells in the first row (first two rows of a 384-well plate) and drops the rest."""
+        wells = _as_list(wells)
+        if self.channels == 1 or self.nozzles != self.channels:
+            return wells
+        kept = []
+        for location in wells:
+            well = location.well if isinstance(location, Location) else location
+            rows = "AB" if isinstance(well, Well) and "_384_" in well.labware.load_name else "A"
+            if not isinstance(well, Well) or well.well_name[0] in rows:
+                kept.append(location)
+        if not kept:
+            raise Exception(f"Invalid {kind} for multichannel transfer: {', '.join(str(well) for well in wells)}")
+        return kept
+
+    def transfer(self, volume, source, dest, new_tip="once", **kwargs):
+        source, dest = self._reachable(source, "source"), self._reachable(dest, "target")
+        sources, dests = _as_list(source), _as_list(dest)
+        volumes = _as_list(volume) if isinstance(volume, (list, tuple)) else [volume]*max(len(sources), len(dests))
+        aspirations = sum(math.ceil(v/self._capacity()) for v in volumes if v > 0)
+        # A volume split over several aspirations keeps its tip, even with new_tip='always'
+        pairs = len([v for v in volumes if v > 0])
+        self._complex("transfer", volume, source, dest, new_tip, pairs, dict(kwargs, aspirations=aspirations))
+
+    def distribute(self, volume, source, dest, new_tip="once", disposal_volume=None, **kwargs):
+        # The API reads disposal_volume; a disposal_vol argument is recorded but has no effect
+        source, dest = self._reachable(source, "source"), self._reachable(dest, "target")
+        dests = _as_list(dest)
+        if disposal_volume is None:
+            disposal_volume = self.min_volume
+        per_aspiration = max(1, int((self._capacity() - disposal_volume) // volume)) if volume else len(dests)
+        aspirations = len(_as_list(source)) * math.ceil(len(dests) / per_aspiration)
+        # new_tip='always' on a distribute means one tip per source, not per aspiration
+        pick_ups = len(_as_list(source)) if new_tip == "always" else aspirations
+        self._complex("distribute", volume, source, dest, new_tip, pick_ups, dict(kwargs, disposal_volume=disposal_volume, aspirations=aspirations))
+
+    def consolidate(self, volume, source, dest, new_tip="once", **kwargs):
+        source, dest = self._reachable(source, "source"), self._reachable(dest, "target")
+        sources = _as_list(source)
+        per_aspiration = max(1, int(self._capacity() // volume)) if volume else len(sources)
+        aspirations = math.ceil(len(sources) / per_aspiration)
+        pick_ups = len(_as_list(dest)) if new_tip == "always" else aspirations
+        self._complex("consolidate", volume, source, dest, new_tip, pick_ups, dict(kwargs, aspirations=aspirations))
+
+
+class RecordingProtocol:
+    """Stand-in for ProtocolContext that records what run() asks the robot to do."""
+
+    def __init__(self, params):
+        self.params = params
+        self.records = []
+        self.labware = []
+        self.modules = []
+        self.instruments = []
+        self.clock = 0.0
+        self.peak_deck = 0
+        self.files = {}
+        # Waste chute and trash bins by slot
+        self.fixtures = {}
+
+    def record(self, call, target, **fields):
+        record = {"index": len(self.records), "call": call, "target": target, "clock": self.clock}
+        record.update({key: _describe(value) for key, value in fields.items()})
+        self.records.append(record)
+        return record
+
+    def location_label(self, location):
+        if isinstance(location, Module):
+            return str(location)
+        if isinstance(location, Labware):
+            return str(location)
+        return _describe(location)
+
+    def deck_slots(self):
+        """Slots holding a module or labware right now; the thermocycler takes A1 and B1."""
+        slots = set()
+        for module in self.modules:
+            slots.update(module.slots)
+        for labware in self.labware:
+            parent = labware.parent
+            while isinstance(parent, Labware):
+                parent = parent.parent
+            if isinstance(parent, Module):
+                parent = parent.location
+            if isinstance(parent, str) and re.fullmatch(r"[A-D][1-4]", parent):
+                slots.add(parent)
+        self.peak_deck = max(self.peak_deck, len(slots))
+        return slots
+
+    def occupant(self, location):
+        """The labware, module or fixture in a slot, or the labware on a module or labware."""
+        if location is None or _value(location) == OFF_DECK:
+            return None
+        for labware in self.labware:
+            if labware.parent is location or (isinstance(location, str) and isinstance(labware.parent, str) and labware.parent == location):
+                return labware
+        if isinstance(location, str):
+            for module in self.modules:
+                if location in module.slots:
+                    return module
+            return self.fixtures.get(location)
+        return None
+
+    def _claim(self, location, what, moving=None):
+        """Raise like the API when something other than the labware being moved is already there."""
+        if isinstance(location, WasteChute):
+            # Labware dropped down the chute is gone, any number can go
+            return
+        occupant = self.occupant(location)
+        if occupant is not None and occupant is not moving:
+            raise LocationIsOccupiedError(f"{what} cannot go to {self.location_label(location)}, {occupant} is already there")
+
+    def is_simulating(self):
+        return True
+
+    def load_labware(self, load_name, location=None, label=None, *args, **kwargs):
+        self._claim(location, load_name)
+        labware = Labware(self, load_name, protocol_api.OFF_DECK if _value(location) == OFF_DECK else location)
+        self.labware.append(labware)
+        self.record("load_labware", "protocol", load_name=load_name, location=self.location_label(labware.parent))
+        self.deck_slots()
+        return labware
+
+    def load_adapter(self, load_name, location=None, *args, **kwargs):
+        return self.load_labware(load_name, location)
+
+    def load_module(self, module_name, location=None, *args, **kwargs):
+        module = Module(self, module_name, location or THERMOCYCLER_SLOT)
+        for slot in module.slots:
+            self._claim(slot, module_name)
+        self.modules.append(module)
+        self.record("load_module", "protocol", module=module_name, location=module.location)
+        self.deck_slots()
+        return module
+
+    def load_waste_chute(self):
+        self._claim("D3", "Waste chute")
+        self.fixtures["D3"] = WasteChute()
+        return self.fixtures["D3"]
+
+    def load_trash_bin(self, location=None):
+        if location is None:
+            return WasteChute(None)
+        self._claim(location, "Trash bin")
+        self.fixtures[location] = WasteChute(location)
+        return self.fixtures[location]
+
+    def load_instrument(self, instrument_name, mount, tip_racks=None, **kwargs):
+        instrument = Instrument(self, instrument_name, mount, tip_racks)
+        self.instruments.append(instrument)
+        self.record("load_instrument", "protocol", instrument=instrument_name, mount=mount)
+        return instrument
+
+    def define_liquid(self, name, description=None, display_color=None):
+        return Liquid(name, description, display_color)
+
+    def move_labware(self, labware, new_location, use_gripper=False, **kwargs):
+        self._claim(new_location, labware.load_name, moving=labware)
+        old_location = self.location_label(labware.parent)
+        # The API sentinel, so protocols can compare a parent with protocol_api.OFF_DECK
+        labware.parent = protocol_api.OFF_DECK if _value(new_location) == OFF_DECK else new_location
+        self.record("move_labware", "protocol", labware=labware.load_name, source=old_location,
+                    dest=self.location_label(labware.parent), use_gripper=use_gripper)
+        self.deck_slots()
+
+    def delay(self, seconds=0, minutes=0, msg=None):
+        record = self.record("delay", "protocol", seconds=seconds + 60*minutes, msg=msg)
+        self.clock += record["seconds"]
+
+    def pause(self, msg=None):
+        self.record("pause", "protocol", msg=msg)
+
+    def comment(self, msg):
+        self.record("comment", "protocol", msg=msg)
+
+    def home(self):
+        self.record("home", "protocol")
+
+    def set_rail_lights(self, on):
+        self.record("set_rail_lights", "protocol", on=on)
+
+
+class _Process:
+    """What subprocess.Popen hands back while tracing."""
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.returncode = 0
+
+    def communicate(self, *args, **kwargs):
+        return self.stdout, None
+
+    def wait(self, *args, **kwargs):
+        return 0
+
+    def poll(self):
+        return 0
+
+    def terminate(self):
+        pass
+
+    kill = terminate
+
+
+def synthetic_bca_plate(sample_concentration=5.0, rows=8, columns=12):
+    """An absorbance block laid out like the plate reader export, 8 x 12 or 16 x 24.
+
+    Columns 1-3 hold the standard curve the protocols fit (10 mg/mL down to 0), in every
+    row of a 96-well plate and every other row of a 384-well plate, and the rest of the
+    plate reads as sample_concentration on the same line.
+    """
+    standards = [10, 5, 2.5, 1.25, 0.625, 0.3125, 0.15625, 0]
+    step = rows // 8
+    values = [[0.1 + 0.08*(standards[row // step] if column < 3 and row % step == 0 else sample_concentration)
+               for column in range(columns)] for row in range(rows)]
+    return pd.DataFrame(values)
+
+
+@contextmanager
+def _offline(protocol, data_file, files=None):
+    """Keep run() off the hardware and the file system for the length of a trace."""
+    original = (subprocess.Popen, time.monotonic, pd.read_excel, pd.DataFrame.to_csv, Path.write_text, Path.exists, Path.read_text)
+    files = {str(path): text for path, text in (files or {}).items()}
+
+    def popen(args, *popen_args, **kwargs):
+        protocol.record("subprocess", "protocol", args=args)
+        # wait_for_file.py prints a line and then the path of the new export
+        return _Process(f"Found file:\n{data_file or 'synthetic_bca_plate.xlsx'}\n")
+
+    def read_excel(path, *args, **kwargs):
+        protocol.record("read_excel", "protocol", path=str(path))
+        if data_file:
+            return original[2](path, *args, **kwargs)
+        # usecols spans the plate columns, e.g. "C:N" for 12
+        first, last = kwargs.get("usecols", "C:N").split(":")
+        return synthetic_bca_plate(rows=kwargs.get("nrows", 8), columns=ord(last) - ord(first) + 1)
+
+    def to_csv(frame, path=None, *args, **kwargs):
+        protocol.record("write_file", "protocol", path=str(path), rows=len(frame))
+        protocol.files[str(path)] = frame.copy()
+
+    def write_text(path, data, *args, **kwargs):
+        protocol.record("write_file", "protocol", path=str(path), size=len(data))
+
+    def exists(path, *args, **kwargs):
+        return str(path) in files or original[5](path, *args, **kwargs)
+
+    def read_text(path, *args, **kwargs):
+        if str(path) in files:
+            protocol.record("read_file", "protocol", path=str(path))
+            return files[str(path)]
+        return original[6](path, *args, **kwargs)
+
+    subprocess.Popen = popen
+    # Incubation bookkeeping reads the clock, so only recorded delays move it
+    time.monotonic = lambda: protocol.clock
+    pd.read_excel = read_excel
+    pd.DataFrame.to_csv = to_csv
+    Path.write_text = write_text
+    Path.exists = exists
+    Path.read_text = read_text
+    try:
+        yield
+    finally:
+        subprocess.Popen, time.monotonic, pd.read_excel, pd.DataFrame.to_csv, Path.write_text, Path.exists, Path.read_text = original
+
+
+# Compiled protocol files by path, modification time and size
+_compiled = {}
+
+
+def load_protocol(path):
+    """Import a protocol file; the file names in this repo are not valid module names.
+
+    Every call gives a fresh module, but a file is only compiled again when it changes.
+    """
+    path = Path(path)
+    name = re.sub(r"\W", "_", path.stem)
+    stat = path.stat()
+    key = (str(path.resolve()), stat.st_mtime_ns, stat.st_size)
+    if key not in _compiled:
+        _compiled[key] = compile(path.read_bytes(), str(path), "exec")
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    exec(_compiled[key], module.__dict__)
+    return module
+
+
+def trace(path, params=None, data_file=None, ignore_unknown=False, quiet=False, files=None):
+    """Run a protocol against the recorder and return the RecordingProtocol.
+
+    With ignore_unknown, parameters the protocol does not define are skipped, so the
+    same overrides can be applied to several variants of a protocol. quiet hides what
+    the protocol prints and the pandas warnings its analysis raises; the warnings are
+    kept in protocol.warnings either way. files are the texts the protocol reads by path.
+    """
+    module = load_protocol(path)
+    parameters = Parameters()
+    if hasattr(module, "add_parameters"):
+        module.add_parameters(parameters)
+    if parameters.problems:
+        raise ParameterNameError("; ".join(parameters.problems))
+    protocol = RecordingProtocol(parameters.override(params or {}, ignore_unknown))
+    with _offline(protocol, data_file, files), warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        if quiet:
+            with redirect_stdout(io.StringIO()):
+                module.run(protocol)
+        else:
+            module.run(protocol)
+    protocol.warnings = [f"{warning.category.__name__}: {warning.message}" for warning in caught]
+    if not quiet:
+        for warning in caught:
+            warnings.showwarning(warning.message, warning.category, warning.filename, warning.lineno)
+    return protocol
+
+
+def summarize(protocol):
+    """Counts of calls, tips per rack, volume moved and time spent waiting."""
+    calls = Counter(record["call"] for record in protocol.records)
+    pick_ups = 0
+    tips = 0
+    volume = 0.0
+    for record in protocol.records:
+        if record["call"] == "pick_up_tip":
+            pick_ups += 1
+            tips += len(record["tips"])
+        if record["call"] in ["transfer", "distribute", "consolidate"]:
+            pick_ups += len(record["tips"])
+            tips += sum(len(pick_up) for pick_up in record["tips"])
+            volumes = record["volume"] if isinstance(record["volume"], list) else [record["volume"]]*max(len(record["source"]), len(record["dest"]))
+            volume += sum(volumes)
+    return {
+        "calls": dict(calls),
+        "tip_pick_ups": pick_ups,
+        "tips": tips,
+        "volume_ul": round(volume, 1),
+        "delay_minutes": round(sum(record["seconds"] for record in protocol.records if record["call"] == "delay") / 60, 1),
+        "pauses": calls.get("pause", 0),
+    }
+
+
+def _parse_value(text):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return text
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trace a protocol's run() without a robot")
+    parser.add_argument("protocol", help="protocol file to trace")
+    parser.add_argument("params", nargs="*", help="parameter overrides as name=value")
+    parser.add_argument("--data-file", help="plate reader export to normalize against")
+    parser.add_argument("--records", help="write every record to this JSON lines file")
+    args = parser.parse_args()
+
+    overrides = dict((name, _parse_value(value)) for name, value in (param.split("=", 1) for param in args.params))
+    protocol = trace(args.protocol, overrides, args.data_file, quiet=True)
+    if args.records:
+        with open(args.records, "w") as records_file:
+            for record in protocol.records:
+                records_file.write(json.dumps(record) + "\n")
+    print(json.dumps(summarize(protocol), indent=2))
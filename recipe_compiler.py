@@ -0,0 +1,548 @@
+"""Compile declarative recipes into Flex protocols.
+
+A recipe (JSON, see recipes/) lists what a BCA, normalization or click protocol needs:
+metadata, runtime parameters, modules, labware, pipettes, liquids, the sample tubes and
+where each sample goes, and phases of steps. Steps are pipetting (transfer, distribute,
+consolidate), a serial dilution, labware moves and loads, module calls, delays, pauses,
+comments and the BCA analysis that turns the plate reader file into normalization
+volumes. The compiler writes a protocol file for the Flex API from it:
+
+    python recipe_compiler.py recipes/westernblot_bca_normalize.json
+    python recipe_compiler.py recipes/westernblot_bca_normalize.json --check num_samples=18
+
+Before the code is written the steps go through these passes, each reported with what
+it changed:
+
+- moves: a labware move to where the labware already is is dropped, and two moves of
+  the same labware with nothing using it in between become one (or none when it comes
+  back to where it was)
+- fusion: a step done for every sample from one reagent becomes one call over every
+  sample's wells, and neighbouring calls of one pipette with the same source, volume and
+  settings are merged into one call over all their wells
+- tips: neighbouring calls of one pipette from the same source into wells that hold
+  nothing yet share one tip instead of taking a fresh tip each
+- nozzles: configure_nozzle_layout is only called when a pipette's layout or tip rack
+  changes
+
+Fusion and tip sharing only apply to wells nothing has been dispensed into yet, so a
+tip never carries one well's contents to another. Sample wells come from the samples
+section: the BCA wells of the standards and samples from plate_map.py, which is
+copied into the compiled protocol to read the plate with, and one output well per sample column
+by column. --check traces the compiled protocol with
+protocol_recorder and compares its estimated time and tips with the hand-written
+protocol the recipe names as its reference.
+"""
+import argparse
+import json
+import re
+from pathlib import Path
+
+import shared_code
+
+OUTPUT = Path("compiled")
+
+PIPETTING = ['transfer', 'distribute', 'consolidate']
+ROWS = "ABCDEFGH"
+SAMPLE_REFS = ['sample.tube', 'sample.bca', 'sample.output']
+
+
+def load_recipe(path):
+    recipe = json.loads(Path(path).read_text())
+    for section in ['metadata', 'labware', 'pipettes', 'samples', 'phases']:
+        if section not in recipe:
+            raise Exception(f"{path} has no {section} section")
+    return recipe
+
+
+class Compiler:
+    """Steps of one recipe, the passes over them and the protocol source they make."""
+
+    def __init__(self, recipe, source=None):
+        self.recipe = recipe
+        self.source = source
+        self.params = [param['variable_name'] for param in recipe.get('parameters', [])]
+        self.constants = recipe.get('constants', {})
+        self.modules = recipe.get('modules', {})
+        self.labware = recipe['labware']
+        self.pipettes = recipe['pipettes']
+        self.samples = recipe['samples']
+        self.steps = []
+        for phase in recipe['phases']:
+            self.steps.append({'action': 'phase', 'name': phase['name']})
+            self.steps += [self._step(step) for step in phase['steps']]
+        self.report = {}
+
+    # ---------------- Reading the recipe ----------------
+    def _step(self, step):
+        step = dict(step)
+        if step['action'] in PIPETTING:
+            if step['pipette'] not in self.pipettes:
+                raise Exception(f"Unknown pipette {step['pipette']}")
+            step['dest'] = step['dest'] if isinstance(step['dest'], list) else [step['dest']]
+            for ref in [step['source']] + step['dest']:
+                self._labware_of(ref)
+            step.setdefault('options', {})
+            step.setdefault('new_tip', 'once')
+            step.setdefault('each_sample', False)
+        return step
+
+    def _labware_of(self, ref):
+        """The labware a well reference points into."""
+        if ref in SAMPLE_REFS:
+            name = self.samples[ref.split('.')[1]]['labware'] if ref != 'sample.tube' else self.samples['labware']
+        else:
+            name = ref.split(':')[0]
+        if name not in self.labware:
+            raise Exception(f"Unknown labware {name} in {ref}")
+        return name
+
+    def _wells(self, ref):
+        """(labware, key) of the wells a reference covers, for telling whether wells already hold something."""
+        if ref in SAMPLE_REFS:
+            return [(self._labware_of(ref), ref)]
+        name, wells = ref.split(':')
+        return [(name, well) for well in wells.split(',')]
+
+    @staticmethod
+    def _overlap(held, wanted):
+        # Sample sets and templated wells may be anywhere on their labware
+        if held[0] != wanted[0]:
+            return False
+        literal = re.compile(r"[A-P]\d+$")
+        return held[1] == wanted[1] or not (literal.match(held[1]) and literal.match(wanted[1]))
+
+    def _clean(self, contents, refs):
+        """Whether nothing has been dispensed into any well of refs yet."""
+        return not any(self._overlap(held, wanted) for wanted in [well for ref in refs for well in self._wells(ref)] for held in contents)
+
+    def _fill(self, contents, step):
+        """Contents after a step, as (labware, key) of the wells something went into."""
+        if step['action'] in PIPETTING:
+            contents |= {well for ref in step['dest'] for well in self._wells(ref)}
+        elif step['action'] == 'serial_dilution':
+            contents.add((step['column'].split(':')[0], 'column'))
+        elif step['action'] == 'load':
+            contents -= {well for well in contents if well[0] == step['labware']}
+        return contents
+
+    def _uses(self, step, name, location):
+        """Whether a step works on a labware, or on the module it sits on."""
+        if step['action'] in PIPETTING:
+            return name in [self._labware_of(ref) for ref in [step['source']] + step['dest']] + step['nozzles'].split()
+        if step['action'] == 'serial_dilution':
+            return name in [step['source'].split(':')[0], step['column'].split(':')[0]] + step['nozzles'].split()
+        if step['action'] == 'module':
+            return location.split('.')[0] == step['module']
+        return step['action'] in ['load', 'bca_analysis']
+
+    # ---------------- Passes ----------------
+    def minimize_moves(self):
+        locations = {name: labware['location'] for name, labware in self.labware.items()}
+        removed = 0
+        steps = list(self.steps)
+        i = 0
+        while i < len(steps):
+            step = steps[i]
+            if step['action'] == 'load':
+                locations[step['labware']] = step['location']
+            if step['action'] != 'move':
+                i += 1
+                continue
+            name = step['labware']
+            if locations[name] == step['to']:
+                del steps[i]
+                removed += 1
+                continue
+            # The next move of this labware, if nothing touches it or takes either of its places before then
+            following = None
+            for j in range(i + 1, len(steps)):
+                if steps[j]['action'] == 'move' and steps[j]['labware'] == name:
+                    following = j
+                    break
+                if (self._uses(steps[j], name, step['to']) or steps[j]['action'] == 'pause'
+                        or steps[j].get('to', steps[j].get('location')) in [locations[name], step['to']]):
+                    break
+            if following is not None:
+                steps[following] = dict(steps[following], gripper=steps[following].get('gripper', True) and step.get('gripper', True))
+                del steps[i]
+                removed += 1
+                continue
+            locations[name] = step['to']
+            i += 1
+        self.steps = steps
+        self.report['moves removed'] = removed
+
+    def fuse(self):
+        hoisted = 0
+        merged = 0
+        contents = set()
+        steps = []
+        for step in self.steps:
+            if step['action'] in PIPETTING:
+                step = dict(step, clean=self._clean(contents, step['dest']))
+            if step.get('clean') and step['each_sample'] and step['source'] not in SAMPLE_REFS and step['new_tip'] == 'once':
+                # One call over every sample's wells instead of a call per sample
+                step = dict(step, each_sample=False)
+                hoisted += 1
+            previous = steps[-1] if steps else None
+            if (previous and step.get('clean') and previous.get('clean') and not step['each_sample'] and not previous['each_sample']
+                    and all(previous.get(key) == step.get(key) for key in ['action', 'pipette', 'nozzles', 'source', 'volume', 'options', 'new_tip'])
+                    and not isinstance(step['volume'], str)):
+                steps[-1] = dict(previous, dest=previous['dest'] + step['dest'])
+                merged += 1
+            else:
+                steps.append(step)
+            contents = self._fill(contents, step)
+        self.steps = steps
+        self.report['per-sample steps made one call'] = hoisted
+        self.report['calls merged'] = merged
+
+    def share_tips(self):
+        shared = 0
+        previous = None
+        for step in self.steps:
+            if step['action'] in PIPETTING:
+                # Both calls only ever touch the source and wells that held nothing
+                chained = (previous is not None and previous['clean'] and step['clean']
+                           and not step['each_sample'] and not previous['each_sample']
+                           and step['new_tip'] == 'once' and previous['new_tip'] == 'once'
+                           and all(previous.get(key) == step.get(key) for key in ['pipette', 'nozzles', 'source']))
+                if chained:
+                    previous.setdefault('tip', 'first')
+                    step['tip'] = 'next'
+                    shared += 1
+                previous = step
+            elif step['action'] not in ['comment', 'phase']:
+                previous = None
+        self.report['tips shared'] = shared
+
+    def compile(self):
+        self.minimize_moves()
+        self.fuse()
+        self.share_tips()
+        return self.emit()
+
+    # ---------------- Code ----------------
+    def expression(self, value, each_sample=True):
+        """Python source of a recipe value: parameters become protocol.params, sample.x the sample's x."""
+        if not isinstance(value, str):
+            return repr(tuple(value)) if isinstance(value, list) else repr(value)
+
+        def name(match):
+            if match.group(1):
+                return f"sample['{match.group(2)}']"
+            if match.group(2) in self.params:
+                return f"protocol.params.{match.group(2)}"
+            return match.group(2)
+
+        code = re.sub(r"\b(sample\.)?([A-Za-z_]\w*)\b", name, value)
+        if not each_sample and 'sample[' in code:
+            return f"[{code} for sample in samples]"
+        return code
+
+    def well_name(self, well):
+        if '{' not in well:
+            return repr(well)
+        return "f'" + re.sub(r"\{(\w+)\}", lambda match: "{" + self.expression(match.group(1)) + "}", well) + "'"
+
+    def location(self, place):
+        if place == 'off_deck':
+            return "protocol_api.OFF_DECK"
+        if place.endswith('.adapter'):
+            return f"{place.split('.')[0]}_adapter"
+        if place in self.modules:
+            return place
+        return repr(place)
+
+    def wells_code(self, ref, each_sample, bottom=None):
+        """Source of the well or wells a reference stands for, with the bottom offset if given."""
+        at = f".bottom(z={bottom})" if bottom is not None else ""
+        if ref in SAMPLE_REFS:
+            name = self._labware_of(ref)
+            key = ref.split('.')[1]
+            if key == 'bca':
+                return f"[{name}[well]{at} for well in sample['bca']]" if each_sample else \
+                    f"[{name}[well]{at} for sample in samples for well in sample['bca']]"
+            return f"{name}[sample['{key}']]{at}" if each_sample else f"[{name}[sample['{key}']]{at} for sample in samples]"
+        name, wells = ref.split(':')
+        if wells == '*':
+            return f"[well{at} for well in {name}.wells()]" if at else f"{name}.wells()"
+        codes = [f"{name}[{self.well_name(well)}]{at}" for well in wells.split(',')]
+        return codes[0] if len(codes) == 1 else "[" + ", ".join(codes) + "]"
+
+    def pipetting(self, step, indent):
+        each_sample = step['each_sample']
+        options = dict(step['options'])
+        bottom = options.pop('bottom', None)
+        dests = [self.wells_code(ref, each_sample, bottom) for ref in step['dest']]
+        if len(dests) > 1 and all(ref not in SAMPLE_REFS and not ref.endswith(':*') for ref in step['dest']):
+            # Merged wells of fixed names make one list
+            dests = ["[" + ", ".join(code.strip('[]') for code in dests) + "]"]
+        elif len(dests) > 1:
+            dests = [" + ".join(code if code.startswith('[') or code.endswith('wells()') else f"[{code}]" for code in dests)]
+        new_tip = 'never' if step.get('tip') else step['new_tip']
+        arguments = [self.expression(step['volume'], each_sample), self.wells_code(step['source'], each_sample), dests[0]]
+        arguments += [f"{key}={self.expression(value)}" for key, value in options.items()]
+        arguments.append(f"new_tip='{new_tip}'")
+        lines = []
+        if step.get('tip') == 'first':
+            lines.append(f"{indent}{step['pipette']}.pick_up_tip()")
+        lines.append(self.call(indent, f"{step['pipette']}.{step['action']}", arguments))
+        return lines
+
+    @staticmethod
+    def call(indent, function, arguments):
+        """A call with one argument per line, lined up after the bracket."""
+        opening = f"{indent}{function}("
+        return opening + f",\n{' '*len(opening)}".join(arguments) + ")"
+
+    def emit(self):
+        recipe = self.recipe
+        lines = [f"# Compiled from {self.source or 'a recipe'} by recipe_compiler.py, change the recipe rather than this file",
+                 "from opentrons import protocol_api",
+                 "from opentrons.protocol_api import SINGLE, ALL",
+                 "import pandas as pd",
+                 "import numpy as np",
+                 "import math",
+                 "import subprocess",
+                 "from pathlib import Path",
+                 "import datetime",
+                 "import sys",
+                 "",
+                 "# Per-step timing log for live runs, see run_telemetry.py",
+                 'sys.path.append("/var/lib/jupyter/notebooks")',
+                 "try:",
+                 "    import run_telemetry",
+                 "except ImportError:",
+                 "    run_telemetry = None",
+                 "",
+                 "# History of every run's normalization results, see run_history.py",
+                 "try:",
+                 "    import run_history",
+                 "except ImportError:",
+                 "    run_history = None",
+                 "",
+                 "# Wells of the standards and samples on the BCA plate, see plate_map.py",
+                 *shared_code.block('plate_map.py'),
+                 "",
+                 f"metadata = {json.dumps(recipe['metadata'], indent=4, ensure_ascii=False)}",
+                 "",
+                 f"requirements = {json.dumps(recipe.get('requirements', {'robotType': 'Flex', 'apiLevel': '2.21'}), indent=4)}",
+                 "",
+                 "def add_parameters(parameters):"]
+        for param in recipe.get('parameters', []):
+            param = dict(param)
+            kind = param.pop('type')
+            lines.append(f"    parameters.add_{kind}(")
+            lines.append(",\n".join(f"        {key}={value!r}" for key, value in param.items()))
+            lines.append("    )")
+        if not recipe.get('parameters'):
+            lines.append("    pass")
+
+        lines += ["", "def run(protocol: protocol_api.ProtocolContext):",
+                  "    telemetry = run_telemetry.instrument(protocol, metadata['protocolName']) if run_telemetry else None",
+                  "    history = run_history.start(protocol, metadata['protocolName'], telemetry.run_id if telemetry else None) if run_history else None"]
+        lines += [f"    {name} = {value!r}" for name, value in self.constants.items()]
+
+        lines += ["", "    # Load modules"]
+        for name, module in self.modules.items():
+            location = f", {module['location']!r}" if module.get('location') else ""
+            lines.append(f"    {name} = protocol.load_module({module['load_name']!r}{location})")
+            if module.get('adapter'):
+                lines.append(f"    {name}_adapter = {name}.load_adapter({module['adapter']!r})")
+        if recipe.get('waste_chute', True):
+            lines.append("    chute = protocol.load_waste_chute()")
+
+        lines += ["", "    # Load labware"]
+        for name, labware in self.labware.items():
+            lines.append(self.load_line(name, labware['load_name'], labware['location'], "    "))
+
+        lines += ["", "    # Load pipettes"]
+        for name, pipette in self.pipettes.items():
+            lines.append(f"    {name} = protocol.load_instrument({pipette['load_name']!r}, {pipette['mount']!r})")
+
+        lines += self.sample_lines()
+
+        lines += ["", "    # Liquid definitions"]
+        for i, liquid in enumerate(recipe.get('liquids', [])):
+            lines.append(f"    liquid_{i} = protocol.define_liquid(name={liquid['name']!r}, display_color={liquid['color']!r})")
+            name, well = liquid['well'].split(':')
+            lines.append(f"    {name}[{well!r}].load_liquid(liquid=liquid_{i}, volume={liquid['volume']!r})")
+        lines += ["    for sample in samples:",
+                  f"        {self.samples['labware']}[sample['tube']].load_liquid(liquid=protocol.define_liquid(name=sample['name'], display_color={self.samples.get('color', '#FFA000')!r}), volume={self.samples.get('volume', 200)!r})"]
+
+        nozzles = {}
+        for step in self.steps:
+            indent = "    "
+            action = step['action']
+            if step.get('note'):
+                lines.append(f"{indent}# {step['note']}")
+            if action == 'phase':
+                lines += ["", f"    # ---------------- {step['name']} ----------------", f"    protocol.comment({'Running ' + step['name']!r})"]
+            elif action in PIPETTING:
+                # Layout changes only, configure_nozzle_layout resets the pipette's tip tracking
+                style, rack = step['nozzles'].split()
+                if nozzles.get(step['pipette']) != (style, rack):
+                    start = ', start="A1"' if style == 'SINGLE' else ""
+                    lines.append(f"{indent}{step['pipette']}.configure_nozzle_layout(style={style}{start}, tip_racks=[{rack}])")
+                    nozzles[step['pipette']] = (style, rack)
+                if step['each_sample']:
+                    lines.append(f"{indent}for sample in samples:")
+                    lines += self.pipetting(step, indent + "    ")
+                else:
+                    lines += self.pipetting(step, indent)
+                if step.get('tip') == 'next' and not self._continues(step):
+                    lines.append(f"{indent}{step['pipette']}.drop_tip()")
+            elif action == 'serial_dilution':
+                lines += self.dilution_lines(step, nozzles)
+            elif action == 'move':
+                gripper = ", use_gripper=True" if step.get('gripper', True) else ""
+                lines.append(f"{indent}protocol.move_labware(labware={step['labware']}, new_location={self.location(step['to'])}{gripper})")
+            elif action == 'load':
+                lines.append(self.load_line(step['labware'], step['load_name'], step['location'], indent))
+            elif action == 'module':
+                arguments = [self.expression(value) for value in step.get('args', [])]
+                arguments += [f"{key}={self.expression(value)}" for key, value in step.get('kwargs', {}).items()]
+                lines.append(f"{indent}{step['module']}.{step['call']}({', '.join(arguments)})")
+            elif action == 'delay':
+                lines.append(f"{indent}protocol.delay(minutes={step['minutes']!r})")
+            elif action == 'pause':
+                lines.append(f"{indent}protocol.pause({step['message']!r})" if step.get('message') else f"{indent}protocol.pause()")
+            elif action == 'comment':
+                lines.append(f"{indent}protocol.comment({step['text']!r})")
+            elif action == 'bca_analysis':
+                lines += self.analysis_lines(step)
+            else:
+                raise Exception(f"Unknown action {action}")
+        return "\n".join(lines) + "\n"
+
+    def _continues(self, step):
+        """Whether the next pipetting call goes on with this step's tip."""
+        following = self.steps[self.steps.index(step) + 1:]
+        for other in following:
+            if other['action'] in PIPETTING:
+                return other.get('tip') == 'next'
+            if other['action'] not in ['comment', 'phase']:
+                return False
+        return False
+
+    def load_line(self, name, load_name, place, indent):
+        if place in self.modules or place.endswith('.adapter'):
+            return f"{indent}{name} = {self.location(place)}.load_labware({load_name!r})"
+        return f"{indent}{name} = protocol.load_labware({load_name!r}, {self.location(place)})"
+
+    def sample_lines(self):
+        samples = self.samples
+        bca = samples['bca']
+        output = samples['output']
+        return ["",
+                "    # Samples in order: the tube, the BCA wells from the plate map and the output well,",
+                "    # column by column",
+                f"    sample_tubes = {samples['tubes']!r}",
+                "    if protocol.params.num_samples > len(sample_tubes):",
+                "        raise Exception(f\"At most {len(sample_tubes)} samples fit in the tubes.\")",
+                f"    bca_map = compile_map(protocol.params.num_samples, {bca.get('plate', '96')!r}, {bca['replicates']})",
+                "    samples = []",
+                "    for index in range(protocol.params.num_samples):",
+                "        samples.append({'name': f'Sample {index + 1}', 'tube': sample_tubes[index],",
+                "                        'bca': bca_map.samples[index]['wells'],",
+                f"                        'output': f\"{{'{ROWS}'[index % 8]}}{{index // 8 + {output.get('first_column', 1)}}}\"}})"]
+
+    def dilution_lines(self, step, nozzles):
+        pipette = step['pipette']
+        name, column = step['column'].split(':')
+        rows = step.get('rows', 'ABCDEFG')
+        style, rack = step['nozzles'].split()
+        lines = []
+        if nozzles.get(pipette) != (style, rack):
+            start = ', start="A1"' if style == 'SINGLE' else ""
+            lines.append(f"    {pipette}.configure_nozzle_layout(style={style}{start}, tip_racks=[{rack}])")
+            nozzles[pipette] = (style, rack)
+        options = [f"{key}={self.expression(value)}" for key, value in step.get('options', {}).items()]
+        dilution = [f"{key}={self.expression(value)}" for key, value in step.get('dilution_options', {}).items()]
+        well = self.well_name("{source}" + column)
+        lines += [self.call("    ", f"{pipette}.transfer", [repr(step['volume']), self.wells_code(step['source'], False),
+                                                            f"{name}[{self.well_name(rows[0] + column)}]"] + options + ["new_tip='once'"]),
+                  f"    {pipette}.pick_up_tip()",
+                  f"    for source, dest in zip({rows[:-1]!r}, {rows[1:]!r}):",
+                  self.call("        ", f"{pipette}.transfer", [repr(step['volume']), f"{name}[{well}]", f"{name}[{well.replace('{source}', '{dest}')}]"]
+                            + dilution + ["new_tip='never'"]),
+                  "    # Take the excess off the last standard",
+                  f"    {pipette}.aspirate({step['volume']!r}, {name}[{self.well_name(rows[-1] + column)}])",
+                  f"    {pipette}.drop_tip()"]
+        return lines
+
+    def analysis_lines(self, step):
+        lines = [f"    protocol.comment({step['message']!r})"] if step.get('message') else []
+        return lines + [
+                "    find_file = subprocess.Popen(['python3', \"/var/lib/jupyter/notebooks/wait_for_file.py\"], stdout=subprocess.PIPE, text=True)",
+                "    stdout, stderr = find_file.communicate()",
+                "    if stderr:",
+                "        raise ValueError(f\"Error while waiting for file: {stderr}\")",
+                "    file_path = stdout.splitlines()[1]",
+                "    if not file_path:",
+                "        raise ValueError(\"No file path returned by wait_for_file.py\")",
+                "    protocol.comment(f\"Successfully loaded: {file_path}\")",
+                "    df = pd.read_excel(file_path, header=5, nrows=8, usecols=\"C:N\")",
+                "",
+                "    # Mean absorbance of replicate wells, read by well name from the reader block",
+                "    def absorbance(wells):",
+                f"        return np.mean([df.iloc['{ROWS}'.index(well[0]), int(well[1:]) - 1] for well in wells])",
+                "",
+                f"    standard_concentrations = {step.get('standards', [10, 5, 2.5, 1.25, 0.625, 0.3125, 0.15625, 0])!r}",
+                "    standard_absorbance = [absorbance(standard['wells']) for standard in bca_map.standards]",
+                "    slope, intercept = np.polyfit(standard_concentrations, standard_absorbance, 1)",
+                "    y_pred = slope*np.array(standard_concentrations) + intercept",
+                "    r_squared = 1 - np.sum((standard_absorbance - y_pred) ** 2)/np.sum((standard_absorbance - np.mean(standard_absorbance)) ** 2)",
+                "",
+                f"    final_volume = {self.expression(step['final_volume'])}",
+                "    unknown_samples = pd.DataFrame({'Sample': [sample['name'] for sample in samples],",
+                "                                    'Mean Absorbance': [absorbance(sample['bca']) for sample in samples]})",
+                "    unknown_samples['Protein Concentration (mg/mL)'] = (unknown_samples['Mean Absorbance'] - intercept) / slope",
+                f"    unknown_samples['Sample Volume (µL)'] = {self.expression(step['protein_ug'])} / unknown_samples['Protein Concentration (mg/mL)']",
+                "    unknown_samples['Diluent Volume (µL)'] = final_volume - unknown_samples['Sample Volume (µL)']",
+                "    if any(unknown_samples['Sample Volume (µL)'] > final_volume):",
+                "        raise Exception(\"Aborting protocol: at least one sample volume exceeds the final volume threshold.\")",
+                "    normalized_samples = unknown_samples[['Sample', 'Protein Concentration (mg/mL)', 'Sample Volume (µL)', 'Diluent Volume (µL)']]",
+                "    if history:",
+                "        history.add_plate(file_path, df, (slope, intercept, r_squared), unknown_samples)",
+                f"    normalized_samples.to_csv(Path({step.get('directory', '/var/lib/jupyter/notebooks/Data/')!r}).joinpath(f\"Protocol_output_{{datetime.date.today().strftime('%y%m%d')}}.csv\"))",
+                "    for sample, volume, diluent in zip(samples, normalized_samples['Sample Volume (µL)'], normalized_samples['Diluent Volume (µL)']):",
+                "        sample['volume'] = volume",
+                "        sample['diluent'] = diluent"]
+
+
+def compile_recipe(path):
+    """Protocol source for a recipe file and what each pass changed."""
+    compiler = Compiler(load_recipe(path), Path(path).as_posix())
+    return compiler.compile(), compiler.report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile a protocol recipe into a Flex protocol")
+    parser.add_argument("recipes", nargs="+", help="recipe JSON files")
+    parser.add_argument("--out", default=OUTPUT, help="directory for the compiled protocols")
+    parser.add_argument("--check", nargs="*", metavar="name=value",
+                        help="trace the compiled protocol, with these parameters, against the recipe's reference protocol")
+    args = parser.parse_args()
+
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    for path in args.recipes:
+        source, report = compile_recipe(path)
+        destination = out / f"{Path(path).stem}.py"
+        destination.write_text(source)
+        print(f"{path} -> {destination}: " + ", ".join(f"{count} {name}" for name, count in report.items()))
+        if args.check is not None:
+            import cost_model
+            import protocol_recorder
+            overrides = dict((name, protocol_recorder._parse_value(value)) for name, value in (param.split("=", 1) for param in args.check))
+            compared = [destination]
+            reference = load_recipe(path).get('reference')
+            if reference:
+                compared.append(Path(path).parent.parent / reference)
+            for protocol_file in compared:
+                protocol = protocol_recorder.trace(protocol_file, overrides, quiet=True)
+                summary = protocol_recorder.summarize(protocol)
+                print(f"  {Path(protocol_file).name}: {cost_model.format_minutes(cost_model.estimate(protocol.records)['total'])} min, "
+                      f"{summary['tips']} tips, {summary['calls'].get('move_labware', 0)} labware moves")
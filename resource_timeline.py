@@ -0,0 +1,231 @@
+"""Which resource the run is waiting on, and where the others sit idle.
+
+A run is a sequence of steps from an offline trace (timed with cost_model) or from a
+live run log written by run_telemetry. Every step occupies one resource: a pipette, the
+gripper, a module the run waits on, the operator, or nothing for a plain delay. Modules
+also stay engaged in the background between calls, from the moment they start shaking,
+heating or hold a plate on the magnetic block until they are switched off or the plate
+leaves. The report shows, per phase, which resource the critical path ran through, how
+long each module was engaged while the gantry worked and while it stood still, and the
+longest stretches where the gantry waited:
+
+    python resource_timeline.py ChemProt_10plex_BCA_Click_RedAlkDigest_022625.py
+    python resource_timeline.py Data/run_logs/Photolabeling_BCA_Click_and_RedAlkDigest_250301-091500.jsonl
+
+Protocol API calls run one at a time, so the critical path is the whole run; what it
+shows is which resource each minute of it belongs to. A delay is put down to the module
+engaged most recently, which is the incubation the protocol is waiting for.
+"""
+import argparse
+import json
+import re
+
+import cost_model
+import protocol_recorder
+import trace_cache
+
+GANTRY = 'gantry'
+OPERATOR = 'operator'
+WAITING = 'delay'
+
+# Module calls that start or stop background work, by the kind of work
+ENGAGE = {
+    'set_and_wait_for_shake_speed': 'shake',
+    'set_and_wait_for_temperature': 'temperature',
+    'set_target_temperature': 'temperature',
+    'set_temperature': 'temperature',
+    'set_block_temperature': 'temperature',
+    'set_lid_temperature': 'lid',
+}
+DISENGAGE = {
+    'deactivate_shaker': ['shake'],
+    'deactivate_heater': ['temperature'],
+    'deactivate_block': ['temperature'],
+    'deactivate_lid': ['lid'],
+    'deactivate': ['shake', 'temperature', 'lid'],
+}
+
+
+def steps_from_trace(records, as_written=False):
+    """Steps laid end to end with the durations cost_model gives each record."""
+    estimated = cost_model.estimate(records, as_written)
+    seconds = {}
+    phases = {}
+    for command in estimated['commands']:
+        seconds[command['index']] = seconds.get(command['index'], 0) + command['seconds']
+        phases[command['index']] = command['phase']
+    steps = []
+    clock = 0
+    for record in records:
+        if record['index'] not in seconds:
+            continue
+        step = dict(record, phase=phases[record['index']], start=clock, end=clock + seconds[record['index']])
+        if record['call'] == 'move_labware':
+            step['to'] = record['dest']
+        steps.append(step)
+        clock = step['end']
+    return steps
+
+
+def steps_from_log(path):
+    """Steps of a run_telemetry log, timed from the start of the run."""
+    with open(path) as file:
+        entries = [json.loads(line) for line in file if line.strip()]
+    started = entries[0]['start']
+    return [dict(entry, start=entry['start'] - started, end=entry['end'] - started)
+            for entry in entries if entry['call'] != 'run_start']
+
+
+def resource(step):
+    """The resource a step keeps busy, or None for steps that take no time."""
+    call, target = step['call'], step['target']
+    if call == 'move_labware':
+        return GANTRY + ' (gripper)' if step.get('use_gripper') else OPERATOR
+    if call == 'pause':
+        return OPERATOR
+    if call == 'delay':
+        return WAITING
+    if target == 'protocol':
+        return None
+    if re.search(r"\((left|right)\)$", target):
+        return f"{GANTRY} ({target})"
+    return target
+
+
+def _merge(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        elif end > start:
+            merged.append([start, end])
+    return merged
+
+
+def _overlap(first, second):
+    total = 0
+    for start, end in first:
+        for other_start, other_end in second:
+            total += max(0, min(end, other_end) - max(start, other_start))
+    return total
+
+
+def _length(intervals):
+    return sum(end - start for start, end in intervals)
+
+
+def engaged(steps):
+    """Background intervals per module: shaking, holding a temperature or holding a plate on a magnet."""
+    run_end = steps[-1]['end'] if steps else 0
+    open_since = {}
+    intervals = {}
+    magnet = {}
+    for step in steps:
+        target = step['target']
+        if step['call'] in ENGAGE:
+            open_since.setdefault((target, ENGAGE[step['call']]), step['start'])
+        for kind in DISENGAGE.get(step['call'], []):
+            if (target, kind) in open_since:
+                intervals.setdefault(target, []).append((open_since.pop((target, kind)), step['end']))
+        if target != 'protocol' and resource(step) == target:
+            # Ramps and profiles the run waits for
+            intervals.setdefault(target, []).append((step['start'], step['end']))
+        if step['call'] == 'move_labware':
+            labware = step['labware']
+            if labware in magnet:
+                module, since = magnet.pop(labware)
+                intervals.setdefault(module, []).append((since, step['start']))
+            if 'magnetic' in str(step.get('to', '')).lower():
+                magnet[labware] = (str(step['to']), step['end'])
+    for (target, _), since in open_since.items():
+        intervals.setdefault(target, []).append((since, run_end))
+    for module, since in magnet.values():
+        intervals.setdefault(module, []).append((since, run_end))
+    return {module: _merge(spans) for module, spans in intervals.items()}
+
+
+def analyze(steps):
+    """Critical path by resource and phase, module engagement against gantry work, and the longest waits."""
+    background = engaged(steps)
+    critical = {}
+    phases = {}
+    waits = []
+    gantry = []
+    for step in steps:
+        used = resource(step)
+        if used is None:
+            continue
+        seconds = step['end'] - step['start']
+        if used.startswith(GANTRY):
+            gantry.append((step['start'], step['end']))
+        if used == WAITING:
+            # Put the wait down to the module engaged most recently before it
+            engaged_now = [(start, module) for module, spans in background.items()
+                           for start, end in spans if start <= step['start'] < end]
+            used = f"{WAITING} ({max(engaged_now)[1]})" if engaged_now else WAITING
+            waits.append({'phase': step['phase'], 'start': step['start'], 'seconds': seconds, 'on': used})
+        critical[used] = critical.get(used, 0) + seconds
+        phase = phases.setdefault(step['phase'], {})
+        phase[used] = phase.get(used, 0) + seconds
+    gantry = _merge(gantry)
+    total = steps[-1]['end'] if steps else 0
+    modules = {}
+    for module, spans in background.items():
+        with_gantry = _overlap(spans, gantry)
+        modules[module] = {'engaged': _length(spans), 'engaged_with_gantry': with_gantry,
+                           'engaged_gantry_idle': _length(spans) - with_gantry,
+                           'idle_while_gantry_worked': _length(gantry) - with_gantry}
+    return {'total': total, 'gantry': _length(gantry), 'critical': critical, 'phases': phases,
+            'modules': modules, 'waits': sorted(waits, key=lambda wait: -wait['seconds'])}
+
+
+def timeline(steps):
+    """Rows of resource, kind, start and end in seconds for plotting."""
+    rows = [{'resource': resource(step), 'kind': 'busy', 'call': step['call'], 'phase': step['phase'],
+             'start': round(step['start'], 1), 'end': round(step['end'], 1)}
+            for step in steps if resource(step) is not None]
+    for module, spans in engaged(steps).items():
+        rows += [{'resource': module, 'kind': 'engaged', 'call': '', 'phase': '',
+                  'start': round(start, 1), 'end': round(end, 1)} for start, end in spans]
+    return rows
+
+
+def report(name, analysis, top=5):
+    minutes = cost_model.format_minutes
+    lines = [name, f"  Total {minutes(analysis['total'])} min, gantry working {minutes(analysis['gantry'])} min", "  Critical path"]
+    for used, seconds in sorted(analysis['critical'].items(), key=lambda item: -item[1]):
+        lines.append(f"    {used[:60]:<60}{minutes(seconds):>9} min {100*seconds/max(analysis['total'], 1):5.1f}%")
+    lines.append("  By phase")
+    for phase, resources in analysis['phases'].items():
+        leading = max(resources, key=resources.get)
+        lines.append(f"    {phase[:40]:<40}{minutes(sum(resources.values())):>9} min, mostly {leading} ({minutes(resources[leading])} min)")
+    lines.append(f"  {'Modules':<44}{'engaged':>9}{'+gantry':>9}{'gantry idle':>13}{'idle, gantry busy':>19}")
+    for module, times in analysis['modules'].items():
+        lines.append(f"    {module[:40]:<40}" + ''.join(f"{minutes(times[key]):>{width}}" for key, width in
+                     [('engaged', 9), ('engaged_with_gantry', 9), ('engaged_gantry_idle', 13), ('idle_while_gantry_worked', 19)]))
+    if analysis['waits']:
+        lines.append("  Longest gantry waits")
+        for wait in analysis['waits'][:top]:
+            lines.append(f"    {minutes(wait['seconds']):>7} min at {minutes(wait['start'])} min in {wait['phase']}: {wait['on']}")
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Critical path and idle resources of a traced or logged run")
+    parser.add_argument("run", help="protocol file to trace, or a run_telemetry .jsonl log")
+    parser.add_argument("--param", action="append", default=[], help="parameter override as name=value")
+    parser.add_argument("--data-file", help="plate reader export to normalize against")
+    parser.add_argument("--as-written", action="store_true", help="cost rate=, delay= and mix options the API ignores")
+    parser.add_argument("--timeline", help="write the busy and engaged intervals to this CSV")
+    args = parser.parse_args()
+
+    if args.run.endswith(".jsonl"):
+        steps = steps_from_log(args.run)
+    else:
+        overrides = dict((name, protocol_recorder._parse_value(value)) for name, value in (param.split("=", 1) for param in args.param))
+        protocol = trace_cache.cached_trace(args.run, overrides, args.data_file)
+        steps = steps_from_trace(protocol.records, args.as_written)
+    print(report(args.run, analyze(steps)))
+    if args.timeline:
+        import pandas as pd
+        pd.DataFrame(timeline(steps)).to_csv(args.timeline, index=False)
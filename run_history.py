@@ -0,0 +1,280 @@
+"""Append-only history of the BCA normalization results of every run.
+
+start(protocol, name) opens a run; add_plate() then appends one plate reader file to
+/var/lib/jupyter/notebooks/Data/run_history.sqlite as soon as it has been analysed: the
+absorbance of every well, the standard curve fit, and per sample the replicates, mean
+absorbance, concentration and the sample and diluent volumes it was normalized with.
+Unlike Protocol_output_<date>.csv, which the next run of the day overwrites, rows are
+only ever added; the tables refuse updates and deletes. Runs are indexed by run ID, date
+and protocol, samples by sample ID:
+
+    python run_history.py runs --protocol WesternBlot --since 2025-01-01
+    python run_history.py sample "Sample 9"
+    python run_history.py export history.csv --since 2025-01-01        # .parquet needs pyarrow
+    python run_history.py import Data/Protocol_output_*.csv --protocol "Western Blot BCA Normalize"
+
+import backfills the output tables of earlier runs, dated from their file names.
+Copy this file next to run_telemetry.py in /var/lib/jupyter/notebooks; protocols that
+cannot import it run without a history, and simulations write nothing.
+"""
+import argparse
+import datetime
+import json
+import math
+import re
+import socket
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+DATABASE = Path("/var/lib/jupyter/notebooks/Data/run_history.sqlite")
+
+TABLES = ['runs', 'plates', 'readings', 'samples']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    robot TEXT,
+    protocol TEXT NOT NULL,
+    started TEXT NOT NULL,
+    date TEXT NOT NULL,
+    params TEXT
+);
+CREATE TABLE IF NOT EXISTS plates (
+    run INTEGER NOT NULL REFERENCES runs(run),
+    plate INTEGER NOT NULL,
+    batch INTEGER,
+    data_file TEXT,
+    read_at TEXT,
+    slope REAL,
+    intercept REAL,
+    r_squared REAL,
+    PRIMARY KEY (run, plate)
+);
+CREATE TABLE IF NOT EXISTS readings (
+    run INTEGER NOT NULL,
+    plate INTEGER NOT NULL,
+    well TEXT NOT NULL,
+    absorbance REAL
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run INTEGER NOT NULL,
+    plate INTEGER NOT NULL,
+    sample TEXT NOT NULL,
+    mean_absorbance REAL,
+    concentration_mg_ml REAL,
+    sample_volume_ul REAL,
+    diluent_volume_ul REAL,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_by_run_id ON runs(run_id);
+CREATE INDEX IF NOT EXISTS runs_by_date ON runs(date);
+CREATE INDEX IF NOT EXISTS runs_by_protocol ON runs(protocol, date);
+CREATE INDEX IF NOT EXISTS readings_by_plate ON readings(run, plate);
+CREATE INDEX IF NOT EXISTS samples_by_sample ON samples(sample);
+CREATE INDEX IF NOT EXISTS samples_by_run ON samples(run, plate);
+""" + "".join(f"""
+CREATE TRIGGER IF NOT EXISTS {table}_no_update BEFORE UPDATE ON {table}
+BEGIN SELECT RAISE(ABORT, 'run history is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS {table}_no_delete BEFORE DELETE ON {table}
+BEGIN SELECT RAISE(ABORT, 'run history is append-only'); END;
+""" for table in TABLES)
+
+# Columns of the samples table with a row of sample results and the joined run and plate
+EXPORT = """
+SELECT runs.run_id, runs.robot, runs.protocol, runs.date, plates.plate, plates.batch, plates.data_file,
+       plates.slope, plates.intercept, plates.r_squared, samples.sample, samples.mean_absorbance,
+       samples.concentration_mg_ml, samples.sample_volume_ul, samples.diluent_volume_ul, samples.detail
+FROM samples JOIN runs ON runs.run = samples.run
+LEFT JOIN plates ON plates.run = samples.run AND plates.plate = samples.plate
+"""
+
+
+def connect(path=DATABASE):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def _number(value):
+    """A float for SQLite, None for blanks and values that are not a number."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+def _microlitres(row, prefix):
+    """The volume in a column such as 'Sample Volume (mL)' or 'Diluent Volume (µL)', in µL."""
+    for column, value in row.items():
+        found = re.match(rf"{prefix} Volume \((mL|µL|uL)\)", str(column))
+        if found:
+            value = _number(value)
+            return value*1000 if value is not None and found.group(1) == 'mL' else value
+    return None
+
+
+def sample_rows(table):
+    """Rows of the samples table for a normalization table with a Sample column."""
+    rows = []
+    for record in table.to_dict('records'):
+        concentration = next((value for column, value in record.items()
+                              if str(column).startswith('Protein Concentration')), None)
+        rows.append((str(record['Sample']), _number(record.get('Mean Absorbance')), _number(concentration),
+                     _microlitres(record, 'Sample'), _microlitres(record, 'Diluent'),
+                     json.dumps({str(column): value for column, value in record.items() if column != 'Sample'}, default=str)))
+    return rows
+
+
+class Run:
+    def __init__(self, protocol, protocol_name, run_id=None, path=DATABASE):
+        started = datetime.datetime.now()
+        self.protocol = protocol
+        self.protocol_name = protocol_name
+        self.run_id = run_id or started.strftime("%y%m%d-%H%M%S")
+        self.started = started
+        self.path = path
+        self.run = None
+        self.plates = 0
+
+    def _params(self):
+        params = self.protocol.params
+        values = params.get_all() if hasattr(params, 'get_all') else vars(params)
+        return json.dumps({name: value if isinstance(value, (bool, int, float, str)) or value is None else str(value)
+                           for name, value in values.items()})
+
+    def add_plate(self, data_file, block, fit, samples, batch=None):
+        """Append one plate: the reader block as exported (rows A.., columns 1..), the
+        (slope, intercept, r_squared) of the standard curve and the normalization table."""
+        self.plates += 1
+        if self.protocol.is_simulating():
+            return
+        connection = connect(self.path)
+        with closing(connection), connection:
+            if self.run is None:
+                self.run = connection.execute(
+                    "INSERT INTO runs (run_id, robot, protocol, started, date, params) VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.run_id, socket.gethostname(), self.protocol_name, self.started.isoformat(timespec='seconds'),
+                     self.started.date().isoformat(), self._params())).lastrowid
+            slope, intercept, r_squared = fit
+            connection.execute("INSERT INTO plates VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (self.run, self.plates, batch, str(data_file), datetime.datetime.now().isoformat(timespec='seconds'),
+                                _number(slope), _number(intercept), _number(r_squared)))
+            values = block.values if hasattr(block, 'values') else block
+            connection.executemany("INSERT INTO readings VALUES (?, ?, ?, ?)",
+                                   [(self.run, self.plates, f"{chr(ord('A') + row)}{column + 1}", _number(value))
+                                    for row, line in enumerate(values) for column, value in enumerate(line)])
+            connection.executemany("INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                   [(self.run, self.plates) + row for row in sample_rows(samples)])
+
+
+def start(protocol, protocol_name, run_id=None, path=DATABASE):
+    """A run to add plates to; pass the run_telemetry run ID to find its log again."""
+    return Run(protocol, protocol_name, run_id, path)
+
+
+def _where(protocol=None, since=None, until=None):
+    conditions, values = [], []
+    if protocol:
+        conditions.append("runs.protocol LIKE ?")
+        values.append(f"%{protocol}%")
+    if since:
+        conditions.append("runs.date >= ?")
+        values.append(since)
+    if until:
+        conditions.append("runs.date <= ?")
+        values.append(until)
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), values
+
+
+def runs(connection, protocol=None, since=None, until=None):
+    """One row per run with its plates and samples."""
+    import pandas as pd
+    where, values = _where(protocol, since, until)
+    return pd.read_sql_query(
+        "SELECT runs.run_id, runs.robot, runs.protocol, runs.started, "
+        "(SELECT COUNT(*) FROM plates WHERE plates.run = runs.run) AS plates, "
+        "(SELECT COUNT(*) FROM samples WHERE samples.run = runs.run) AS samples, "
+        "(SELECT MIN(r_squared) FROM plates WHERE plates.run = runs.run) AS lowest_r_squared "
+        f"FROM runs{where} ORDER BY runs.started", connection, params=values)
+
+
+def sample_history(connection, sample, protocol=None, since=None, until=None):
+    """Every result for one sample ID, oldest first."""
+    import pandas as pd
+    where, values = _where(protocol, since, until)
+    where = (where + " AND" if where else " WHERE") + " samples.sample = ?"
+    return pd.read_sql_query(f"{EXPORT}{where} ORDER BY runs.started", connection, params=values + [sample])
+
+
+def export(connection, destination, protocol=None, since=None, until=None, readings=False):
+    """Write the sample results, or the well readings, to CSV or Parquet by the file suffix."""
+    import pandas as pd
+    where, values = _where(protocol, since, until)
+    if readings:
+        query = ("SELECT runs.run_id, runs.protocol, runs.date, readings.plate, readings.well, readings.absorbance "
+                 f"FROM readings JOIN runs ON runs.run = readings.run{where} ORDER BY runs.started, readings.plate")
+    else:
+        query = f"{EXPORT}{where} ORDER BY runs.started, samples.plate"
+    table = pd.read_sql_query(query, connection, params=values)
+    if str(destination).endswith('.parquet'):
+        table.to_parquet(destination, index=False)
+    else:
+        table.to_csv(destination, index=False)
+    return len(table)
+
+
+def backfill(connection, paths, protocol_name):
+    """Append earlier Protocol_output_<yymmdd>.csv tables, one run per file, without readings or fit."""
+    import pandas as pd
+    added = 0
+    for path in paths:
+        found = re.search(r"(\d{6})", Path(path).name)
+        date = datetime.datetime.strptime(found.group(1), "%y%m%d") if found else datetime.datetime.fromtimestamp(Path(path).stat().st_mtime)
+        table = pd.read_csv(path)
+        table = table.drop(columns=[column for column in table.columns if column.startswith('Unnamed')])
+        with connection:
+            run = connection.execute(
+                "INSERT INTO runs (run_id, robot, protocol, started, date, params) VALUES (?, ?, ?, ?, ?, ?)",
+                (Path(path).stem, None, protocol_name, date.isoformat(timespec='seconds'), date.date().isoformat(),
+                 json.dumps({'imported_from': str(path)}))).lastrowid
+            connection.execute("INSERT INTO plates (run, plate, data_file) VALUES (?, 1, ?)", (run, str(path)))
+            connection.executemany("INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                   [(run, 1) + row for row in sample_rows(table)])
+        added += len(table)
+    return added
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query and export the normalization results of past runs")
+    parser.add_argument("--database", default=DATABASE, help="history database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    listing = commands.add_parser("runs", help="runs with their plate and sample counts")
+    lookup = commands.add_parser("sample", help="every result for one sample ID")
+    lookup.add_argument("sample")
+    exporting = commands.add_parser("export", help="sample results or well readings to CSV or Parquet")
+    exporting.add_argument("destination", help="file to write, .csv or .parquet")
+    exporting.add_argument("--readings", action="store_true", help="export the absorbance of every well instead")
+    for command in [listing, lookup, exporting]:
+        command.add_argument("--protocol", help="only protocols whose name contains this")
+        command.add_argument("--since", help="first date, YYYY-MM-DD")
+        command.add_argument("--until", help="last date, YYYY-MM-DD")
+    importing = commands.add_parser("import", help="append earlier Protocol_output CSV files")
+    importing.add_argument("paths", nargs="+")
+    importing.add_argument("--protocol", required=True, help="protocol name to file them under")
+    args = parser.parse_args()
+
+    connection = connect(args.database)
+    if args.command == "runs":
+        print(runs(connection, args.protocol, args.since, args.until).to_string(index=False))
+    elif args.command == "sample":
+        print(sample_history(connection, args.sample, args.protocol, args.since, args.until).drop(columns="detail").to_string(index=False))
+    elif args.command == "export":
+        count = export(connection, args.destination, args.protocol, args.since, args.until, args.readings)
+        print(f"{count} rows written to {args.destination}")
+    else:
+        print(f"{backfill(connection, args.paths, args.protocol)} samples imported from {len(args.paths)} files")
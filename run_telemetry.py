@@ -0,0 +1,218 @@
+"""Per-step timing for live runs.
+
+instrument(protocol, name) wraps the liquid handling, tip, gripper, delay and module
+calls of a ProtocolContext and of every pipette and module loaded after it. Each call
+made by the protocol is appended to a JSON lines log, one file per run in
+/var/lib/jupyter/notebooks/Data/run_logs, with wall-clock start and end, the phase
+(taken from the last "Running ..." comment), the pipette and its nozzle layout, the
+volume, the number of wells and the tips it used. Calls a transfer makes internally are
+not logged on their own, but the tips they pick up are counted against the transfer.
+
+Copy this file next to the video and wait_for_file scripts in /var/lib/jupyter/notebooks;
+protocols that cannot import it run without a log. Simulations wrap the same calls but
+write nothing.
+"""
+import datetime
+import functools
+import json
+import re
+import time
+import tracemalloc
+from pathlib import Path
+
+LOG_DIRECTORY = Path("/var/lib/jupyter/notebooks/Data/run_logs")
+
+PROTOCOL_CALLS = ['move_labware', 'delay', 'pause']
+PIPETTE_CALLS = ['transfer', 'distribute', 'consolidate', 'aspirate', 'dispense', 'mix', 'blow_out',
+                 'touch_tip', 'air_gap', 'pick_up_tip', 'drop_tip', 'return_tip', 'configure_nozzle_layout']
+MODULE_CALLS = ['set_temperature', 'set_and_wait_for_temperature', 'set_target_temperature', 'wait_for_temperature',
+                'set_block_temperature', 'set_lid_temperature', 'execute_profile', 'open_lid', 'close_lid',
+                'open_labware_latch', 'close_labware_latch', 'set_and_wait_for_shake_speed', 'deactivate_shaker',
+                'deactivate_heater', 'deactivate_block', 'deactivate_lid', 'deactivate']
+
+# Tips picked up per nozzle layout; ALL uses every channel
+NOZZLES = {'SINGLE': 1, 'COLUMN': 8, 'ROW': 12}
+
+
+def _name(value):
+    return str(getattr(value, 'value', value))
+
+
+def _count(wells):
+    return len(wells) if isinstance(wells, (list, tuple)) else 1
+
+
+def _params(protocol):
+    params = protocol.params
+    values = params.get_all() if hasattr(params, 'get_all') else vars(params)
+    return {name: value if isinstance(value, (bool, int, float, str)) or value is None else str(value)
+            for name, value in values.items()}
+
+
+class RunLog:
+    def __init__(self, protocol, protocol_name, directory=LOG_DIRECTORY):
+        self.run_id = datetime.datetime.now().strftime("%y%m%d-%H%M%S")
+        self.path = Path(directory) / f"{re.sub(r'[^A-Za-z0-9]+', '_', protocol_name).strip('_')}_{self.run_id}.jsonl"
+        self.protocol = protocol
+        self.file = None
+        if not protocol.is_simulating():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(self.path, 'a', buffering=1)
+        self.phase = 'setup'
+        self.seq = 0
+        self.current = None
+        self.layouts = {}
+        self.write({'call': 'run_start', 'protocol': protocol_name, 'params': _params(protocol), 'start': time.time()})
+
+    def write(self, entry):
+        self.seq += 1
+        entry = dict({'run': self.run_id, 'seq': self.seq, 'phase': self.phase}, **entry)
+        if self.file is not None:
+            self.file.write(json.dumps(entry, default=str) + '\n')
+
+    def wrap(self, obj, call, target, describe):
+        method = getattr(obj, call, None)
+        if method is None:
+            return
+
+        @functools.wraps(method)
+        def logged(*args, **kwargs):
+            if call == 'pick_up_tip':
+                # Tips a transfer picks up belong to the transfer's entry
+                counted = self.current if self.current is not None else {}
+                counted['tips'] = counted.get('tips', 0) + self.tips_per_pick_up(obj, target)
+            if self.current is not None:
+                return method(*args, **kwargs)
+            entry = {'call': call, 'target': target}
+            entry.update(describe(call, args, kwargs))
+            self.current = entry
+            entry['start'] = time.time()
+            try:
+                return method(*args, **kwargs)
+            except Exception as error:
+                entry['error'] = f"{type(error).__name__}: {error}"
+                raise
+            finally:
+                entry['end'] = time.time()
+                entry['seconds'] = round(entry['end'] - entry['start'], 3)
+                self.current = None
+                self.write(entry)
+        setattr(obj, call, logged)
+
+    def tips_per_pick_up(self, pipette, target):
+        layout = self.layouts.get(target, 'ALL')
+        return NOZZLES.get(layout, getattr(pipette, 'channels', 1))
+
+    def describe_pipette(self, target):
+        def describe(call, args, kwargs):
+            if call == 'configure_nozzle_layout':
+                self.layouts[target] = _name(kwargs.get('style', args[0] if args else 'ALL'))
+            entry = {'nozzle_layout': self.layouts.get(target, 'ALL')}
+            if call in ['transfer', 'distribute', 'consolidate']:
+                volume = kwargs.get('volume', args[0] if args else None)
+                entry.update(volume=volume if isinstance(volume, (int, float)) else list(volume),
+                             sources=_count(kwargs.get('source', args[1] if len(args) > 1 else None)),
+                             dests=_count(kwargs.get('dest', args[2] if len(args) > 2 else None)),
+                             new_tip=kwargs.get('new_tip', 'once'))
+            elif call == 'mix':
+                entry.update(repetitions=kwargs.get('repetitions', args[0] if args else 1),
+                             volume=kwargs.get('volume', args[1] if len(args) > 1 else None))
+            elif call in ['aspirate', 'dispense', 'air_gap']:
+                entry['volume'] = kwargs.get('volume', args[0] if args else None)
+            if 'rate' in kwargs:
+                entry['rate'] = kwargs['rate']
+            return entry
+        return describe
+
+    def describe_protocol(self, call, args, kwargs):
+        if call == 'move_labware':
+            labware = kwargs.get('labware', args[0] if args else None)
+            return {'labware': getattr(labware, 'load_name', str(labware)),
+                    'from': str(getattr(labware, 'parent', None)),
+                    'to': str(kwargs.get('new_location', args[1] if len(args) > 1 else None)),
+                    'use_gripper': kwargs.get('use_gripper', False)}
+        if call == 'delay':
+            return {'requested': kwargs.get('seconds', 0) + 60*kwargs.get('minutes', 0)}
+        return {}
+
+    def describe_module(self, call, args, kwargs):
+        return {'args': [value for value in args if isinstance(value, (int, float))],
+                **{name: value for name, value in kwargs.items() if isinstance(value, (int, float))}}
+
+    def profile(self):
+        """Start timing the analysis that runs on the robot, see AnalysisProfile."""
+        return AnalysisProfile(self)
+
+    def comment(self, comment):
+        @functools.wraps(comment)
+        def logged(msg, *args, **kwargs):
+            if str(msg).startswith('Running '):
+                self.phase = str(msg)[len('Running '):]
+            return comment(msg, *args, **kwargs)
+        return logged
+
+
+class AnalysisProfile:
+    """Lap timer for code that runs on the robot's own CPU, like the plate reader analysis.
+
+    stage(name) ends the running stage and starts the next; stage() ends the last one.
+    Each stage is logged with its time and the peak memory allocated during it, and the
+    stages are summed up in a protocol comment.
+    """
+
+    def __init__(self, log):
+        self.log = log
+        self.stages = []
+        self.current = None
+        tracemalloc.start()
+
+    def stage(self, name=None):
+        now = time.perf_counter()
+        if self.current is not None:
+            stage_name, started, start = self.current
+            peak = tracemalloc.get_traced_memory()[1]
+            self.stages.append((stage_name, now - started, peak))
+            self.log.write({'call': 'analysis', 'target': 'protocol', 'stage': stage_name, 'start': start,
+                            'end': time.time(), 'seconds': round(now - started, 4), 'peak_kb': round(peak/1024, 1)})
+        self.current = None
+        if name is None:
+            tracemalloc.stop()
+            self.log.protocol.comment("Analysis profile: " + ", ".join(
+                f"{stage_name} {seconds:.2f} s ({peak/1024:.0f} kB)" for stage_name, seconds, peak in self.stages))
+            return
+        tracemalloc.reset_peak()
+        self.current = (name, time.perf_counter(), time.time())
+
+
+def instrument(protocol, protocol_name, directory=LOG_DIRECTORY):
+    """Start a run log and wrap protocol so every later load is wrapped too. Returns the log."""
+    log = RunLog(protocol, protocol_name, directory)
+    for call in PROTOCOL_CALLS:
+        log.wrap(protocol, call, 'protocol', log.describe_protocol)
+    protocol.comment = log.comment(protocol.comment)
+
+    load_instrument = protocol.load_instrument
+    load_module = protocol.load_module
+
+    @functools.wraps(load_instrument)
+    def instrumented_pipette(*args, **kwargs):
+        pipette = load_instrument(*args, **kwargs)
+        target = f"{pipette.name} ({pipette.mount})"
+        for call in PIPETTE_CALLS:
+            log.wrap(pipette, call, target, log.describe_pipette(target))
+        return pipette
+
+    @functools.wraps(load_module)
+    def instrumented_module(*args, **kwargs):
+        module = load_module(*args, **kwargs)
+        target = str(args[0] if args else kwargs.get('module_name'))
+        location = kwargs.get('location', args[1] if len(args) > 1 else None)
+        if location:
+            target += f" on {location}"
+        for call in MODULE_CALLS:
+            log.wrap(module, call, target, log.describe_module)
+        return module
+
+    protocol.load_instrument = instrumented_pipette
+    protocol.load_module = instrumented_module
+    return log
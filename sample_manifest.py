@@ -0,0 +1,101 @@
+"""Sample manifests: the samples of a run and the tube each one sits in.
+
+A manifest is the sample_manifest CSV parameter of a protocol, one row per sample with
+its ID, its tube on the 24-tube aluminum block and, optionally, the expected
+concentration (mg/mL) and the protein to normalize to (ug). Columns are found by their
+whole name in any order, ignoring case, spaces and punctuation, so "Sample ID" is the
+sample column but "sample_volume" is not (see HEADERS). A manifest is
+turned down with the line at fault when a sample repeats, a tube is reserved, taken or
+not on the block, a number does not parse, or it lists more samples than the run has
+room for:
+
+    python sample_manifest.py samples.csv --reserved A1 A2 D5 D6 --max 18
+
+Protocols carry a copy of it, kept up to date with shared_code.py.
+"""
+import argparse
+import csv
+import re
+
+from opentrons.protocol_api import RuntimeParameterRequiredError
+
+# Tubes of the 24-tube aluminum block
+TUBE_ROWS = 'ABCD'
+TUBE_COLUMNS = 6
+# Header names each manifest column goes by
+HEADERS = {
+    'sample': ['sample', 'sample_id', 'id'],
+    'tube': ['position', 'tube'],
+    'expected': ['expected', 'expected_mg_ml', 'conc', 'concentration', 'conc_mg_ml', 'concentration_mg_ml'],
+    'target': ['target', 'target_ug'],
+}
+
+
+def free_tubes(reserved_tubes):
+    """Tubes left for samples, row by row."""
+    return [f"{row}{number}" for row in TUBE_ROWS for number in range(1, TUBE_COLUMNS + 1) if f"{row}{number}" not in reserved_tubes]
+
+
+def header_name(cell):
+    """A header cell in lower case with every run of spaces and punctuation as one underscore."""
+    return re.sub(r'[^a-z0-9]+', '_', cell.lower()).strip('_')
+
+
+def parse_manifest(rows, reserved_tubes, max_samples=None):
+    """Samples of manifest rows as dicts of sample, tube, expected (mg/mL) and target (ug)."""
+    rows = [row for row in rows if any(cell.strip() for cell in row)]
+    if not rows:
+        raise Exception("The sample manifest is empty")
+    header = [header_name(cell) for cell in rows[0]]
+
+    def column(field):
+        return next((i for i, cell in enumerate(header) if cell in HEADERS[field]), None)
+
+    sample_column, tube_column = column('sample'), column('tube')
+    expected_column, target_column = column('expected'), column('target')
+    if sample_column is None or tube_column is None:
+        raise Exception(f"The sample manifest needs a sample and a position column, not {', '.join(rows[0])}")
+    tubes = free_tubes(reserved_tubes)
+    room = len(tubes) if max_samples is None else min(len(tubes), max_samples)
+    if len(rows) - 1 > room:
+        raise Exception(f"The sample manifest lists {len(rows) - 1} samples, this run has room for {room}")
+    samples = []
+    for line, row in enumerate(rows[1:], start=2):
+        cells = [cell.strip() for cell in row] + ['']*len(header)
+        sample_id, tube = cells[sample_column], cells[tube_column].upper()
+        if any(sample['sample'] == sample_id for sample in samples):
+            raise Exception(f"Line {line} of the sample manifest repeats sample {sample_id}")
+        if tube not in tubes:
+            raise Exception(f"Line {line} of the sample manifest puts {sample_id} in {tube}, which is not one of the free tubes {', '.join(tubes)}")
+        tubes.remove(tube)
+        try:
+            expected = float(cells[expected_column]) if expected_column is not None and cells[expected_column] else None
+            target = float(cells[target_column]) if target_column is not None and cells[target_column] else None
+        except ValueError:
+            raise Exception(f"Line {line} of the sample manifest has a concentration or target that is not a number")
+        samples.append({'sample': sample_id, 'tube': tube, 'expected': expected, 'target': target})
+    if not samples:
+        raise Exception("The sample manifest has no samples")
+    return samples
+
+
+def read_sample_manifest(manifest, reserved_tubes, max_samples=None):
+    """Samples of a sample_manifest parameter, or None when the run has no manifest."""
+    try:
+        rows = manifest.parse_as_csv()
+    except RuntimeParameterRequiredError:
+        return None
+    return parse_manifest(rows, reserved_tubes, max_samples)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check a sample manifest before a run")
+    parser.add_argument("manifest", help="sample manifest CSV")
+    parser.add_argument("--reserved", nargs="*", default=['A1', 'A2', 'A3', 'A4', 'A5', 'A6'], help="tubes the protocol keeps for reagents")
+    parser.add_argument("--max", type=int, help="most samples the protocol takes")
+    args = parser.parse_args()
+
+    with open(args.manifest, newline="") as manifest_file:
+        samples = parse_manifest(list(csv.reader(manifest_file)), args.reserved, args.max)
+    for sample in samples:
+        print(f"{sample['tube']:<4}{sample['sample']}  expected {sample['expected']} mg/mL, target {sample['target']} ug")
@@ -0,0 +1,91 @@
+"""Copies of shared helper code inside the protocols.
+
+A protocol has to be one file: the app, opentrons_simulate and the robot load it on its
+own, so it cannot import helpers that are not installed there. Code that several
+protocols share lives once in a helper module (see HELPERS) and each protocol carries a
+copy of it between two marker lines:
+
+    # ---- plate_map.py (copied by shared_code.py, edit plate_map.py instead) ----
+    ...
+    # ---- end of plate_map.py ----
+
+The copy is the module without its docstring, imports and command line, so the
+protocol imports what the helper needs itself. Running this writes the current helpers
+into every protocol that has the markers, keeping each file's line endings; --check
+only reports the copies that differ from their helper.
+
+    python shared_code.py
+    python shared_code.py --check
+"""
+import argparse
+import ast
+import re
+import sys
+from pathlib import Path
+
+HELPERS = ['plate_map.py', 'sample_manifest.py', 'tip_planner.py', 'incubation_stations.py']
+
+
+def body(helper, directory=Path(__file__).parent):
+    """Lines of a helper module between its imports and its command line."""
+    source = (Path(directory) / helper).read_text()
+    lines = source.splitlines()
+    tree = ast.parse(source)
+    header = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    if ast.get_docstring(tree):
+        header.append(tree.body[0])
+    start = max((node.end_lineno for node in header), default=0)
+    end = next((node.lineno - 1 for node in tree.body if isinstance(node, ast.If) and "__name__" in ast.unparse(node.test)), len(lines))
+    lines = lines[start:end]
+    while lines and not lines[0].strip():
+        lines.pop(0)
+    while lines and not lines[-1].strip():
+        lines.pop()
+    return lines
+
+
+def block(helper, directory=Path(__file__).parent):
+    """The marked copy of a helper, as it goes into a protocol."""
+    return ([f"# ---- {helper} (copied by shared_code.py, edit {helper} instead) ----"]
+            + body(helper, directory)
+            + [f"# ---- end of {helper} ----"])
+
+
+def _pattern(helper):
+    name = re.escape(helper)
+    return re.compile(rf"^# ---- {name} \(copied by shared_code\.py.*?^# ---- end of {name} ----$", re.M | re.S)
+
+
+def protocols(directory=Path(__file__).parent):
+    """Files that carry a copy of a helper."""
+    return sorted(path for path in Path(directory).glob("*.py") if "(copied by shared_code.py" in path.read_text(errors="ignore") and path.name != Path(__file__).name)
+
+
+def sync(path, write=True, directory=Path(__file__).parent):
+    """Helpers whose copy in a protocol differs from the helper, rewritten unless write is False."""
+    raw = Path(path).read_bytes()
+    newline = "\r\n" if b"\r\n" in raw else "\n"
+    text = raw.decode().replace("\r\n", "\n")
+    stale = []
+    for helper in HELPERS:
+        copy = "\n".join(block(helper, directory))
+        current = _pattern(helper).search(text)
+        if current and current.group(0) != copy:
+            stale.append(helper)
+            text = text[:current.start()] + copy + text[current.end():]
+    if stale and write:
+        Path(path).write_bytes(text.replace("\n", newline).encode())
+    return stale
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy the shared helper modules into the protocols")
+    parser.add_argument("--check", action="store_true", help="only report copies that differ from their helper")
+    args = parser.parse_args()
+
+    stale = False
+    for path in protocols():
+        for helper in sync(path, write=not args.check):
+            print(f"{path.name}: {helper} {'is out of date' if args.check else 'updated'}")
+            stale = True
+    sys.exit(1 if stale and args.check else 0)
@@ -0,0 +1,5 @@
+# The shared helpers live at the top of the repo next to the protocols
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,128 @@
+"""Tests of the helpers shared_code.py copies into the protocols."""
+import pandas as pd
+import pytest
+from opentrons.protocol_api import ALL, SINGLE
+
+import protocol_recorder
+from plate_map import capacity, compile_map
+from sample_manifest import parse_manifest
+from tip_planner import TipPlanner, count_spares
+
+RESERVED = ['A1', 'A2', 'A3', 'A4', 'A5', 'A6']
+
+
+@pytest.mark.parametrize("plate, samples", [('96', 24), ('384', 120)])
+def test_capacity_fills_the_plate(plate, samples):
+    assert capacity(plate) == samples
+    assert len(compile_map(samples, plate).samples) == samples
+    with pytest.raises(Exception, match="holds"):
+        compile_map(samples + 1, plate)
+
+
+def test_96_well_order():
+    plate_map = compile_map(9)
+    assert plate_map.wells('Standard 1') == ['A1', 'A2', 'A3']
+    assert plate_map.wells('Standard 8') == ['H1', 'H2', 'H3']
+    assert plate_map.wells('Sample 1') == ['A4', 'A5', 'A6']
+    assert plate_map.wells('Sample 8') == ['H4', 'H5', 'H6']
+    assert plate_map.wells('Sample 9') == ['A7', 'A8', 'A9']
+    assert [top_wells for top_wells, _ in plate_map.sample_blocks()] == [['A4', 'A5', 'A6'], ['A7', 'A8', 'A9']]
+
+
+def test_384_well_order():
+    # Blocks take every other row, down the plate before the next group of columns
+    plate_map = compile_map(17, '384')
+    assert plate_map.wells('Standard 1') == ['A1', 'A2', 'A3']
+    assert plate_map.wells('Standard 8') == ['O1', 'O2', 'O3']
+    assert plate_map.wells('Sample 1') == ['B1', 'B2', 'B3']
+    assert plate_map.wells('Sample 8') == ['P1', 'P2', 'P3']
+    assert plate_map.wells('Sample 9') == ['A4', 'A5', 'A6']
+    assert plate_map.wells('Sample 17') == ['B4', 'B5', 'B6']
+    assert plate_map.top_wells(1) == ['B1', 'B2', 'B3']
+
+
+@pytest.mark.parametrize("plate", ['96', '384'])
+def test_read_returns_the_mapped_wells(plate):
+    plate_map = compile_map(capacity(plate), plate)
+    rows = plate_map.row_names
+    # Each reader cell holds its own well name, so every replicate reads back where it was plated
+    block = pd.DataFrame([[f"{row}{column}" for column in range(1, plate_map.columns + 1)] for row in rows])
+    table = plate_map.read(block)
+    assert list(table['Sample']) == [entry['name'] for entry in plate_map.standards + plate_map.samples]
+    for (_, row), entry in zip(table.iterrows(), plate_map.standards + plate_map.samples):
+        assert [row[f'Replicate {i + 1}'] for i in range(3)] == entry['wells']
+
+
+def manifest(*lines, header="sample,position,expected_mg_ml,target_ug"):
+    return [header.split(",")] + [line.split(",") for line in lines]
+
+
+def test_manifest_samples():
+    samples = parse_manifest(manifest("Liver-1,b1,5,300", "Liver-2,C3,,"), RESERVED)
+    assert samples == [{'sample': 'Liver-1', 'tube': 'B1', 'expected': 5.0, 'target': 300.0},
+                       {'sample': 'Liver-2', 'tube': 'C3', 'expected': None, 'target': None}]
+
+
+def test_manifest_rejects_a_reserved_tube():
+    with pytest.raises(Exception, match="Line 3 .* A2, which is not one of the free tubes"):
+        parse_manifest(manifest("S1,B1,,", "S2,A2,,"), RESERVED)
+
+
+def test_manifest_rejects_a_duplicate_tube():
+    with pytest.raises(Exception, match="Line 3 .* B1, which is not one of the free tubes"):
+        parse_manifest(manifest("S1,B1,,", "S2,B1,,"), RESERVED)
+
+
+def test_manifest_rejects_a_duplicate_sample():
+    with pytest.raises(Exception, match="Line 3 of the sample manifest repeats sample S1"):
+        parse_manifest(manifest("S1,B1,,", "S1,B2,,"), RESERVED)
+
+
+def test_manifest_rejects_more_samples_than_the_run_takes():
+    with pytest.raises(Exception, match="lists 3 samples, this run has room for 2"):
+        parse_manifest(manifest("S1,B1,,", "S2,B2,,", "S3,B3,,"), RESERVED, max_samples=2)
+
+
+def test_manifest_headers_match_whole_names():
+    # sample_volume comes first but is not the sample column
+    rows = manifest("10,S1,b2,2,300", header="sample_volume,Sample ID,Tube,Expected (mg/mL),Target (ug)")
+    assert parse_manifest(rows, RESERVED) == [{'sample': 'S1', 'tube': 'B2', 'expected': 2.0, 'target': 300.0}]
+    with pytest.raises(Exception, match="needs a sample and a position column"):
+        parse_manifest(manifest("10,B2", header="sample_volume,position"), RESERVED)
+
+
+def test_count_spares_single_and_all():
+    # 96 single tips or 12 full columns empty one rack
+    assert count_spares({'single': ('tips', 1, 96)}, ['tips']) == {'tips': 0}
+    assert count_spares({'columns': ('tips', 8, 12)}, ['tips']) == {'tips': 0}
+    # One single tip leaves a partial column the 8-channel cannot use
+    assert count_spares({'single': ('tips', 1, 1), 'columns': ('tips', 8, 12)}, ['tips']) == {'tips': 1}
+    assert count_spares({'single': ('tips', 1, 8), 'columns': ('tips', 8, 11)}, ['tips']) == {'tips': 0}
+    with pytest.raises(Exception, match="needs more than one tips rack"):
+        count_spares({'single': ('tips', 1, 97)}, ['tips'])
+
+
+def test_tip_planner_swaps_before_all_nozzles_run_dry():
+    protocol = protocol_recorder.RecordingProtocol(protocol_recorder.Parameters().override({}, False))
+    rack = protocol.load_labware('opentrons_flex_96_filtertiprack_50ul', 'B3')
+    pipette = protocol.load_instrument('flex_8channel_50', 'left', tip_racks=[rack])
+    racks = {'tips_50': rack}
+    tip_plan = {'single': ('tips_50', 1, 4), 'columns': ('tips_50', 8, 12)}
+    planner = TipPlanner(protocol, racks, tip_plan, protocol.load_waste_chute(), [pipette], spare_slots=['D4'])
+    spare = planner.spare_racks['tips_50'][0]
+    assert planner.spares_needed == {'tips_50': 1}
+
+    pipette.configure_nozzle_layout(style=SINGLE, start="A1", tip_racks=[racks['tips_50']])
+    planner.ensure('single')
+    for _ in range(4):
+        pipette.pick_up_tip()
+        pipette.drop_tip()
+    assert racks['tips_50'] is rack
+
+    # Twelve full columns do not fit the 11 left, the spare takes the rack's slot
+    pipette.configure_nozzle_layout(style=ALL, tip_racks=[racks['tips_50']])
+    planner.ensure('columns')
+    assert racks['tips_50'] is spare and spare.parent == 'B3'
+    assert pipette.tip_racks == [spare]
+    moves = [(record['source'], record['dest']) for record in protocol.records if record['call'] == 'move_labware']
+    assert moves == [('B3', 'Waste Chute'), ('D4', 'B3')]
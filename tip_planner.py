@@ -0,0 +1,98 @@
+"""Tip planning: spare tip racks staged before a run instead of the run stalling on an empty rack.
+
+A protocol lists the tips every step picks up, in the order the steps run, as
+{step: (rack name, tips per pick-up, number of pick-ups)}. TipPlanner walks that plan
+with fresh racks, loads one spare rack for every time a rack type runs dry and, right
+before the step that would run a rack dry, drops it down the chute and moves the spare
+into its slot. Single tips are taken column by column, 8 tips need a full column:
+
+    python tip_planner.py partial_50:1:90 partial_50:8:4 tips_200:1:40
+
+prints the spare racks such a plan needs. Protocols carry a copy of it, kept up to date
+with shared_code.py.
+"""
+import argparse
+
+from opentrons import protocol_api
+
+
+def pick_up_tips(columns, tips, pick_ups):
+    """Take the pick-ups from the tips left in each column. Returns False when the rack runs dry."""
+    for _ in range(pick_ups):
+        free = [i for i, n in enumerate(columns) if n >= tips]
+        if tips == 8:
+            free = [i for i in free if columns[i] == 8]
+        if not free:
+            return False
+        columns[free[0]] -= tips
+    return True
+
+
+def count_spares(tip_plan, rack_names):
+    """Spare racks of each type the plan needs, walking it with fresh racks."""
+    spares_needed = {name: 0 for name in rack_names}
+    rack_columns = {name: [8]*12 for name in rack_names}
+    for step, (name, tips, pick_ups) in tip_plan.items():
+        if not pick_up_tips(rack_columns[name], tips, pick_ups):
+            spares_needed[name] += 1
+            rack_columns[name] = [8]*12
+            if not pick_up_tips(rack_columns[name], tips, pick_ups):
+                raise Exception(f"Step {step} needs more than one {name} rack on its own.")
+    return spares_needed
+
+
+class TipPlanner:
+    """The racks of a run by name, their spares and the swap when one runs dry.
+
+    racks is updated in place when a spare is swapped in, so the protocol's own dict
+    always holds the rack in use. Spares go to spare_slots, staging slots the protocol
+    never parks labware in; with off_deck the ones that do not fit wait off deck and are
+    put in place by hand, otherwise running out of slots raises.
+    """
+
+    def __init__(self, protocol, racks, tip_plan, chute, pipettes, spare_slots, off_deck=False):
+        self.protocol = protocol
+        self.racks = racks
+        self.tip_plan = tip_plan
+        self.chute = chute
+        self.pipettes = pipettes
+        self.spares_needed = count_spares(tip_plan, racks)
+        spare_slots = list(spare_slots)
+        if not off_deck and sum(self.spares_needed.values()) > len(spare_slots):
+            raise Exception(f"Not enough staging slots for spare tip racks: {self.spares_needed}")
+        self.spare_racks = {name: [] for name in racks}
+        for name, count in self.spares_needed.items():
+            for _ in range(count):
+                slot = spare_slots.pop(0) if spare_slots else protocol_api.OFF_DECK
+                self.spare_racks[name].append(protocol.load_labware(racks[name].load_name, location=slot))
+        protocol.comment(f"Tip plan: spare racks {self.spares_needed}")
+
+    def ensure(self, step):
+        """Swap an exhausted rack for its spare right before the step that would run it dry."""
+        name, tips, pick_ups = self.tip_plan[step]
+        rack = self.racks[name]
+        columns = [sum(well.has_tip for well in column) for column in rack.columns()]
+        if pick_up_tips(columns, tips, pick_ups):
+            return
+        spare = self.spare_racks[name].pop(0)
+        slot = rack.parent
+        self.protocol.comment(f"{name} is out of tips for {step}, swapping in the spare rack")
+        self.protocol.move_labware(labware=rack, new_location=self.chute, use_gripper=True)
+        # A spare kept off deck is put in place by hand, the run waits for it
+        self.protocol.move_labware(labware=spare, new_location=slot, use_gripper=spare.parent != protocol_api.OFF_DECK)
+        self.racks[name] = spare
+        for pipette in self.pipettes:
+            if rack in pipette.tip_racks:
+                pipette.tip_racks = [spare]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count the spare tip racks a tip plan needs")
+    parser.add_argument("steps", nargs="+", help="steps in run order as rack:tips per pick-up:pick-ups")
+    args = parser.parse_args()
+
+    tip_plan = {}
+    for number, step in enumerate(args.steps, start=1):
+        name, tips, pick_ups = step.split(":")
+        tip_plan[f"{number} {name}"] = (name, int(tips), int(pick_ups))
+    print(count_spares(tip_plan, sorted({name for name, tips, pick_ups in tip_plan.values()})))
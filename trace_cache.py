@@ -0,0 +1,81 @@
+"""Cache of protocol traces, keyed by the protocol file, parameters and data file.
+
+cached_trace() takes the same arguments as protocol_recorder.trace() and returns the
+records, the most deck slots in use and the warnings of the run. A trace is stored as
+JSON in .trace_cache next to this file under a hash of the protocol file, the
+parameter values (the contents for CSV files such as a sample manifest), the plate
+reader export, the files handed to the protocol and the recorder itself, so editing any of
+them analyses the protocol again. Reading a stored trace marks it as recently used;
+once there are more than MAX_ENTRIES the least recently used ones are removed. Traces
+that raise are not stored.
+
+    python trace_cache.py            # entries and size
+    python trace_cache.py --clear
+"""
+import argparse
+import hashlib
+import json
+import os
+import types
+from pathlib import Path
+
+import protocol_recorder
+
+CACHE = Path(__file__).with_name(".trace_cache")
+MAX_ENTRIES = 500
+
+
+def _file_hash(path):
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def cache_key(path, params=None, data_file=None, ignore_unknown=False, files=None):
+    # CSV file parameters are paths, the file behind one can change under the same name
+    params = {name: _file_hash(value) if isinstance(value, str) and value.lower().endswith('.csv') and Path(value).is_file() else value
+              for name, value in (params or {}).items()}
+    key = {
+        'protocol': _file_hash(path),
+        'params': params,
+        'data_file': _file_hash(data_file) if data_file else None,
+        'ignore_unknown': ignore_unknown,
+        'files': {str(name): hashlib.sha256(text.encode()).hexdigest() for name, text in (files or {}).items()},
+        'recorder': _file_hash(protocol_recorder.__file__),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+
+def _evict(directory, max_entries):
+    entries = sorted(directory.glob("*.json"), key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:max(0, len(entries) - max_entries)]:
+        entry.unlink(missing_ok=True)
+
+
+def cached_trace(path, params=None, data_file=None, ignore_unknown=False, quiet=True, directory=CACHE, max_entries=MAX_ENTRIES, files=None):
+    """A trace with records, peak_deck and warnings, from the cache when this configuration was traced before."""
+    entry = Path(directory) / f"{cache_key(path, params, data_file, ignore_unknown, files)}.json"
+    if entry.exists():
+        os.utime(entry)
+        return types.SimpleNamespace(**json.loads(entry.read_text()), cached=True)
+    protocol = protocol_recorder.trace(path, params, data_file, ignore_unknown, quiet, files)
+    stored = {'records': protocol.records, 'peak_deck': protocol.peak_deck, 'warnings': protocol.warnings}
+    entry.parent.mkdir(exist_ok=True)
+    # Write then rename, so a reader never sees half an entry
+    partial = entry.with_suffix(".tmp")
+    partial.write_text(json.dumps(stored))
+    partial.replace(entry)
+    _evict(entry.parent, max_entries)
+    return types.SimpleNamespace(**stored, cached=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or clear the trace cache")
+    parser.add_argument("--clear", action="store_true", help="remove every cached trace")
+    args = parser.parse_args()
+
+    entries = list(CACHE.glob("*.json"))
+    if args.clear:
+        for entry in entries:
+            entry.unlink()
+        print(f"Removed {len(entries)} cached traces")
+    else:
+        print(f"{len(entries)} cached traces, {sum(entry.stat().st_size for entry in entries)/1e6:.1f} MB in {CACHE}")
@@ -0,0 +1,288 @@
+"""Side by side comparison of the dated variants of a protocol.
+
+Protocol files whose protocolName is the same once dates are taken out, or extends
+another one's (Gel-based Chemical Proteomics, ... 07162025, ... Without BCA), are
+variants of one workflow. Each variant is traced with the same parameters and costed
+with cost_model, and the estimated minutes, tips, gripper moves and µL drawn per
+reagent are listed phase by phase, with the difference to the oldest variant:
+
+    python variant_compare.py                                   # families with a variant added or changed since the last comparison
+    python variant_compare.py --all --param num_samples=16
+    python variant_compare.py BCA_with_Normalization_and_Click_Reaction_Gel_1.0.py ChemProt_Gel_BCA_Normalization_Click_08282025.py
+
+Older variants fix values such as num_samples = 10 at the top of run() instead of
+taking them as parameters; those assignments are set to the compared value in a copy
+of the file, so every variant runs the same samples. Variants are ordered by the date
+in the file name or protocolName, undated ones first. benchmark.py runs the
+comparison for every family one of the protocols it sweeps belongs to, so a new dated
+variant is compared with the others the first time it is benchmarked. Each comparison
+is appended to variant_history.csv.
+"""
+import argparse
+import ast
+import datetime
+import json
+import re
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+import benchmark
+import cost_model
+import protocol_recorder
+import trace_cache
+
+HISTORY = Path(__file__).with_name("variant_history.csv")
+
+DATE = r"(?<!\d)(\d{8}|\d{6})(?!\d)"
+METRICS = ['minutes', 'tips', 'gripper_moves', 'reagent_ul']
+
+
+def protocol_name(path):
+    match = re.search(r"['\"]protocolName['\"]\s*:\s*['\"]([^'\"]+)['\"]", Path(path).read_text(errors="ignore"))
+    return match.group(1) if match else Path(path).stem
+
+
+def family_name(path):
+    """protocolName without the dates in it."""
+    return ' '.join(re.sub(DATE, '', protocol_name(path)).split())
+
+
+def variant_date(path):
+    """Date in the file name, or else in protocolName, as MMDDYYYY or MMDDYY."""
+    for text in [Path(path).stem, protocol_name(path)]:
+        for digits in re.findall(DATE, text):
+            try:
+                return datetime.datetime.strptime(digits, "%m%d%Y" if len(digits) == 8 else "%m%d%y").date()
+            except ValueError:
+                continue
+    return None
+
+
+def families(paths):
+    """Family name and its variants, oldest first, for every family with more than one file."""
+    names = {path: family_name(path) for path in paths}
+    roots = sorted(set(names.values()), key=len)
+    grouped = {}
+    for path, name in names.items():
+        root = next(root for root in roots if name == root or name.startswith(root + ' '))
+        grouped.setdefault(root, []).append(path)
+    return {root: sorted(variants, key=lambda path: (variant_date(path) or datetime.date.min, Path(path).name))
+            for root, variants in grouped.items() if len(variants) > 1}
+
+
+def declared_parameters(path):
+    module = protocol_recorder.load_protocol(path)
+    parameters = protocol_recorder.Parameters()
+    if hasattr(module, "add_parameters"):
+        module.add_parameters(parameters)
+    return set(parameters.values)
+
+
+def pin(path, params, directory):
+    """A copy of the protocol with the values run() fixes for params set to theirs.
+
+    Returns the path to trace and the names that were fixed in the file.
+    """
+    source = Path(path).read_text()
+    run = next((node for node in ast.parse(source).body if isinstance(node, ast.FunctionDef) and node.name == 'run'), None)
+    lines = source.splitlines(keepends=True)
+    fixed = []
+    for node in run.body if run else []:
+        if not (isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name)):
+            continue
+        name = node.targets[0].id
+        if name not in params or not isinstance(node.value, ast.Constant) or node.value.lineno != node.value.end_lineno:
+            continue
+        # Column offsets count bytes
+        line = lines[node.value.lineno - 1].encode()
+        lines[node.value.lineno - 1] = (line[:node.value.col_offset] + repr(params[name]).encode()
+                                        + line[node.value.end_col_offset:]).decode()
+        fixed.append(name)
+    if not fixed:
+        return Path(path), fixed
+    copy = Path(directory) / Path(path).name
+    copy.write_text(''.join(lines))
+    return copy, fixed
+
+
+def phase_metrics(records):
+    """Minutes, tips, gripper moves and µL per reagent for every phase of a trace."""
+    phases = {}
+
+    def metrics(phase):
+        return phases.setdefault(phase, {'minutes': 0, 'tips': 0, 'gripper_moves': 0, 'reagent_ul': {}})
+
+    for command in cost_model.estimate(records)['commands']:
+        metrics(command['phase'])['minutes'] += command['seconds']/60
+    liquids = [record for record in records if record['call'] == 'load_liquid']
+    grouped = {}
+    phase = 'setup'
+    for record in records:
+        if record['call'] == 'comment' and str(record.get('msg', '')).startswith('Running '):
+            phase = record['msg'][len('Running '):]
+            continue
+        grouped.setdefault(phase, []).append(record)
+    for phase, phase_records in grouped.items():
+        measured = metrics(phase)
+        measured['tips'] = sum(benchmark.tip_counts(phase_records).values())
+        measured['gripper_moves'] = sum(1 for record in phase_records if record['call'] == 'move_labware' and record['use_gripper'])
+        measured['reagent_ul'] = benchmark.reagent_volumes(liquids + phase_records)
+    return {phase: measured for phase, measured in phases.items()
+            if measured['minutes'] or measured['tips'] or measured['gripper_moves'] or measured['reagent_ul']}
+
+
+def compare(paths, params=None, data_file=None):
+    """Trace every variant with the same parameters; one entry per variant, oldest first."""
+    params = params or {}
+    variants = []
+    with tempfile.TemporaryDirectory() as directory:
+        for path in paths:
+            variant = {'protocol': Path(path).name, 'file_hash': benchmark.file_hash(path), 'date': variant_date(path)}
+            unused = set(params) - declared_parameters(path)
+            traced, fixed = pin(path, {name: params[name] for name in unused}, directory)
+            variant['fixed'] = fixed
+            variant['unused'] = sorted(unused - set(fixed))
+            try:
+                protocol = trace_cache.cached_trace(traced, params, data_file, ignore_unknown=True)
+            except Exception as error:
+                variant['error'] = f"{type(error).__name__}: {error}"
+                variants.append(variant)
+                continue
+            variant['phases'] = phase_metrics(protocol.records)
+            variant['total'] = {metric: sum(phase[metric] for phase in variant['phases'].values()) for metric in METRICS[:3]}
+            variant['total']['reagent_ul'] = round(sum(sum(phase['reagent_ul'].values()) for phase in variant['phases'].values()), 1)
+            variants.append(variant)
+    return variants
+
+
+def _phases(variants):
+    """Phase names in the order of the newest variant, then those only older ones have."""
+    names = []
+    for variant in reversed(variants):
+        names += [phase for phase in variant.get('phases', {}) if phase not in names]
+    return names
+
+
+def report(name, variants, params=None, top=5):
+    lines = [f"{name}: {len(variants)} variants" + (f" with {json.dumps(params)}" if params else "")]
+    for variant in variants:
+        notes = [str(variant['date'] or 'undated')]
+        if variant['fixed']:
+            notes.append(f"set {', '.join(variant['fixed'])} in a copy")
+        if variant['unused']:
+            notes.append(f"does not use {', '.join(variant['unused'])}")
+        lines.append(f"  {variant['protocol']} ({'; '.join(notes)})" + (f": {variant['error']}" if 'error' in variant else ""))
+    traced = [variant for variant in variants if 'error' not in variant]
+    if not traced:
+        return '\n'.join(lines)
+    baseline = traced[0]
+    width = max(len(variant['protocol']) for variant in traced) + 2
+    header = f"    {'':<{width}}{'min':>14}{'tips':>12}{'gripper':>12}{'reagent µL':>16}"
+    for phase in _phases(traced) + ['total']:
+        lines += [f"  {phase}", header]
+        for variant in traced:
+            measured = variant['total'] if phase == 'total' else variant['phases'].get(phase)
+            if measured is None:
+                lines.append(f"    {variant['protocol']:<{width}}{'-':>14}")
+                continue
+            reference = baseline['total'] if phase == 'total' else baseline['phases'].get(phase)
+            cells = []
+            for metric, size, form in [('minutes', 14, '.1f'), ('tips', 12, 'g'), ('gripper_moves', 12, 'g'), ('reagent_ul', 16, '.0f')]:
+                value = measured[metric] if metric != 'reagent_ul' or phase == 'total' else sum(measured[metric].values())
+                cell = format(value, form)
+                if reference is not None and variant is not baseline:
+                    before = reference[metric] if metric != 'reagent_ul' or phase == 'total' else sum(reference[metric].values())
+                    cell += f" ({value - before:+{form}})" if round(value - before, 1) else ""
+                cells.append(f"{cell:>{size}}")
+            lines.append(f"    {variant['protocol']:<{width}}" + ''.join(cells))
+        if phase == 'total':
+            continue
+        # Reagents whose volume differs most between the variants
+        volumes = {}
+        for variant in traced:
+            for reagent, volume in variant['phases'].get(phase, {}).get('reagent_ul', {}).items():
+                volumes.setdefault(reagent, {})[variant['protocol']] = volume
+        spread = sorted(((max(used.values(), default=0) - min([used.get(variant['protocol'], 0) for variant in traced]), reagent)
+                         for reagent, used in volumes.items()), reverse=True)
+        for difference, reagent in spread[:top]:
+            if difference < 0.5:
+                break
+            lines.append(f"      {reagent[:50]}: " + ' / '.join(f"{volumes[reagent].get(variant['protocol'], 0):g}" for variant in traced) + " µL")
+    fastest = min(traced, key=lambda variant: variant['total']['minutes'])
+    fewest = min(traced, key=lambda variant: variant['total']['tips'])
+    lines.append(f"  Fastest {fastest['protocol']} ({fastest['total']['minutes']:.1f} min), "
+                 f"fewest tips {fewest['protocol']} ({fewest['total']['tips']:g})")
+    return '\n'.join(lines)
+
+
+def history_rows(name, variants, params, run_at):
+    rows = []
+    for variant in variants:
+        row = {'family': name, 'protocol': variant['protocol'], 'file_hash': variant['file_hash'],
+               'params': json.dumps(params or {}, sort_keys=True), 'run_at': run_at}
+        if 'error' in variant:
+            rows.append(dict(row, phase='', error=variant['error']))
+            continue
+        for phase, measured in list(variant['phases'].items()) + [('total', None)]:
+            measured = measured or dict(variant['total'], reagent_ul={})
+            rows.append(dict(row, phase=phase, minutes=round(measured['minutes'], 2), tips=measured['tips'],
+                             gripper_moves=measured['gripper_moves'], reagent_ul=json.dumps(measured['reagent_ul'], sort_keys=True),
+                             error=''))
+    return rows
+
+
+def run_comparisons(paths, history_file=HISTORY, params=None, data_file=None, force=False, save=True):
+    """Compare the families of the repo's protocols that any of paths belongs to.
+
+    Families whose variants were all compared before at these parameters are skipped
+    unless force. Returns [(family name, variants)].
+    """
+    history = pd.read_csv(history_file) if Path(history_file).exists() else pd.DataFrame()
+    seen = set()
+    if not history.empty:
+        seen = set(zip(history['protocol'], history['file_hash'], history['params']))
+    names = {Path(path).name for path in paths}
+    key = json.dumps(params or {}, sort_keys=True)
+    run_at = datetime.datetime.now().isoformat(timespec="seconds")
+    compared, rows = [], []
+    for name, variants in families(benchmark.protocol_files()).items():
+        if not names & {Path(path).name for path in variants}:
+            continue
+        if not force and all((Path(path).name, benchmark.file_hash(path), key) in seen for path in variants):
+            continue
+        result = compare(variants, params, data_file)
+        compared.append((name, result))
+        rows += history_rows(name, result, params, run_at)
+    if save and rows:
+        pd.concat([history, pd.DataFrame(rows)], ignore_index=True).to_csv(history_file, index=False)
+    return compared
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the dated variants of a protocol phase by phase")
+    parser.add_argument("protocols", nargs="*", help="variants to compare with each other, families found in the repo by default")
+    parser.add_argument("--all", action="store_true", help="compare every family, also those compared before")
+    parser.add_argument("--param", action="append", default=[], help="parameter value every variant runs with, as name=value")
+    parser.add_argument("--data-file", help="plate reader export to normalize against")
+    parser.add_argument("--history", default=HISTORY, help="history table to append to")
+    parser.add_argument("--no-save", action="store_true", help="do not append this comparison to the history")
+    args = parser.parse_args()
+
+    overrides = dict((name, protocol_recorder._parse_value(value)) for name, value in (param.split("=", 1) for param in args.param))
+    if args.protocols:
+        # Files named together are one family, whatever their protocolName
+        family = sorted(args.protocols, key=lambda path: (variant_date(path) or datetime.date.min, Path(path).name))
+        compared = [(family_name(family[-1]), compare(family, overrides, args.data_file))]
+        if not args.no_save:
+            rows = history_rows(compared[0][0], compared[0][1], overrides, datetime.datetime.now().isoformat(timespec="seconds"))
+            history = pd.read_csv(args.history) if Path(args.history).exists() else pd.DataFrame()
+            pd.concat([history, pd.DataFrame(rows)], ignore_index=True).to_csv(args.history, index=False)
+    else:
+        compared = run_comparisons(benchmark.protocol_files(), args.history, overrides, args.data_file, args.all, not args.no_save)
+        if not compared:
+            print("No family has a new or changed variant")
+    for name, variants in compared:
+        print(report(name, variants, overrides))
+        print()